@@ -10,6 +10,8 @@ from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 from pathlib import Path
 
+from services.query_stats import query_count_listener
+
 # Charger .env
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -22,7 +24,7 @@ DB_NAME = os.environ.get('DB_NAME')
 if not DB_NAME:
     raise ValueError("DB_NAME environment variable is required")
 
-client = AsyncIOMotorClient(MONGO_URL)
+client = AsyncIOMotorClient(MONGO_URL, event_listeners=[query_count_listener])
 db = client[DB_NAME]
 
 print(f"[CONFIG] Using database: {DB_NAME}")
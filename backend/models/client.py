@@ -62,6 +62,9 @@ class ClientCreate(BaseModel):
     
     # Nouveau: contrôle livraison
     auto_send_enabled: bool = True  # Si False → ready_to_send au lieu de sent
+    # Micro-batchs intraday (services/micro_batch.py), None → défauts MICRO_BATCH_*
+    micro_batch_interval_minutes: Optional[int] = None
+    micro_batch_size: Optional[int] = None
     
     # Paramètres commerciaux
     default_prix_lead: float = 0.0
@@ -91,6 +94,8 @@ class ClientUpdate(BaseModel):
     api_endpoint: Optional[str] = None
     api_key: Optional[str] = None
     auto_send_enabled: Optional[bool] = None
+    micro_batch_interval_minutes: Optional[int] = None
+    micro_batch_size: Optional[int] = None
     default_prix_lead: Optional[float] = None
     remise_percent: Optional[float] = None
     vat_rate: Optional[float] = None
@@ -120,6 +125,8 @@ class ClientResponse(BaseModel):
     # Contrôle livraison
     delivery_enabled: bool = True   # Calculé: True si au moins 1 canal valide
     auto_send_enabled: bool = True  # Si False → mode manuel
+    micro_batch_interval_minutes: Optional[int] = None
+    micro_batch_size: Optional[int] = None
     
     # Commercial
     default_prix_lead: float = 0.0
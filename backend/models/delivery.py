@@ -62,9 +62,11 @@ class Delivery(BaseModel):
     last_sent_at: Optional[str] = None  # Dernier envoi tenté
     last_error: Optional[str] = None    # Dernière erreur
     sent_by: Optional[str] = None   # User qui a envoyé (si manuel)
+    outbox_job_id: Optional[str] = None  # Job outbox qui a pris la delivery (claim "sending")
     
     # CSV stocké (pour ready_to_send / téléchargement)
-    csv_content: Optional[str] = None       # Contenu CSV (string)
+    csv_file_id: Optional[str] = None       # Fichier delivery_files (sha256, 1 par batch)
+    csv_content: Optional[str] = None       # Ancien format inline (avant migration)
     csv_filename: Optional[str] = None      # Nom du fichier
     csv_generated_at: Optional[str] = None  # Date génération
     
@@ -156,7 +158,7 @@ class DeliveryResponse(BaseModel):
     last_sent_at: Optional[str] = None
     last_error: Optional[str] = None
     is_lb: bool = False
-    has_csv: bool = False  # True si csv_content existe
+    has_csv: bool = False  # True si un CSV est stocké (csv_filename)
     csv_filename: Optional[str] = None
     created_at: str = ""
     updated_at: Optional[str] = None
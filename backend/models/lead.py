@@ -42,6 +42,7 @@ class ProductType(str, Enum):
 class LeadStatus(str, Enum):
     """Statuts de lead — COMPLET (inclut tous les statuts reels du systeme)"""
     NEW = "new"
+    QUEUED = "queued"  # Mode async: en attente du worker de routing
     ROUTED = "routed"
     LIVRE = "livre"
     DOUBLON = "doublon"
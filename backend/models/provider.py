@@ -21,6 +21,8 @@ class ProviderCreate(BaseModel):
     entity: EntityType
     contact_email: Optional[str] = ""
     notes: Optional[str] = ""
+    # Routing async opt-in (file de routing, ASYNC_ROUTING_ENABLED requis)
+    async_routing: Optional[bool] = False
 
 
 class ProviderUpdate(BaseModel):
@@ -29,6 +31,7 @@ class ProviderUpdate(BaseModel):
     contact_email: Optional[str] = None
     notes: Optional[str] = None
     active: Optional[bool] = None
+    async_routing: Optional[bool] = None
 
 
 class ProviderResponse(BaseModel):
@@ -41,6 +44,7 @@ class ProviderResponse(BaseModel):
     contact_email: str = ""
     notes: str = ""
     active: bool = True
+    async_routing: bool = False
     total_leads: int = 0
     created_at: str = ""
     updated_at: str = ""
@@ -6,11 +6,13 @@ Login / Logout / Session / User CRUD with granular permissions.
 from fastapi import APIRouter, HTTPException, Depends, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from datetime import datetime, timezone, timedelta
+import os
 import uuid
 
 from models.auth import UserLogin, UserCreate, UserUpdate
 from config import db, hash_password, generate_token, now_iso
 from services.activity_logger import log_activity
+from services.ingestion_cache import LruTtlCache
 from services.permissions import (
     get_preset_permissions,
     VALID_ROLES,
@@ -22,18 +24,62 @@ from services.permissions import (
 router = APIRouter(prefix="/auth", tags=["Auth"])
 security = HTTPBearer(auto_error=False)
 
+SESSION_DURATION_DAYS = 7
+
+# Cache token -> (user, session_expires_at), process-local.
+# Évincé sur logout / update / désactivation; TTL court pour les autres workers.
+AUTH_CACHE_TTL_SECONDS = float(os.environ.get("AUTH_CACHE_TTL_SECONDS", "30"))
+_session_cache = LruTtlCache("auth_sessions", AUTH_CACHE_TTL_SECONDS, 4096)
+
 
 # ==================== HELPERS ====================
 
+def _as_utc(value) -> datetime:
+    """expires_at: date native (nouveau) ou ISO string (sessions historiques)"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def evict_user_sessions_cache(user_id: str) -> int:
+    """Évince du cache tous les tokens d'un utilisateur (update / désactivation)"""
+    return _session_cache.discard_where(lambda entry: entry[0].get("id") == user_id)
+
+
+def get_auth_cache_stats() -> dict:
+    """Métriques du cache sessions (pour /system/health)"""
+    return {
+        "enabled": AUTH_CACHE_TTL_SECONDS > 0,
+        "ttl_seconds": AUTH_CACHE_TTL_SECONDS,
+        **_session_cache.snapshot_stats(),
+    }
+
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Récupère l'utilisateur connecté depuis le token."""
     if not credentials:
         raise HTTPException(status_code=401, detail="Non authentifié")
 
     token = credentials.credentials
+    now = datetime.now(timezone.utc)
+
+    found, entry = _session_cache.get(token)
+    if found:
+        user, expires_at = entry
+        if expires_at > now:
+            return user
+        _session_cache.discard(token)
+        raise HTTPException(status_code=401, detail="Session expirée")
+
     session = await db.sessions.find_one({
         "token": token,
-        "expires_at": {"$gt": now_iso()}
+        "$or": [
+            {"expires_at": {"$gt": now}},
+            # Sessions historiques (expires_at en ISO string)
+            {"expires_at": {"$gt": now.isoformat()}},
+        ]
     })
 
     if not session:
@@ -54,6 +100,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     if not user.get("permissions"):
         user["permissions"] = get_preset_permissions(user.get("role", "viewer"))
 
+    _session_cache.set(token, (user, _as_utc(session["expires_at"])))
     return user
 
 
@@ -84,7 +131,8 @@ async def login(data: UserLogin, request: Request):
         raise HTTPException(status_code=403, detail="Compte désactivé")
 
     token = generate_token()
-    expires_at = (datetime.now(timezone.utc) + timedelta(days=7)).isoformat()
+    # Date native: purge automatique par l'index TTL
+    expires_at = datetime.now(timezone.utc) + timedelta(days=SESSION_DURATION_DAYS)
 
     await db.sessions.insert_one({
         "token": token,
@@ -123,6 +171,7 @@ async def logout(
 ):
     if credentials:
         await db.sessions.delete_one({"token": credentials.credentials})
+        _session_cache.discard(credentials.credentials)
     return {"success": True}
 
 
@@ -225,6 +274,8 @@ async def update_user(user_id: str, data: UserUpdate, user: dict = Depends(get_c
     update_data["updated_at"] = now_iso()
 
     await db.users.update_one({"id": user_id}, {"$set": update_data})
+    # Rôle / permissions / is_active changés → recharger au prochain appel
+    evict_user_sessions_cache(user_id)
 
     await log_activity(
         user=user,
@@ -260,6 +311,7 @@ async def deactivate_user(user_id: str, user: dict = Depends(get_current_user)):
         {"$set": {"is_active": False, "deactivated_at": now_iso()}}
     )
     await db.sessions.delete_many({"user_id": user_id})
+    evict_user_sessions_cache(user_id)
 
     await log_activity(
         user=user,
@@ -23,6 +23,7 @@ from config import db, now_iso
 from routes.auth import get_current_user
 from services.permissions import require_permission, validate_entity_access
 from services.event_logger import log_event
+from services.routing_snapshot import invalidate_routing_snapshot
 
 router = APIRouter(tags=["Billing"])
 
@@ -156,6 +157,7 @@ async def upsert_product_pricing(
                 "units_purchased_total": 0, "units_delivered_total": 0,
                 "units_remaining": 0, "updated_at": now_iso(),
             })
+    invalidate_routing_snapshot("product_pricing_upsert")
     await log_event("pricing_update", "client", client_id, user=user.get("email"),
                      details={"product": pc, "unit_price": data.unit_price_eur,
                               "discount_pct": data.discount_pct, "billing_mode": data.billing_mode})
@@ -167,6 +169,7 @@ async def delete_product_pricing(client_id: str, product_code: str, user: dict =
     r = await db.client_product_pricing.delete_one({"client_id": client_id, "product_code": product_code.upper()})
     if r.deleted_count == 0:
         raise HTTPException(404, "Product pricing not found")
+    invalidate_routing_snapshot("product_pricing_delete")
     await log_event("pricing_delete", "client", client_id, user=user.get("email"),
                      details={"product": product_code})
     return {"success": True}
@@ -255,6 +258,7 @@ async def add_prepayment_units(client_id: str, data: PrepaymentAddUnits, user: d
          "$setOnInsert": {"client_id": client_id, "product_code": pc, "units_delivered_total": 0}},
         upsert=True,
     )
+    invalidate_routing_snapshot("prepayment_add_units")
     bal = await db.prepayment_balances.find_one({"client_id": client_id, "product_code": pc}, {"_id": 0})
     await log_event("prepayment_units_added", "client", client_id, user=user.get("email"),
                      details={"product": pc, "units_added": data.units_to_add,
@@ -21,6 +21,8 @@ from models import (
     validate_entity
 )
 from services.permissions import require_permission, validate_entity_access
+from services.routing_snapshot import invalidate_routing_snapshot
+from services.client_groups import sync_client_group, client_emails, group_key_for
 
 router = APIRouter(prefix="/clients", tags=["Clients"])
 
@@ -169,6 +171,8 @@ async def create_client(
         "api_endpoint": data.api_endpoint or "",
         "api_key": data.api_key or "",
         "auto_send_enabled": data.auto_send_enabled,  # Phase 2.5: contrôle envoi auto
+        "micro_batch_interval_minutes": data.micro_batch_interval_minutes,
+        "micro_batch_size": data.micro_batch_size,
         "default_prix_lead": data.default_prix_lead,
         "remise_percent": data.remise_percent,
         "notes": data.notes or "",
@@ -176,9 +180,12 @@ async def create_client(
         "created_at": now_iso(),
         "updated_at": now_iso()
     }
+    client["group_key"] = group_key_for(client_emails(client))
     
     await db.clients.insert_one(client)
     client.pop("_id", None)
+    invalidate_routing_snapshot("client_create")
+    await sync_client_group(None, client)
     
     return {"success": True, "client": client}
 
@@ -205,6 +212,7 @@ async def update_client(
         {"id": client_id},
         {"$set": update_data}
     )
+    invalidate_routing_snapshot("client_update")
     
     # Log if auto_send changed
     if new_auto_send is not None and old_auto_send != new_auto_send:
@@ -220,6 +228,8 @@ async def update_client(
         )
     
     updated = await db.clients.find_one({"id": client_id}, {"_id": 0})
+    await sync_client_group(client, updated)
+    updated["group_key"] = group_key_for(client_emails(updated))
     return {"success": True, "client": updated}
 
 
@@ -244,9 +254,11 @@ async def delete_client(
             detail=f"Impossible de supprimer: {active_commandes} commande(s) active(s)"
         )
     
-    result = await db.clients.delete_one({"id": client_id})
-    if result.deleted_count == 0:
+    client = await db.clients.find_one_and_delete({"id": client_id}, {"_id": 0})
+    if not client:
         raise HTTPException(status_code=404, detail="Client non trouvé")
+    invalidate_routing_snapshot("client_delete")
+    await sync_client_group(client, None)
     
     return {"success": True, "deleted_id": client_id}
 
@@ -29,6 +29,7 @@ from models import (
 )
 from services.routing_engine import get_week_start, get_commande_stats, resolve_week_range
 from services.permissions import require_permission, validate_entity_access, user_has_permission
+from services.routing_snapshot import invalidate_routing_snapshot
 
 router = APIRouter(prefix="/commandes", tags=["Commandes"])
 
@@ -250,6 +251,7 @@ async def create_commande(
     
     await db.commandes.insert_one(commande)
     commande.pop("_id", None)
+    invalidate_routing_snapshot("commande_create")
     
     # Ajouter nom client
     commande["client_name"] = client.get("name", "")
@@ -275,6 +277,7 @@ async def update_commande(
         {"id": commande_id},
         {"$set": update_data}
     )
+    invalidate_routing_snapshot("commande_update")
     
     updated = await db.commandes.find_one({"id": commande_id}, {"_id": 0})
     
@@ -312,6 +315,7 @@ async def delete_commande(
     result = await db.commandes.delete_one({"id": commande_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Commande non trouvée")
+    invalidate_routing_snapshot("commande_delete")
     
     return {"success": True, "deleted_id": commande_id}
 
@@ -332,6 +336,7 @@ async def toggle_commande(
         {"id": commande_id},
         {"$set": {"active": new_status, "updated_at": now_iso()}}
     )
+    invalidate_routing_snapshot("commande_toggle")
     
     from services.event_logger import log_event
     await log_event(
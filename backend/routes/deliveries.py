@@ -4,7 +4,10 @@ RDZ CRM - Routes Deliveries
 Gestion des livraisons:
 - Liste des deliveries par statut
 - Envoi/Renvoi manuel
+- Outbox (jobs d'envoi en file, relance des dead)
+- Simulation du run quotidien (dry run)
 - Téléchargement CSV
+- Exports CSV / ZIP en streaming (batch, client x semaine, liste de batchs)
 - Stats
 """
 
@@ -13,6 +16,7 @@ from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List
 import logging
+import time
 import io
 
 from config import db, now_iso
@@ -20,6 +24,7 @@ from routes.auth import get_current_user, require_admin
 from services.permissions import require_permission, validate_entity_access
 from models.delivery import DeliveryStatus, SendDeliveryRequest, RejectDeliveryRequest, VALID_STATUS_TRANSITIONS
 from services.csv_delivery import send_csv_email, generate_csv_content
+from services.delivery_files import store_csv, load_delivery_csv, get_csv_file, iter_csv_chunks
 from services.settings import get_simulation_email_override, get_email_denylist_settings
 
 router = APIRouter(prefix="/deliveries", tags=["Deliveries"])
@@ -140,6 +145,181 @@ async def get_delivery_stats(
     return stats
 
 
+# ---- Outbox (envois en file) ----
+
+@router.get("/outbox")
+async def list_outbox_jobs(
+    status: Optional[str] = None,
+    entity: Optional[str] = None,
+    limit: int = 100,
+    user: dict = Depends(require_admin)
+):
+    """Jobs d'envoi de l'outbox (pending / sent / dead), plus récents d'abord"""
+    query = {}
+    if status:
+        query["status"] = status
+    if entity:
+        query["entity"] = entity.upper()
+
+    jobs = await db.outbox.find(
+        query, {"_id": 0, "csv_content": 0}
+    ).sort("created_at", -1).limit(min(limit, 500)).to_list(min(limit, 500))
+
+    return {"jobs": jobs, "count": len(jobs)}
+
+
+@router.post("/outbox/{job_id}/requeue")
+async def requeue_outbox_job(
+    job_id: str,
+    user: dict = Depends(require_admin)
+):
+    """
+    Relance un job dead (deliveries failed → sending)
+
+    🔒 Utilise delivery_state_machine pour les transitions
+    """
+    from services.outbox import requeue_dead_job
+    from services.delivery_state_machine import DeliveryInvariantError
+
+    try:
+        job = await requeue_dead_job(job_id)
+    except DeliveryInvariantError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if not job:
+        raise HTTPException(status_code=404, detail="Job dead non trouvé")
+
+    from services.event_logger import log_event
+    await log_event(
+        action="requeue_outbox_job",
+        entity_type="outbox",
+        entity_id=job_id,
+        entity=job.get("entity", ""),
+        user=user.get("email"),
+        details={"delivery_count": len(job.get("delivery_ids", [])), "to": job.get("to_emails", [])},
+        related={"client_id": job.get("client_id"), "client_name": job.get("client_name")}
+    )
+
+    return {"success": True, "job_id": job_id, "status": job["status"]}
+
+
+# ---- Exports (streaming) ----
+
+class ExportZipRequest(BaseModel):
+    batch_ids: List[str]
+
+
+def _csv_stream_response(chunks, filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        chunks,
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+def _zip_stream_response(chunks, filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        chunks,
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+@router.get("/export")
+async def export_client_deliveries(
+    client_id: str,
+    week: Optional[str] = None,
+    status: Optional[str] = "sent",
+    as_zip: bool = False,
+    user: dict = Depends(require_permission("deliveries.view"))
+):
+    """
+    Export des deliveries d'un client (semaine courante par défaut)
+
+    CSV unique, ou ZIP avec 1 CSV par batch (as_zip=true). Le filtre
+    (semaine, statut) s'applique aux lignes de chaque batch: CSV et ZIP
+    contiennent les mêmes leads.
+    Envoyé en streaming: leads chargés par lots, mémoire bornée.
+    """
+    from services.routing_engine import resolve_week_range, get_week_key
+    from services.delivery_exports import stream_csv, stream_zip, list_batches
+
+    client = await db.clients.find_one({"id": client_id}, {"_id": 0, "id": 1, "entity": 1, "name": 1})
+    if not client:
+        raise HTTPException(status_code=404, detail="Client non trouvé")
+    validate_entity_access(user, client["entity"])
+
+    week_key = week or get_week_key()
+    ws, we = resolve_week_range(week_key)
+    query = {"client_id": client_id, "created_at": {"$gte": ws, "$lte": we}}
+    if status:
+        query["status"] = status
+
+    filename = f"{client['entity']}_{client.get('name') or client_id}_{week_key}".replace(" ", "_").replace('"', "")
+    if as_zip:
+        return _zip_stream_response(stream_zip(await list_batches(query), query=query), f"{filename}.zip")
+    return _csv_stream_response(stream_csv(query, client["entity"]), f"{filename}.csv")
+
+
+@router.post("/export/zip")
+async def export_batches_zip(
+    data: ExportZipRequest,
+    user: dict = Depends(require_permission("deliveries.view"))
+):
+    """ZIP de plusieurs batchs (1 CSV par batch), en streaming"""
+    from services.delivery_exports import stream_zip, list_batches
+
+    if not data.batch_ids:
+        raise HTTPException(status_code=400, detail="batch_ids requis")
+    batches = await list_batches({"batch_id": {"$in": data.batch_ids}})
+    if not batches:
+        raise HTTPException(status_code=404, detail="Aucun batch trouvé")
+    for entity in {b["entity"] for b in batches}:
+        validate_entity_access(user, entity)
+
+    return _zip_stream_response(stream_zip(batches), f"batches_{now_iso()[:10]}.zip")
+
+
+@router.get("/batches/{batch_id}/export")
+async def export_batch_csv(
+    batch_id: str,
+    user: dict = Depends(require_permission("deliveries.view"))
+):
+    """CSV d'un batch (fichier envoyé au client si stocké, sinon régénéré), en streaming"""
+    from services.delivery_exports import stream_batch_csv, list_batches, batch_entry_name
+
+    batches = await list_batches({"batch_id": batch_id})
+    if not batches:
+        raise HTTPException(status_code=404, detail="Batch non trouvé")
+    batch = batches[0]
+    validate_entity_access(user, batch["entity"])
+
+    return _csv_stream_response(stream_batch_csv(batch_id, batch["entity"]), batch_entry_name(batch))
+
+
+# ---- Run quotidien: simulation ----
+
+@router.post("/daily-run/dry-run")
+async def dry_run_daily_delivery(
+    allocator: Optional[str] = None,
+    user: dict = Depends(require_admin)
+):
+    """
+    Simule le run quotidien: batchs prévus par commande (leads, LB, doublons
+    sautés, canal), manques LB, fallback cross-entity, requêtes MongoDB par
+    phase. Aucune delivery, aucun job outbox, aucun lead modifié: seul le
+    rapport (dry_run=True) est enregistré.
+    """
+    from services.daily_delivery import run_daily_delivery, ALLOCATORS
+
+    if allocator and allocator not in ALLOCATORS:
+        raise HTTPException(status_code=400, detail=f"allocator invalide: {', '.join(ALLOCATORS)}")
+
+    report = await run_daily_delivery(allocator=allocator, dry_run=True)
+    report.pop("_id", None)
+    return report
+
+
 @router.get("/{delivery_id}")
 async def get_delivery(
     delivery_id: str,
@@ -235,7 +415,7 @@ async def send_delivery(
         entity = delivery.get("entity")
         produit = delivery.get("produit")
         
-        csv_content = delivery.get("csv_content")
+        csv_content = await load_delivery_csv(delivery)
         if not csv_content:
             csv_content = generate_csv_content([lead], produit, entity)
         
@@ -260,14 +440,17 @@ async def send_delivery(
             sent_by=user.get("email")
         )
         
-        # 3. Stocker le CSV pour téléchargement
+        # 3. Stocker le CSV pour téléchargement (delivery_files)
         await db.deliveries.update_one(
             {"id": delivery_id},
-            {"$set": {
-                "csv_content": csv_content,
-                "csv_filename": csv_filename,
-                "csv_generated_at": now_iso()
-            }}
+            {
+                "$set": {
+                    "csv_file_id": await store_csv(csv_content),
+                    "csv_filename": csv_filename,
+                    "csv_generated_at": now_iso()
+                },
+                "$unset": {"csv_content": ""}
+            }
         )
         
         logger.info(f"[DELIVERY_SENT] id={delivery_id} to={to_emails} by={user.get('email')}")
@@ -366,6 +549,10 @@ async def reject_delivery_leads(
     
     now = now_iso()
     lead_id = delivery.get("lead_id")
+    lead_before = await db.leads.find_one(
+        {"id": lead_id},
+        {"_id": 0, "status": 1, "is_lb": 1, "delivery_commande_id": 1, "routed_at": 1, "delivered_at": 1}
+    )
     
     # 1. Marquer la delivery comme rejected (status reste "sent", CSV intact)
     await db.deliveries.update_one(
@@ -400,6 +587,12 @@ async def reject_delivery_leads(
         }
     )
     
+    # Compteurs hebdo commande + empreinte doublon
+    from services.commande_counters import release_delivery_counters
+    await release_delivery_counters(delivery, lead_before)
+    from services.duplicate_detector import remove_delivery_fingerprint
+    await remove_delivery_fingerprint(lead_id, delivery.get("client_id"))
+    
     # Event log
     from services.event_logger import log_event
     await log_event(
@@ -469,6 +662,10 @@ async def remove_lead_from_delivery(
     reason = data.reason or "autre"
     now = now_iso()
     lead_id = delivery.get("lead_id")
+    lead_before = await db.leads.find_one(
+        {"id": lead_id},
+        {"_id": 0, "status": 1, "is_lb": 1, "delivery_commande_id": 1, "routed_at": 1, "delivered_at": 1}
+    )
     
     # 1. Annotate delivery
     await db.deliveries.update_one(
@@ -501,7 +698,13 @@ async def remove_lead_from_delivery(
         }
     )
     
-    # 3. Event log
+    # 3. Compteurs hebdo commande + empreinte doublon
+    from services.commande_counters import release_delivery_counters
+    await release_delivery_counters(delivery, lead_before)
+    from services.duplicate_detector import remove_delivery_fingerprint
+    await remove_delivery_fingerprint(lead_id, delivery.get("client_id"))
+    
+    # 4. Event log
     from services.event_logger import log_event
     await log_event(
         action="lead_removed_from_delivery",
@@ -530,14 +733,38 @@ async def remove_lead_from_delivery(
 @router.get("/{delivery_id}/download")
 async def download_delivery_csv(
     delivery_id: str,
+    request: Request,
     user: dict = Depends(require_permission("deliveries.view"))
 ):
-    """Télécharge le CSV d'une delivery"""
+    """
+    Télécharge le CSV d'une delivery
+
+    CSV stocké (delivery_files): envoyé en streaming, tel quel en gzip
+    si le client l'accepte. Sinon ancien csv_content inline, ou CSV
+    régénéré depuis le lead.
+    """
     delivery = await db.deliveries.find_one({"id": delivery_id}, {"_id": 0})
     
     if not delivery:
         raise HTTPException(status_code=404, detail="Delivery non trouvée")
     
+    csv_filename = delivery.get("csv_filename") or f"delivery_{delivery_id}.csv"
+    headers = {"Content-Disposition": f'attachment; filename="{csv_filename}"'}
+
+    csv_file = await get_csv_file(delivery.get("csv_file_id"))
+    if csv_file:
+        if "gzip" in request.headers.get("accept-encoding", ""):
+            return Response(
+                content=bytes(csv_file["data"]),
+                media_type="text/csv; charset=utf-8",
+                headers={**headers, "Content-Encoding": "gzip"}
+            )
+        return StreamingResponse(
+            iter_csv_chunks(csv_file),
+            media_type="text/csv; charset=utf-8",
+            headers=headers
+        )
+
     csv_content = delivery.get("csv_content")
     
     # Si pas de CSV stocké, le générer
@@ -552,15 +779,11 @@ async def download_delivery_csv(
             delivery.get("entity")
         )
     
-    csv_filename = delivery.get("csv_filename") or f"delivery_{delivery_id}.csv"
-    
     # Retourner comme fichier téléchargeable
     return Response(
         content=csv_content.encode("utf-8"),
         media_type="text/csv; charset=utf-8",
-        headers={
-            "Content-Disposition": f'attachment; filename="{csv_filename}"'
-        }
+        headers=headers
     )
 
 
@@ -588,12 +811,16 @@ async def batch_generate_csv(
     if not pending:
         return {"success": True, "processed": 0, "message": "Aucune delivery en attente"}
     
+    from services.delivery_exports import load_leads_by_ids
+
     processed = 0
     errors = []
+    # Leads chargés par lots $in (pas 1 find_one par delivery)
+    leads = await load_leads_by_ids([d.get("lead_id") for d in pending if d.get("lead_id")])
     
     for delivery in pending:
         try:
-            lead = await db.leads.find_one({"id": delivery.get("lead_id")}, {"_id": 0})
+            lead = leads.get(delivery.get("lead_id"))
             if not lead:
                 continue
             
@@ -606,7 +833,7 @@ async def batch_generate_csv(
             # 🔒 Via state machine uniquement
             await mark_delivery_ready_to_send(
                 delivery_id=delivery.get("id"),
-                csv_content=csv_content,
+                csv_file_id=await store_csv(csv_content),
                 csv_filename=csv_filename
             )
             processed += 1
@@ -636,16 +863,20 @@ async def batch_send_ready(
     
     - Respecte le calendar gating
     - Utilise le CSV déjà généré
+    - Toutes les deliveries en une passe: groupes lus par pages, clients
+      préchargés par page ($in), 1 email par tranche de PENDING_BATCH_MAX
     - 🔒 Utilise delivery_state_machine pour les transitions
     """
     from services.settings import is_delivery_day_enabled, get_simulation_email_override
     from services.csv_delivery import send_csv_email
+    from services.daily_delivery import (
+        iter_delivery_group_pages, prefetch_group_refs, pending_throughput, PENDING_BATCH_MAX
+    )
     from services.delivery_state_machine import (
         batch_mark_deliveries_sent,
         batch_mark_deliveries_failed,
         DeliveryInvariantError
     )
-    from collections import defaultdict
     
     query = {"status": "ready_to_send"}
     if entity:
@@ -653,119 +884,144 @@ async def batch_send_ready(
     if client_id:
         query["client_id"] = client_id
     
-    ready = await db.deliveries.find(query, {"_id": 0}).to_list(1000)
-    
-    if not ready:
-        return {"success": True, "sent": 0, "message": "Aucune delivery ready_to_send"}
-    
     results = {
+        "processed": 0,
+        "groups": 0,
+        "pages": 0,
         "sent": 0,
         "skipped_calendar": 0,
         "errors": []
     }
+    started = time.perf_counter()
     
     simulation_email = await get_simulation_email_override()
+    calendar = {}
     
-    grouped = defaultdict(list)
-    for delivery in ready:
-        key = (delivery.get("client_id"), delivery.get("commande_id"), delivery.get("entity"))
-        grouped[key].append(delivery)
-    
-    for (grp_client_id, grp_commande_id, grp_entity), deliveries in grouped.items():
-        # Calendar gating
-        day_enabled, day_reason = await is_delivery_day_enabled(grp_entity)
-        if not day_enabled:
-            logger.info(f"[BATCH_SEND] {grp_entity}: {day_reason} - skipped")
-            results["skipped_calendar"] += len(deliveries)
-            continue
-        
-        client = await db.clients.find_one({"id": grp_client_id}, {"_id": 0})
-        if not client:
-            results["errors"].append({"client_id": grp_client_id, "error": "client_not_found"})
-            continue
-        
-        client_name = client.get("name", "")
-        
-        if override_email:
-            to_emails = [override_email]
-        elif simulation_email:
-            to_emails = [simulation_email]
-        else:
-            to_emails = client.get("delivery_emails", [])
-            if not to_emails and client.get("email"):
-                to_emails = [client.get("email")]
-        
-        if not to_emails:
-            results["errors"].append({"client": client_name, "error": "no_email"})
-            continue
-        
-        lead_ids = [d.get("lead_id") for d in deliveries]
-        leads = await db.leads.find(
-            {"id": {"$in": lead_ids}},
-            {"_id": 0}
-        ).to_list(len(lead_ids))
+    async for page in iter_delivery_group_pages(query):
+        results["pages"] += 1
+        results["groups"] += len(page)
+        results["processed"] += sum(len(g["deliveries"]) for g in page)
         
-        if not leads:
-            continue
+        clients, _ = await prefetch_group_refs(page, with_commandes=False)
+        for page_entity in {g["entity"] for g in page} - calendar.keys():
+            calendar[page_entity] = await is_delivery_day_enabled(page_entity)
         
-        produit = deliveries[0].get("produit", "")
-        csv_content = generate_csv_content(leads, produit, grp_entity)
-        csv_filename = f"leads_{grp_entity}_{produit}_{now_iso()[:10].replace('-', '')}_{len(leads)}.csv"
-        lb_count = sum(1 for lead in leads if lead.get("is_lb"))
-        delivery_ids = [d.get("id") for d in deliveries]
-        
-        try:
-            # 1. Envoyer l'email RÉELLEMENT
-            await send_csv_email(
-                entity=grp_entity,
-                to_emails=to_emails,
-                csv_content=csv_content,
-                csv_filename=csv_filename,
-                lead_count=len(leads),
-                lb_count=lb_count,
-                produit=produit
-            )
+        for group in page:
+            grp_client_id, grp_commande_id, grp_entity = group["client_id"], group["commande_id"], group["entity"]
             
-            # 2. 🔒 SEULEMENT après envoi réussi: state machine
-            await batch_mark_deliveries_sent(
-                delivery_ids=delivery_ids,
-                lead_ids=lead_ids,
-                sent_to=to_emails,
-                client_id=grp_client_id,
-                client_name=client_name,
-                commande_id=grp_commande_id or ""
-            )
+            # Calendar gating
+            day_enabled, day_reason = calendar[grp_entity]
+            if not day_enabled:
+                logger.info(f"[BATCH_SEND] {grp_entity}: {day_reason} - skipped")
+                results["skipped_calendar"] += len(group["deliveries"])
+                continue
             
-            # 3. Stocker CSV pour téléchargement
-            await db.deliveries.update_many(
-                {"id": {"$in": delivery_ids}},
-                {"$set": {
-                    "csv_content": csv_content,
-                    "csv_filename": csv_filename,
-                    "csv_generated_at": now_iso(),
-                    "sent_by": user.get("email")
-                }}
-            )
+            client = clients.get(grp_client_id)
+            if not client:
+                results["errors"].append({"client_id": grp_client_id, "error": "client_not_found"})
+                continue
             
-            results["sent"] += len(leads)
-            logger.info(f"[BATCH_SEND] {client_name}: {len(leads)} leads sent to {to_emails}")
+            client_name = client.get("name", "")
             
-        except Exception as e:
-            # 🔒 Marquer comme failed via state machine
-            try:
-                await batch_mark_deliveries_failed(
-                    delivery_ids=delivery_ids,
-                    error=str(e)
-                )
-            except DeliveryInvariantError:
-                logger.error(f"[BATCH_SEND] State machine failed for batch: {str(e)}")
+            if override_email:
+                to_emails = [override_email]
+            elif simulation_email:
+                to_emails = [simulation_email]
+            else:
+                to_emails = client.get("delivery_emails", [])
+                if not to_emails and client.get("email"):
+                    to_emails = [client.get("email")]
+            
+            if not to_emails:
+                results["errors"].append({"client": client_name, "error": "no_email"})
+                continue
             
-            results["errors"].append({"client": client_name, "error": str(e)})
+            for start in range(0, len(group["deliveries"]), PENDING_BATCH_MAX):
+                deliveries = group["deliveries"][start:start + PENDING_BATCH_MAX]
+                lead_ids = [d.get("lead_id") for d in deliveries]
+                leads = await db.leads.find(
+                    {"id": {"$in": lead_ids}},
+                    {"_id": 0}
+                ).to_list(len(lead_ids))
+                
+                if not leads:
+                    continue
+                
+                produit = deliveries[0].get("produit", "")
+                csv_content = generate_csv_content(leads, produit, grp_entity)
+                csv_filename = f"leads_{grp_entity}_{produit}_{now_iso()[:10].replace('-', '')}_{len(leads)}.csv"
+                lb_count = sum(1 for lead in leads if lead.get("is_lb"))
+                delivery_ids = [d.get("id") for d in deliveries]
+                
+                try:
+                    # 1. Envoyer l'email RÉELLEMENT
+                    await send_csv_email(
+                        entity=grp_entity,
+                        to_emails=to_emails,
+                        csv_content=csv_content,
+                        csv_filename=csv_filename,
+                        lead_count=len(leads),
+                        lb_count=lb_count,
+                        produit=produit
+                    )
+                    
+                    # 2. 🔒 SEULEMENT après envoi réussi: state machine
+                    await batch_mark_deliveries_sent(
+                        delivery_ids=delivery_ids,
+                        lead_ids=lead_ids,
+                        sent_to=to_emails,
+                        client_id=grp_client_id,
+                        client_name=client_name,
+                        commande_id=grp_commande_id or ""
+                    )
+                    
+                    # 3. Stocker CSV pour téléchargement (1 fichier pour le batch)
+                    await db.deliveries.update_many(
+                        {"id": {"$in": delivery_ids}},
+                        {
+                            "$set": {
+                                "csv_file_id": await store_csv(csv_content),
+                                "csv_filename": csv_filename,
+                                "csv_generated_at": now_iso(),
+                                "sent_by": user.get("email")
+                            },
+                            "$unset": {"csv_content": ""}
+                        }
+                    )
+                    
+                    results["sent"] += len(leads)
+                    logger.info(f"[BATCH_SEND] {client_name}: {len(leads)} leads sent to {to_emails}")
+                    
+                except Exception as e:
+                    # 🔒 Marquer comme failed via state machine
+                    try:
+                        await batch_mark_deliveries_failed(
+                            delivery_ids=delivery_ids,
+                            error=str(e)
+                        )
+                    except DeliveryInvariantError:
+                        logger.error(f"[BATCH_SEND] State machine failed for batch: {str(e)}")
+                    
+                    results["errors"].append({"client": client_name, "error": str(e)})
+    
+    if not results["processed"]:
+        return {"success": True, "sent": 0, "message": "Aucune delivery ready_to_send"}
+    
+    throughput = pending_throughput(results["processed"], started)
+    logger.info(
+        f"[BATCH_SEND] {results['processed']} deliveries ({results['groups']} groupes, "
+        f"{results['pages']} pages) en {throughput['duration_seconds']}s "
+        f"({throughput['deliveries_per_second']}/s)"
+    )
     
     return {
         "success": True,
         "sent": results["sent"],
         "skipped_calendar": results["skipped_calendar"],
-        "errors": results["errors"]
+        "errors": results["errors"],
+        "processed": results["processed"],
+        "groups": results["groups"],
+        "pages": results["pages"],
+        **throughput
     }
 
@@ -465,32 +465,31 @@ async def monitoring_intelligence(
     # 8. CLIENT OVERLAP STATS
     # ═══════════════════════════════════════════════════════════
     try:
-        from services.overlap_guard import compute_client_group_key
-
-        # Shared clients: clients with emails present in both entities
-        all_clients = await db.clients.find(
-            {"active": True}, {"_id": 0, "id": 1, "entity": 1, "email": 1, "delivery_emails": 1}
-        ).to_list(500)
-
-        email_to_entities = defaultdict(set)
-        client_keys = {}
-        for c in all_clients:
-            key = compute_client_group_key(c)
-            if key:
-                client_keys[c["id"]] = key
-                for em in key.split("|"):
-                    email_to_entities[em].add(c.get("entity", ""))
-
-        shared_emails = {em for em, ents in email_to_entities.items() if len(ents) >= 2}
+        # Shared clients: active clients whose emails exist in both entities
+        # (client_groups index: only shared emails are loaded)
+        shared_groups = await db.client_groups.find(
+            {"shared": True}, {"_id": 0, "entities": 1}
+        ).to_list(None)
+        candidate_ids = {cid for g in shared_groups for ids in g.get("entities", {}).values() for cid in ids}
+        active_ids = set()
+        if candidate_ids:
+            active_ids = {
+                c["id"] for c in await db.clients.find(
+                    {"id": {"$in": list(candidate_ids)}, "active": True}, {"_id": 0, "id": 1}
+                ).to_list(None)
+            }
+
         shared_client_ids = set()
-        for c in all_clients:
-            key = client_keys.get(c["id"], "")
-            for em in key.split("|"):
-                if em in shared_emails:
-                    shared_client_ids.add(c["id"])
-                    break
-
-        total_clients = len(all_clients) or 1
+        for g in shared_groups:
+            active_by_entity = {
+                ent: [cid for cid in ids if cid in active_ids]
+                for ent, ids in g.get("entities", {}).items()
+            }
+            if sum(1 for ids in active_by_entity.values() if ids) >= 2:
+                for ids in active_by_entity.values():
+                    shared_client_ids.update(ids)
+
+        total_clients = await db.clients.count_documents({"active": True}) or 1
         shared_count = len(shared_client_ids)
 
         # Overlap deliveries (30d window from deliveries collection)
@@ -15,6 +15,7 @@ from routes.auth import get_current_user, require_admin
 from models import validate_entity
 from models.provider import ProviderCreate, ProviderUpdate
 from services.permissions import require_permission
+from services.ingestion_cache import invalidate_provider_cache
 
 router = APIRouter(prefix="/providers", tags=["Providers"])
 
@@ -75,6 +76,7 @@ async def create_provider(data: ProviderCreate, user: dict = Depends(require_per
         "api_key": generate_provider_key(),
         "contact_email": data.contact_email or "",
         "notes": data.notes or "",
+        "async_routing": bool(data.async_routing),
         "active": True,
         "created_at": now_iso(),
         "updated_at": now_iso(),
@@ -82,6 +84,7 @@ async def create_provider(data: ProviderCreate, user: dict = Depends(require_per
 
     await db.providers.insert_one(provider)
     provider.pop("_id", None)
+    invalidate_provider_cache("create")
 
     return {"success": True, "provider": provider}
 
@@ -101,6 +104,7 @@ async def update_provider(
     update["updated_at"] = now_iso()
 
     await db.providers.update_one({"id": provider_id}, {"$set": update})
+    invalidate_provider_cache("update")
     updated = await db.providers.find_one({"id": provider_id}, {"_id": 0})
     return {"success": True, "provider": updated}
 
@@ -111,6 +115,7 @@ async def delete_provider(provider_id: str, user: dict = Depends(require_permiss
     result = await db.providers.delete_one({"id": provider_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Provider non trouve")
+    invalidate_provider_cache("delete")
     return {"success": True, "deleted_id": provider_id}
 
 
@@ -126,6 +131,7 @@ async def rotate_api_key(provider_id: str, user: dict = Depends(require_permissi
         {"id": provider_id},
         {"$set": {"api_key": new_key, "updated_at": now_iso()}}
     )
+    invalidate_provider_cache("rotate_key")
     
     from services.event_logger import log_event
     await log_event(
@@ -3,19 +3,27 @@ RDZ CRM - Routes Publiques
 - Tracking sessions visiteurs
 - Tracking evenements LP/Form
 - Soumission leads avec routing immediat (Phase 2)
+- Ingestion bulk provider (/leads/bulk)
 """
 
 from fastapi import APIRouter, Request
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, Dict, List, Tuple, Any
+import os
 import uuid
 import json
 import logging
 
 from config import db, now_iso, timestamp, validate_phone_fr, normalize_phone_fr
-from services.routing_engine import route_lead, RoutingResult
-from services.settings import get_form_config, is_source_allowed
+from services.routing_engine import RoutingResult
+from services.lead_ingestion import (
+    plan_lead_routing, persist_planned_chunks, route_and_persist_lead,
+)
+from services.routing_queue import QUEUED_STATUS, is_async_routing_available, notify_lead_queued
+from services.tracking_buffer import prepare_event, enqueue_event, enqueue_session_update
+from services.settings import is_source_allowed
+from services.ingestion_cache import resolve_provider, resolve_form_config
 
 router = APIRouter(prefix="/public", tags=["Public"])
 logger = logging.getLogger("public")
@@ -83,6 +91,8 @@ class LeadData(BaseModel):
     produit: Optional[str] = ""
     # Provider auth (API key dans le body ou header)
     api_key: Optional[str] = ""
+    # Mode async (ASYNC_ROUTING_ENABLED): True = forcer le routing synchrone
+    sync_routing: Optional[bool] = None
 
 
 # Tracking endpoints
@@ -175,14 +185,6 @@ async def track_lp_visit(request: Request):
     if not session:
         return {"success": False, "error": "Session invalide"}
 
-    # Anti-doublon: 1 seule lp_visit par session
-    existing = await db.tracking.find_one({
-        "session_id": session_id,
-        "event": "lp_visit"
-    })
-    if existing:
-        return {"success": True, "event_id": existing.get("id"), "duplicate": True}
-
     event_id = str(uuid.uuid4())
     lp_code = data.get("lp_code") or session.get("lp_code", "")
 
@@ -205,15 +207,19 @@ async def track_lp_visit(request: Request):
         "created_at": now_iso()
     }
 
-    await db.tracking.insert_one(event)
+    # Anti-doublon: 1 seule lp_visit par session (index unique partiel au flush)
+    existing_id = prepare_event(event)
+    if existing_id:
+        return {"success": True, "event_id": existing_id, "duplicate": True}
+
+    await enqueue_event(event)
 
     # MAJ session UTM si manquant
     update_session = {}
     for key in ["utm_source", "utm_medium", "utm_campaign", "utm_content", "utm_term", "gclid", "fbclid"]:
         if data.get(key) and not session.get(key):
             update_session[key] = data.get(key)
-    if update_session:
-        await db.visitor_sessions.update_one({"id": session_id}, {"$set": update_session})
+    await enqueue_session_update(session_id, update_session)
 
     return {"success": True, "event_id": event_id}
 
@@ -232,15 +238,6 @@ async def track_event(request: Request):
     if not session:
         return {"success": False, "error": "Session invalide"}
 
-    # Anti-doublon pour certains events
-    if event_type in ["lp_visit", "cta_click", "form_start"]:
-        existing = await db.tracking.find_one({
-            "session_id": session_id,
-            "event": event_type
-        })
-        if existing:
-            return {"success": True, "event_id": existing.get("id"), "duplicate": True}
-
     event_id = str(uuid.uuid4())
 
     event = {
@@ -255,133 +252,62 @@ async def track_event(request: Request):
         "created_at": now_iso()
     }
 
-    await db.tracking.insert_one(event)
+    # Anti-doublon pour certains events (lp_visit, cta_click, form_start)
+    existing_id = prepare_event(event)
+    if existing_id:
+        return {"success": True, "event_id": existing_id, "duplicate": True}
+
+    await enqueue_event(event)
     return {"success": True, "event_id": event_id}
 
 
 # Lead submission
 
-@router.post("/leads")
-async def submit_lead(data: LeadData, request: Request):
-    """
-    Soumettre un lead avec routing immediat (Phase 2)
-
-    FLUX:
-    1. Valider telephone
-    2. Anti double-submit (5 sec)
-    3. Resoudre entity + produit (provider OU form_code)
-    4. Sauvegarder lead
-    5. Router immediatement si eligible
-    6. Retourner resultat enrichi
-
-    STATUTS POSSIBLES:
-    - routed: lead livre a un client
-    - no_open_orders: aucune commande OPEN compatible
-    - hold_source: source blacklistee
-    - duplicate: doublon 30j chez tous les clients
-    - invalid: donnees incompletes
-    """
-    from services.duplicate_detector import check_double_submit
-
-    # ---- Provider auth ----
-    api_key = data.api_key or ""
+def _extract_api_key(body_api_key: str, request: Request) -> str:
+    """API key provider: body prioritaire, sinon header Authorization"""
+    api_key = body_api_key or ""
     if not api_key:
         auth_header = request.headers.get("authorization", "")
         if auth_header.startswith("Bearer "):
             api_key = auth_header[7:].strip()
         elif auth_header.startswith("prov_"):
             api_key = auth_header.strip()
+    return api_key
 
-    provider = None
-    entity_locked = False
 
-    if api_key and api_key.startswith("prov_"):
-        provider = await db.providers.find_one(
-            {"api_key": api_key, "active": True},
-            {"_id": 0}
-        )
-        if not provider:
-            return {"success": False, "error": "API key provider invalide ou inactive"}
-
-    # Valider et normaliser telephone (FORMAT UNIQUE: 0XXXXXXXXX)
-    phone_status, phone_result, phone_quality = normalize_phone_fr(data.phone)
-    is_valid = phone_status == "valid"
-    phone = phone_result if is_valid else data.phone
-
-    # ════════════════════════════════════════════════════════════
-    # SUSPICIOUS PHONE POLICY (applies to ALL entities)
-    # - Providers: REJECT immediately (HTTP 400-like, no lead created)
-    # - Inter-CRM: REJECT immediately
-    # - Internal LP: ACCEPT (LB replacement at routing time)
-    # ════════════════════════════════════════════════════════════
-    is_provider_source = bool(provider)
-    is_intercrm = bool(data.api_key and not provider)  # API key present but not a valid provider
+def _request_ip(request: Request) -> str:
+    return request.headers.get("x-forwarded-for", request.client.host if request.client else "")
 
-    if is_valid and phone_quality == "suspicious" and (is_provider_source or is_intercrm):
-        source_label = f"provider:{provider.get('slug')}" if provider else "intercrm"
-        logger.warning(
-            f"[SUSPICIOUS_REJECTED] phone=***{phone[-4:]} source={source_label} "
-            f"reason=suspicious_provider_rejected"
-        )
-        return {
-            "success": False,
-            "error": "suspicious_provider_rejected",
-            "message": "Numéro suspect rejeté — qualité insuffisante",
-            "phone_quality": "suspicious",
-        }
 
-    # Champs obligatoires
+def _build_lead(
+    data: LeadData,
+    phone: str,
+    phone_quality: str,
+    is_valid: bool,
+    provider: Optional[Dict],
+    entity: str,
+    produit: str,
+    session: Optional[Dict],
+    source_allowed: Optional[bool],
+    ip: str
+) -> Dict:
+    """
+    Construit le document lead (statut initial inclus).
+    source_allowed: résultat du source gating (None = non évalué).
+    """
     nom = (data.nom or "").strip()
     dept = (data.departement or "").strip()[:2] if data.departement else ""
 
     # Champs minimaux valides (phone + departement + nom)
     lead_minimal_valid = bool(is_valid and nom and dept)
 
-    # Anti double-submit (5 sec)
-    if is_valid and data.session_id:
-        dup_result = await check_double_submit(phone, data.session_id)
-        if dup_result.is_duplicate:
-            return {
-                "success": True,
-                "lead_id": dup_result.original_lead_id,
-                "status": "double_submit",
-                "message": "Double soumission detectee - lead deja cree"
-            }
-
-    # ---- Resoudre entity + produit ----
-    entity = (data.entity or "").upper()
-    produit = (data.produit or "").upper()
-
-    # Si provider: entity VERROUILLEE
-    if provider:
-        entity = provider.get("entity", "")
-        entity_locked = True
-        # produit peut venir du body
-    
-    # Si pas provider ET pas entity/produit: resoudre depuis form_code
-    if not provider and (not entity or not produit) and data.form_code:
-        form_config = await get_form_config(data.form_code)
-        if form_config:
-            entity = entity or form_config.get("entity", "")
-            produit = produit or form_config.get("produit", "")
-        else:
-            logger.warning(f"[LEAD] form_code={data.form_code} non configure - entity/produit manquants")
-
-    # Recuperer session pour source/UTM
-    session = await db.visitor_sessions.find_one({"id": data.session_id}, {"_id": 0})
     utm_source = session.get("utm_source", "") if session else ""
     utm_medium = session.get("utm_medium", "") if session else ""
     utm_campaign = data.utm_campaign or (session.get("utm_campaign", "") if session else "")
     lp_code = data.lp_code or (session.get("lp_code", "") if session else "")
 
     source_name = utm_source or lp_code or ""
-    
-    # Source gating
-    source_blocked = False
-    if lead_minimal_valid and source_name:
-        allowed = await is_source_allowed(source_name)
-        if not allowed:
-            source_blocked = True
+    source_blocked = bool(lead_minimal_valid and source_name and source_allowed is False)
 
     # Determiner le statut initial
     if not lead_minimal_valid:
@@ -401,10 +327,8 @@ async def submit_lead(data: LeadData, request: Request):
     else:
         lead_source_type = "direct"
 
-    # Creer le lead
-    lead_id = str(uuid.uuid4())
     lead = {
-        "id": lead_id,
+        "id": str(uuid.uuid4()),
         "phone": phone,
         "phone_quality": phone_quality if is_valid else "invalid",
         "lead_source_type": lead_source_type,
@@ -420,7 +344,7 @@ async def submit_lead(data: LeadData, request: Request):
         # Provider
         "provider_id": provider.get("id") if provider else None,
         "provider_slug": provider.get("slug") if provider else None,
-        "entity_locked": entity_locked,
+        "entity_locked": bool(provider),
         # Tracking
         "session_id": data.session_id,
         "form_code": data.form_code or "",
@@ -433,7 +357,7 @@ async def submit_lead(data: LeadData, request: Request):
         # Champs secondaires
         "custom_fields": {},
         # Meta
-        "ip": request.headers.get("x-forwarded-for", request.client.host if request.client else ""),
+        "ip": ip,
         "register_date": timestamp(),
         "created_at": now_iso(),
     }
@@ -454,188 +378,27 @@ async def submit_lead(data: LeadData, request: Request):
     if secondary:
         lead["custom_fields"] = secondary
 
-    # ======== INSERT LEAD ========
-    await db.leads.insert_one(lead)
+    return lead
 
-    # MAJ session
-    if session:
-        await db.visitor_sessions.update_one(
-            {"id": data.session_id},
-            {"$set": {"status": "converted", "lead_id": lead_id}}
-        )
 
-    # ======== ROUTING IMMEDIAT ========
-    routing_result = None
-    delivery_id = None
-    
-    # Conditions pour router:
-    # - lead_minimal_valid
-    # - NOT source_blocked
-    # - entity + produit presents
-    can_route = lead_minimal_valid and not source_blocked and entity and produit
-
-    if can_route:
-        routing_result = await route_lead(
-            entity=entity,
-            produit=produit,
-            departement=dept,
-            phone=phone,
-            is_lb=False,
-            entity_locked=entity_locked
-        )
+def _source_to_check(data: LeadData, session: Optional[Dict]) -> str:
+    """Source soumise au gating (utm_source de la session, sinon lp_code)"""
+    utm_source = session.get("utm_source", "") if session else ""
+    lp_code = data.lp_code or (session.get("lp_code", "") if session else "")
+    return utm_source or lp_code or ""
 
-        if routing_result.success:
-            # Determine target entity from commande (may differ from lead entity on fallback)
-            target_cmd = await db.commandes.find_one(
-                {"id": routing_result.commande_id}, {"_id": 0, "entity": 1}
-            )
-            target_entity = target_cmd.get("entity", entity) if target_cmd else entity
-
-            # ════════════════════════════════════════════════════════
-            # CLIENT OVERLAP GUARD (fail-open, kill switch, bounded)
-            # Avoid delivering to shared clients if alternative exists
-            # ════════════════════════════════════════════════════════
-            overlap_result = {"is_shared": False, "overlap_active_30d": False,
-                              "client_group_key": "", "fallback": False}
-            try:
-                from services.overlap_guard import check_overlap_and_find_alternative, is_guard_enabled
-                if await is_guard_enabled():
-                    overlap_result = await check_overlap_and_find_alternative(
-                        selected_client_id=routing_result.client_id,
-                        selected_commande_id=routing_result.commande_id,
-                        entity=target_entity,
-                        produit=produit,
-                        departement=dept,
-                        phone=phone,
-                    )
-                    if overlap_result.get("alternative_found"):
-                        # Switch to alternative
-                        routing_result = type(routing_result)(
-                            success=True,
-                            client_id=overlap_result["alternative_client_id"],
-                            client_name=overlap_result["alternative_client_name"],
-                            commande_id=overlap_result["alternative_commande_id"],
-                            is_lb=routing_result.is_lb,
-                            reason="overlap_alternative",
-                            routing_mode=routing_result.routing_mode,
-                        )
-                        logger.info(
-                            f"[OVERLAP] Switched to alternative: {overlap_result['alternative_client_name']}"
-                        )
-            except Exception as e:
-                logger.error(f"[OVERLAP] Guard failed (fail-open): {e}")
-
-            # ════════════════════════════════════════════════════════
-            # SUSPICIOUS LB REPLACEMENT HOOK
-            # If suspicious + internal_lp → try to deliver an LB instead
-            # ════════════════════════════════════════════════════════
-            actual_lead_id = lead_id
-            actual_is_lb = False
-            was_replaced = False
-            replacement_lb_id = None
-
-            if phone_quality == "suspicious" and lead_source_type == "internal_lp":
-                from services.lb_replacement import try_lb_replacement
-                lb_result = await try_lb_replacement(
-                    commande_id=routing_result.commande_id,
-                    target_entity=target_entity,
-                    produit=produit,
-                    client_id=routing_result.client_id,
-                    exclude_lead_id=lead_id,
-                )
-                if lb_result.get("found"):
-                    replacement_lb_id = lb_result["lead_id"]
-                    actual_lead_id = replacement_lb_id
-                    actual_is_lb = True
-                    was_replaced = True
-                    # Mark original suspicious lead
-                    await db.leads.update_one(
-                        {"id": lead_id},
-                        {"$set": {
-                            "was_replaced": True,
-                            "replacement_source": "LB",
-                            "replacement_lead_id": replacement_lb_id,
-                            "status": "replaced_by_lb",
-                            "updated_at": now_iso(),
-                        }}
-                    )
-                    lead["status"] = "replaced_by_lb"
-                    logger.info(
-                        f"[LB_REPLACE] suspicious={lead_id[:8]}... replaced by LB={replacement_lb_id[:8]}... "
-                        f"commande={routing_result.commande_id[:8]}..."
-                    )
-                else:
-                    # No LB available → deliver suspicious normally
-                    await db.leads.update_one(
-                        {"id": lead_id},
-                        {"$set": {"was_replaced": False}}
-                    )
-
-            # Creer delivery record (for actual_lead_id — LB or original)
-            delivery_id = str(uuid.uuid4())
-            delivery = {
-                "id": delivery_id,
-                "lead_id": actual_lead_id,
-                "client_id": routing_result.client_id,
-                "client_name": routing_result.client_name,
-                "commande_id": routing_result.commande_id,
-                "entity": target_entity,
-                "produit": produit,
-                "delivery_method": "realtime",
-                "status": "pending_csv",
-                "is_lb": actual_is_lb,
-                "routing_mode": routing_result.routing_mode,
-                "client_group_key": overlap_result.get("client_group_key", ""),
-                "is_shared_client_30d": overlap_result.get("overlap_active_30d", False),
-                "overlap_fallback_delivery": overlap_result.get("fallback", False),
-                "created_at": now_iso(),
-            }
-            if was_replaced:
-                delivery["replaced_suspicious_id"] = lead_id
-            await db.deliveries.insert_one(delivery)
-
-            # MAJ lead (the actual delivered lead — LB or original)
-            await db.leads.update_one(
-                {"id": actual_lead_id},
-                {"$set": {
-                    "status": "routed",
-                    "delivery_id": delivery_id,
-                    "delivery_client_id": routing_result.client_id,
-                    "delivery_client_name": routing_result.client_name,
-                    "delivery_commande_id": routing_result.commande_id,
-                    "routing_mode": routing_result.routing_mode,
-                    "routed_at": now_iso()
-                }}
-            )
-            if not was_replaced:
-                lead["status"] = "routed"
-        else:
-            # Pas de commande OPEN
-            reason = routing_result.reason
-            if "duplicate" in reason:
-                new_status = "duplicate"
-            else:
-                new_status = "no_open_orders"
-            
-            await db.leads.update_one(
-                {"id": lead_id},
-                {"$set": {
-                    "status": new_status,
-                    "routing_reason": reason
-                }}
-            )
-            lead["status"] = new_status
 
-    # ======== LOG ========
+def _log_lead_created(lead: Dict, provider: Optional[Dict], routing_result: Optional[RoutingResult]) -> None:
+    phone = lead["phone"]
     log_msg = (
-        f"[LEAD_CREATED] id={lead_id} phone=***{phone[-4:] if len(phone) >= 4 else phone} "
-        f"entity={entity or 'N/A'} produit={produit or 'N/A'} dept={dept} "
+        f"[LEAD_CREATED] id={lead['id']} phone=***{phone[-4:] if len(phone) >= 4 else phone} "
+        f"entity={lead['entity'] or 'N/A'} produit={lead['produit'] or 'N/A'} dept={lead['departement']} "
         f"status={lead['status']}"
     )
     if provider:
         log_msg += f" provider={provider.get('slug')} entity_locked=True"
-    if source_blocked:
-        log_msg += f" HOLD_SOURCE={source_name}"
+    if lead.get("hold_reason"):
+        log_msg += f" HOLD_SOURCE={lead['source']}"
     if routing_result:
         if routing_result.success:
             log_msg += f" -> ROUTED to {routing_result.client_name}"
@@ -643,13 +406,14 @@ async def submit_lead(data: LeadData, request: Request):
             log_msg += f" -> {routing_result.reason}"
     logger.info(log_msg)
 
-    # ======== RESPONSE ========
+
+def _lead_response(lead: Dict, routing_result: Optional[RoutingResult], delivery_id: Optional[str]) -> Dict:
     response = {
         "success": True,
-        "lead_id": lead_id,
+        "lead_id": lead["id"],
         "status": lead["status"],
-        "entity": entity or None,
-        "produit": produit or None,
+        "entity": lead["entity"] or None,
+        "produit": lead["produit"] or None,
     }
 
     if delivery_id:
@@ -657,12 +421,14 @@ async def submit_lead(data: LeadData, request: Request):
         response["client_id"] = routing_result.client_id
         response["client_name"] = routing_result.client_name
         response["message"] = f"Lead route vers {routing_result.client_name}"
-    elif source_blocked:
+    elif lead.get("hold_reason"):
         response["message"] = "Lead stocke - source en attente de validation"
-    elif not lead_minimal_valid:
+    elif lead["phone_quality"] == "invalid" or not lead["nom"] or not lead["departement"]:
         response["message"] = "Lead stocke - donnees incompletes"
-    elif not entity or not produit:
+    elif not lead["entity"] or not lead["produit"]:
         response["message"] = "Lead stocke - configuration formulaire manquante"
+    elif lead["status"] == QUEUED_STATUS:
+        response["message"] = "Lead enregistre - routing en cours"
     elif routing_result and not routing_result.success:
         response["message"] = f"Lead stocke - {routing_result.reason}"
         response["routing_reason"] = routing_result.reason
@@ -670,3 +436,384 @@ async def submit_lead(data: LeadData, request: Request):
         response["message"] = "Lead enregistre"
 
     return response
+
+
+def _use_async_routing(data: LeadData, provider: Optional[Dict]) -> bool:
+    if data.sync_routing or not is_async_routing_available():
+        return False
+    if provider:
+        return bool(provider.get("async_routing"))
+    return True
+
+
+SUSPICIOUS_REJECTED_RESPONSE = {
+    "success": False,
+    "error": "suspicious_provider_rejected",
+    "message": "Numéro suspect rejeté — qualité insuffisante",
+    "phone_quality": "suspicious",
+}
+
+
+@router.post("/leads")
+async def submit_lead(data: LeadData, request: Request):
+    """
+    Soumettre un lead avec routing immediat (Phase 2)
+
+    FLUX:
+    1. Valider telephone
+    2. Anti double-submit (5 sec)
+    3. Resoudre entity + produit (provider OU form_code)
+    4. Sauvegarder lead
+    5. Router immediatement si eligible
+    6. Retourner resultat enrichi
+
+    STATUTS POSSIBLES:
+    - routed: lead livre a un client
+    - queued: mode async (ASYNC_ROUTING_ENABLED), routing par routing_queue
+    - no_open_orders: aucune commande OPEN compatible
+    - hold_source: source blacklistee
+    - duplicate: doublon 30j chez tous les clients
+    - invalid: donnees incompletes
+    """
+    from services.duplicate_detector import check_double_submit
+
+    # ---- Provider auth ----
+    api_key = _extract_api_key(data.api_key, request)
+    provider = None
+
+    if api_key and api_key.startswith("prov_"):
+        provider = await resolve_provider(api_key)
+        if not provider:
+            return {"success": False, "error": "API key provider invalide ou inactive"}
+
+    # Valider et normaliser telephone (FORMAT UNIQUE: 0XXXXXXXXX)
+    phone_status, phone_result, phone_quality = normalize_phone_fr(data.phone)
+    is_valid = phone_status == "valid"
+    phone = phone_result if is_valid else data.phone
+
+    # ════════════════════════════════════════════════════════════
+    # SUSPICIOUS PHONE POLICY (applies to ALL entities)
+    # - Providers: REJECT immediately (HTTP 400-like, no lead created)
+    # - Inter-CRM: REJECT immediately
+    # - Internal LP: ACCEPT (LB replacement at routing time)
+    # ════════════════════════════════════════════════════════
+    is_provider_source = bool(provider)
+    is_intercrm = bool(data.api_key and not provider)  # API key present but not a valid provider
+
+    if is_valid and phone_quality == "suspicious" and (is_provider_source or is_intercrm):
+        source_label = f"provider:{provider.get('slug')}" if provider else "intercrm"
+        logger.warning(
+            f"[SUSPICIOUS_REJECTED] phone=***{phone[-4:]} source={source_label} "
+            f"reason=suspicious_provider_rejected"
+        )
+        return dict(SUSPICIOUS_REJECTED_RESPONSE)
+
+    # Anti double-submit (5 sec)
+    if is_valid and data.session_id:
+        dup_result = await check_double_submit(phone, data.session_id)
+        if dup_result.is_duplicate:
+            return {
+                "success": True,
+                "lead_id": dup_result.original_lead_id,
+                "status": "double_submit",
+                "message": "Double soumission detectee - lead deja cree"
+            }
+
+    # ---- Resoudre entity + produit ----
+    entity = (data.entity or "").upper()
+    produit = (data.produit or "").upper()
+
+    # Si provider: entity VERROUILLEE
+    if provider:
+        entity = provider.get("entity", "")
+        # produit peut venir du body
+
+    # Si pas provider ET pas entity/produit: resoudre depuis form_code
+    if not provider and (not entity or not produit) and data.form_code:
+        form_config = await resolve_form_config(data.form_code)
+        if form_config:
+            entity = entity or form_config.get("entity", "")
+            produit = produit or form_config.get("produit", "")
+        else:
+            logger.warning(f"[LEAD] form_code={data.form_code} non configure - entity/produit manquants")
+
+    # Recuperer session pour source/UTM
+    session = await db.visitor_sessions.find_one({"id": data.session_id}, {"_id": 0})
+
+    # Source gating
+    source_allowed = None
+    source_name = _source_to_check(data, session)
+    if source_name:
+        source_allowed = await is_source_allowed(source_name)
+
+    lead = _build_lead(
+        data, phone, phone_quality, is_valid, provider, entity, produit,
+        session, source_allowed, _request_ip(request)
+    )
+    lead_id = lead["id"]
+
+    # Mode async: lead routable → file de routing, réponse immédiate.
+    # Providers: synchrone par défaut (résultat de routing attendu),
+    # sauf provider.async_routing=True. sync_routing=True force le synchrone.
+    if lead["status"] == "new" and _use_async_routing(data, provider):
+        lead["status"] = QUEUED_STATUS
+        lead["queued_at"] = now_iso()
+
+    # ======== ROUTING IMMEDIAT + INSERT ========
+    # Routing calculé AVANT la persistance: le lead est inséré une seule
+    # fois dans son état final (avec sa delivery, en transaction si replica set).
+    # Conditions pour router: statut "new" (minimal valide, source OK, entity + produit)
+    routing_result = None
+    delivery_id = None
+    if lead["status"] == "new":
+        routing_result, delivery_id = await route_and_persist_lead(lead)
+    else:
+        await db.leads.insert_one(dict(lead))
+        if lead["status"] == QUEUED_STATUS:
+            notify_lead_queued()
+
+    # MAJ session (coalescée par le buffer tracking)
+    if session:
+        await enqueue_session_update(data.session_id, {"status": "converted", "lead_id": lead_id})
+
+    _log_lead_created(lead, provider, routing_result)
+    return _lead_response(lead, routing_result, delivery_id)
+
+
+# ══════════════════════════════════════════════════════════════════
+# INGESTION BULK PROVIDER
+# POST /public/leads/bulk
+# Body: JSON [lead, ...] | {"api_key"?, "leads": [...]} | NDJSON (1 lead / ligne)
+# ══════════════════════════════════════════════════════════════════
+
+BULK_MAX_LEADS = int(os.environ.get("BULK_LEADS_MAX", "5000"))
+BULK_DEDUP_WINDOW_SECONDS = int(os.environ.get("BULK_DEDUP_WINDOW_SECONDS", "600"))
+
+
+def _parse_bulk_body(raw: bytes, content_type: str) -> Tuple[List[Any], str]:
+    """
+    Retourne (items, api_key_body). Une ligne NDJSON illisible donne None
+    à sa position (résultat "invalid_payload" sans décaler les index).
+    Lève ValueError si le corps est inexploitable.
+    """
+    text = raw.decode("utf-8").strip()
+    if not text:
+        return [], ""
+
+    is_ndjson = "ndjson" in content_type or "jsonlines" in content_type
+    if not is_ndjson:
+        try:
+            body = json.loads(text)
+        except json.JSONDecodeError:
+            # JSON invalide en un bloc: tenter le NDJSON
+            is_ndjson = True
+        else:
+            if isinstance(body, list):
+                return body, ""
+            if isinstance(body, dict) and isinstance(body.get("leads"), list):
+                return body["leads"], str(body.get("api_key") or "")
+            if isinstance(body, dict):
+                return [body], ""
+            raise ValueError("Format attendu: liste de leads, {leads: [...]} ou NDJSON")
+
+    items = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            items.append(json.loads(line))
+        except json.JSONDecodeError:
+            items.append(None)
+    return items, ""
+
+
+@router.post("/leads/bulk")
+async def submit_leads_bulk(request: Request):
+    """
+    Ingestion bulk provider (jusqu'à BULK_LEADS_MAX leads par appel)
+
+    FLUX:
+    1. Auth provider UNE fois (entity verrouillée pour tout le lot)
+    2. Normalisation + politique suspicious lead par lead
+    3. Doublons: intra-lot (phone + produit) puis Mongo (1 requête $in,
+       fenêtre BULK_DEDUP_WINDOW_SECONDS) → statut "double_submit"
+    4. Routing séquentiel dans l'ordre du lot: le snapshot de routing
+       (entity, produit) est construit une fois et consommé localement
+    5. insert_many des leads dans leur état final + deliveries (ordre conservé),
+       par tranches de BULK_PERSIST_CHUNK leads (1 transaction par tranche;
+       tranche en échec → leads stockés en "new", rapport dans "chunks")
+    6. Résultats par lead, dans l'ordre ({index, ...réponse /leads})
+    """
+    from pydantic import ValidationError
+    from services.duplicate_detector import check_recent_submissions_many
+
+    try:
+        items, body_api_key = _parse_bulk_body(
+            await request.body(), request.headers.get("content-type", "")
+        )
+    except (ValueError, UnicodeDecodeError) as e:
+        return {"success": False, "error": "invalid_body", "message": str(e)}
+
+    # ---- Provider auth (une fois) ----
+    api_key = _extract_api_key(body_api_key, request)
+    provider = await resolve_provider(api_key) if api_key.startswith("prov_") else None
+    if not provider:
+        return {"success": False, "error": "API key provider invalide ou inactive"}
+
+    if not items:
+        return {"success": False, "error": "empty_batch", "message": "Aucun lead dans le lot"}
+    if len(items) > BULK_MAX_LEADS:
+        return {
+            "success": False,
+            "error": "batch_too_large",
+            "message": f"Lot limité à {BULK_MAX_LEADS} leads ({len(items)} reçus)",
+        }
+
+    entity = provider.get("entity", "")
+    ip = _request_ip(request)
+    results: List[Optional[Dict]] = [None] * len(items)
+
+    # ---- Normalisation + validation ----
+    prepared = []  # (index, data, phone, phone_quality, is_valid, produit)
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[i] = {"index": i, "success": False, "error": "invalid_payload"}
+            continue
+        try:
+            data = LeadData(**{"session_id": "", "form_code": "", **item})
+        except ValidationError as e:
+            results[i] = {
+                "index": i, "success": False, "error": "invalid_payload",
+                "message": "; ".join(str(err.get("loc", [""])[0]) for err in e.errors()),
+            }
+            continue
+
+        phone_status, phone_result, phone_quality = normalize_phone_fr(data.phone)
+        is_valid = phone_status == "valid"
+        phone = phone_result if is_valid else data.phone
+
+        if is_valid and phone_quality == "suspicious":
+            results[i] = {"index": i, **SUSPICIOUS_REJECTED_RESPONSE}
+            continue
+
+        prepared.append((i, data, phone, phone_quality, is_valid, (data.produit or "").upper()))
+
+    # ---- Doublons intra-lot + Mongo (1 requête) ----
+    recent = await check_recent_submissions_many(
+        [p[2] for p in prepared if p[4]], provider.get("id"), BULK_DEDUP_WINDOW_SECONDS
+    )
+    first_in_batch: Dict[Tuple[str, str], int] = {}
+    to_build = []
+    for entry in prepared:
+        i, _, phone, _, is_valid, produit = entry
+        key = (phone, produit)
+        if is_valid and key in recent:
+            results[i] = {
+                "index": i, "success": True, "lead_id": recent[key], "status": "double_submit",
+                "message": "Double soumission detectee - lead deja cree",
+            }
+            continue
+        if is_valid and key in first_in_batch:
+            results[i] = {
+                "index": i, "success": True, "status": "double_submit",
+                "duplicate_of_index": first_in_batch[key],
+                "message": "Doublon dans le lot - lead deja cree",
+            }
+            continue
+        if is_valid:
+            first_in_batch[key] = i
+        to_build.append(entry)
+
+    # ---- Sessions (1 requête $in) ----
+    session_ids = list({e[1].session_id for e in to_build if e[1].session_id})
+    sessions = {}
+    if session_ids:
+        sessions = {
+            s["id"]: s for s in await db.visitor_sessions.find(
+                {"id": {"$in": session_ids}}, {"_id": 0}
+            ).to_list(len(session_ids))
+        }
+
+    # ---- Construction ----
+    source_cache: Dict[str, bool] = {}
+    leads = []  # (index, lead)
+    for i, data, phone, phone_quality, is_valid, produit in to_build:
+        session = sessions.get(data.session_id)
+        source_allowed = None
+        source_name = _source_to_check(data, session)
+        if source_name:
+            if source_name not in source_cache:
+                source_cache[source_name] = await is_source_allowed(source_name)
+            source_allowed = source_cache[source_name]
+        leads.append((i, _build_lead(
+            data, phone, phone_quality, is_valid, provider, entity, produit,
+            session, source_allowed, ip
+        )))
+
+    # ---- Routing (ordre du lot) AVANT persistance ----
+    pristine = [dict(lead) for _, lead in leads]
+    planned = []  # (lead, plan)
+    routing_errors = set()
+    for i, lead in leads:
+        plan = None
+        if lead["status"] == "new":
+            try:
+                plan = await plan_lead_routing(lead)
+            except Exception as e:
+                # Lead stocké en "new": reprise possible par la livraison différée
+                logger.error(f"[BULK] Routing lead {lead['id'][:8]}... échoué: {e}")
+                routing_errors.add(i)
+        planned.append((lead, plan))
+
+    # ---- Persistance par tranches: insert_many leads (état final) + deliveries ----
+    chunks = await persist_planned_chunks(planned, pristine) if planned else []
+    persist_errors = set()
+    for chunk in chunks:
+        if not chunk["persisted"]:
+            persist_errors.update(
+                leads[pos][0] for pos in range(chunk["start"], chunk["start"] + chunk["count"])
+            )
+
+    for _, lead in leads:
+        if lead["session_id"] in sessions:
+            await enqueue_session_update(lead["session_id"], {"status": "converted", "lead_id": lead["id"]})
+
+    routed = 0
+    for (i, lead), (_, plan), raw in zip(leads, planned, pristine):
+        if i in persist_errors:
+            results[i] = {
+                "index": i, "success": True, "lead_id": raw["id"], "status": raw["status"],
+                "entity": raw["entity"] or None, "produit": raw["produit"] or None,
+                "message": "Lead stocke - persistance en erreur",
+            }
+            continue
+        if i in routing_errors:
+            results[i] = {
+                "index": i, "success": True, "lead_id": lead["id"], "status": lead["status"],
+                "entity": lead["entity"] or None, "produit": lead["produit"] or None,
+                "message": "Lead stocke - routing en erreur",
+            }
+            continue
+        routing_result = plan["routing_result"] if plan else None
+        delivery_id = plan["delivery"]["id"] if plan and plan["delivery"] else None
+        if delivery_id:
+            routed += 1
+        _log_lead_created(lead, provider, routing_result)
+        results[i] = {"index": i, **_lead_response(lead, routing_result, delivery_id)}
+
+    logger.info(
+        f"[BULK] provider={provider.get('slug')} received={len(items)} "
+        f"created={len(leads)} routed={routed} chunks_failed={sum(1 for c in chunks if not c['persisted'])}"
+    )
+
+    return {
+        "success": True,
+        "received": len(items),
+        "created": len(leads),
+        "routed": routed,
+        "rejected": sum(1 for r in results if not r.get("success")),
+        "double_submit": sum(1 for r in results if r.get("status") == "double_submit"),
+        "chunks": chunks,
+        "results": results,
+    }
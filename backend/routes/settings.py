@@ -21,6 +21,7 @@ from services.settings import (
     DEFAULT_CROSS_ENTITY,
     DEFAULT_SOURCE_GATING,
 )
+from services.ingestion_cache import invalidate_form_config_cache
 
 router = APIRouter(prefix="/settings", tags=["Settings"])
 
@@ -157,6 +158,7 @@ async def update_forms_config(
         {"forms": forms_map},
         updated_by=user.get("email", "admin")
     )
+    invalidate_form_config_cache("forms_config")
     return {"success": True, "setting": result}
 
 
@@ -176,6 +178,7 @@ async def upsert_single_form_config(
         produit=produit.upper(),
         updated_by=user.get("email", "admin")
     )
+    invalidate_form_config_cache(f"form:{form_code}")
     return {"success": True, "form_code": form_code, "config": result.get("forms", {}).get(form_code)}
 
 
@@ -62,7 +62,7 @@ async def system_health(
     # --- CRON ---
     try:
         last_daily = await db.delivery_reports.find_one(
-            {}, {"_id": 0, "run_at": 1, "duration_seconds": 1}
+            {"dry_run": {"$ne": True}}, {"_id": 0, "run_at": 1, "duration_seconds": 1}
         , sort=[("run_at", -1)])
 
         last_interco_cron = await db.cron_logs.find_one(
@@ -134,6 +134,104 @@ async def system_health(
     except Exception as e:
         health["modules"]["invoices"] = {"status": "error", "error": str(e)[:200]}
 
+    # --- ROUTING SNAPSHOT (process-local) ---
+    from services.routing_snapshot import get_routing_snapshot_stats
+    health["modules"]["routing_snapshot"] = {
+        "status": "healthy",
+        **get_routing_snapshot_stats(),
+    }
+
+    # --- SETTINGS CACHE (process-local) ---
+    from services.settings import get_settings_cache_stats
+    health["modules"]["settings_cache"] = {
+        "status": "healthy",
+        **get_settings_cache_stats(),
+    }
+
+    # --- INGESTION CACHE (process-local) ---
+    from services.ingestion_cache import get_ingestion_cache_stats
+    health["modules"]["ingestion_cache"] = {
+        "status": "healthy",
+        **get_ingestion_cache_stats(),
+    }
+
+    # --- CLIENT GROUPS INDEX (process-local, overlap guard) ---
+    from services.client_groups import get_client_groups_stats
+    health["modules"]["client_groups"] = {
+        "status": "healthy",
+        **get_client_groups_stats(),
+    }
+
+    # --- AUTH SESSION CACHE (process-local) ---
+    from routes.auth import get_auth_cache_stats
+    health["modules"]["auth_cache"] = {
+        "status": "healthy",
+        **get_auth_cache_stats(),
+    }
+
+    # --- TRACKING BUFFER (write-behind, process-local) ---
+    from services.tracking_buffer import get_tracking_buffer_stats
+    tracking_stats = get_tracking_buffer_stats()
+    health["modules"]["tracking_buffer"] = {
+        "status": "degraded" if tracking_stats["errors"] else "healthy",
+        **tracking_stats,
+    }
+
+    # --- ROUTING QUEUE (mode async /public/leads) ---
+    try:
+        from services.routing_queue import get_routing_queue_stats
+        queue_stats = await get_routing_queue_stats()
+        queue_status = "healthy"
+        if queue_stats["queue_depth"] and not queue_stats["running"]:
+            queue_status = "warning"
+        if queue_stats["oldest_age_seconds"] > 300:
+            queue_status = "degraded"
+        health["modules"]["routing_queue"] = {"status": queue_status, **queue_stats}
+    except Exception as e:
+        health["modules"]["routing_queue"] = {"status": "error", "error": str(e)[:200]}
+
+    # --- OUTBOX (envois clients) ---
+    try:
+        from services.outbox import get_outbox_stats
+        outbox_stats = await get_outbox_stats()
+        outbox_status = "healthy"
+        if outbox_stats["dead"] or (outbox_stats["pending"] and not outbox_stats["running"]):
+            outbox_status = "warning"
+        if outbox_stats["oldest_due_age_seconds"] > 900:
+            outbox_status = "degraded"
+        health["modules"]["outbox"] = {"status": outbox_status, **outbox_stats}
+    except Exception as e:
+        health["modules"]["outbox"] = {"status": "error", "error": str(e)[:200]}
+
+    # --- MICRO-BATCHS (deliveries pending_csv intraday, process-local) ---
+    from services.micro_batch import get_micro_batch_stats
+    micro_batch_stats = get_micro_batch_stats()
+    health["modules"]["micro_batch"] = {
+        "status": "warning" if micro_batch_stats["enabled"] and not micro_batch_stats["running"] else "healthy",
+        **micro_batch_stats,
+    }
+
+    # --- DELIVERY FILES (CSV des batchs, process-local) ---
+    from services.delivery_files import get_delivery_files_stats
+    health["modules"]["delivery_files"] = {"status": "healthy", **get_delivery_files_stats()}
+
+    # --- SMTP TRANSPORT (pool de connexions, process-local) ---
+    from services.smtp_transport import get_smtp_stats
+    smtp_stats = get_smtp_stats()
+    smtp_errors = sum(s["errors"] for s in smtp_stats["entities"].values())
+    health["modules"]["smtp"] = {
+        "status": "warning" if smtp_errors else "healthy",
+        **smtp_stats,
+    }
+
+    # --- API PUSH (livraison clients api_endpoint, process-local) ---
+    from services.api_push import get_api_push_stats
+    api_push_stats = get_api_push_stats()
+    health["modules"]["api_push"] = {
+        "status": "warning" if api_push_stats["open_circuits"] else "healthy",
+        **api_push_stats,
+    }
+
     # --- OVERALL STATUS ---
     statuses = [m.get("status", "healthy") for m in health["modules"].values()]
     if "error" in statuses:
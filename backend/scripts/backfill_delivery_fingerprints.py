@@ -0,0 +1,31 @@
+"""
+RDZ CRM — Migration: Backfill delivery_fingerprints depuis les leads livrés / routés
+des 30 derniers jours (ancien format livre/delivered_to_client_id et nouveau
+format routed/delivery_client_id).
+Run: cd /app/backend && python3 scripts/backfill_delivery_fingerprints.py
+
+Idempotent: upsert par (phone, produit, client_id), la livraison la plus récente gagne.
+Lancé automatiquement au démarrage si la collection est vide
+(ensure_delivery_fingerprints).
+"""
+
+import asyncio
+import sys
+sys.path.insert(0, "/app/backend")
+
+from config import db
+from services.duplicate_detector import backfill_delivery_fingerprints, DUPLICATE_WINDOW_DAYS
+
+
+async def migrate():
+    before = await db.delivery_fingerprints.count_documents({})
+    report = await backfill_delivery_fingerprints()
+    after = await db.delivery_fingerprints.count_documents({})
+
+    print(f"Leads livrés/routés sur {DUPLICATE_WINDOW_DAYS} jours: {report['leads']}")
+    print(f"Empreintes écrites (upserts): {report['written']}")
+    print(f"delivery_fingerprints: {before} -> {after}")
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
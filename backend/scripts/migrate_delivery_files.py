@@ -0,0 +1,34 @@
+"""
+RDZ CRM — Migration: csv_content inline des deliveries → delivery_files
+(1 fichier gzip par contenu distinct, deliveries.csv_file_id, csv_content retiré).
+Run: cd /app/backend && python3 scripts/migrate_delivery_files.py [--apply]
+
+Sans --apply: rapport seul (deliveries concernées, contenus distincts, gain).
+Idempotent: seules les deliveries ayant encore csv_content sont traitées.
+"""
+
+import argparse
+import asyncio
+import sys
+sys.path.insert(0, "/app/backend")
+
+from services.delivery_files import migrate_inline_csv
+
+
+async def main(apply):
+    report = await migrate_inline_csv(apply=apply)
+
+    print(f"Deliveries avec csv_content: {report['deliveries']}")
+    print(f"Contenus distincts: {report['unique_files']}")
+    print(f"Octets inline: {report['bytes_inline']} -> stockés (gzip): {report['bytes_stored']}")
+    if apply:
+        print(f"Deliveries migrées: {report['migrated']}")
+    elif report["deliveries"]:
+        print("Relancer avec --apply pour migrer.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--apply", action="store_true", help="Écrire delivery_files et migrer les deliveries")
+    args = parser.parse_args()
+    asyncio.run(main(args.apply))
@@ -0,0 +1,23 @@
+"""
+RDZ CRM — Reconstruit l'index client_groups (+ clients.group_key) depuis clients.
+Run: cd /app/backend && python3 scripts/rebuild_client_groups.py
+
+À lancer après un import / une modification directe de la collection clients.
+"""
+
+import asyncio
+import sys
+sys.path.insert(0, "/app/backend")
+
+from services.client_groups import rebuild_client_groups
+
+
+async def main():
+    report = await rebuild_client_groups()
+    print(f"Emails indexés: {report['emails']}")
+    print(f"Emails partagés (>= 2 entités): {report['shared_emails']}")
+    print(f"group_key mis à jour: {report['group_keys_updated']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
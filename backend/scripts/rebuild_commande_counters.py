@@ -0,0 +1,35 @@
+"""
+RDZ CRM — Vérifie / reconstruit commande_week_counters depuis leads + deliveries.
+Run: cd /app/backend && python3 scripts/rebuild_commande_counters.py [--week 2026-W07] [--apply]
+
+Sans --apply: vérification seule (rapport de drift).
+"""
+
+import argparse
+import asyncio
+import sys
+sys.path.insert(0, "/app/backend")
+
+from services.commande_counters import rebuild_commande_counters
+
+
+async def main(week_key, apply):
+    report = await rebuild_commande_counters(week_key, apply=apply)
+
+    print(f"Semaine: {report['week_key']}")
+    print(f"Commandes vérifiées: {report['checked']}")
+    print(f"En drift: {report['drifted']}")
+    for d in report["drift"]:
+        print(f"  {d['commande_id']}: attendu={d['expected']} actuel={d['actual']}")
+    if apply:
+        print(f"Corrigés: {report['fixed']}")
+    elif report["drifted"]:
+        print("Relancer avec --apply pour corriger.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--week", default=None, help="YYYY-W## (défaut: semaine courante)")
+    parser.add_argument("--apply", action="store_true", help="Écrire les valeurs recalculées")
+    args = parser.parse_args()
+    asyncio.run(main(args.week, args.apply))
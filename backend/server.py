@@ -28,13 +28,20 @@ async def lifespan(app: FastAPI):
 
     logger.info("RDZ CRM v4.0 - Architecture Multi-Tenant")
 
-    from config import db
+    from config import db, now_iso
 
     try:
         # Index utilisateurs/sessions (auth)
         await db.users.create_index("email", unique=True, background=True)
         await db.sessions.create_index("token", background=True)
-        await db.sessions.create_index("expires_at", background=True)
+        # expires_at: date native + TTL (l'ancien index simple est remplacé)
+        session_indexes = await db.sessions.index_information()
+        legacy_expires = session_indexes.get("expires_at_1")
+        if legacy_expires and "expireAfterSeconds" not in legacy_expires:
+            await db.sessions.drop_index("expires_at_1")
+        await db.sessions.create_index("expires_at", expireAfterSeconds=0, background=True)
+        # Sessions historiques (expires_at ISO string) ignorées par le TTL
+        await db.sessions.delete_many({"expires_at": {"$type": "string", "$lt": now_iso()}})
 
         # Index leads
         await db.leads.create_index("phone", background=True)
@@ -96,6 +103,30 @@ async def lifespan(app: FastAPI):
             name="idx_commande_routing"
         )
 
+        # Compteurs hebdo par commande (quota / LB target)
+        await db.commande_week_counters.create_index(
+            [("commande_id", 1), ("week_key", 1)],
+            unique=True,
+            background=True,
+            name="idx_commande_week_counters"
+        )
+        from services.commande_counters import ensure_commande_counters
+        await ensure_commande_counters()
+
+        # Empreintes de livraison (doublon 30j) - TTL sur expires_at (date native)
+        await db.delivery_fingerprints.create_index(
+            [("phone", 1), ("produit", 1), ("client_id", 1)],
+            unique=True,
+            background=True,
+            name="idx_fingerprint_phone_produit_client"
+        )
+        await db.delivery_fingerprints.create_index(
+            "expires_at", expireAfterSeconds=0, background=True, name="idx_fingerprint_ttl"
+        )
+        await db.delivery_fingerprints.create_index("lead_id", background=True)
+        from services.duplicate_detector import ensure_delivery_fingerprints
+        await ensure_delivery_fingerprints()
+
         # Index delivery batches
         await db.delivery_batches.create_index("entity", background=True)
         await db.delivery_batches.create_index("sent_at", background=True)
@@ -106,6 +137,8 @@ async def lifespan(app: FastAPI):
         await db.deliveries.create_index("client_id", background=True)
         await db.deliveries.create_index("lead_id", background=True)
         await db.deliveries.create_index("commande_id", background=True)
+        await db.deliveries.create_index("batch_id", background=True, sparse=True)
+        await db.deliveries.create_index("counter_reserved_week", background=True, sparse=True)
         await db.deliveries.create_index("created_at", background=True)
         await db.deliveries.create_index("outcome", background=True)
         await db.deliveries.create_index(
@@ -154,6 +187,14 @@ async def lifespan(app: FastAPI):
         await db.tracking.create_index("lp_code", background=True)
         await db.tracking.create_index("form_code", background=True)
         await db.tracking.create_index("session_id", background=True)
+        # Anti-doublon des events uniques par session (buffer write-behind)
+        await db.tracking.create_index(
+            [("session_id", 1), ("event", 1)],
+            unique=True,
+            partialFilterExpression={"once_per_session": True},
+            background=True,
+            name="idx_tracking_once_per_session"
+        )
 
         # Index sessions visiteurs
         await db.visitor_sessions.create_index("id", unique=True, background=True)
@@ -206,10 +247,48 @@ async def lifespan(app: FastAPI):
         from services.intercompany import seed_intercompany_pricing
         await seed_intercompany_pricing()
 
+        # Index file de routing async (claim du plus ancien lead "queued")
+        await db.leads.create_index(
+            [("queued_at", 1)],
+            partialFilterExpression={"status": "queued"},
+            background=True,
+            name="idx_leads_routing_queue"
+        )
+
+        # Index client_groups (emails partagés entre entités, overlap guard)
+        await db.client_groups.create_index("email", unique=True, background=True)
+        await db.client_groups.create_index("shared", background=True)
+        from services.client_groups import ensure_client_groups
+        await ensure_client_groups()
+
+        # Index delivery_files (CSV des batchs, adressés par hash)
+        await db.delivery_files.create_index("id", unique=True, background=True)
+
+        # Index outbox (envois clients: claim des jobs dus)
+        await db.outbox.create_index("id", unique=True, background=True)
+        await db.outbox.create_index([("status", 1), ("next_attempt_at", 1)], background=True)
+
         logger.info("Index MongoDB OK")
     except Exception as e:
         logger.warning(f"Index MongoDB: {str(e)}")
 
+    # Buffer write-behind tracking
+    from services.tracking_buffer import start_tracking_buffer, stop_tracking_buffer
+    start_tracking_buffer()
+
+    # File de routing async (workers /public/leads en mode async;
+    # mode synchrone: reprise unique des leads restés "queued")
+    from services.routing_queue import start_routing_queue, stop_routing_queue
+    start_routing_queue()
+
+    # Outbox des livraisons clients (workers d'envoi)
+    from services.outbox import start_outbox, stop_outbox
+    start_outbox()
+
+    # Micro-batchs intraday des deliveries pending_csv (opt-in)
+    from services.micro_batch import start_micro_batch, stop_micro_batch
+    start_micro_batch()
+
     # Scheduler
     try:
         from apscheduler.schedulers.asyncio import AsyncIOScheduler
@@ -286,6 +365,17 @@ async def lifespan(app: FastAPI):
         scheduler.shutdown()
         logger.info("Scheduler arrete")
 
+    await stop_micro_batch()
+    await stop_outbox()
+    await stop_routing_queue()
+    await stop_tracking_buffer()
+
+    from services.smtp_transport import close_smtp_connections
+    await close_smtp_connections()
+
+    from services.api_push import close_api_push_client
+    await close_api_push_client()
+
 
 app = FastAPI(
     title="RDZ CRM",
@@ -0,0 +1,357 @@
+"""
+RDZ CRM - Allocation optimisée du run quotidien (mode "optimizer")
+
+Le mode glouton (process_commande_delivery) sert les commandes une à une
+par priorité: une commande "*" prioritaire peut consommer les seuls leads
+d'un département dont dépend une commande plus étroite, qui reste sous
+son quota alors que des leads restent inutilisés.
+
+Ici l'allocation est un problème de flot sur les pools agrégés (buckets):
+
+  S → bucket (type, produit, dept)        cap = leads disponibles
+  bucket → (commande, type)               cap = leads non bloqués 30j pour ce client
+  (commande, type) → commande             cap = part fresh / LB (phases ci-dessous)
+  commande                                demande = quota restant
+
+Les commandes sont servies par ordre de priorité (= coût): pour chacune,
+chemins augmentants (BFS arrière depuis la commande) jusqu'au quota, en
+pouvant déplacer des commandes déjà servies vers d'autres buckets sans
+réduire leur volume. Le coût ne dépendant que de la commande, cet ordre
+donne un flot max qui sert d'abord les commandes prioritaires.
+
+Par commande (comme le glouton):
+  1. LB jusqu'à l'objectif lb_target_pct
+  2. Fresh jusqu'au quota
+  3. LB en complément (si lb_target_pct > 0)
+La composition fresh / LB d'une commande servie est ensuite figée.
+
+Le flot donne des volumes par (bucket, commande); les leads sont ensuite
+choisis dans chaque bucket (plus anciens d'abord, LB jamais livrés au
+client d'abord, doublons 30j exclus). Sortie au format du glouton:
+1 dict par commande (leads, lb_count, doublons sautés, manque LB), + rapport comparant le taux de remplissage
+avec une estimation gloutonne sur les mêmes buckets.
+"""
+
+import time
+import logging
+from collections import Counter, defaultdict, deque
+from math import ceil
+from typing import Dict, List, Tuple
+
+from config import now_iso
+
+logger = logging.getLogger("allocation_optimizer")
+
+FRESH = "fresh"
+LB = "lb"
+
+
+class FlowGraph:
+    """Graphe résiduel: l'arête i et son inverse i ^ 1"""
+
+    def __init__(self):
+        self.adj: List[List[int]] = []
+        self.to: List[int] = []
+        self.cap: List[int] = []
+        self.closed: List[bool] = []
+
+    def add_node(self) -> int:
+        self.adj.append([])
+        return len(self.adj) - 1
+
+    def add_edge(self, u: int, v: int, cap: int) -> int:
+        i = len(self.to)
+        self.to.extend((v, u))
+        self.cap.extend((cap, 0))
+        self.closed.extend((False, False))
+        self.adj[u].append(i)
+        self.adj[v].append(i + 1)
+        return i
+
+    def flow(self, i: int) -> int:
+        return self.cap[i ^ 1]
+
+    def augment(self, source: int, target: int, limit: int) -> int:
+        """
+        Un chemin augmentant source → target, cherché en arrière depuis
+        target (explore seulement le voisinage de la commande).
+        Retourne le flot poussé (0 si aucun chemin).
+        """
+        toward: Dict[int, int] = {target: -1}
+        queue = deque([target])
+        while queue and source not in toward:
+            v = queue.popleft()
+            for j in self.adj[v]:
+                i = j ^ 1  # arête entrante u → v
+                u = self.to[j]
+                if self.cap[i] > 0 and not self.closed[i] and u not in toward:
+                    toward[u] = i
+                    queue.append(u)
+        if source not in toward:
+            return 0
+
+        push, u = limit, source
+        while u != target:
+            i = toward[u]
+            push = min(push, self.cap[i])
+            u = self.to[i]
+        u = source
+        while u != target:
+            i = toward[u]
+            self.cap[i] -= push
+            self.cap[i ^ 1] += push
+            u = self.to[i]
+        return push
+
+
+def _lb_goal(state: Dict, target_pct: float, expected: int) -> int:
+    """LB à attribuer pour approcher lb_target_pct sur le volume attendu"""
+    if target_pct <= 0 or expected <= 0:
+        return 0
+    goal = ceil(target_pct * (state["already_delivered"] + expected)) - state["already_lb"]
+    return max(0, min(expected, goal))
+
+
+def _blocked_counts(history, pools: Dict[str, Dict[Tuple[str, str], List[Dict]]]) -> Dict:
+    """(client_id, produit) → Counter[(type, dept)] des leads bloqués 30j"""
+    occurrences: Dict[Tuple[str, str], List[Tuple[str, str]]] = defaultdict(list)
+    for lead_type, buckets in pools.items():
+        for (produit, dept), leads in buckets.items():
+            for lead in leads:
+                occurrences[(lead.get("phone"), produit)].append((lead_type, dept))
+
+    counts: Dict[Tuple[str, str], Counter] = defaultdict(Counter)
+    for phone, produit, client_id in history.blocked:
+        for key in occurrences.get((phone, produit), ()):
+            counts[(client_id, produit)][key] += 1
+    return counts
+
+
+def _fill_report(counts: List[int], states: List[Dict]) -> Dict:
+    from services.daily_delivery import UNLIMITED_QUOTA
+
+    demand = allocated_on_quota = filled = short = 0
+    for count, state in zip(counts, states):
+        quota = state["quota_remaining"]
+        if quota <= 0 or quota >= UNLIMITED_QUOTA:
+            continue
+        demand += quota
+        allocated_on_quota += min(count, quota)
+        if count >= quota:
+            filled += 1
+        else:
+            short += 1
+    return {
+        "allocated": sum(counts),
+        "demand": demand,
+        "fill_rate": round(allocated_on_quota / demand, 4) if demand else None,
+        "commandes_filled": filled,
+        "commandes_short": short,
+    }
+
+
+def _greedy_estimate(specs: List[Dict], supply: Dict[Tuple[str, str, str], int]) -> List[int]:
+    """Glouton par priorité sur les mêmes buckets (sans réaffectation)"""
+    remaining = dict(supply)
+    counts = []
+    for spec in specs:
+        taken = 0
+        for lead_type, goal in spec["phases"]:
+            need = min(goal, spec["quota"] - taken) if goal is not None else spec["quota"] - taken
+            for bucket, cap in spec["edges"][lead_type]:
+                if need <= 0:
+                    break
+                take = min(need, cap, remaining[bucket])
+                remaining[bucket] -= take
+                need -= take
+                taken += take
+        counts.append(taken)
+    return counts
+
+
+async def optimize_allocation(
+    entity: str,
+    commandes: List[Dict],
+    fresh_pool,
+    lb_pool,
+    history,
+    week_start: str,
+    dry_run: bool = False
+) -> Tuple[List[Dict], Dict]:
+    """
+    Alloue les pools du run aux commandes (ordre de priorité de la liste).
+
+    dry_run: manque LB retourné sans event
+
+    Returns:
+        (allocations, report) - allocations: 1 dict par commande
+        {cmd, leads, lb_count, skipped_duplicates, lb_shortfall} comme le glouton
+    """
+    from services.daily_delivery import get_commande_allocation_state, UNLIMITED_QUOTA
+
+    states = [await get_commande_allocation_state(cmd, week_start) for cmd in commandes]
+
+    started = time.perf_counter()
+    pools = {FRESH: fresh_pool.buckets(), LB: lb_pool.buckets()}
+    blocked = _blocked_counts(history, pools)
+    total_leads = sum(len(leads) for buckets in pools.values() for leads in buckets.values())
+
+    depts_by_produit: Dict[str, Dict[str, List[str]]] = {FRESH: defaultdict(list), LB: defaultdict(list)}
+    for lead_type, buckets in pools.items():
+        for produit, dept in buckets:
+            depts_by_produit[lead_type][produit].append(dept)
+
+    graph = FlowGraph()
+    source = graph.add_node()
+    bucket_nodes: Dict[Tuple[str, str, str], int] = {}
+    supply: Dict[Tuple[str, str, str], int] = {}
+    for lead_type, buckets in pools.items():
+        for (produit, dept), leads in buckets.items():
+            if leads:
+                node = graph.add_node()
+                bucket_nodes[(lead_type, produit, dept)] = node
+                supply[(lead_type, produit, dept)] = len(leads)
+                graph.add_edge(source, node, len(leads))
+
+    specs = []
+    for cmd, state in zip(commandes, states):
+        produit = cmd.get("produit")
+        client_id = cmd.get("client_id")
+        departements = cmd.get("departements", [])
+        target_pct = cmd.get("lb_target_pct", 0)
+        quota = min(max(0, state["quota_remaining"]), UNLIMITED_QUOTA, total_leads)
+
+        node = graph.add_node()
+        spec = {"node": node, "quota": quota, "comp": {}, "edges": {FRESH: [], LB: []}, "bucket_edges": []}
+        for lead_type in (FRESH, LB):
+            if lead_type == LB and target_pct <= 0:
+                continue  # target = 0 → aucun LB (comme le glouton)
+            type_node = graph.add_node()
+            spec["comp"][lead_type] = graph.add_edge(type_node, node, 0)
+            known = depts_by_produit[lead_type].get(produit, [])
+            depts = known if "*" in departements else [d for d in dict.fromkeys(departements) if d in known]
+            for dept in depts:
+                bucket = (lead_type, produit, dept)
+                cap = supply[bucket] - blocked.get((client_id, produit), {}).get((lead_type, dept), 0)
+                if cap > 0:
+                    edge = graph.add_edge(bucket_nodes[bucket], type_node, cap)
+                    spec["edges"][lead_type].append((bucket, cap))
+                    spec["bucket_edges"].append((edge, lead_type, dept))
+
+        reachable = sum(cap for edges in spec["edges"].values() for _, cap in edges)
+        lb_goal = _lb_goal(state, target_pct, min(quota, reachable))
+        spec["lb_goal"] = lb_goal
+        spec["phases"] = [(LB, lb_goal), (FRESH, None), (LB, None)] if target_pct > 0 else [(FRESH, None)]
+        specs.append(spec)
+
+    # Flot: commandes par priorité, chemins augmentants
+    flow_counts = []
+    for spec in specs:
+        taken = 0
+        for lead_type, goal in spec["phases"]:
+            need = (min(goal, spec["quota"] - taken) if goal is not None else spec["quota"] - taken)
+            if need <= 0:
+                continue
+            graph.cap[spec["comp"][lead_type]] += need
+            while need > 0:
+                pushed = graph.augment(source, spec["node"], need)
+                if not pushed:
+                    break
+                need -= pushed
+                taken += pushed
+            # Capacité non utilisée retirée: la phase suivante repart du réel
+            graph.cap[spec["comp"][lead_type]] -= need
+        # Composition figée pour les commandes suivantes
+        for edge in spec["comp"].values():
+            graph.closed[edge ^ 1] = True
+        flow_counts.append(taken)
+    solve_seconds = time.perf_counter() - started
+
+    allocations, realized = await _realize(
+        commandes, states, specs, graph, fresh_pool, lb_pool, history, dry_run
+    )
+
+    report = {
+        "allocator": "optimizer",
+        "commandes": len(commandes),
+        "leads_available": total_leads,
+        "greedy_estimate": _fill_report(_greedy_estimate(specs, supply), states),
+        "optimizer": _fill_report(realized, states),
+        "flow_allocated": sum(flow_counts),
+        "solve_seconds": round(solve_seconds, 3),
+    }
+    report["gain_leads"] = report["optimizer"]["allocated"] - report["greedy_estimate"]["allocated"]
+    logger.info(
+        f"[ALLOCATION] {entity} optimizer: {report['optimizer']['allocated']} leads "
+        f"(fill={report['optimizer']['fill_rate']}) vs glouton estimé "
+        f"{report['greedy_estimate']['allocated']} (fill={report['greedy_estimate']['fill_rate']}) "
+        f"en {report['solve_seconds']}s"
+    )
+    return allocations, report
+
+
+async def _realize(commandes, states, specs, graph, fresh_pool, lb_pool, history, dry_run):
+    """Volumes du flot → leads concrets (plus anciens d'abord, doublons 30j exclus)"""
+    from services.daily_delivery import log_lb_shortfall
+
+    allocations = []
+    realized = []
+    now = now_iso()
+    for cmd, state, spec in zip(commandes, states, specs):
+        produit = cmd.get("produit")
+        client_id = cmd.get("client_id")
+        leads: List[Dict] = []
+        lb_count = 0
+        skipped_duplicates = 0
+
+        for edge, lead_type, dept in spec["bucket_edges"]:
+            count = graph.flow(edge)
+            if count <= 0:
+                continue
+            pool = lb_pool if lead_type == LB else fresh_pool
+            if lead_type == LB:
+                # LB jamais livrés à ce client d'abord, puis recyclés
+                passes = [
+                    (ld for ld in pool.cursor(produit, [dept])
+                     if not history.was_delivered(ld.get("phone"), produit, client_id)),
+                    (ld for ld in pool.cursor(produit, [dept])
+                     if history.was_delivered(ld.get("phone"), produit, client_id)),
+                ]
+            else:
+                passes = [pool.cursor(produit, [dept])]
+            for candidates in passes:
+                for lead in candidates:
+                    if count <= 0:
+                        break
+                    if history.is_blocked(lead.get("phone"), produit, client_id):
+                        skipped_duplicates += 1
+                        continue
+                    leads.append(lead)
+                    pool.used.add(lead.get("id"))
+                    history.record(lead.get("phone"), produit, client_id, now)
+                    count -= 1
+                    if lead_type == LB:
+                        lb_count += 1
+
+        lb_shortfall = None
+        if spec["lb_goal"] > lb_count:
+            total = state["already_delivered"] + len(leads)
+            current_lb = state["already_lb"] + lb_count
+            lb_shortfall = {
+                "target_pct": cmd.get("lb_target_pct", 0),
+                "current_pct": round(current_lb / total * 100, 2) if total > 0 else 0,
+                "lb_needed": spec["lb_goal"] - lb_count,
+                "available_lb": sum(cap for _, cap in spec["edges"][LB]),
+            }
+            if not dry_run:
+                await log_lb_shortfall(cmd, {**lb_shortfall, "allocator": "optimizer"})
+        realized.append(len(leads))
+        allocations.append({
+            "cmd": cmd,
+            "leads": leads,
+            "lb_count": lb_count,
+            "skipped_duplicates": skipped_duplicates,
+            "lb_shortfall": lb_shortfall,
+        })
+    return allocations, realized
+
@@ -0,0 +1,253 @@
+"""
+RDZ CRM - Livraison par API (push vers clients.api_endpoint)
+
+Canal "api" de l'outbox (services/outbox.py): un job = 1 POST JSON
+contenant 1 lead (routing temps réel) ou un micro-batch (bulk, cron):
+
+  POST {api_endpoint}
+  Authorization: {api_key}          (si configurée)
+  Idempotency-Key: {job_id}         (identique à chaque retry)
+  {
+    "batch_id", "entity", "produit",
+    "leads": [{"delivery_id", "lead_id", <colonnes CSV: build_export_row>}]
+  }
+  → 2xx = accepté (deliveries sent / leads livre via la state machine)
+
+TRANSPORT: 1 httpx.AsyncClient partagé (keep-alive, API_PUSH_MAX_CONNECTIONS),
+timeout API_PUSH_TIMEOUT_SECONDS, API_PUSH_MAX_CONCURRENCY_PER_CLIENT
+requêtes simultanées max par client.
+
+ÉCHECS: réseau / timeout / 5xx / 408 / 429 → retry par l'outbox (backoff);
+autre 4xx → non réessayable (dead, à corriger puis relancer).
+
+CIRCUIT BREAKER (par client): API_PUSH_BREAKER_THRESHOLD échecs consécutifs
+→ ouvert API_PUSH_BREAKER_COOLDOWN_SECONDS; les jobs sont reportés sans
+consommer de tentative; le premier échec après le délai (half-open)
+rouvre le circuit, le premier succès le referme.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import httpx
+
+from config import db
+
+logger = logging.getLogger("api_push")
+
+API_PUSH_TIMEOUT_SECONDS = float(os.environ.get("API_PUSH_TIMEOUT_SECONDS", "10"))
+API_PUSH_MAX_CONNECTIONS = int(os.environ.get("API_PUSH_MAX_CONNECTIONS", "50"))
+API_PUSH_MAX_CONCURRENCY_PER_CLIENT = int(os.environ.get("API_PUSH_MAX_CONCURRENCY_PER_CLIENT", "2"))
+API_PUSH_BREAKER_THRESHOLD = int(os.environ.get("API_PUSH_BREAKER_THRESHOLD", "5"))
+API_PUSH_BREAKER_COOLDOWN_SECONDS = float(os.environ.get("API_PUSH_BREAKER_COOLDOWN_SECONDS", "60"))
+
+RETRYABLE_STATUS = {408, 429}
+
+# (loop, client): un AsyncClient est lié à la boucle qui l'a créé
+_http: Optional[Tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]] = None
+# client_id -> (loop, sémaphore)
+_semaphores: Dict[str, Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = {}
+# client_id -> {"failures", "open_until" (monotonic), "opened"}
+_breakers: Dict[str, Dict] = {}
+_stats: Dict[str, Dict] = {}
+
+
+def endpoint_host(endpoint: str) -> str:
+    return (urlparse(endpoint or "").hostname or "").lower()
+
+
+def _client_stats(client_id: str) -> Dict:
+    if client_id not in _stats:
+        _stats[client_id] = {
+            "sent": 0,
+            "errors": 0,
+            "last_status": None,
+            "last_latency_ms": 0,
+            "max_latency_ms": 0,
+        }
+    return _stats[client_id]
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _http
+    loop = asyncio.get_running_loop()
+    if _http is None or _http[0] is not loop or _http[1].is_closed:
+        _http = (loop, httpx.AsyncClient(
+            timeout=httpx.Timeout(API_PUSH_TIMEOUT_SECONDS),
+            limits=httpx.Limits(
+                max_connections=API_PUSH_MAX_CONNECTIONS,
+                max_keepalive_connections=API_PUSH_MAX_CONNECTIONS,
+            ),
+        ))
+    return _http[1]
+
+
+async def close_api_push_client() -> None:
+    """Ferme le client HTTP partagé (arrêt du serveur)"""
+    global _http
+    if _http is not None and _http[0] is asyncio.get_running_loop():
+        await _http[1].aclose()
+    _http = None
+
+
+def _get_semaphore(client_id: str) -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    current = _semaphores.get(client_id)
+    if current is None or current[0] is not loop:
+        current = (loop, asyncio.Semaphore(max(1, API_PUSH_MAX_CONCURRENCY_PER_CLIENT)))
+        _semaphores[client_id] = current
+    return current[1]
+
+
+def breaker_wait_seconds(client_id: str) -> float:
+    """> 0 si le circuit du client est ouvert (secondes avant le prochain essai)"""
+    breaker = _breakers.get(client_id)
+    if not breaker:
+        return 0
+    return max(0.0, breaker["open_until"] - time.monotonic())
+
+
+def _record_result(client_id: str, success: bool) -> None:
+    breaker = _breakers.setdefault(client_id, {"failures": 0, "open_until": 0.0, "opened": 0})
+    if success:
+        if breaker["open_until"]:
+            logger.info(f"[API_PUSH] circuit fermé client={client_id[:8]}...")
+        breaker["failures"] = 0
+        breaker["open_until"] = 0.0
+        return
+    breaker["failures"] += 1
+    if breaker["failures"] >= API_PUSH_BREAKER_THRESHOLD:
+        # Ouverture (ou réouverture après un essai half-open raté)
+        breaker["open_until"] = time.monotonic() + API_PUSH_BREAKER_COOLDOWN_SECONDS
+        breaker["opened"] += 1
+        logger.warning(
+            f"[API_PUSH] circuit ouvert client={client_id[:8]}... "
+            f"({breaker['failures']} échecs) pour {API_PUSH_BREAKER_COOLDOWN_SECONDS:.0f}s"
+        )
+
+
+async def post_leads(
+    client_id: str,
+    endpoint: str,
+    api_key: str,
+    payload: Dict,
+    idempotency_key: str
+) -> Dict:
+    """
+    POST du payload vers l'endpoint client.
+    Retourne {success, status_code, latency_ms, error, retryable, defer_seconds}
+    """
+    wait = breaker_wait_seconds(client_id)
+    if wait > 0:
+        return {"success": False, "error": "circuit_open", "retryable": True, "defer_seconds": wait}
+
+    headers = {"Content-Type": "application/json", "Idempotency-Key": idempotency_key}
+    if api_key:
+        headers["Authorization"] = api_key
+
+    stats = _client_stats(client_id)
+    async with _get_semaphore(client_id):
+        started = time.perf_counter()
+        try:
+            response = await get_http_client().post(endpoint, json=payload, headers=headers)
+        except httpx.HTTPError as e:
+            stats["errors"] += 1
+            _record_result(client_id, False)
+            return {
+                "success": False,
+                "error": f"{type(e).__name__}: {e}"[:300],
+                "retryable": True,
+                "latency_ms": int((time.perf_counter() - started) * 1000),
+            }
+        latency_ms = int((time.perf_counter() - started) * 1000)
+
+    stats["last_status"] = response.status_code
+    stats["last_latency_ms"] = latency_ms
+    stats["max_latency_ms"] = max(stats["max_latency_ms"], latency_ms)
+
+    if 200 <= response.status_code < 300:
+        stats["sent"] += 1
+        _record_result(client_id, True)
+        return {"success": True, "status_code": response.status_code, "latency_ms": latency_ms}
+
+    stats["errors"] += 1
+    retryable = response.status_code >= 500 or response.status_code in RETRYABLE_STATUS
+    # Un 4xx définitif ne dit rien de la santé de l'endpoint
+    if retryable:
+        _record_result(client_id, False)
+    return {
+        "success": False,
+        "status_code": response.status_code,
+        "error": f"HTTP {response.status_code}: {response.text[:200]}",
+        "retryable": retryable,
+        "latency_ms": latency_ms,
+    }
+
+
+def build_payload(job: Dict, leads: List[Dict]) -> Dict:
+    """Payload JSON d'un job (colonnes identiques au CSV)"""
+    from services.csv_delivery import build_export_row
+
+    by_id = {lead["id"]: lead for lead in leads}
+    rows = []
+    for delivery_id, lead_id in zip(job["delivery_ids"], job["lead_ids"]):
+        lead = by_id.get(lead_id)
+        if not lead:
+            continue
+        rows.append({
+            "delivery_id": delivery_id,
+            "lead_id": lead_id,
+            **build_export_row(lead, job.get("produit", ""), job["entity"]),
+        })
+    return {
+        "batch_id": job["batch_id"],
+        "entity": job["entity"],
+        "produit": job.get("produit", ""),
+        "leads": rows,
+    }
+
+
+async def push_job(job: Dict) -> Dict:
+    """Envoi d'un job outbox channel=api (endpoint / clé relus sur le client)"""
+    client = await db.clients.find_one(
+        {"id": job["client_id"]}, {"_id": 0, "api_endpoint": 1, "api_key": 1}
+    ) or {}
+    endpoint = (client.get("api_endpoint") or job.get("endpoint") or "").strip()
+    if not endpoint:
+        return {"success": False, "error": "api_endpoint non configuré", "retryable": False}
+
+    leads = await db.leads.find(
+        {"id": {"$in": job["lead_ids"]}}, {"_id": 0}
+    ).to_list(len(job["lead_ids"]))
+    result = await post_leads(
+        client_id=job["client_id"],
+        endpoint=endpoint,
+        api_key=client.get("api_key", ""),
+        payload=build_payload(job, leads),
+        idempotency_key=job["id"],
+    )
+    if result.get("success"):
+        result["endpoint"] = endpoint
+        logger.info(
+            f"[API_PUSH] client={job['client_name']} leads={len(leads)} "
+            f"status={result['status_code']} latency={result['latency_ms']}ms"
+        )
+    return result
+
+
+def get_api_push_stats() -> Dict:
+    """Métriques du canal API (pour /system/health)"""
+    now = time.monotonic()
+    return {
+        "max_concurrency_per_client": API_PUSH_MAX_CONCURRENCY_PER_CLIENT,
+        "timeout_seconds": API_PUSH_TIMEOUT_SECONDS,
+        "open_circuits": sorted(cid for cid, b in _breakers.items() if b["open_until"] > now),
+        "clients": {
+            cid: {**s, "consecutive_failures": _breakers.get(cid, {}).get("failures", 0)}
+            for cid, s in _stats.items()
+        },
+    }
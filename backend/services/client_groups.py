@@ -0,0 +1,260 @@
+"""
+RDZ CRM - Index des groupes de clients (emails partagés entre entités)
+
+Collection: client_groups
+  1 document par email normalisé:
+  {
+    email,
+    entities: {"ZR7": [client_ids], "MDL": [client_ids]},
+    shared,       # True si l'email existe dans >= 2 entités
+    updated_at
+  }
++ clients.group_key (emails triés joints par "|", cf. compute_client_group_key)
+
+MISE À JOUR: routes/clients (create / update / delete) → sync_client_group()
+RECONSTRUCTION: rebuild_client_groups() (démarrage si index vide,
+                scripts/rebuild_client_groups.py)
+
+LECTURE: get_client_group_index() charge tout l'index en mémoire
+(quelques centaines de clients) → overlap guard = tests d'ensembles.
+TTL: CLIENT_GROUPS_CACHE_TTL_SECONDS (défaut 30s) borne la dérive entre
+workers; invalidation locale immédiate à chaque écriture.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set
+from pymongo import UpdateOne, DeleteOne
+from config import db, now_iso
+
+logger = logging.getLogger("client_groups")
+
+CACHE_TTL_SECONDS = float(os.environ.get("CLIENT_GROUPS_CACHE_TTL_SECONDS", "30"))
+
+
+def normalize_email(email: str) -> str:
+    return (email or "").strip().lower()
+
+
+def client_emails(client: Optional[Dict]) -> Set[str]:
+    """Emails normalisés d'un client (email principal + delivery_emails)"""
+    if not client:
+        return set()
+    emails = {normalize_email(e) for e in client.get("delivery_emails", []) or []}
+    emails.add(normalize_email(client.get("email", "")))
+    emails.discard("")
+    return emails
+
+
+def group_key_for(emails: Set[str]) -> str:
+    return "|".join(sorted(emails))
+
+
+class ClientGroupIndex:
+    """Vue mémoire de client_groups"""
+
+    def __init__(self, groups: List[Dict]):
+        # email -> {entity: set(client_ids)}
+        self.by_email: Dict[str, Dict[str, Set[str]]] = {}
+        # client_id -> set(emails)
+        self.emails_by_client: Dict[str, Set[str]] = {}
+        for doc in groups:
+            email = doc.get("email", "")
+            entities = {
+                ent: set(ids) for ent, ids in (doc.get("entities") or {}).items() if ids
+            }
+            if not email or not entities:
+                continue
+            self.by_email[email] = entities
+            for ids in entities.values():
+                for cid in ids:
+                    self.emails_by_client.setdefault(cid, set()).add(email)
+        self.built_at = time.monotonic()
+
+    def group_key(self, client_id: str) -> str:
+        return group_key_for(self.emails_by_client.get(client_id, set()))
+
+    def shared_with(self, client_id: str, other_entity: str) -> Set[str]:
+        """Clients de other_entity partageant au moins un email avec client_id"""
+        shared: Set[str] = set()
+        for email in self.emails_by_client.get(client_id, set()):
+            shared |= self.by_email.get(email, {}).get(other_entity, set())
+        return shared
+
+    def shared_emails(self) -> Dict[str, Dict[str, Set[str]]]:
+        """Emails présents dans au moins 2 entités"""
+        return {email: ents for email, ents in self.by_email.items() if len(ents) >= 2}
+
+
+_index: Optional[ClientGroupIndex] = None
+_generation = 0
+_build_lock: Optional[asyncio.Lock] = None
+_stats = {"hits": 0, "builds": 0, "invalidations": 0, "syncs": 0}
+
+
+def invalidate_client_group_index() -> None:
+    global _index, _generation
+    _index = None
+    _generation += 1
+    _stats["invalidations"] += 1
+
+
+async def get_client_group_index() -> ClientGroupIndex:
+    """Index mémoire (TTL + invalidation locale), construit en 1 requête"""
+    global _index, _build_lock
+    idx = _index
+    if idx and time.monotonic() - idx.built_at < CACHE_TTL_SECONDS:
+        _stats["hits"] += 1
+        return idx
+
+    if _build_lock is None:
+        _build_lock = asyncio.Lock()
+    async with _build_lock:
+        idx = _index
+        if idx and time.monotonic() - idx.built_at < CACHE_TTL_SECONDS:
+            _stats["hits"] += 1
+            return idx
+        generation = _generation
+        groups = await db.client_groups.find({}, {"_id": 0}).to_list(None)
+        idx = ClientGroupIndex(groups)
+        _stats["builds"] += 1
+        # Ne pas publier un index invalidé pendant sa construction
+        if generation == _generation and CACHE_TTL_SECONDS > 0:
+            _index = idx
+        return idx
+
+
+def get_client_groups_stats() -> Dict:
+    """Métriques de l'index (pour /system/health)"""
+    return {
+        **_stats,
+        "ttl_seconds": CACHE_TTL_SECONDS,
+        "loaded": _index is not None,
+        "emails": len(_index.by_email) if _index else 0,
+        "clients": len(_index.emails_by_client) if _index else 0,
+    }
+
+
+async def _refresh_shared_flags(emails: Set[str]) -> None:
+    """Recalcule shared + supprime les groupes vides pour ces emails"""
+    if not emails:
+        return
+    docs = await db.client_groups.find(
+        {"email": {"$in": list(emails)}}, {"_id": 0, "email": 1, "entities": 1}
+    ).to_list(len(emails))
+    ops = []
+    for doc in docs:
+        entities = doc.get("entities") or {}
+        populated = [ent for ent, ids in entities.items() if ids]
+        if populated:
+            ops.append(UpdateOne({"email": doc["email"]}, {"$set": {"shared": len(populated) >= 2}}))
+        else:
+            # Groupe vide: supprimé seulement s'il l'est toujours (écriture concurrente)
+            ops.append(DeleteOne({
+                "email": doc["email"],
+                **{f"entities.{ent}.0": {"$exists": False} for ent in entities},
+            }))
+    if ops:
+        await db.client_groups.bulk_write(ops, ordered=False)
+
+
+async def sync_client_group(before: Optional[Dict], after: Optional[Dict]) -> None:
+    """
+    Maintient client_groups + clients.group_key après une écriture client.
+    before=None: création. after=None: suppression.
+    """
+    client = after or before
+    if not client:
+        return
+    client_id = client["id"]
+
+    old_entity = (before or {}).get("entity", "")
+    new_entity = (after or {}).get("entity", "")
+    old_emails = client_emails(before)
+    new_emails = client_emails(after)
+
+    removed = old_emails if old_entity != new_entity else old_emails - new_emails
+    added = new_emails if old_entity != new_entity else new_emails - old_emails
+    if not old_entity:
+        removed = set()
+    if not new_entity:
+        added = set()
+
+    ops = []
+    for email in removed:
+        ops.append(UpdateOne(
+            {"email": email},
+            {"$pull": {f"entities.{old_entity}": client_id}, "$set": {"updated_at": now_iso()}}
+        ))
+    for email in added:
+        ops.append(UpdateOne(
+            {"email": email},
+            {
+                "$addToSet": {f"entities.{new_entity}": client_id},
+                "$set": {"updated_at": now_iso()},
+                "$setOnInsert": {"email": email},
+            },
+            upsert=True
+        ))
+    if ops:
+        await db.client_groups.bulk_write(ops, ordered=True)
+        await _refresh_shared_flags(removed | added)
+
+    if after:
+        group_key = group_key_for(new_emails)
+        if after.get("group_key") != group_key:
+            await db.clients.update_one({"id": client_id}, {"$set": {"group_key": group_key}})
+
+    _stats["syncs"] += 1
+    invalidate_client_group_index()
+
+
+async def rebuild_client_groups() -> Dict:
+    """Reconstruit client_groups + clients.group_key depuis clients"""
+    by_email: Dict[str, Dict[str, Set[str]]] = {}
+    key_ops = []
+    async for client in db.clients.find(
+        {}, {"_id": 0, "id": 1, "entity": 1, "email": 1, "delivery_emails": 1, "group_key": 1}
+    ):
+        emails = client_emails(client)
+        for email in emails:
+            by_email.setdefault(email, {}).setdefault(client.get("entity", ""), set()).add(client["id"])
+        group_key = group_key_for(emails)
+        if client.get("group_key") != group_key:
+            key_ops.append(UpdateOne({"id": client["id"]}, {"$set": {"group_key": group_key}}))
+
+    now = now_iso()
+    docs = [
+        {
+            "email": email,
+            "entities": {ent: sorted(ids) for ent, ids in ents.items()},
+            "shared": len(ents) >= 2,
+            "updated_at": now,
+        }
+        for email, ents in by_email.items()
+    ]
+
+    await db.client_groups.delete_many({})
+    if docs:
+        await db.client_groups.insert_many(docs)
+    if key_ops:
+        await db.clients.bulk_write(key_ops, ordered=False)
+
+    invalidate_client_group_index()
+    result = {
+        "emails": len(docs),
+        "shared_emails": sum(1 for d in docs if d["shared"]),
+        "group_keys_updated": len(key_ops),
+    }
+    logger.info(f"[CLIENT_GROUPS] rebuilt: {result}")
+    return result
+
+
+async def ensure_client_groups() -> None:
+    """Démarrage: construit l'index s'il est vide alors que des clients existent"""
+    if await db.client_groups.count_documents({}, limit=1):
+        return
+    if await db.clients.count_documents({}, limit=1):
+        await rebuild_client_groups()
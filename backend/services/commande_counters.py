@@ -0,0 +1,380 @@
+"""
+RDZ CRM - Compteurs hebdomadaires par commande (matérialisés)
+
+Collection: commande_week_counters
+  1 document par (commande_id, week_key):
+  {
+    commande_id, week_key,
+    delivered,     # leads attribués (routed / livre) - quota
+    lb_delivered,  # dont LB
+    accepted,      # deliveries sent + outcome accepté - LB target
+    lb_accepted,   # dont LB
+    updated_at
+  }
+
+MISE À JOUR ($inc, au fil des transitions):
+- route_lead (réservation atomique)        → delivered, garde quota ($lt)
+- outbox (mise en file, run quotidien)     → delivered réservé (counter_reserved_week),
+                                             rendu si le job part en dead-letter
+- submit_lead (échec après réservation)    → release_commande_slot
+- delivery_state_machine (→ sent)          → accepted (+lb), delivered si lead pas encore attribué
+- reject / remove (routes/deliveries)      → release (décrément)
+
+LECTURE: 1 point read indexé (idx unique commande_id + week_key).
+DRIFT: rebuild_commande_counters() recalcule depuis leads/deliveries
+       (scripts/rebuild_commande_counters.py).
+DÉMARRAGE: ensure_commande_counters() remplit la semaine courante si
+       elle n'a encore aucun compteur (premier déploiement): sans cela le
+       quota de chaque commande repartirait de 0 en milieu de semaine.
+"""
+
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from pymongo.errors import DuplicateKeyError
+from config import db, now_iso
+
+logger = logging.getLogger("commande_counters")
+
+COUNTER_FIELDS = ["delivered", "lb_delivered", "accepted", "lb_accepted"]
+
+
+def week_key_for(ts_iso: Optional[str] = None) -> str:
+    """Clé de semaine ISO (YYYY-W##) d'un timestamp ISO (défaut: maintenant)"""
+    if ts_iso:
+        dt = datetime.fromisoformat(ts_iso.replace("Z", "+00:00"))
+    else:
+        dt = datetime.now(timezone.utc)
+    iso = dt.isocalendar()
+    return f"{iso[0]}-W{iso[1]:02d}"
+
+
+def _empty_counters() -> Dict[str, int]:
+    return {f: 0 for f in COUNTER_FIELDS}
+
+
+async def inc_commande_counters(
+    commande_id: str,
+    week_key: Optional[str] = None,
+    delivered: int = 0,
+    lb_delivered: int = 0,
+    accepted: int = 0,
+    lb_accepted: int = 0
+) -> None:
+    """$inc atomique (upsert) sur le compteur (commande_id, week_key)"""
+    if not commande_id:
+        return
+
+    inc = {
+        "delivered": delivered,
+        "lb_delivered": lb_delivered,
+        "accepted": accepted,
+        "lb_accepted": lb_accepted,
+    }
+    inc = {k: v for k, v in inc.items() if v}
+    if not inc:
+        return
+
+    wk = week_key or week_key_for()
+    await db.commande_week_counters.update_one(
+        {"commande_id": commande_id, "week_key": wk},
+        {
+            "$inc": inc,
+            "$set": {"updated_at": now_iso()},
+            "$setOnInsert": {"commande_id": commande_id, "week_key": wk},
+        },
+        upsert=True
+    )
+
+
+async def reserve_commande_slot(
+    commande_id: str,
+    quota: int,
+    week_key: Optional[str] = None,
+    is_lb: bool = False
+) -> bool:
+    """
+    Réserve atomiquement 1 unité de quota (delivered += 1).
+
+    $inc conditionnel: {delivered: {$lt: quota}} + upsert.
+    - document absent → créé avec delivered=1
+    - quota atteint   → le filtre ne matche pas, l'upsert heurte l'index
+                        unique (commande_id, week_key) → DuplicateKeyError → False
+    quota <= 0 = illimité (pas de garde).
+    """
+    if not commande_id:
+        return False
+
+    wk = week_key or week_key_for()
+    inc = {"delivered": 1}
+    if is_lb:
+        inc["lb_delivered"] = 1
+
+    query = {"commande_id": commande_id, "week_key": wk}
+    if quota > 0:
+        query["delivered"] = {"$lt": quota}
+
+    try:
+        await db.commande_week_counters.update_one(
+            query,
+            {
+                "$inc": inc,
+                "$set": {"updated_at": now_iso()},
+                "$setOnInsert": {"commande_id": commande_id, "week_key": wk},
+            },
+            upsert=True
+        )
+    except DuplicateKeyError:
+        logger.info(f"[COUNTERS] Commande {commande_id[:8]}... quota_full ({quota}) - réservation refusée")
+        return False
+    return True
+
+
+async def release_commande_slot(commande_id: str, week_key: Optional[str] = None, is_lb: bool = False) -> None:
+    """Libère une unité réservée par reserve_commande_slot (étape suivante en échec)"""
+    await inc_commande_counters(
+        commande_id,
+        week_key,
+        delivered=-1,
+        lb_delivered=-1 if is_lb else 0
+    )
+
+
+async def get_commande_week_counters(commande_id: str, week_key: Optional[str] = None) -> Dict[str, int]:
+    """Point read: compteurs (commande_id, week_key), zéros si absent"""
+    doc = await db.commande_week_counters.find_one(
+        {"commande_id": commande_id, "week_key": week_key or week_key_for()},
+        {"_id": 0, **{f: 1 for f in COUNTER_FIELDS}}
+    )
+    return {**_empty_counters(), **(doc or {})}
+
+
+async def get_commandes_week_counters(commande_ids: List[str], week_key: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+    """Compteurs de plusieurs commandes en une requête: {commande_id: counters}"""
+    if not commande_ids:
+        return {}
+
+    docs = await db.commande_week_counters.find(
+        {"commande_id": {"$in": commande_ids}, "week_key": week_key or week_key_for()},
+        {"_id": 0, "commande_id": 1, **{f: 1 for f in COUNTER_FIELDS}}
+    ).to_list(len(commande_ids))
+
+    result = {cid: _empty_counters() for cid in commande_ids}
+    for doc in docs:
+        result[doc["commande_id"]] = {**_empty_counters(), **{f: doc.get(f, 0) for f in COUNTER_FIELDS}}
+    return result
+
+
+async def release_delivery_counters(delivery: Dict, lead: Optional[Dict]) -> None:
+    """
+    Décrémente les compteurs quand une delivery sent est rejetée / retirée
+    (le lead redevient "new" et sort des stats de la commande).
+    """
+    commande_id = delivery.get("commande_id")
+    if not commande_id:
+        return
+
+    is_lb = bool(delivery.get("is_lb") or (lead or {}).get("is_lb"))
+
+    # accepted: semaine du last_sent_at
+    if delivery.get("status") == "sent" and delivery.get("outcome", "accepted") not in ("rejected", "removed"):
+        await inc_commande_counters(
+            commande_id,
+            week_key_for(delivery.get("last_sent_at")),
+            accepted=-1,
+            lb_accepted=-1 if is_lb else 0
+        )
+
+    # delivered: seulement si le lead était encore attribué à cette commande
+    if (
+        lead
+        and lead.get("delivery_commande_id") == commande_id
+        and lead.get("status") in ("routed", "livre")
+    ):
+        attributed_at = lead.get("routed_at") or lead.get("delivered_at")
+        await inc_commande_counters(
+            commande_id,
+            week_key_for(attributed_at),
+            delivered=-1,
+            lb_delivered=-1 if lead.get("is_lb") else 0
+        )
+
+
+async def compute_commande_week_stats(week_key: str) -> Dict[str, Dict[str, int]]:
+    """
+    Recalcule les compteurs d'une semaine depuis les collections sources
+    (mêmes règles que get_commande_stats / get_accepted_stats_for_lb_target).
+    """
+    from services.routing_engine import week_key_to_range
+
+    week_start, week_end = week_key_to_range(week_key)
+    stats: Dict[str, Dict[str, int]] = {}
+
+    delivered_pipeline = [
+        {
+            "$match": {
+                "delivery_commande_id": {"$exists": True, "$ne": None},
+                "status": {"$in": ["livre", "routed"]},
+                "$or": [
+                    {"delivered_at": {"$gte": week_start, "$lte": week_end}},
+                    {"routed_at": {"$gte": week_start, "$lte": week_end}}
+                ]
+            }
+        },
+        {
+            "$group": {
+                "_id": "$delivery_commande_id",
+                "delivered": {"$sum": 1},
+                "lb_delivered": {"$sum": {"$cond": [{"$eq": ["$is_lb", True]}, 1, 0]}}
+            }
+        }
+    ]
+    async for row in db.leads.aggregate(delivered_pipeline):
+        entry = stats.setdefault(row["_id"], _empty_counters())
+        entry["delivered"] = row.get("delivered", 0)
+        entry["lb_delivered"] = row.get("lb_delivered", 0)
+
+    accepted_pipeline = [
+        {
+            "$match": {
+                "status": "sent",
+                "outcome": {"$nin": ["rejected", "removed"]},
+                "last_sent_at": {"$gte": week_start, "$lte": week_end}
+            }
+        },
+        {
+            "$lookup": {
+                "from": "leads",
+                "localField": "lead_id",
+                "foreignField": "id",
+                "pipeline": [{"$project": {"_id": 0, "is_lb": 1}}],
+                "as": "lead_info"
+            }
+        },
+        {
+            "$group": {
+                "_id": "$commande_id",
+                "accepted": {"$sum": 1},
+                "lb_accepted": {
+                    "$sum": {
+                        "$cond": [
+                            {"$or": [
+                                {"$eq": ["$is_lb", True]},
+                                {"$eq": [{"$arrayElemAt": ["$lead_info.is_lb", 0]}, True]}
+                            ]},
+                            1, 0
+                        ]
+                    }
+                }
+            }
+        }
+    ]
+    async for row in db.deliveries.aggregate(accepted_pipeline):
+        if not row["_id"]:
+            continue
+        entry = stats.setdefault(row["_id"], _empty_counters())
+        entry["accepted"] = row.get("accepted", 0)
+        entry["lb_accepted"] = row.get("lb_accepted", 0)
+
+    # Réservées à la mise en file, pas encore envoyées (lead pas encore attribué)
+    reserved_pipeline = [
+        {"$match": {"counter_reserved_week": week_key, "status": {"$ne": "sent"}}},
+        {
+            "$lookup": {
+                "from": "leads",
+                "localField": "lead_id",
+                "foreignField": "id",
+                "pipeline": [{"$project": {"_id": 0, "is_lb": 1}}],
+                "as": "lead_info"
+            }
+        },
+        {
+            "$group": {
+                "_id": "$commande_id",
+                "delivered": {"$sum": 1},
+                "lb_delivered": {
+                    "$sum": {"$cond": [{"$eq": [{"$arrayElemAt": ["$lead_info.is_lb", 0]}, True]}, 1, 0]}
+                }
+            }
+        }
+    ]
+    async for row in db.deliveries.aggregate(reserved_pipeline):
+        if not row["_id"]:
+            continue
+        entry = stats.setdefault(row["_id"], _empty_counters())
+        entry["delivered"] += row.get("delivered", 0)
+        entry["lb_delivered"] += row.get("lb_delivered", 0)
+
+    return stats
+
+
+async def rebuild_commande_counters(week_key: Optional[str] = None, apply: bool = False) -> Dict:
+    """
+    Vérifie (apply=False) ou reconstruit (apply=True) les compteurs d'une semaine.
+
+    Returns:
+        {week_key, checked, drifted, fixed, drift: [{commande_id, expected, actual}]}
+    """
+    wk = week_key or week_key_for()
+    expected = await compute_commande_week_stats(wk)
+
+    actual = {
+        doc["commande_id"]: {f: doc.get(f, 0) for f in COUNTER_FIELDS}
+        async for doc in db.commande_week_counters.find({"week_key": wk}, {"_id": 0})
+    }
+
+    drift = []
+    for commande_id in set(expected) | set(actual):
+        exp = expected.get(commande_id, _empty_counters())
+        act = actual.get(commande_id, _empty_counters())
+        if exp != act:
+            drift.append({"commande_id": commande_id, "expected": exp, "actual": act})
+
+    fixed = 0
+    if apply:
+        for d in drift:
+            await db.commande_week_counters.update_one(
+                {"commande_id": d["commande_id"], "week_key": wk},
+                {"$set": {**d["expected"], "updated_at": now_iso()}},
+                upsert=True
+            )
+            fixed += 1
+
+    if drift:
+        logger.warning(f"[COUNTERS] {wk}: {len(drift)} compteurs en drift (fixed={fixed})")
+
+    return {
+        "week_key": wk,
+        "checked": len(set(expected) | set(actual)),
+        "drifted": len(drift),
+        "fixed": fixed,
+        "drift": drift,
+    }
+
+
+async def ensure_commande_counters() -> Dict:
+    """
+    Démarrage: remplit les compteurs de la semaine courante depuis
+    leads/deliveries s'il n'en existe encore aucun.
+
+    $max (jamais de baisse): sûr face aux réservations d'autres process
+    déjà démarrés, et idempotent si plusieurs process le lancent.
+    """
+    wk = week_key_for()
+    if await db.commande_week_counters.count_documents({"week_key": wk}, limit=1):
+        return {"week_key": wk, "filled": 0}
+
+    expected = await compute_commande_week_stats(wk)
+    for commande_id, counters in expected.items():
+        await db.commande_week_counters.update_one(
+            {"commande_id": commande_id, "week_key": wk},
+            {
+                "$max": counters,
+                "$set": {"updated_at": now_iso()},
+                "$setOnInsert": {"commande_id": commande_id, "week_key": wk},
+            },
+            upsert=True
+        )
+    if expected:
+        logger.info(f"[COUNTERS] {wk}: {len(expected)} compteurs initialisés depuis leads/deliveries")
+    return {"week_key": wk, "filled": len(expected)}
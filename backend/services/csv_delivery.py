@@ -87,6 +87,35 @@ Maison du Lead"""
 }
 
 
+def build_export_row(lead: Dict, produit: str, entity: str) -> Dict:
+    """
+    Ligne exportée pour un lead (CSV et push API) - mêmes colonnes,
+    mêmes constantes, produit = produit de la COMMANDE (relabel LB)
+    """
+    if entity == "MDL":
+        # MDL: 8 colonnes avec proprietaire = oui + type_logement = maison
+        return {
+            "nom": lead.get("nom", ""),
+            "prenom": lead.get("prenom", ""),
+            "telephone": lead.get("phone", ""),
+            "email": lead.get("email", ""),
+            "departement": lead.get("departement", ""),
+            "proprietaire": "oui",  # CONSTANTE - toujours "oui"
+            "type_logement": "maison",  # CONSTANTE - toujours "maison"
+            "produit": produit  # Produit de la COMMANDE (relabel LB)
+        }
+    # ZR7: 7 colonnes avec proprietaire_maison = oui
+    return {
+        "nom": lead.get("nom", ""),
+        "prenom": lead.get("prenom", ""),
+        "telephone": lead.get("phone", ""),
+        "email": lead.get("email", ""),
+        "departement": lead.get("departement", ""),
+        "proprietaire_maison": "oui",  # CONSTANTE - toujours "oui"
+        "produit": produit  # Produit de la COMMANDE (relabel LB)
+    }
+
+
 def generate_csv_content(leads: List[Dict], produit: str, entity: str) -> str:
     """
     Génère le contenu CSV à partir d'une liste de leads
@@ -117,43 +146,38 @@ def generate_csv_content(leads: List[Dict], produit: str, entity: str) -> str:
     - Constantes forcées quoi qu'il arrive
     - LB invisible: produit = commande (pas original)
     """
-    output = io.StringIO()
-    
-    if entity == "MDL":
-        # MDL: 8 colonnes avec proprietaire = oui + type_logement = maison
-        writer = csv.DictWriter(output, fieldnames=CSV_COLUMNS_MDL)
-        writer.writeheader()
-        
-        for lead in leads:
-            row = {
-                "nom": lead.get("nom", ""),
-                "prenom": lead.get("prenom", ""),
-                "telephone": lead.get("phone", ""),
-                "email": lead.get("email", ""),
-                "departement": lead.get("departement", ""),
-                "proprietaire": "oui",  # CONSTANTE - toujours "oui"
-                "type_logement": "maison",  # CONSTANTE - toujours "maison"
-                "produit": produit  # Produit de la COMMANDE (relabel LB)
-            }
-            writer.writerow(row)
-    else:
-        # ZR7: 7 colonnes avec proprietaire_maison = oui
-        writer = csv.DictWriter(output, fieldnames=CSV_COLUMNS_ZR7)
-        writer.writeheader()
-        
-        for lead in leads:
-            row = {
-                "nom": lead.get("nom", ""),
-                "prenom": lead.get("prenom", ""),
-                "telephone": lead.get("phone", ""),
-                "email": lead.get("email", ""),
-                "departement": lead.get("departement", ""),
-                "proprietaire_maison": "oui",  # CONSTANTE - toujours "oui"
-                "produit": produit  # Produit de la COMMANDE (relabel LB)
-            }
-            writer.writerow(row)
-    
-    return output.getvalue()
+    writer = CsvStreamWriter(entity)
+    for lead in leads:
+        writer.writerow(lead, produit)
+    return writer.drain()
+
+
+class CsvStreamWriter:
+    """
+    CSV écrit par morceaux (exports en streaming): même format que
+    generate_csv_content, vidé par drain() quand pending_size grossit.
+    """
+
+    def __init__(self, entity: str):
+        self.entity = entity
+        self._output = io.StringIO()
+        columns = CSV_COLUMNS_MDL if entity == "MDL" else CSV_COLUMNS_ZR7
+        self._writer = csv.DictWriter(self._output, fieldnames=columns)
+        self._writer.writeheader()
+
+    def writerow(self, lead: Dict, produit: str) -> None:
+        self._writer.writerow(build_export_row(lead, produit, self.entity))
+
+    @property
+    def pending_size(self) -> int:
+        return self._output.tell()
+
+    def drain(self) -> str:
+        """Texte écrit depuis le dernier drain()"""
+        value = self._output.getvalue()
+        self._output.seek(0)
+        self._output.truncate()
+        return value
 
 
 def generate_csv_filename(entity: str, produit: str) -> str:
@@ -196,28 +220,13 @@ async def send_csv_email(
     Returns:
         Dict avec status et détails
     """
-    # Configuration SMTP selon entité
-    smtp_config = {
-        "ZR7": {
-            "host": "ssl0.ovh.net",
-            "port": 465,
-            "email": "vos-leads@zr7-digital.fr",
-            "password_env": "ZR7_SMTP_PASSWORD"
-        },
-        "MDL": {
-            "host": "ssl0.ovh.net",
-            "port": 465,
-            "email": "livraisonleads@maisonduleads.fr",
-            "password_env": "MDL_SMTP_PASSWORD"
-        }
-    }
-    
-    config = smtp_config.get(entity)
+    from services.smtp_transport import get_smtp_config, send_message
+
+    config = get_smtp_config(entity)
     if not config:
         return {"success": False, "error": f"Entity {entity} non configurée"}
     
-    smtp_password = os.environ.get(config["password_env"], "")
-    if not smtp_password:
+    if not os.environ.get(config["password_env"], ""):
         return {"success": False, "error": f"Mot de passe SMTP non configuré pour {entity}"}
     
     # Template email selon entité
@@ -247,14 +256,12 @@ async def send_csv_email(
         )
         msg.attach(attachment)
         
-        # Envoi SMTP
-        with smtplib.SMTP_SSL(config["host"], config["port"], timeout=30) as server:
-            server.login(config["email"], smtp_password)
-            server.send_message(msg)
+        # Envoi SMTP (pool de connexions, hors boucle asyncio)
+        latency_ms = await send_message(entity, msg)
         
         logger.info(
             f"[CSV_SENT] entity={entity} produit={produit} "
-            f"leads={lead_count} lb={lb_count} to={to_emails}"
+            f"leads={lead_count} lb={lb_count} to={to_emails} latency={latency_ms}ms"
         )
         
         return {
@@ -262,7 +269,8 @@ async def send_csv_email(
             "emails_sent_to": to_emails,
             "lead_count": lead_count,
             "lb_count": lb_count,
-            "filename": csv_filename
+            "filename": csv_filename,
+            "latency_ms": latency_ms
         }
         
     except smtplib.SMTPAuthenticationError as e:
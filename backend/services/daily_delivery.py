@@ -31,14 +31,18 @@
 ╚══════════════════════════════════════════════════════════════════════════════╝
 """
 
+import os
+import time
+import heapq
+import asyncio
 import logging
 import uuid
 from datetime import datetime, timezone, timedelta
-from typing import List, Dict, Tuple, Optional, Set
-from collections import defaultdict
+from typing import AsyncIterator, List, Dict, Tuple, Optional, Set, Iterable, Iterator, Deque
+from collections import defaultdict, deque
 
 from config import db, now_iso
-from services.duplicate_detector import check_duplicate_30_days
+from services.duplicate_detector import check_duplicate_30_days, load_active_fingerprints
 from services.routing_engine import get_week_start
 
 logger = logging.getLogger("daily_delivery")
@@ -48,6 +52,29 @@ logger = logging.getLogger("daily_delivery")
 # ════════════════════════════════════════════════════════════════════════
 FRESH_MAX_AGE_DAYS = 8      # Fresh = < 8 jours ET jamais livré
 DUPLICATE_BLOCK_DAYS = 30   # Doublon = blocage 30 jours PAR CLIENT
+HISTORY_PHONE_CHUNK = 1000  # téléphones par requête $in (préchargement historique)
+
+# Run quotidien: allocation séquentielle, mise en file des batchs en parallèle
+DAILY_DELIVERY_ENTITIES = ["ZR7", "MDL"]
+UNLIMITED_QUOTA = 999999    # quota_semaine = 0 → pas de plafond
+# "greedy" (par priorité, défaut) | "optimizer" (flot, services/allocation_optimizer.py)
+DAILY_DELIVERY_ALLOCATOR = os.environ.get("DAILY_DELIVERY_ALLOCATOR", "greedy")
+ALLOCATORS = ("greedy", "optimizer")
+
+# process_pending_csv_deliveries: run 09h30 et micro-batchs jamais en parallèle
+# dans un même process (entre process: claim atomique à l'enqueue outbox)
+_pending_csv_lock: Optional[asyncio.Lock] = None
+# Deliveries en attente lues par pages de groupes (client / commande / entity)
+PENDING_GROUP_PAGE = int(os.environ.get("PENDING_GROUP_PAGE", "100"))   # groupes par page (préchargement $in)
+PENDING_BATCH_MAX = int(os.environ.get("PENDING_BATCH_MAX", "1000"))    # deliveries max par CSV / job outbox
+DAILY_DELIVERY_ENTITY_CONCURRENCY = int(os.environ.get("DAILY_DELIVERY_ENTITY_CONCURRENCY", "2"))
+DAILY_DELIVERY_BATCH_CONCURRENCY = int(os.environ.get("DAILY_DELIVERY_BATCH_CONCURRENCY", "8"))
+
+# Champs chargés pour l'allocation + le CSV / push API (build_export_row)
+LEAD_POOL_PROJECTION = {
+    "_id": 0, "id": 1, "entity": 1, "produit": 1, "departement": 1, "phone": 1,
+    "nom": 1, "prenom": 1, "email": 1, "is_lb": 1, "created_at": 1,
+}
 
 
 # ════════════════════════════════════════════════════════════════════════
@@ -110,6 +137,32 @@ def is_lead_lb(lead: dict) -> bool:
     return False
 
 
+def lb_marking_filters(now: datetime) -> Tuple[Dict, Dict]:
+    """Filtres du marquage LB: (non livrés >= 8 jours, livrés > 30 jours)"""
+    cutoff_8_days = (now - timedelta(days=FRESH_MAX_AGE_DAYS)).isoformat()
+    cutoff_30_days = (now - timedelta(days=DUPLICATE_BLOCK_DAYS)).isoformat()
+    old_leads = {
+        "status": {"$in": ["new", "non_livre"]},
+        "created_at": {"$lt": cutoff_8_days},
+        "is_lb": {"$ne": True}
+    }
+    delivered_leads = {
+        "status": "livre",
+        "is_lb": {"$ne": True},
+        "delivered_at": {"$lt": cutoff_30_days}
+    }
+    return old_leads, delivered_leads
+
+
+async def count_leads_to_mark_lb() -> Tuple[int, int]:
+    """Simulation de mark_leads_as_lb (dry run): volumes, sans écriture"""
+    old_leads, delivered_leads = lb_marking_filters(datetime.now(timezone.utc))
+    return (
+        await db.leads.count_documents(old_leads),
+        await db.leads.count_documents(delivered_leads),
+    )
+
+
 async def mark_leads_as_lb():
     """
     Marque les leads éligibles comme LB
@@ -119,15 +172,11 @@ async def mark_leads_as_lb():
     """
     now = datetime.now(timezone.utc)
     now_str = now_iso()
-    cutoff_8_days = (now - timedelta(days=FRESH_MAX_AGE_DAYS)).isoformat()
+    old_leads, delivered_leads = lb_marking_filters(now)
     
     # Condition 1: Non livrés >= 8 jours → LB
     result_old = await db.leads.update_many(
-        {
-            "status": {"$in": ["new", "non_livre"]},
-            "created_at": {"$lt": cutoff_8_days},
-            "is_lb": {"$ne": True}
-        },
+        old_leads,
         {"$set": {
             "is_lb": True,
             "status": "lb",
@@ -137,13 +186,8 @@ async def mark_leads_as_lb():
     )
     
     # Condition 2: Déjà livrés > 30 jours → LB (pour le pool de recyclage)
-    cutoff_30_days = (now - timedelta(days=30)).isoformat()
     result_delivered = await db.leads.update_many(
-        {
-            "status": "livre",
-            "is_lb": {"$ne": True},
-            "delivered_at": {"$lt": cutoff_30_days}
-        },
+        delivered_leads,
         {"$set": {
             "is_lb": True,
             "lb_since": now_str,
@@ -169,33 +213,6 @@ async def mark_leads_as_lb():
 # (get_week_start imported from routing_engine)
 
 
-async def get_commande_stats_delivery(commande_id: str, week_start: str) -> Dict[str, int]:
-    """Stats de la commande pour la semaine en cours"""
-    pipeline = [
-        {
-            "$match": {
-                "delivery_commande_id": commande_id,
-                "delivered_at": {"$gte": week_start}
-            }
-        },
-        {
-            "$group": {
-                "_id": None,
-                "total_delivered": {"$sum": 1},
-                "lb_delivered": {"$sum": {"$cond": [{"$eq": ["$is_lb", True]}, 1, 0]}}
-            }
-        }
-    ]
-
-    result = await db.leads.aggregate(pipeline).to_list(1)
-    if result:
-        return {
-            "leads_delivered": result[0].get("total_delivered", 0),
-            "lb_delivered": result[0].get("lb_delivered", 0)
-        }
-    return {"leads_delivered": 0, "lb_delivered": 0}
-
-
 async def was_delivered_to_client(phone: str, produit: str, client_id: str) -> Tuple[bool, Optional[str]]:
     """
     Vérifie si ce lead a déjà été livré à ce client
@@ -224,7 +241,151 @@ async def is_duplicate_blocked(phone: str, produit: str, client_id: str) -> bool
     return result.is_duplicate
 
 
-async def get_fresh_leads(entity: str) -> List[Dict]:
+class DeliveryHistory:
+    """
+    Historique de livraison (phone, produit, client_id) préchargé pour un run.
+
+    - delivered: déjà livré à ce client (toutes dates) → split LB nouveau / recyclé
+    - blocked: livré il y a < 30 jours (empreintes actives) → règle doublon
+
+    Remplace was_delivered_to_client / is_duplicate_blocked (1 find_one par
+    lead x commande) par des lookups en mémoire. record() tient compte des
+    attributions du run en cours (l'envoi passe par l'outbox, après coup).
+    """
+
+    def __init__(
+        self,
+        delivered: Optional[Dict[Tuple[str, str, str], Optional[str]]] = None,
+        blocked: Optional[Set[Tuple[str, str, str]]] = None
+    ):
+        self.delivered = delivered if delivered is not None else {}
+        self.blocked = blocked if blocked is not None else set()
+
+    def was_delivered(self, phone: str, produit: str, client_id: str) -> bool:
+        return (phone, produit, client_id) in self.delivered
+
+    def is_blocked(self, phone: str, produit: str, client_id: str) -> bool:
+        return (phone, produit, client_id) in self.blocked
+
+    def record(self, phone: str, produit: str, client_id: str, delivered_at: str) -> None:
+        key = (phone, produit, client_id)
+        self.delivered[key] = delivered_at
+        self.blocked.add(key)
+
+
+async def load_delivery_history(leads: Iterable[Dict], commandes: List[Dict]) -> DeliveryHistory:
+    """
+    Précharge l'historique de livraison des téléphones candidats vers les
+    clients des commandes (1 curseur leads + 1 curseur empreintes par tranche).
+    """
+    phones = sorted({lead.get("phone") for lead in leads if lead.get("phone")})
+    client_ids = list({cmd.get("client_id") for cmd in commandes if cmd.get("client_id")})
+    produits = list({cmd.get("produit") for cmd in commandes if cmd.get("produit")})
+    if not phones or not client_ids:
+        return DeliveryHistory()
+
+    delivered: Dict[Tuple[str, str, str], Optional[str]] = {}
+    for start in range(0, len(phones), HISTORY_PHONE_CHUNK):
+        cursor = db.leads.find({
+            "phone": {"$in": phones[start:start + HISTORY_PHONE_CHUNK]},
+            "produit": {"$in": produits},
+            "delivered_to_client_id": {"$in": client_ids}
+        }, {"_id": 0, "phone": 1, "produit": 1, "delivered_to_client_id": 1, "delivered_at": 1})
+        async for doc in cursor:
+            key = (doc["phone"], doc["produit"], doc["delivered_to_client_id"])
+            delivered_at = doc.get("delivered_at")
+            if key not in delivered or (delivered_at or "") > (delivered[key] or ""):
+                delivered[key] = delivered_at
+
+    blocked = await load_active_fingerprints(phones, client_ids, chunk_size=HISTORY_PHONE_CHUNK)
+    return DeliveryHistory(delivered=delivered, blocked=blocked)
+
+
+class LeadPool:
+    """
+    Leads disponibles d'un run, indexés par (produit, departement).
+
+    Chaque bucket est une deque triée par created_at. Un lead attribué est
+    marqué dans `used` (partagé entre les pools du run) et purgé de la tête
+    des deques à la création du curseur suivant: suppression O(1) amortie,
+    sans re-filtrer la liste complète à chaque commande.
+
+    len(): leads non utilisés, calculé depuis `used` (un lead peut être
+    attribué via un autre bucket / pool sans être purgé d'ici).
+    """
+
+    def __init__(self, used: Set[str]):
+        self.used = used
+        self._buckets: Dict[str, Dict[str, Deque[Dict]]] = defaultdict(dict)
+        self._ids: Set[str] = set()
+
+    @classmethod
+    def from_leads(cls, leads: Iterable[Dict], used: Set[str]) -> "LeadPool":
+        staged: Dict[Tuple[str, str], List[Dict]] = defaultdict(list)
+        for lead in leads:
+            staged[(lead.get("produit", ""), lead.get("departement", ""))].append(lead)
+        pool = cls(used)
+        for (produit, dept), bucket in staged.items():
+            bucket.sort(key=_created_at)
+            pool._buckets[produit][dept] = deque(bucket)
+            pool._ids.update(lead.get("id") for lead in bucket)
+        return pool
+
+    def __len__(self) -> int:
+        return len(self._ids) - len(self._ids & self.used)
+
+    def __iter__(self) -> Iterator[Dict]:
+        for by_dept in self._buckets.values():
+            for bucket in by_dept.values():
+                yield from bucket
+
+    def buckets(self) -> Dict[Tuple[str, str], List[Dict]]:
+        """Leads non utilisés par bucket (produit, departement), ordre created_at"""
+        return {
+            (produit, dept): [lead for lead in bucket if lead.get("id") not in self.used]
+            for produit, by_dept in self._buckets.items()
+            for dept, bucket in by_dept.items()
+        }
+
+    def cursor(self, produit: str, departements: List[str]) -> Iterator[Dict]:
+        """
+        Leads non utilisés d'un produit, ordre created_at.
+        "*" → vue fusionnée de tous les départements du produit.
+
+        ⚠️ Créer tous les curseurs d'une commande avant de les consommer
+        (la purge des têtes modifie les deques).
+        """
+        by_dept = self._buckets.get(produit, {})
+        if "*" in departements:
+            buckets = list(by_dept.values())
+        else:
+            buckets = [by_dept[d] for d in dict.fromkeys(departements) if d in by_dept]
+
+        for bucket in buckets:
+            while bucket and bucket[0].get("id") in self.used:
+                bucket.popleft()
+
+        return self._unused(buckets[0] if len(buckets) == 1 else heapq.merge(*buckets, key=_created_at))
+
+    def _unused(self, leads: Iterable[Dict]) -> Iterator[Dict]:
+        for lead in leads:
+            if lead.get("id") not in self.used:
+                yield lead
+
+
+def _created_at(lead: Dict) -> str:
+    return lead.get("created_at") or ""
+
+
+async def load_lead_pool(query: Dict, used: Set[str]) -> LeadPool:
+    """Stream des leads éligibles (projection réduite, sans plafond) → LeadPool"""
+    leads = []
+    async for lead in db.leads.find(query, LEAD_POOL_PROJECTION):
+        leads.append(lead)
+    return LeadPool.from_leads(leads, used)
+
+
+async def get_fresh_leads(entity: str, used: Optional[Set[str]] = None) -> LeadPool:
     """
     🟢 Récupère les leads FRESH pour une entité
     
@@ -232,35 +393,43 @@ async def get_fresh_leads(entity: str) -> List[Dict]:
     """
     cutoff = (datetime.now(timezone.utc) - timedelta(days=FRESH_MAX_AGE_DAYS)).isoformat()
     
-    leads = await db.leads.find({
+    return await load_lead_pool({
         "entity": entity,
         "status": {"$in": ["new", "non_livre"]},
         "is_lb": {"$ne": True},
         "delivered_at": {"$exists": False},
+        "outbox_job_id": {"$exists": False},  # pas en cours d'envoi (outbox)
         "created_at": {"$gte": cutoff},
         "phone": {"$exists": True, "$ne": ""},
         "departement": {"$exists": True, "$ne": ""},
         "nom": {"$exists": True, "$ne": ""}
-    }, {"_id": 0}).sort("created_at", 1).to_list(1000)
-    
-    return leads
+    }, used if used is not None else set())
 
 
-async def get_lb_leads(entity: str) -> List[Dict]:
+async def get_lb_leads(
+    entity: str,
+    used: Optional[Set[str]] = None,
+    include_pending_marking: bool = False
+) -> LeadPool:
     """
     🟡 Récupère les leads LB pour une entité
     
     LB = is_lb = True (âge >= 8j OR déjà livré)
+    include_pending_marking: + leads que mark_leads_as_lb marquerait (dry run)
     """
-    leads = await db.leads.find({
+    query = {
         "entity": entity,
-        "is_lb": True,
+        "outbox_job_id": {"$exists": False},  # pas en cours d'envoi (outbox)
         "phone": {"$exists": True, "$ne": ""},
         "departement": {"$exists": True, "$ne": ""},
         "nom": {"$exists": True, "$ne": ""}
-    }, {"_id": 0}).sort("created_at", 1).to_list(2000)
-    
-    return leads
+    }
+    if include_pending_marking:
+        old_leads, delivered_leads = lb_marking_filters(datetime.now(timezone.utc))
+        query["$or"] = [{"is_lb": True}, old_leads, delivered_leads]
+    else:
+        query["is_lb"] = True
+    return await load_lead_pool(query, used if used is not None else set())
 
 
 async def get_active_commandes(entity: str) -> List[Dict]:
@@ -283,7 +452,7 @@ async def get_active_commandes(entity: str) -> List[Dict]:
         # Client actif ?
         client = await db.clients.find_one(
             {"id": cmd.get("client_id")},
-            {"_id": 0, "name": 1, "active": 1, "email": 1, "delivery_emails": 1}
+            {"_id": 0, "name": 1, "active": 1, "email": 1, "delivery_emails": 1, "api_endpoint": 1}
         )
         if not client or not client.get("active", True):
             continue
@@ -292,6 +461,7 @@ async def get_active_commandes(entity: str) -> List[Dict]:
         cmd["client_active"] = True
         cmd["client_email"] = client.get("email", "")
         cmd["client_delivery_emails"] = client.get("delivery_emails", [])
+        cmd["client_api_endpoint"] = (client.get("api_endpoint") or "").strip()
 
         # OPEN ?
         is_open, stats = await is_commande_open(cmd, week_start)
@@ -311,16 +481,47 @@ async def get_active_commandes(entity: str) -> List[Dict]:
     return open_commandes
 
 
+async def get_commande_allocation_state(cmd: Dict, week_start: str) -> Dict[str, int]:
+    """
+    Volumes de la semaine d'une commande pour l'allocation:
+    already_delivered / already_lb (acceptés) et quota_remaining
+    (UNLIMITED_QUOTA si quota_semaine = 0)
+    """
+    from services.commande_counters import get_commande_week_counters, week_key_for
+
+    # 1 point read: acceptés (LB target) + attribués (quota, temps réel inclus)
+    counters = await get_commande_week_counters(cmd.get("id"), week_key_for(week_start))
+
+    quota = cmd.get("quota_semaine", 0)
+    if quota > 0:
+        quota_remaining = quota - counters["delivered"]
+    else:
+        quota_remaining = UNLIMITED_QUOTA
+
+    return {
+        "already_delivered": counters["accepted"],
+        "already_lb": counters["lb_accepted"],
+        "quota_remaining": quota_remaining,
+    }
+
+
 async def process_commande_delivery(
     cmd: Dict,
-    fresh_leads: List[Dict],
-    lb_leads: List[Dict],
+    fresh_leads,
+    lb_leads,
     used_lead_ids: Set[str],
-    week_start: str
+    week_start: str,
+    history: Optional[DeliveryHistory] = None,
+    dry_run: bool = False
 ) -> Dict:
     """
     Traite une commande avec LB target dynamique.
 
+    fresh_leads / lb_leads: LeadPool du run (ou listes, indexées ici).
+    history: historique de livraison préchargé (process_entity_deliveries);
+    chargé pour cette seule commande si absent.
+    dry_run: manque LB retourné (lb_shortfall) sans event
+
     Le mix LB/Fresh est piloté au fil de l'eau selon lb_target_pct.
     À chaque attribution: lb_needed = ceil(target * (delivered + 1)) - lb_delivered
 
@@ -331,101 +532,61 @@ async def process_commande_delivery(
     target = 0 → Fresh uniquement (aucun LB volontaire)
     """
     from math import ceil
-    from services.routing_engine import get_accepted_stats_for_lb_target, get_week_end
 
     client_id = cmd.get("client_id")
     client_name = cmd.get("client_name", "")
     produit = cmd.get("produit")
     departements = cmd.get("departements", [])
-    quota = cmd.get("quota_semaine", 0)
     lb_target_pct = cmd.get("lb_target_pct", 0)
 
-    # Stats acceptées cette semaine (delivery.status=sent, outcome=accepted)
-    week_end = get_week_end()
-    accepted = await get_accepted_stats_for_lb_target(cmd.get("id"), week_start, week_end)
-    already_delivered = accepted["units_accepted"]
-    already_lb = accepted["lb_accepted"]
-
-    # Quota restant (basé sur les stats de leads comme avant pour la compat)
-    stats = await get_commande_stats_delivery(cmd.get("id"), week_start)
-    total_in_pipeline = stats.get("leads_delivered", 0)
-
-    if quota > 0:
-        quota_remaining = quota - total_in_pipeline
-        if quota_remaining <= 0:
-            return {"leads": [], "lb_count": 0, "fresh_count": 0, "skipped": "quota_full"}
-    else:
-        quota_remaining = 999999
+    state = await get_commande_allocation_state(cmd, week_start)
+    already_delivered = state["already_delivered"]
+    already_lb = state["already_lb"]
+    quota_remaining = state["quota_remaining"]
+    if quota_remaining <= 0:
+        return {"leads": [], "lb_count": 0, "fresh_count": 0, "skipped": "quota_full",
+                "skipped_duplicates": 0, "lb_shortfall": None}
 
     to_deliver = []
     lb_count = 0
     skipped_duplicates = 0
-    lb_shortfall_logged = False
+    lb_shortfall = None
 
-    def matches_dept(lead):
-        dept = lead.get("departement", "")
-        return "*" in departements or dept in departements
-
-    def matches_produit(lead):
-        return lead.get("produit") == produit
-
-    # Pré-filtrer les leads compatibles
-    def filter_leads(leads_list):
-        return [ld for ld in leads_list if ld.get("id") not in used_lead_ids
-                and matches_dept(ld) and matches_produit(ld)]
-
-    available_fresh = filter_leads(fresh_leads)
-    # LB: séparer en "jamais livré à ce client" et "déjà livré (>30j)"
-    available_lb_new = []
-    available_lb_recycled = []
-    for lead in filter_leads(lb_leads):
-        was_del, _ = await was_delivered_to_client(lead.get("phone"), produit, client_id)
-        if not was_del:
-            available_lb_new.append(lead)
-        else:
-            available_lb_recycled.append(lead)
-
-    fresh_idx = 0
-    lb_new_idx = 0
-    lb_recycled_idx = 0
-
-    async def pick_fresh():
-        nonlocal fresh_idx, skipped_duplicates
-        while fresh_idx < len(available_fresh):
-            lead = available_fresh[fresh_idx]
-            fresh_idx += 1
-            if lead.get("id") in used_lead_ids:
-                continue
-            if await is_duplicate_blocked(lead.get("phone"), produit, client_id):
-                skipped_duplicates += 1
-                continue
-            return lead
-        return None
+    fresh_pool = fresh_leads if isinstance(fresh_leads, LeadPool) else LeadPool.from_leads(fresh_leads, used_lead_ids)
+    lb_pool = lb_leads if isinstance(lb_leads, LeadPool) else LeadPool.from_leads(lb_leads, used_lead_ids)
 
-    async def pick_lb():
-        nonlocal lb_new_idx, lb_recycled_idx, skipped_duplicates
-        # D'abord LB jamais livrés à ce client
-        while lb_new_idx < len(available_lb_new):
-            lead = available_lb_new[lb_new_idx]
-            lb_new_idx += 1
-            if lead.get("id") in used_lead_ids:
-                continue
-            if await is_duplicate_blocked(lead.get("phone"), produit, client_id):
-                skipped_duplicates += 1
-                continue
-            return lead
-        # Ensuite LB déjà livrés (>30j, doublon expiré)
-        while lb_recycled_idx < len(available_lb_recycled):
-            lead = available_lb_recycled[lb_recycled_idx]
-            lb_recycled_idx += 1
-            if lead.get("id") in used_lead_ids:
-                continue
-            if await is_duplicate_blocked(lead.get("phone"), produit, client_id):
+    if history is None:
+        history = await load_delivery_history(
+            [*fresh_pool.cursor(produit, departements), *lb_pool.cursor(produit, departements)], [cmd]
+        )
+
+    # Curseurs (ordre created_at) sur les buckets produit x départements
+    fresh_cursor = fresh_pool.cursor(produit, departements)
+    # LB: d'abord "jamais livré à ce client", puis "déjà livré (>30j)"
+    lb_new_cursor = (
+        ld for ld in lb_pool.cursor(produit, departements)
+        if not history.was_delivered(ld.get("phone"), produit, client_id)
+    )
+    lb_recycled_cursor = (
+        ld for ld in lb_pool.cursor(produit, departements)
+        if history.was_delivered(ld.get("phone"), produit, client_id)
+    )
+
+    def pick(cursor):
+        nonlocal skipped_duplicates
+        for lead in cursor:
+            if history.is_blocked(lead.get("phone"), produit, client_id):
                 skipped_duplicates += 1
                 continue
             return lead
         return None
 
+    def pick_fresh():
+        return pick(fresh_cursor)
+
+    def pick_lb():
+        return pick(lb_new_cursor) or pick(lb_recycled_cursor)
+
     # Boucle principale: attribution dynamique
     while len(to_deliver) < quota_remaining:
         # Calcul du besoin LB en temps réel
@@ -438,40 +599,29 @@ async def process_commande_delivery(
 
         if lb_needed > 0:
             # Prioriser LB
-            lead = await pick_lb()
+            lead = pick_lb()
             if lead:
                 is_lb_pick = True
             else:
                 # LB shortfall: log event si pas encore fait
-                if not lb_shortfall_logged:
-                    lb_shortfall_logged = True
-                    from services.event_logger import log_event
-                    from services.routing_engine import get_week_key
+                if lb_shortfall is None:
                     current_pct = (current_lb / current_total * 100) if current_total > 0 else 0
-                    avail_lb = (len(available_lb_new) - lb_new_idx) + (len(available_lb_recycled) - lb_recycled_idx)
-                    await log_event(
-                        action="lb_shortfall",
-                        entity_type="commande",
-                        entity_id=cmd.get("id", ""),
-                        entity=cmd.get("entity", ""),
-                        user="system",
-                        details={
-                            "week_key": get_week_key(),
-                            "target_pct": lb_target_pct,
-                            "current_pct": round(current_pct, 2),
-                            "lb_needed": lb_needed,
-                            "available_lb": avail_lb
-                        },
-                        related={"client_id": client_id, "client_name": client_name}
-                    )
+                    lb_shortfall = {
+                        "target_pct": lb_target_pct,
+                        "current_pct": round(current_pct, 2),
+                        "lb_needed": lb_needed,
+                        "available_lb": 0  # curseurs LB épuisés
+                    }
+                    if not dry_run:
+                        await log_lb_shortfall(cmd, lb_shortfall)
                 # Fallback: prendre un Fresh
-                lead = await pick_fresh()
+                lead = pick_fresh()
         else:
             # Prioriser Fresh
-            lead = await pick_fresh()
+            lead = pick_fresh()
             if not lead and lb_target_pct > 0:
                 # Fallback: prendre un LB si target > 0
-                lead = await pick_lb()
+                lead = pick_lb()
                 if lead:
                     is_lb_pick = True
 
@@ -480,6 +630,7 @@ async def process_commande_delivery(
 
         to_deliver.append(lead)
         used_lead_ids.add(lead.get("id"))
+        history.record(lead.get("phone"), produit, client_id, now_iso())
         if is_lb_pick:
             lb_count += 1
 
@@ -492,10 +643,27 @@ async def process_commande_delivery(
         "leads": to_deliver,
         "lb_count": lb_count,
         "fresh_count": len(to_deliver) - lb_count,
-        "skipped_duplicates": skipped_duplicates
+        "skipped_duplicates": skipped_duplicates,
+        "lb_shortfall": lb_shortfall
     }
 
 
+async def log_lb_shortfall(cmd: Dict, details: Dict) -> None:
+    """Event lb_shortfall: objectif LB de la commande non atteignable"""
+    from services.event_logger import log_event
+    from services.routing_engine import get_week_key
+
+    await log_event(
+        action="lb_shortfall",
+        entity_type="commande",
+        entity_id=cmd.get("id", ""),
+        entity=cmd.get("entity", ""),
+        user="system",
+        details={"week_key": get_week_key(), **details},
+        related={"client_id": cmd.get("client_id"), "client_name": cmd.get("client_name", "")}
+    )
+
+
 # ════════════════════════════════════════════════════════════════════════
 # LIVRAISON CSV
 # ════════════════════════════════════════════════════════════════════════
@@ -507,45 +675,48 @@ async def deliver_leads_to_client(
     lb_count: int
 ) -> Dict:
     """
-    Génère le CSV et envoie par email
+    Génère le CSV et met l'envoi en file (outbox)
+    Client avec api_endpoint → push API au lieu de l'email
     
-    🔒 Utilise delivery_state_machine pour les transitions de statut
+    🔒 Deliveries → sending à l'enqueue; sent/livre posés par le worker
+    outbox via delivery_state_machine après envoi réussi
     """
-    from services.csv_delivery import generate_csv_content, generate_csv_filename, send_csv_email
-    from services.delivery_state_machine import (
-        batch_mark_deliveries_sent,
-        batch_mark_deliveries_failed,
-        DeliveryInvariantError
-    )
+    from services.csv_delivery import generate_csv_content, generate_csv_filename
+    from services.delivery_files import store_csv
+    from services.delivery_state_machine import batch_mark_deliveries_failed, DeliveryInvariantError
+    from services.outbox import enqueue_csv_email, enqueue_api_push
+    from services.settings import get_simulation_email_override
     
     client_id = cmd.get("client_id")
     client_name = cmd.get("client_name", "")
     produit = cmd.get("produit")
     commande_id = cmd.get("id")
+    # Push API (jamais en mode simulation)
+    api_endpoint = "" if await get_simulation_email_override() else cmd.get("client_api_endpoint", "")
     
     # Emails
     emails = [cmd.get("client_email")]
     emails.extend(cmd.get("client_delivery_emails", []))
     emails = list(set(filter(None, emails)))
     
-    if not emails:
+    if not emails and not api_endpoint:
         return {"success": False, "error": "Aucun email configuré"}
     
-    # Générer CSV
+    # Générer CSV (1 fichier par batch dans delivery_files)
     csv_content = generate_csv_content(leads, produit, entity)
     csv_filename = generate_csv_filename(entity, produit)
+    csv_file_id = await store_csv(csv_content)
     
-    # Créer les delivery records dans la collection deliveries
+    # Créer les delivery records dans la collection deliveries (1 insert_many),
+    # déjà prises par le job outbox ("sending" + outbox_job_id): jamais
+    # visibles en pending_csv pour un micro-batch d'un autre process
     batch_id = str(uuid.uuid4())
+    outbox_job_id = str(uuid.uuid4())
     now = now_iso()
     lead_ids = [lead.get("id") for lead in leads]
-    delivery_ids = []
-    
-    for lead in leads:
-        delivery_id = str(uuid.uuid4())
-        delivery_ids.append(delivery_id)
-        await db.deliveries.insert_one({
-            "id": delivery_id,
+    delivery_docs = [
+        {
+            "id": str(uuid.uuid4()),
             "lead_id": lead.get("id"),
             "client_id": client_id,
             "client_name": client_name,
@@ -553,69 +724,64 @@ async def deliver_leads_to_client(
             "entity": entity,
             "produit": produit,
             "is_lb": lead.get("is_lb", False),
-            "status": "pending_csv",
-            "csv_content": csv_content,
+            "status": "sending",
+            "outbox_job_id": outbox_job_id,
+            "csv_file_id": csv_file_id,
             "csv_filename": csv_filename,
             "csv_generated_at": now,
             "batch_id": batch_id,
             "send_attempts": 0,
             "created_at": now,
             "updated_at": now
-        })
+        }
+        for lead in leads
+    ]
+    delivery_ids = [doc["id"] for doc in delivery_docs]
+    await db.deliveries.insert_many(delivery_docs)
     
-    # Envoyer
+    # Mettre en file (envoi + delivery_batches par le worker outbox)
     try:
-        result = await send_csv_email(
-            entity=entity,
-            to_emails=emails,
-            csv_content=csv_content,
-            csv_filename=csv_filename,
-            lead_count=len(leads),
-            lb_count=lb_count,
-            produit=produit
-        )
-        
-        if not result.get("success"):
-            # 🔒 Marquer failed via state machine
-            await batch_mark_deliveries_failed(
+        if api_endpoint:
+            job = await enqueue_api_push(
+                entity=entity,
+                client_id=client_id,
+                client_name=client_name,
+                commande_id=commande_id,
+                produit=produit,
                 delivery_ids=delivery_ids,
-                error=result.get("error", "send_failed")
+                lead_ids=lead_ids,
+                endpoint=api_endpoint,
+                lb_count=lb_count,
+                source="daily",
+                batch_id=batch_id,
+                claimed_by=outbox_job_id
+            )
+        else:
+            job = await enqueue_csv_email(
+                entity=entity,
+                client_id=client_id,
+                client_name=client_name,
+                commande_id=commande_id,
+                produit=produit,
+                delivery_ids=delivery_ids,
+                lead_ids=lead_ids,
+                to_emails=emails,
+                csv_file_id=csv_file_id,
+                csv_filename=csv_filename,
+                lb_count=lb_count,
+                source="daily",
+                batch_id=batch_id,
+                claimed_by=outbox_job_id
             )
-            return result
         
-        # 🔒 SEULEMENT après envoi réussi: state machine
-        await batch_mark_deliveries_sent(
-            delivery_ids=delivery_ids,
-            lead_ids=lead_ids,
-            sent_to=emails,
-            client_id=client_id,
-            client_name=client_name,
-            commande_id=commande_id
-        )
-        
-        # Sauvegarder batch (backward compatibility)
-        await db.delivery_batches.insert_one({
-            "id": batch_id,
-            "entity": entity,
-            "client_id": client_id,
-            "client_name": client_name,
-            "commande_id": commande_id,
-            "produit": produit,
-            "lead_ids": lead_ids,
-            "delivery_ids": delivery_ids,
-            "lead_count": len(leads),
-            "lb_count": lb_count,
-            "fresh_count": len(leads) - lb_count,
-            "status": "sent",
-            "csv_filename": csv_filename,
-            "emails_sent_to": emails,
-            "sent_at": now,
-            "created_at": now
-        })
+        if not job:
+            return {"success": False, "error": "deliveries_already_queued"}
         
         return {
             "success": True,
+            "queued": True,
             "batch_id": batch_id,
+            "outbox_job_id": job["id"],
             "lead_count": len(leads),
             "lb_count": lb_count
         }
@@ -637,83 +803,185 @@ async def deliver_leads_to_client(
 # PROCESS ENTITY
 # ════════════════════════════════════════════════════════════════════════
 
-async def process_entity_deliveries(entity: str) -> Dict:
+async def process_entity_deliveries(
+    entity: str,
+    allocator: Optional[str] = None,
+    dry_run: bool = False
+) -> Dict:
     """
     Traite toutes les livraisons pour une entité
+    (allocation ici, envoi par l'outbox)
+
+    1. Chargement: pools de leads + commandes OPEN + historique
+    2. Allocation: séquentielle, ordre de priorité des commandes (déterministe)
+       allocator "greedy": commande par commande (process_commande_delivery)
+       allocator "optimizer": flot global (services/allocation_optimizer.py)
+    3. Mise en file: 1 batch par commande servie, en parallèle
+       (DAILY_DELIVERY_BATCH_CONCURRENCY)
+
+    dry_run: pool LB avec les leads que mark_leads_as_lb marquerait, aucune
+    mise en file (batchs prévus dans planned_batches), aucun event, et
+    simulation du fallback cross-entity sur les fresh restants.
+    Durée et requêtes MongoDB par phase: timings / queries.
     """
+    from services.query_stats import count_queries, summarize_queries
+
     results = {
         "entity": entity,
         "fresh_delivered": 0,
         "lb_delivered": 0,
         "total_delivered": 0,
         "clients_served": 0,
-        "batches_sent": 0,
-        "errors": []
+        "batches_queued": 0,
+        "skipped_duplicates": 0,
+        "lb_shortfalls": [],
+        "errors": [],
+        "timings": {},
+        "queries": {}
     }
+    if dry_run:
+        results["dry_run"] = True
+        results["planned_batches"] = []
+
+    def phase_done(name: str, started: float, queries) -> None:
+        results["timings"][f"{name}_seconds"] = round(time.perf_counter() - started, 3)
+        results["queries"][name] = summarize_queries(queries)
     
-    # Récupérer les leads
-    fresh_leads = await get_fresh_leads(entity)
-    lb_leads = await get_lb_leads(entity)
-    
-    logger.info(f"[{entity}] Fresh: {len(fresh_leads)}, LB: {len(lb_leads)}")
-    
+    # Récupérer les leads (pools produit x département, sans plafond),
+    # les commandes et l'historique livré / doublons 30j (1 chargement)
+    started = time.perf_counter()
+    with count_queries() as queries:
+        used_lead_ids: Set[str] = set()
+        fresh_leads = await get_fresh_leads(entity, used_lead_ids)
+        lb_leads = await get_lb_leads(entity, used_lead_ids, include_pending_marking=dry_run)
+        logger.info(f"[{entity}] Fresh: {len(fresh_leads)}, LB: {len(lb_leads)}")
+
+        commandes = await get_active_commandes(entity) if (fresh_leads or lb_leads) else []
+        history = await load_delivery_history([*fresh_leads, *lb_leads], commandes) if commandes else None
+    phase_done("load", started, queries)
+
     if not fresh_leads and not lb_leads:
         return results
-    
-    # Récupérer les commandes
-    commandes = await get_active_commandes(entity)
     if not commandes:
         logger.info(f"[{entity}] Aucune commande active")
         return results
+    logger.info(
+        f"[{entity}] Historique: {len(history.delivered)} déjà livrés, "
+        f"{len(history.blocked)} doublons 30j"
+    )
     
+    # Allocation (séquentielle: used_lead_ids / historique partagés)
     week_start = get_week_start()
-    used_lead_ids: Set[str] = set()
-    
-    # Traiter chaque commande
-    for cmd in commandes:
-        try:
-            delivery_result = await process_commande_delivery(
-                cmd, fresh_leads, lb_leads, used_lead_ids, week_start
+    started = time.perf_counter()
+    with count_queries() as queries:
+        if (allocator or DAILY_DELIVERY_ALLOCATOR) == "optimizer":
+            from services.allocation_optimizer import optimize_allocation
+            allocations, results["allocation"] = await optimize_allocation(
+                entity, commandes, fresh_leads, lb_leads, history, week_start, dry_run=dry_run
             )
+        else:
+            allocations = []
+            for cmd in commandes:
+                try:
+                    delivery_result = await process_commande_delivery(
+                        cmd, fresh_leads, lb_leads, used_lead_ids, week_start, history, dry_run=dry_run
+                    )
+                    allocations.append({
+                        "cmd": cmd,
+                        "leads": delivery_result.get("leads", []),
+                        "lb_count": delivery_result.get("lb_count", 0),
+                        "skipped_duplicates": delivery_result.get("skipped_duplicates", 0),
+                        "lb_shortfall": delivery_result.get("lb_shortfall"),
+                    })
+                except Exception as e:
+                    logger.error(f"[{entity}] Erreur commande {cmd.get('id')}: {str(e)}")
+                    results["errors"].append({
+                        "client": cmd.get("client_name"),
+                        "error": str(e)
+                    })
+    phase_done("allocation", started, queries)
+
+    for allocation in allocations:
+        cmd = allocation["cmd"]
+        results["skipped_duplicates"] += allocation["skipped_duplicates"]
+        if allocation["lb_shortfall"]:
+            results["lb_shortfalls"].append({
+                "commande_id": cmd.get("id"),
+                "client_name": cmd.get("client_name"),
+                **allocation["lb_shortfall"]
+            })
+    planned = [allocation for allocation in allocations if allocation["leads"]]
+
+    # Mise en file des batchs (indépendants: 1 commande = 1 batch)
+    started = time.perf_counter()
+    with count_queries() as queries:
+        if dry_run:
+            send_results = [{"success": True}] * len(planned)
+            results["planned_batches"] = [_planned_batch(allocation) for allocation in planned]
+        else:
+            semaphore = asyncio.Semaphore(max(1, DAILY_DELIVERY_BATCH_CONCURRENCY))
+
+            async def deliver(allocation: Dict) -> Dict:
+                cmd = allocation["cmd"]
+                async with semaphore:
+                    try:
+                        return await deliver_leads_to_client(
+                            entity, cmd, allocation["leads"], allocation["lb_count"]
+                        )
+                    except Exception as e:
+                        logger.error(f"[{entity}] Erreur commande {cmd.get('id')}: {str(e)}")
+                        return {"success": False, "error": str(e)}
+
+            send_results = await asyncio.gather(*[deliver(allocation) for allocation in planned])
+    phase_done("delivery", started, queries)
+
+    for allocation, send_result in zip(planned, send_results):
+        cmd = allocation["cmd"]
+        lead_count = len(allocation["leads"])
+        lb_count = allocation["lb_count"]
+        if send_result.get("success"):
+            results["fresh_delivered"] += lead_count - lb_count
+            results["lb_delivered"] += lb_count
+            results["total_delivered"] += lead_count
+            results["clients_served"] += 1
+            results["batches_queued"] += 1
             
-            leads_to_deliver = delivery_result.get("leads", [])
-            lb_count = delivery_result.get("lb_count", 0)
-            
-            if not leads_to_deliver:
-                continue
-            
-            # Livrer
-            send_result = await deliver_leads_to_client(
-                entity, cmd, leads_to_deliver, lb_count
+            logger.info(
+                f"[{entity}] {'(dry run) ' if dry_run else ''}{cmd.get('client_name')}: "
+                f"{lead_count} leads (Fresh: {lead_count - lb_count}, LB: {lb_count})"
             )
-            
-            if send_result.get("success"):
-                results["fresh_delivered"] += len(leads_to_deliver) - lb_count
-                results["lb_delivered"] += lb_count
-                results["total_delivered"] += len(leads_to_deliver)
-                results["clients_served"] += 1
-                results["batches_sent"] += 1
-                
-                logger.info(
-                    f"[{entity}] {cmd.get('client_name')}: "
-                    f"{len(leads_to_deliver)} leads (Fresh: {len(leads_to_deliver) - lb_count}, LB: {lb_count})"
-                )
-            else:
-                results["errors"].append({
-                    "client": cmd.get("client_name"),
-                    "error": send_result.get("error")
-                })
-                
-        except Exception as e:
-            logger.error(f"[{entity}] Erreur commande {cmd.get('id')}: {str(e)}")
+        else:
             results["errors"].append({
                 "client": cmd.get("client_name"),
-                "error": str(e)
+                "error": send_result.get("error")
             })
+
+    if dry_run:
+        started = time.perf_counter()
+        with count_queries() as queries:
+            results["cross_entity"] = await simulate_cross_entity_fallback(entity, fresh_leads)
+        phase_done("cross_entity", started, queries)
     
     return results
 
 
+def _planned_batch(allocation: Dict) -> Dict:
+    """Batch prévu (dry run): ce que la mise en file enverrait"""
+    cmd = allocation["cmd"]
+    lead_count = len(allocation["leads"])
+    return {
+        "commande_id": cmd.get("id"),
+        "client_id": cmd.get("client_id"),
+        "client_name": cmd.get("client_name"),
+        "produit": cmd.get("produit"),
+        "channel": "api" if cmd.get("client_api_endpoint") else "email",
+        "lead_count": lead_count,
+        "fresh_count": lead_count - allocation["lb_count"],
+        "lb_count": allocation["lb_count"],
+        "skipped_duplicates": allocation["skipped_duplicates"],
+    }
+
+
 # ---- CROSS-ENTITY FALLBACK ----
 
 async def try_cross_entity_fallback(
@@ -779,13 +1047,128 @@ async def try_cross_entity_fallback(
     return None
 
 
+async def simulate_cross_entity_fallback(entity: str, fresh_pool: LeadPool) -> Dict:
+    """
+    Dry run: fresh restés sans commande que le fallback cross-entity pourrait
+    placer (commande OPEN de l'autre entité, même produit + département,
+    avant contrôle doublon 30j)
+    """
+    from services.settings import is_cross_entity_allowed
+
+    other_entity = "MDL" if entity == "ZR7" else "ZR7"
+    leftover = {key: len(leads) for key, leads in fresh_pool.buckets().items() if leads}
+    report = {"to": other_entity, "allowed": False, "leftover_fresh": sum(leftover.values()), "eligible": 0}
+    if not leftover:
+        return report
+
+    report["allowed"] = await is_cross_entity_allowed(entity, other_entity)
+    if not report["allowed"]:
+        return report
+
+    commandes = await get_active_commandes(other_entity)
+    for (produit, dept), count in leftover.items():
+        if any(
+            cmd.get("produit") == produit
+            and ("*" in cmd.get("departements", []) or dept in cmd.get("departements", []))
+            for cmd in commandes
+        ):
+            report["eligible"] += count
+    return report
+
+
+# ════════════════════════════════════════════════════════════════════════
+# DELIVERIES EN ATTENTE (pending_csv / ready_to_send): GROUPES PAR PAGES
+# ════════════════════════════════════════════════════════════════════════
+
+async def iter_delivery_group_pages(
+    query: Dict,
+    page_size: Optional[int] = None
+) -> AsyncIterator[List[Dict]]:
+    """
+    Deliveries de la requête groupées par client_id + commande_id + entity
+    (1 aggregate, plus anciens groupes d'abord), lues par curseur en pages
+    de page_size groupes (défaut PENDING_GROUP_PAGE).
+
+    Le $group est calculé avant le premier résultat: les transitions de
+    statut faites pendant le traitement ne décalent pas la pagination, et
+    aucun plafond sur le nombre de deliveries traitées en une passe.
+
+    Yields:
+        [{client_id, commande_id, entity, deliveries: [{id, lead_id, produit}]}]
+    """
+    cursor = db.deliveries.aggregate([
+        {"$match": query},
+        {"$sort": {"created_at": 1}},
+        {"$group": {
+            "_id": {"client_id": "$client_id", "commande_id": "$commande_id", "entity": "$entity"},
+            "deliveries": {"$push": {"id": "$id", "lead_id": "$lead_id", "produit": "$produit"}},
+            "oldest_created_at": {"$min": "$created_at"},
+        }},
+        {"$sort": {"oldest_created_at": 1}},
+    ], allowDiskUse=True)
+
+    page: List[Dict] = []
+    async for group in cursor:
+        key = group["_id"]
+        page.append({
+            "client_id": key.get("client_id"),
+            "commande_id": key.get("commande_id"),
+            "entity": key.get("entity"),
+            "deliveries": group["deliveries"],
+        })
+        if len(page) >= (page_size or PENDING_GROUP_PAGE):
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+async def prefetch_group_refs(
+    groups: List[Dict],
+    with_commandes: bool = True
+) -> Tuple[Dict[str, Dict], Dict[str, Dict]]:
+    """Clients et commandes d'une page de groupes: 1 requête $in chacun"""
+    client_ids = list({g["client_id"] for g in groups if g.get("client_id")})
+    commande_ids = list({g["commande_id"] for g in groups if g.get("commande_id")}) if with_commandes else []
+    clients = {
+        c["id"]: c async for c in db.clients.find({"id": {"$in": client_ids}}, {"_id": 0})
+    } if client_ids else {}
+    commandes = {
+        c["id"]: c async for c in db.commandes.find({"id": {"$in": commande_ids}}, {"_id": 0})
+    } if commande_ids else {}
+    return clients, commandes
+
+
+def pending_throughput(processed: int, started: float) -> Dict:
+    """Durée et débit d'une passe (started: time.perf_counter())"""
+    duration = time.perf_counter() - started
+    return {
+        "duration_seconds": round(duration, 3),
+        "deliveries_per_second": round(processed / duration, 1) if duration > 0 else None,
+    }
+
+
 # ════════════════════════════════════════════════════════════════════════
 # MAIN - RUN DAILY DELIVERY
 # ════════════════════════════════════════════════════════════════════════
 
-async def process_pending_csv_deliveries() -> Dict:
+async def process_pending_csv_deliveries(
+    client_ids: Optional[List[str]] = None,
+    source: str = "pending_csv"
+) -> Dict:
     """
     📤 Traite les deliveries créées par le routing immédiat (Phase 2)
+
+    client_ids: limiter aux deliveries de ces clients (micro-batchs
+    intraday, services/micro_batch.py); None → toutes (run 09h30).
+    source: source des jobs outbox ("pending_csv" | "micro_batch").
+    Un seul traitement à la fois par process (_pending_csv_lock), ce qui
+    évite de générer deux fois les mêmes CSV. Entre process (workers
+    uvicorn, pods), deux traitements peuvent lire les mêmes deliveries:
+    le claim atomique de l'outbox (batch_mark_deliveries_sending) n'en
+    donne chacune qu'à un seul job, l'autre est compté en
+    skipped_already_queued. Les deliveries du run quotidien sont créées
+    déjà prises (jamais pending_csv).
     
     ORDRE DE PRIORITÉ STRICT:
     1. Calendar gating (hard stop) - Si jour OFF → ne rien faire
@@ -794,70 +1177,176 @@ async def process_pending_csv_deliveries() -> Dict:
     
     COMPORTEMENT:
     - Jour OFF → deliveries restent pending_csv
-    - Jour OK + auto_send=true → sent + leads=livre (via state machine)
+    - Jour OK + auto_send=true → sending + job outbox (sent/livre par le worker)
     - Jour OK + auto_send=false → ready_to_send (CSV généré, pas envoyé)
+
+    PAGINATION: toutes les deliveries en une passe (pas de plafond),
+    groupes lus par pages (iter_delivery_group_pages), clients / commandes
+    préchargés par page ($in), calendrier lu une fois par entité. Un groupe
+    de plus de PENDING_BATCH_MAX deliveries donne plusieurs CSV. Débit
+    rapporté: pages, groups, duration_seconds, deliveries_per_second.
     
     🔒 UTILISE delivery_state_machine pour les transitions de statut
     
     Returns:
         Dict avec stats de traitement
     """
-    from services.csv_delivery import send_csv_email, generate_csv_content
+    global _pending_csv_lock
+    if _pending_csv_lock is None:
+        _pending_csv_lock = asyncio.Lock()
+    async with _pending_csv_lock:
+        return await _process_pending_csv(client_ids, source)
+
+
+async def _process_pending_csv(client_ids: Optional[List[str]], source: str) -> Dict:
     from services.settings import is_delivery_day_enabled, get_email_denylist_settings, get_simulation_email_override
-    from services.delivery_state_machine import (
-        batch_mark_deliveries_sent,
-        batch_mark_deliveries_ready_to_send,
-        batch_mark_deliveries_failed
-    )
-    from models.client import check_client_deliverable
     
     results = {
         "processed": 0,
-        "sent": 0,
+        "groups": 0,
+        "pages": 0,
+        "queued": 0,
         "ready_to_send": 0,
         "skipped_calendar": 0,
         "skipped_not_deliverable": 0,
+        "skipped_already_queued": 0,
         "errors": []
     }
     
-    # Récupérer toutes les deliveries pending_csv
-    pending = await db.deliveries.find(
-        {"status": "pending_csv"},
-        {"_id": 0}
-    ).to_list(1000)
-    
-    if not pending:
-        logger.info("[PENDING_CSV] Aucune delivery en attente")
-        return results
+    started = time.perf_counter()
     
-    results["processed"] = len(pending)
-    logger.info(f"[PENDING_CSV] {len(pending)} deliveries à traiter")
+    # Deliveries pending_csv (toutes ou celles des clients demandés),
+    # groupées par client_id + commande_id + entity, lues par pages
+    query = {"status": "pending_csv"}
+    if client_ids is not None:
+        query["client_id"] = {"$in": client_ids}
     
     # Récupérer la denylist et le mode simulation
     denylist_settings = await get_email_denylist_settings()
     denylist = denylist_settings.get("domains", [])
     simulation_email = await get_simulation_email_override()
+    calendar: Dict[str, tuple] = {}
     
-    # Grouper par client_id + commande_id + entity
-    grouped = defaultdict(list)
+    async for page in iter_delivery_group_pages(query):
+        results["pages"] += 1
+        results["groups"] += len(page)
+        results["processed"] += sum(len(g["deliveries"]) for g in page)
+        
+        # Préchargement de la page: clients, commandes ($in), calendrier par entité
+        clients, commandes = await prefetch_group_refs(page)
+        for page_entity in {g["entity"] for g in page} - calendar.keys():
+            calendar[page_entity] = await is_delivery_day_enabled(page_entity)
+        
+        for group in page:
+            await _process_pending_group(
+                group, clients, commandes, calendar, denylist, simulation_email, source, results
+            )
     
-    for delivery in pending:
-        key = (delivery.get("client_id"), delivery.get("commande_id"), delivery.get("entity"))
-        grouped[key].append(delivery)
+    if not results["processed"]:
+        logger.info("[PENDING_CSV] Aucune delivery en attente")
+        return results
     
-    # Traiter chaque groupe
-    for (client_id, commande_id, entity), deliveries in grouped.items():
-        try:
-            # ════════════════════════════════════════════════════════════
-            # PRIORITÉ 1: CALENDAR GATING
-            # ════════════════════════════════════════════════════════════
-            day_enabled, day_reason = await is_delivery_day_enabled(entity)
-            if not day_enabled:
-                logger.info(
-                    f"[PENDING_CSV] {entity}: {day_reason} - {len(deliveries)} deliveries skipped"
-                )
-                results["skipped_calendar"] += len(deliveries)
-                continue  # Reste pending_csv
+    results.update(pending_throughput(results["processed"], started))
+    logger.info(
+        f"[PENDING_CSV] {results['processed']} deliveries ({results['groups']} groupes, "
+        f"{results['pages']} pages) en {results['duration_seconds']}s "
+        f"({results['deliveries_per_second']}/s)"
+    )
+    return results
+
+
+async def _process_pending_group(
+    group: Dict,
+    clients: Dict[str, Dict],
+    commandes: Dict[str, Dict],
+    calendar: Dict[str, tuple],
+    denylist: List[str],
+    simulation_email: Optional[str],
+    source: str,
+    results: Dict
+) -> None:
+    """Un groupe client / commande / entity: 1 CSV par tranche de PENDING_BATCH_MAX deliveries"""
+    from services.csv_delivery import generate_csv_content
+    from services.delivery_files import store_csv
+    from services.delivery_state_machine import (
+        batch_mark_deliveries_ready_to_send,
+        batch_mark_deliveries_failed
+    )
+    from services.outbox import enqueue_csv_email, enqueue_api_push
+    from models.client import check_client_deliverable
+    
+    client_id, commande_id, entity = group["client_id"], group["commande_id"], group["entity"]
+    group_deliveries = group["deliveries"]
+    try:
+        # ════════════════════════════════════════════════════════════
+        # PRIORITÉ 1: CALENDAR GATING
+        # ════════════════════════════════════════════════════════════
+        day_enabled, day_reason = calendar[entity]
+        if not day_enabled:
+            logger.info(
+                f"[PENDING_CSV] {entity}: {day_reason} - {len(group_deliveries)} deliveries skipped"
+            )
+            results["skipped_calendar"] += len(group_deliveries)
+            return  # Reste pending_csv
+        
+        # Info client et commande (préchargées pour la page)
+        client = clients.get(client_id)
+        commande = commandes.get(commande_id)
+        
+        if not client or not commande:
+            logger.error(f"[PENDING_CSV] Client ou commande introuvable: {client_id}/{commande_id}")
+            results["errors"].append({"client_id": client_id, "error": "client_or_commande_not_found"})
+            return
+        
+        produit = commande.get("produit", group_deliveries[0].get("produit", ""))
+        client_name = client.get("name", "")
+        
+        # ════════════════════════════════════════════════════════════
+        # PRIORITÉ 2: CLIENT DELIVERABLE
+        # ════════════════════════════════════════════════════════════
+        deliverable_check = check_client_deliverable(
+            email=client.get("email", ""),
+            delivery_emails=client.get("delivery_emails", []),
+            api_endpoint=client.get("api_endpoint", ""),
+            denylist=denylist
+        )
+        
+        if not deliverable_check["deliverable"]:
+            logger.warning(
+                f"[PENDING_CSV] Client {client_name} non livrable: {deliverable_check['reason']}"
+            )
+            results["skipped_not_deliverable"] += len(group_deliveries)
+            # 🔒 Marquer comme failed via state machine
+            await batch_mark_deliveries_failed(
+                delivery_ids=[d.get("id") for d in group_deliveries],
+                error=f"client_not_deliverable: {deliverable_check['reason']}"
+            )
+            results["errors"].append({"client": client_name, "error": deliverable_check["reason"]})
+            return
+        
+        # Emails de livraison (avec simulation override)
+        if simulation_email:
+            emails = [simulation_email]
+        else:
+            emails = client.get("delivery_emails", [])
+            if not emails and client.get("email"):
+                emails = [client.get("email")]
+        
+        # Push API (jamais en mode simulation)
+        api_endpoint = "" if simulation_email else (client.get("api_endpoint") or "").strip()
+        
+        if not emails and not api_endpoint:
+            logger.warning(f"[PENDING_CSV] Pas d'email pour client {client_name}")
+            results["errors"].append({"client": client_name, "error": "no_email"})
+            return
+        
+        # ════════════════════════════════════════════════════════════
+        # PRIORITÉ 3: AUTO_SEND_ENABLED
+        # ════════════════════════════════════════════════════════════
+        auto_send_enabled = client.get("auto_send_enabled", True)
+        
+        for start in range(0, len(group_deliveries), PENDING_BATCH_MAX):
+            deliveries = group_deliveries[start:start + PENDING_BATCH_MAX]
             
             # Récupérer les leads associés
             lead_ids = [d.get("lead_id") for d in deliveries]
@@ -869,63 +1358,10 @@ async def process_pending_csv_deliveries() -> Dict:
             if not leads:
                 continue
             
-            # Récupérer info client et commande
-            client = await db.clients.find_one({"id": client_id}, {"_id": 0})
-            commande = await db.commandes.find_one({"id": commande_id}, {"_id": 0})
-            
-            if not client or not commande:
-                logger.error(f"[PENDING_CSV] Client ou commande introuvable: {client_id}/{commande_id}")
-                results["errors"].append({"client_id": client_id, "error": "client_or_commande_not_found"})
-                continue
-            
-            produit = commande.get("produit", deliveries[0].get("produit", ""))
-            client_name = client.get("name", "")
-            
-            # ════════════════════════════════════════════════════════════
-            # PRIORITÉ 2: CLIENT DELIVERABLE
-            # ════════════════════════════════════════════════════════════
-            deliverable_check = check_client_deliverable(
-                email=client.get("email", ""),
-                delivery_emails=client.get("delivery_emails", []),
-                api_endpoint=client.get("api_endpoint", ""),
-                denylist=denylist
-            )
-            
-            if not deliverable_check["deliverable"]:
-                logger.warning(
-                    f"[PENDING_CSV] Client {client_name} non livrable: {deliverable_check['reason']}"
-                )
-                results["skipped_not_deliverable"] += len(deliveries)
-                # 🔒 Marquer comme failed via state machine
-                delivery_ids = [d.get("id") for d in deliveries]
-                await batch_mark_deliveries_failed(
-                    delivery_ids=delivery_ids,
-                    error=f"client_not_deliverable: {deliverable_check['reason']}"
-                )
-                results["errors"].append({"client": client_name, "error": deliverable_check["reason"]})
-                continue
-            
-            # Emails de livraison (avec simulation override)
-            if simulation_email:
-                emails = [simulation_email]
-            else:
-                emails = client.get("delivery_emails", [])
-                if not emails and client.get("email"):
-                    emails = [client.get("email")]
-            
-            if not emails:
-                logger.warning(f"[PENDING_CSV] Pas d'email pour client {client_name}")
-                results["errors"].append({"client": client_name, "error": "no_email"})
-                continue
-            
-            # ════════════════════════════════════════════════════════════
-            # PRIORITÉ 3: AUTO_SEND_ENABLED
-            # ════════════════════════════════════════════════════════════
-            auto_send_enabled = client.get("auto_send_enabled", True)
-            
-            # Générer CSV (toujours)
+            # Générer CSV (toujours, 1 fichier par batch dans delivery_files)
             lb_count = sum(1 for lead in leads if lead.get("is_lb"))
             csv_content = generate_csv_content(leads, produit, entity)
+            csv_file_id = await store_csv(csv_content)
             
             now = now_iso()
             csv_filename = f"leads_{entity}_{produit}_{now[:10].replace('-', '')}_{len(leads)}.csv"
@@ -933,13 +1369,13 @@ async def process_pending_csv_deliveries() -> Dict:
             delivery_ids = [d.get("id") for d in deliveries]
             
             if not auto_send_enabled:
-                # ════════════════════════════════════════════════════════
+                # ════════════════════════════════════════════════════
                 # MODE MANUEL: ready_to_send (CSV généré, pas envoyé)
                 # 🔒 Via state machine
-                # ════════════════════════════════════════════════════════
+                # ════════════════════════════════════════════════════
                 await batch_mark_deliveries_ready_to_send(
                     delivery_ids=delivery_ids,
-                    csv_content=csv_content,
+                    csv_file_id=csv_file_id,
                     csv_filename=csv_filename
                 )
                 
@@ -950,138 +1386,190 @@ async def process_pending_csv_deliveries() -> Dict:
                     f"[PENDING_CSV] {client_name}: {len(leads)} leads → ready_to_send "
                     f"(auto_send_enabled=false)"
                 )
-            else:
-                # ════════════════════════════════════════════════════════
-                # MODE AUTO: Envoyer et marquer livre
-                # 🔒 Via state machine APRÈS envoi réussi
-                # ════════════════════════════════════════════════════════
-                try:
-                    # 1. Envoyer l'email RÉELLEMENT
-                    await send_csv_email(
+                continue
+            
+            # ════════════════════════════════════════════════════════
+            # MODE AUTO: mise en file (outbox)
+            # 🔒 sent/livre posés par le worker APRÈS envoi réussi
+            # ════════════════════════════════════════════════════════
+            batch_id = str(uuid.uuid4())
+            
+            try:
+                if api_endpoint:
+                    job = await enqueue_api_push(
                         entity=entity,
-                        to_emails=emails,
-                        csv_content=csv_content,
-                        csv_filename=csv_filename,
-                        lead_count=len(leads),
-                        lb_count=lb_count,
-                        produit=produit
-                    )
-                    
-                    # 2. SEULEMENT après envoi réussi: marquer via state machine
-                    # 🔒 batch_mark_deliveries_sent vérifie les invariants
-                    await batch_mark_deliveries_sent(
+                        client_id=client_id,
+                        client_name=client_name,
+                        commande_id=commande_id,
+                        produit=produit,
                         delivery_ids=delivery_ids,
                         lead_ids=lead_ids,
-                        sent_to=emails,
+                        endpoint=api_endpoint,
+                        lb_count=lb_count,
+                        source=source,
+                        batch_id=batch_id
+                    )
+                else:
+                    job = await enqueue_csv_email(
+                        entity=entity,
                         client_id=client_id,
                         client_name=client_name,
-                        commande_id=commande_id
-                    )
-                    
-                    # Stocker le CSV dans les deliveries (pour téléchargement)
-                    await db.deliveries.update_many(
-                        {"id": {"$in": delivery_ids}},
-                        {"$set": {
-                            "csv_content": csv_content,
-                            "csv_filename": csv_filename,
-                            "csv_generated_at": now_iso()
-                        }}
-                    )
-                    
-                    results["sent"] += len(leads)
-                    logger.info(
-                        f"[PENDING_CSV] {client_name}: {len(leads)} leads envoyés → sent "
-                        f"(entity={entity}, produit={produit}, to={emails})"
-                    )
-                    
-                except Exception as e:
-                    logger.error(f"[PENDING_CSV] Erreur envoi CSV {client_name}: {str(e)}")
-                    
-                    # 🔒 Marquer comme failed via state machine
-                    await batch_mark_deliveries_failed(
+                        commande_id=commande_id,
+                        produit=produit,
                         delivery_ids=delivery_ids,
-                        error=str(e)
-                    )
-                    
-                    # Stocker le CSV même en cas d'échec (pour retry manuel)
-                    await db.deliveries.update_many(
-                        {"id": {"$in": delivery_ids}},
-                        {"$set": {
-                            "csv_content": csv_content,
-                            "csv_filename": csv_filename,
-                            "csv_generated_at": now_iso()
-                        }}
+                        lead_ids=lead_ids,
+                        to_emails=emails,
+                        csv_file_id=csv_file_id,
+                        csv_filename=csv_filename,
+                        lb_count=lb_count,
+                        source=source,
+                        batch_id=batch_id
                     )
-                    
-                    results["errors"].append({"client": client_name, "error": str(e)})
                 
-        except Exception as e:
-            logger.error(f"[PENDING_CSV] Erreur traitement groupe: {str(e)}")
-            results["errors"].append({"group": f"{client_id}/{commande_id}", "error": str(e)})
-    
-    return results
+                if not job:
+                    # Deliveries déjà prises par un autre enqueuer (autre process)
+                    results["skipped_already_queued"] += len(delivery_ids)
+                    continue
+                
+                # Référencer le CSV dans les deliveries prises par le job
+                # (téléchargement / exports par batch)
+                await db.deliveries.update_many(
+                    {"id": {"$in": job["delivery_ids"]}},
+                    {"$set": {
+                        "batch_id": batch_id,
+                        "csv_file_id": job.get("csv_file_id", csv_file_id),
+                        "csv_filename": csv_filename,
+                        "csv_generated_at": now_iso()
+                    }}
+                )
+                skipped = len(delivery_ids) - len(job["delivery_ids"])
+                results["skipped_already_queued"] += skipped
+                
+                results["queued"] += job["lead_count"]
+                logger.info(
+                    f"[PENDING_CSV] {client_name}: {job['lead_count']} leads → outbox "
+                    f"(entity={entity}, produit={produit}, to={api_endpoint or emails})"
+                )
+                
+            except Exception as e:
+                logger.error(f"[PENDING_CSV] Erreur mise en file {client_name}: {str(e)}")
+                results["errors"].append({"client": client_name, "error": str(e)})
+            
+    except Exception as e:
+        logger.error(f"[PENDING_CSV] Erreur traitement groupe: {str(e)}")
+        results["errors"].append({"group": f"{client_id}/{commande_id}", "error": str(e)})
 
 
-async def run_daily_delivery():
+async def run_daily_delivery(allocator: Optional[str] = None, dry_run: bool = False):
     """
     Fonction principale appelée par le cron à 09h30 Europe/Paris
+
+    allocator: "greedy" | "optimizer" (défaut: DAILY_DELIVERY_ALLOCATOR)
     
     1. Traiter les deliveries pending_csv (routing immédiat Phase 2)
     2. Marquer leads éligibles → LB
-    3. Traiter ZR7 (leads new non encore routés)
-    4. Traiter MDL (leads new non encore routés)
-    5. Sauvegarder rapport
+    3. Traiter ZR7 et MDL en parallèle (leads new non encore routés)
+    4. Sauvegarder rapport (avec durée et requêtes MongoDB par phase:
+       timings / queries)
+    
+    Aucun envoi ici: les CSV sont mis en file dans l'outbox
+    (services/outbox.py), envoyés ensuite par ses workers.
+
+    dry_run: planification seule (POST /deliveries/daily-run/dry-run).
+    pending_csv et LB comptés sans être traités, batchs prévus sans mise en
+    file ni event: seul le rapport (dry_run=True) est écrit.
     """
+    from services.query_stats import count_queries, summarize_queries
+
+    mode = " (DRY RUN)" if dry_run else ""
     logger.info("[DAILY_DELIVERY] ════════════════════════════════════════")
-    logger.info("[DAILY_DELIVERY] DÉBUT LIVRAISON QUOTIDIENNE 09h30")
+    logger.info(f"[DAILY_DELIVERY] DÉBUT LIVRAISON QUOTIDIENNE 09h30{mode}")
     logger.info("[DAILY_DELIVERY] ════════════════════════════════════════")
     
     start_time = datetime.now(timezone.utc)
+    timings = {}
+    queries = {}
+
+    allocator = allocator or DAILY_DELIVERY_ALLOCATOR
+    if allocator not in ALLOCATORS:
+        logger.warning(f"[DAILY_DELIVERY] Allocator inconnu '{allocator}' → greedy")
+        allocator = "greedy"
     
     # 0. Traiter les deliveries pending_csv (Phase 2)
-    pending_csv_results = await process_pending_csv_deliveries()
-    logger.info(
-        f"[DAILY_DELIVERY] Pending CSV: {pending_csv_results['sent']} leads envoyés "
-        f"({pending_csv_results['processed']} deliveries traitées)"
-    )
+    phase_started = time.perf_counter()
+    with count_queries() as counter:
+        if dry_run:
+            pending_csv_results = {
+                "dry_run": True,
+                "pending": await db.deliveries.count_documents({"status": "pending_csv"})
+            }
+        else:
+            pending_csv_results = await process_pending_csv_deliveries()
+    timings["pending_csv_seconds"] = round(time.perf_counter() - phase_started, 3)
+    queries["pending_csv"] = summarize_queries(counter)
+    if dry_run:
+        logger.info(f"[DAILY_DELIVERY] Pending CSV: {pending_csv_results['pending']} deliveries à traiter")
+    else:
+        logger.info(
+            f"[DAILY_DELIVERY] Pending CSV: {pending_csv_results['queued']} leads en file d'envoi "
+            f"({pending_csv_results['processed']} deliveries traitées)"
+        )
     
-    # 1. Marquer les leads LB
-    lb_old, lb_delivered = await mark_leads_as_lb()
+    # 1. Marquer les leads LB (dry run: compter les leads à marquer)
+    phase_started = time.perf_counter()
+    with count_queries() as counter:
+        if dry_run:
+            lb_old, lb_delivered = await count_leads_to_mark_lb()
+        else:
+            lb_old, lb_delivered = await mark_leads_as_lb()
+    timings["lb_marking_seconds"] = round(time.perf_counter() - phase_started, 3)
+    queries["lb_marking"] = summarize_queries(counter)
     
     # 2. Traiter chaque entité (leads new non encore routés)
     all_results = {
         "run_at": now_iso(),
+        "dry_run": dry_run,
         "pending_csv": pending_csv_results,
         "lb_marked": {
             "from_old_leads": lb_old,
             "from_delivered": lb_delivered,
             "total": lb_old + lb_delivered
         },
-        "entities": {}
+        "entities": {},
+        "allocator": allocator,
+        "timings": timings,
+        "queries": queries
     }
     
-    for entity in ["ZR7", "MDL"]:
-        try:
-            result = await process_entity_deliveries(entity)
-            all_results["entities"][entity] = result
-            
-            logger.info(
-                f"[DAILY_DELIVERY] {entity}: "
-                f"Total={result['total_delivered']} "
-                f"(Fresh={result['fresh_delivered']}, LB={result['lb_delivered']}) "
-                f"Clients={result['clients_served']}"
-            )
-            
-        except Exception as e:
-            logger.error(f"[DAILY_DELIVERY] Erreur {entity}: {str(e)}")
-            all_results["entities"][entity] = {"error": str(e)}
+    # Entités indépendantes (leads, commandes, clients distincts) → en parallèle
+    phase_started = time.perf_counter()
+    entity_semaphore = asyncio.Semaphore(max(1, DAILY_DELIVERY_ENTITY_CONCURRENCY))
+
+    async def run_entity(entity: str) -> Dict:
+        async with entity_semaphore:
+            try:
+                result = await process_entity_deliveries(entity, allocator, dry_run=dry_run)
+            except Exception as e:
+                logger.error(f"[DAILY_DELIVERY] Erreur {entity}: {str(e)}")
+                return {"error": str(e)}
+        logger.info(
+            f"[DAILY_DELIVERY] {entity}{mode}: "
+            f"Total={result['total_delivered']} "
+            f"(Fresh={result['fresh_delivered']}, LB={result['lb_delivered']}) "
+            f"Clients={result['clients_served']}"
+        )
+        return result
+
+    entity_results = await asyncio.gather(*[run_entity(e) for e in DAILY_DELIVERY_ENTITIES])
+    all_results["entities"] = dict(zip(DAILY_DELIVERY_ENTITIES, entity_results))
+    timings["entities_seconds"] = round(time.perf_counter() - phase_started, 3)
     
-    # 3. Sauvegarder le rapport
+    # 3. Sauvegarder le rapport (seule écriture en dry run)
     all_results["duration_seconds"] = (datetime.now(timezone.utc) - start_time).total_seconds()
     await db.delivery_reports.insert_one(all_results)
     
     logger.info("[DAILY_DELIVERY] ════════════════════════════════════════")
-    logger.info(f"[DAILY_DELIVERY] FIN (durée: {all_results['duration_seconds']:.1f}s)")
+    logger.info(f"[DAILY_DELIVERY] FIN{mode} (durée: {all_results['duration_seconds']:.1f}s)")
     logger.info("[DAILY_DELIVERY] ════════════════════════════════════════")
     
     return all_results
@@ -0,0 +1,160 @@
+"""
+RDZ CRM - Exports CSV / ZIP des deliveries en streaming
+
+Exports (routes/deliveries.py):
+  - 1 batch               → CSV (fichier stocké delivery_files si présent)
+  - 1 client x 1 semaine  → CSV unique, ou ZIP (1 CSV par batch, même filtre)
+  - liste de batchs       → ZIP
+
+Mémoire bornée quelle que soit la taille de l'export:
+  - deliveries lues par curseur, leads chargés par lots ($in de
+    EXPORT_LEAD_CHUNK ids, projection des seules colonnes exportées)
+  - CSV écrit par CsvStreamWriter (format de generate_csv_content) et
+    envoyé par morceaux de EXPORT_FLUSH_BYTES
+  - ZIP écrit en flux (zipfile sur sortie non seekable, entrées zip64)
+"""
+
+import os
+import zipfile
+import logging
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from config import db
+
+logger = logging.getLogger("delivery_exports")
+
+EXPORT_LEAD_CHUNK = int(os.environ.get("EXPORT_LEAD_CHUNK", "500"))
+EXPORT_FLUSH_BYTES = 64 * 1024
+
+LEAD_EXPORT_PROJECTION = {
+    "_id": 0, "id": 1, "nom": 1, "prenom": 1, "phone": 1, "email": 1, "departement": 1,
+}
+DELIVERY_EXPORT_PROJECTION = {
+    "_id": 0, "id": 1, "lead_id": 1, "produit": 1, "entity": 1, "batch_id": 1,
+    "csv_file_id": 1, "csv_filename": 1, "created_at": 1,
+}
+
+
+async def load_leads_by_ids(lead_ids: List[str], chunk_size: int = EXPORT_LEAD_CHUNK,
+                            projection: Optional[Dict] = None) -> Dict[str, Dict]:
+    """Leads par id, chargés par lots $in"""
+    leads: Dict[str, Dict] = {}
+    for start in range(0, len(lead_ids), chunk_size):
+        chunk = lead_ids[start:start + chunk_size]
+        async for lead in db.leads.find({"id": {"$in": chunk}}, projection or {"_id": 0}):
+            leads[lead["id"]] = lead
+    return leads
+
+
+async def iter_delivery_leads(query: Dict) -> AsyncIterator[Tuple[Dict, Dict]]:
+    """(delivery, lead) dans l'ordre created_at, leads chargés par lots"""
+    cursor = db.deliveries.find(query, DELIVERY_EXPORT_PROJECTION).sort("created_at", 1)
+    chunk: List[Dict] = []
+
+    async def resolve(deliveries: List[Dict]):
+        leads = await load_leads_by_ids(
+            [d["lead_id"] for d in deliveries if d.get("lead_id")],
+            projection=LEAD_EXPORT_PROJECTION
+        )
+        return [(d, leads[d["lead_id"]]) for d in deliveries if d.get("lead_id") in leads]
+
+    async for delivery in cursor:
+        chunk.append(delivery)
+        if len(chunk) >= EXPORT_LEAD_CHUNK:
+            for pair in await resolve(chunk):
+                yield pair
+            chunk = []
+    if chunk:
+        for pair in await resolve(chunk):
+            yield pair
+
+
+async def stream_csv(query: Dict, entity: str) -> AsyncIterator[bytes]:
+    """CSV des deliveries de la requête (produit = produit de la delivery / commande)"""
+    from services.csv_delivery import CsvStreamWriter
+
+    writer = CsvStreamWriter(entity)
+    async for delivery, lead in iter_delivery_leads(query):
+        writer.writerow(lead, delivery.get("produit", ""))
+        if writer.pending_size >= EXPORT_FLUSH_BYTES:
+            yield writer.drain().encode("utf-8")
+    yield writer.drain().encode("utf-8")
+
+
+async def stream_batch_csv(batch_id: str, entity: str) -> AsyncIterator[bytes]:
+    """CSV d'un batch: fichier envoyé au client (delivery_files), sinon régénéré"""
+    from services.delivery_files import get_csv_file, iter_csv_chunks
+
+    first = await db.deliveries.find_one({"batch_id": batch_id}, {"_id": 0, "csv_file_id": 1})
+    csv_file = await get_csv_file((first or {}).get("csv_file_id"))
+    if csv_file:
+        async for chunk in iter_csv_chunks(csv_file):
+            yield chunk
+        return
+    async for chunk in stream_csv({"batch_id": batch_id}, entity):
+        yield chunk
+
+
+async def list_batches(query: Dict) -> List[Dict]:
+    """Batchs des deliveries de la requête (1 aggregate), ordre chronologique"""
+    batches = await db.deliveries.aggregate([
+        {"$match": {**query, "batch_id": {"$exists": True}}},
+        {"$group": {
+            "_id": "$batch_id",
+            "entity": {"$first": "$entity"},
+            "csv_filename": {"$first": "$csv_filename"},
+            "created_at": {"$min": "$created_at"},
+            "count": {"$sum": 1},
+        }},
+        {"$sort": {"created_at": 1}},
+    ]).to_list(None)
+    return [{"batch_id": b["_id"], **{k: v for k, v in b.items() if k != "_id"}} for b in batches]
+
+
+def batch_entry_name(batch: Dict) -> str:
+    """Nom unique dans le ZIP (plusieurs batchs peuvent avoir le même csv_filename)"""
+    stem = (batch.get("csv_filename") or f"batch_{(batch.get('created_at') or '')[:10]}").rsplit(".csv", 1)[0]
+    return f"{stem}_{batch['batch_id'][:8]}.csv"
+
+
+class _ZipSink:
+    """Sortie non seekable de zipfile: octets récupérés par drain()"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def write(self, data) -> int:
+        self._buffer += data
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+async def stream_zip(batches: List[Dict], query: Optional[Dict] = None) -> AsyncIterator[bytes]:
+    """
+    ZIP (1 CSV par batch) écrit et envoyé au fil de l'eau.
+    Sans query: batchs tels qu'envoyés (fichier stocké). Avec query: chaque
+    batch est régénéré avec le même filtre que le CSV (même lot de leads).
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as archive:
+        for batch in batches:
+            if query is None:
+                chunks = stream_batch_csv(batch["batch_id"], batch["entity"])
+            else:
+                chunks = stream_csv({**query, "batch_id": batch["batch_id"]}, batch["entity"])
+            with archive.open(batch_entry_name(batch), "w", force_zip64=True) as entry:
+                async for chunk in chunks:
+                    entry.write(chunk)
+                    if len(sink) >= EXPORT_FLUSH_BYTES:
+                        yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
@@ -0,0 +1,177 @@
+"""
+RDZ CRM - Stockage des CSV de livraison (collection delivery_files)
+
+Avant: le CSV d'un batch était copié dans chaque delivery du batch
+(csv_content, 200 leads = 200 copies), dans la collection que scannent
+tous les dashboards.
+
+Maintenant: 1 fichier par contenu, compressé (gzip), adressé par son hash:
+  {
+    id,                 # sha256 du CSV (utf-8) = csv_file_id des deliveries
+    encoding: "gzip", content_type: "text/csv",
+    size, stored_size,  # octets CSV / octets gzip
+    data,               # Binary gzip
+    created_at
+  }
+Même contenu → même id → stocké une seule fois (upsert $setOnInsert).
+Les deliveries gardent csv_filename / csv_generated_at et pointent le
+fichier par csv_file_id. Deliveries antérieures: csv_content inline,
+lu en repli (load_delivery_csv) jusqu'à la migration
+(scripts/migrate_delivery_files.py).
+
+Un CSV de batch fait quelques centaines de Ko au plus: document simple
+(pas de GridFS), bien sous la limite de 16 Mo après compression.
+"""
+
+import gzip
+import zlib
+import hashlib
+import logging
+from typing import AsyncIterator, Dict, List, Optional
+from bson import Binary
+from pymongo import UpdateOne
+from config import db, now_iso
+
+logger = logging.getLogger("delivery_files")
+
+STREAM_CHUNK_BYTES = 64 * 1024
+MIGRATION_CHUNK_SIZE = 500
+
+_stats = {
+    "stored": 0,
+    "deduplicated": 0,
+    "bytes_in": 0,
+    "bytes_stored": 0,
+    "loads": 0,
+    "inline_fallbacks": 0,
+}
+
+
+def csv_file_id(csv_content: str) -> str:
+    return hashlib.sha256(csv_content.encode("utf-8")).hexdigest()
+
+
+async def store_csv(csv_content: str) -> str:
+    """
+    Stocke un CSV (compressé, dédupliqué par hash)
+
+    Returns:
+        csv_file_id à poser sur les deliveries
+    """
+    raw = csv_content.encode("utf-8")
+    file_id = hashlib.sha256(raw).hexdigest()
+    data = gzip.compress(raw)
+
+    result = await db.delivery_files.update_one(
+        {"id": file_id},
+        {"$setOnInsert": {
+            "id": file_id,
+            "encoding": "gzip",
+            "content_type": "text/csv",
+            "size": len(raw),
+            "stored_size": len(data),
+            "data": Binary(data),
+            "created_at": now_iso(),
+        }},
+        upsert=True
+    )
+    _stats["bytes_in"] += len(raw)
+    if result.upserted_id is not None:
+        _stats["stored"] += 1
+        _stats["bytes_stored"] += len(data)
+    else:
+        _stats["deduplicated"] += 1
+    return file_id
+
+
+async def get_csv_file(file_id: str) -> Optional[Dict]:
+    """Document delivery_files (data gzip) ou None"""
+    if not file_id:
+        return None
+    _stats["loads"] += 1
+    return await db.delivery_files.find_one({"id": file_id}, {"_id": 0})
+
+
+async def load_csv(file_id: str) -> Optional[str]:
+    """CSV décompressé ou None"""
+    doc = await get_csv_file(file_id)
+    if not doc:
+        return None
+    return gzip.decompress(doc["data"]).decode("utf-8")
+
+
+async def load_delivery_csv(delivery: Dict) -> Optional[str]:
+    """CSV d'une delivery: fichier (csv_file_id), sinon ancien csv_content inline"""
+    if delivery.get("csv_file_id"):
+        csv_content = await load_csv(delivery["csv_file_id"])
+        if csv_content is not None:
+            return csv_content
+        logger.warning(f"[DELIVERY_FILES] Fichier {delivery['csv_file_id'][:12]}... introuvable")
+    if delivery.get("csv_content"):
+        _stats["inline_fallbacks"] += 1
+        return delivery["csv_content"]
+    return None
+
+
+async def iter_csv_chunks(doc: Dict, chunk_size: int = STREAM_CHUNK_BYTES) -> AsyncIterator[bytes]:
+    """CSV décompressé par morceaux (téléchargement en streaming)"""
+    data = bytes(doc["data"])
+    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    for start in range(0, len(data), chunk_size):
+        chunk = decompressor.decompress(data[start:start + chunk_size])
+        if chunk:
+            yield chunk
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+
+async def migrate_inline_csv(apply: bool = False, chunk_size: int = MIGRATION_CHUNK_SIZE) -> Dict:
+    """
+    Déplace les csv_content inline des deliveries vers delivery_files
+    (1 fichier par contenu distinct), puis pose csv_file_id et retire csv_content.
+
+    apply=False: rapport seul (deliveries, contenus distincts, octets).
+    Idempotent: ne traite que les deliveries ayant encore csv_content.
+    """
+    report = {"deliveries": 0, "unique_files": 0, "bytes_inline": 0, "bytes_stored": 0, "migrated": 0}
+    seen: Dict[str, int] = {}  # hash → taille stockée
+
+    async def flush(ops: List[UpdateOne]) -> None:
+        if apply and ops:
+            result = await db.deliveries.bulk_write(ops, ordered=False)
+            report["migrated"] += result.modified_count
+
+    cursor = db.deliveries.find(
+        {"csv_content": {"$exists": True, "$nin": [None, ""]}},
+        {"_id": 0, "id": 1, "csv_content": 1}
+    )
+    ops: List[UpdateOne] = []
+    async for delivery in cursor:
+        csv_content = delivery["csv_content"]
+        report["deliveries"] += 1
+        report["bytes_inline"] += len(csv_content.encode("utf-8"))
+
+        file_id = csv_file_id(csv_content)
+        if file_id not in seen:
+            seen[file_id] = len(gzip.compress(csv_content.encode("utf-8")))
+            if apply:
+                await store_csv(csv_content)
+
+        ops.append(UpdateOne(
+            {"id": delivery["id"]},
+            {"$set": {"csv_file_id": file_id}, "$unset": {"csv_content": ""}}
+        ))
+        if len(ops) >= chunk_size:
+            await flush(ops)
+            ops = []
+    await flush(ops)
+
+    report["unique_files"] = len(seen)
+    report["bytes_stored"] = sum(seen.values())
+    return report
+
+
+def get_delivery_files_stats() -> Dict:
+    """Métriques locales du store (pour /system/health)"""
+    return dict(_stats)
@@ -38,6 +38,7 @@ VALID_DELIVERY_TRANSITIONS = {
 
 VALID_LEAD_TRANSITIONS = {
     "new": ["routed", "no_open_orders", "hold_source", "pending_config", "invalid", "duplicate"],
+    "queued": ["routed", "no_open_orders", "duplicate", "replaced_by_lb", "new"],  # Routing async
     "routed": ["livre", "failed"],  # routed -> livre ONLY via delivery_state_machine
     "livre": [],  # TERMINAL
     "no_open_orders": ["routed"],  # Can be re-routed later
@@ -93,6 +94,125 @@ async def validate_delivery_transition(delivery_id: str, from_status: str, to_st
     return True
 
 
+def _already_attributed(lead: Dict, commande_id: str) -> bool:
+    """Lead déjà compté dans delivered (routing immédiat ou livraison antérieure)"""
+    return lead.get("delivery_commande_id") == commande_id and lead.get("status") in ("routed", "livre")
+
+
+async def _inc_sent_counters(
+    deliveries: List[Dict],
+    leads_by_id: Dict[str, Dict],
+    default_commande_id: str = ""
+) -> None:
+    """
+    Met à jour commande_week_counters pour des deliveries passées à "sent".
+    - accepted (+lb_accepted si delivery ou lead LB)
+    - delivered (+lb_delivered) si le lead n'était pas déjà attribué à la
+      commande (routing immédiat = déjà compté dans submit_lead) ni réservé
+      à la mise en file (counter_reserved_week, reserve_delivery_counters)
+    """
+    from services.commande_counters import inc_commande_counters
+
+    per_commande = defaultdict(lambda: {"delivered": 0, "lb_delivered": 0, "accepted": 0, "lb_accepted": 0})
+    for d in deliveries:
+        commande_id = d.get("commande_id") or default_commande_id
+        if not commande_id:
+            continue
+        lead = leads_by_id.get(d.get("lead_id")) or {}
+        is_lb = bool(d.get("is_lb") or lead.get("is_lb"))
+        c = per_commande[commande_id]
+        c["accepted"] += 1
+        c["lb_accepted"] += 1 if is_lb else 0
+        if not d.get("counter_reserved_week") and not _already_attributed(lead, commande_id):
+            c["delivered"] += 1
+            c["lb_delivered"] += 1 if lead.get("is_lb") else 0
+
+    for commande_id, c in per_commande.items():
+        try:
+            await inc_commande_counters(commande_id, **c)
+        except Exception as e:
+            # Fail-open: le rebuild réconcilie le drift
+            logger.error(f"[STATE_MACHINE] Counters update failed for {commande_id}: {e}")
+
+
+async def reserve_delivery_counters(delivery_ids: List[str]) -> int:
+    """
+    Réserve delivered (+lb_delivered) des deliveries mises en file dont le
+    lead n'est pas encore attribué (run quotidien): le quota vu par le
+    routing temps réel inclut les leads en attente d'envoi (backoff).
+    Marque counter_reserved_week (semaine de la réservation) sur les
+    deliveries; _inc_sent_counters ne recompte pas delivered à l'envoi.
+    Retourne le nombre d'unités réservées.
+    """
+    from services.commande_counters import inc_commande_counters, week_key_for
+
+    if not delivery_ids:
+        return 0
+    deliveries = await db.deliveries.find(
+        {"id": {"$in": delivery_ids}, "counter_reserved_week": {"$exists": False}},
+        {"_id": 0, "id": 1, "lead_id": 1, "commande_id": 1}
+    ).to_list(len(delivery_ids))
+    lead_ids = [d.get("lead_id") for d in deliveries]
+    leads_by_id = {
+        ld["id"]: ld for ld in await db.leads.find(
+            {"id": {"$in": lead_ids}},
+            {"_id": 0, "id": 1, "status": 1, "is_lb": 1, "delivery_commande_id": 1}
+        ).to_list(len(lead_ids))
+    }
+
+    per_commande = defaultdict(lambda: {"delivered": 0, "lb_delivered": 0})
+    reserved = []
+    for d in deliveries:
+        lead = leads_by_id.get(d.get("lead_id")) or {}
+        if not d.get("commande_id") or _already_attributed(lead, d["commande_id"]):
+            continue
+        reserved.append(d["id"])
+        c = per_commande[d["commande_id"]]
+        c["delivered"] += 1
+        c["lb_delivered"] += 1 if lead.get("is_lb") else 0
+    if not reserved:
+        return 0
+
+    wk = week_key_for()
+    await db.deliveries.update_many({"id": {"$in": reserved}}, {"$set": {"counter_reserved_week": wk}})
+    for commande_id, c in per_commande.items():
+        await inc_commande_counters(commande_id, wk, **c)
+    return len(reserved)
+
+
+async def release_reserved_counters(delivery_ids: List[str]) -> int:
+    """Rend les unités réservées par reserve_delivery_counters (job dead-letter)"""
+    from services.commande_counters import inc_commande_counters
+
+    if not delivery_ids:
+        return 0
+    deliveries = await db.deliveries.find(
+        {"id": {"$in": delivery_ids}, "counter_reserved_week": {"$exists": True}, "status": {"$ne": "sent"}},
+        {"_id": 0, "id": 1, "lead_id": 1, "commande_id": 1, "counter_reserved_week": 1}
+    ).to_list(len(delivery_ids))
+    if not deliveries:
+        return 0
+    lead_ids = [d.get("lead_id") for d in deliveries]
+    lb_ids = {
+        ld["id"] for ld in await db.leads.find(
+            {"id": {"$in": lead_ids}, "is_lb": True}, {"_id": 0, "id": 1}
+        ).to_list(len(lead_ids))
+    }
+
+    await db.deliveries.update_many(
+        {"id": {"$in": [d["id"] for d in deliveries]}},
+        {"$unset": {"counter_reserved_week": ""}}
+    )
+    per_week = defaultdict(lambda: {"delivered": 0, "lb_delivered": 0})
+    for d in deliveries:
+        c = per_week[(d["commande_id"], d["counter_reserved_week"])]
+        c["delivered"] -= 1
+        c["lb_delivered"] -= 1 if d.get("lead_id") in lb_ids else 0
+    for (commande_id, wk), c in per_week.items():
+        await inc_commande_counters(commande_id, wk, **c)
+    return len(deliveries)
+
+
 # ════════════════════════════════════════════════════════════════════════════
 # SAFE STATE TRANSITIONS (THE ONLY WAY TO MARK SENT/LIVRE)
 # ════════════════════════════════════════════════════════════════════════════
@@ -164,6 +284,11 @@ async def mark_delivery_sent(
     client_name = delivery.get("client_name", "")
     commande_id = delivery.get("commande_id")
     
+    lead_before = await db.leads.find_one(
+        {"id": lead_id},
+        {"_id": 0, "status": 1, "is_lb": 1, "delivery_commande_id": 1, "phone": 1, "produit": 1}
+    )
+    
     await db.leads.update_one(
         {"id": lead_id},
         {"$set": {
@@ -181,6 +306,17 @@ async def mark_delivery_sent(
         f"Lead {lead_id} -> livre | sent_to={sent_to}"
     )
 
+    # Compteurs hebdo commande (accepted + delivered si lead pas encore attribué)
+    await _inc_sent_counters([delivery], {lead_id: lead_before or {}})
+
+    # Empreinte doublon 30j
+    if lead_before:
+        from services.duplicate_detector import record_delivery_fingerprint
+        await record_delivery_fingerprint(
+            lead_before.get("phone", ""), lead_before.get("produit", ""),
+            client_id, lead_id, now, client_name
+        )
+
     # Update prepayment balance if PREPAID
     produit = delivery.get("produit", "")
     prepay_pp = await db.client_product_pricing.find_one(
@@ -194,6 +330,8 @@ async def mark_delivery_sent(
              "$set": {"updated_at": now_iso()}}
         )
         logger.info(f"[STATE_MACHINE] Prepayment balance decremented for {client_id}:{produit}")
+        from services.routing_snapshot import invalidate_routing_snapshot
+        invalidate_routing_snapshot("prepayment_decrement")
 
     # Intercompany transfer check (billable = sent + accepted)
     try:
@@ -218,12 +356,13 @@ async def mark_delivery_sent(
 
 async def mark_delivery_ready_to_send(
     delivery_id: str,
-    csv_content: str,
+    csv_file_id: str,
     csv_filename: str
 ) -> Dict[str, Any]:
     """
     🔒 Marque une delivery comme "ready_to_send" (CSV généré, pas envoyé)
     
+    csv_file_id: CSV stocké dans delivery_files (services/delivery_files.py)
     Le lead reste "routed" (PAS livre).
     """
     now = now_iso()
@@ -239,7 +378,7 @@ async def mark_delivery_ready_to_send(
         {"id": delivery_id},
         {"$set": {
             "status": "ready_to_send",
-            "csv_content": csv_content,
+            "csv_file_id": csv_file_id,
             "csv_filename": csv_filename,
             "csv_generated_at": now,
             "updated_at": now
@@ -393,6 +532,16 @@ async def batch_mark_deliveries_sent(
         }}
     )
     
+    # État des leads AVANT transition (pour les compteurs hebdo)
+    leads_before = await db.leads.find(
+        {"id": {"$in": lead_ids}},
+        {"_id": 0, "id": 1, "status": 1, "is_lb": 1, "delivery_commande_id": 1, "phone": 1, "produit": 1}
+    ).to_list(len(lead_ids))
+    sent_deliveries = await db.deliveries.find(
+        {"id": {"$in": delivery_ids}, "status": "sent", "last_sent_at": now},
+        {"_id": 0, "id": 1, "lead_id": 1, "commande_id": 1, "is_lb": 1, "counter_reserved_week": 1}
+    ).to_list(len(delivery_ids))
+    
     # Mettre à jour les leads
     result_leads = await db.leads.update_many(
         {"id": {"$in": lead_ids}},
@@ -411,6 +560,23 @@ async def batch_mark_deliveries_sent(
         f"{result_leads.modified_count} leads -> livre | sent_to={sent_to}"
     )
 
+    # Compteurs hebdo commande
+    await _inc_sent_counters(
+        sent_deliveries, {ld.get("id"): ld for ld in leads_before},
+        default_commande_id=commande_id
+    )
+
+    # Empreintes doublon 30j
+    from services.duplicate_detector import record_delivery_fingerprints
+    await record_delivery_fingerprints([
+        {
+            "phone": ld.get("phone", ""), "produit": ld.get("produit", ""),
+            "client_id": client_id, "client_name": client_name,
+            "lead_id": ld.get("id"), "delivered_at": now,
+        }
+        for ld in leads_before
+    ])
+
     # Update prepayment balances for PREPAID clients in this batch
     if delivery_ids:
         batch_dels = await db.deliveries.find(
@@ -431,6 +597,8 @@ async def batch_mark_deliveries_sent(
                     {"$inc": {"units_delivered_total": count, "units_remaining": -count},
                      "$set": {"updated_at": now_iso()}}
                 )
+                from services.routing_snapshot import invalidate_routing_snapshot
+                invalidate_routing_snapshot("prepayment_decrement")
 
     # Intercompany transfer check for each delivery in batch (FAIL-OPEN per delivery)
     try:
@@ -460,12 +628,13 @@ async def batch_mark_deliveries_sent(
 
 async def batch_mark_deliveries_ready_to_send(
     delivery_ids: List[str],
-    csv_content: str,
+    csv_file_id: str,
     csv_filename: str
 ) -> Dict[str, Any]:
     """
     🔒 Marque un batch de deliveries comme "ready_to_send"
     
+    csv_file_id: CSV du batch stocké une fois dans delivery_files
     Les leads restent "routed". Vérifie les états sources.
     """
     now = now_iso()
@@ -492,7 +661,7 @@ async def batch_mark_deliveries_ready_to_send(
         },
         {"$set": {
             "status": "ready_to_send",
-            "csv_content": csv_content,
+            "csv_file_id": csv_file_id,
             "csv_filename": csv_filename,
             "csv_generated_at": now,
             "updated_at": now
@@ -507,6 +676,58 @@ async def batch_mark_deliveries_ready_to_send(
     }
 
 
+SENDABLE_STATUSES = ["pending_csv", "ready_to_send", "failed"]
+
+
+async def batch_mark_deliveries_sending(
+    delivery_ids: List[str],
+    outbox_job_id: str
+) -> Dict[str, Any]:
+    """
+    🔒 Claim atomique d'un batch de deliveries par un job outbox ("sending")
+
+    Chaque delivery n'est prise que si elle est encore pending_csv,
+    ready_to_send ou failed (filtre de l'update, atomique par document):
+    deux enqueuers concurrents (cron 09h30, micro-batch, envoi manuel,
+    autre process) ne prennent jamais la même delivery. outbox_job_id est
+    posé sur les deliveries prises, relues ensuite par cet id.
+
+    Returns:
+        claimed_ids: deliveries prises par ce job (sous-ensemble de delivery_ids)
+    """
+    now = now_iso()
+    result = await db.deliveries.update_many(
+        {
+            "id": {"$in": delivery_ids},
+            "status": {"$in": SENDABLE_STATUSES}
+        },
+        {"$set": {
+            "status": "sending",
+            "outbox_job_id": outbox_job_id,
+            "updated_at": now
+        }}
+    )
+    
+    claimed = await db.deliveries.find(
+        {"id": {"$in": delivery_ids}, "outbox_job_id": outbox_job_id, "status": "sending"},
+        {"_id": 0, "id": 1}
+    ).to_list(len(delivery_ids))
+    claimed_ids = [d["id"] for d in claimed]
+    
+    if len(claimed_ids) < len(delivery_ids):
+        logger.warning(
+            f"[STATE_MACHINE_BATCH] {len(delivery_ids) - len(claimed_ids)}/{len(delivery_ids)} deliveries "
+            f"non prises (déjà en cours d'envoi ou terminales)"
+        )
+    logger.info(f"[STATE_MACHINE_BATCH] {result.modified_count} deliveries -> sending")
+    
+    return {
+        "deliveries_updated": result.modified_count,
+        "claimed_ids": claimed_ids,
+        "status": "sending"
+    }
+
+
 async def batch_mark_deliveries_failed(
     delivery_ids: List[str],
     error: str
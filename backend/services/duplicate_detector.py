@@ -15,12 +15,21 @@
 ║                                                                              ║
 ║  PROTECTION ANTI DOUBLE-SUBMIT:                                              ║
 ║  - Même session + même phone en < 5 secondes                                 ║
+║                                                                              ║
+║  EMPREINTES DE LIVRAISON (delivery_fingerprints):                            ║
+║  - 1 doc par (phone, produit, client_id), expires_at = livraison + 30j       ║
+║  - Écrit au routing et par la state machine (→ sent)                         ║
+║  - Supprimé si la livraison est rejetée / retirée                            ║
+║  - Index TTL sur expires_at: la fenêtre glisse toute seule                   ║
+║  - Collection vide au démarrage → backfill depuis les leads des 30 jours     ║
+║    (ensure_delivery_fingerprints, server.py)                                 ║
 ╚══════════════════════════════════════════════════════════════════════════════╝
 """
 
 import logging
 from datetime import datetime, timezone, timedelta
-from typing import Optional, Dict, Any, Tuple
+from typing import Optional, Dict, Any, Tuple, List, Set
+from pymongo import UpdateOne
 from config import db
 
 logger = logging.getLogger("duplicate_detector")
@@ -28,6 +37,7 @@ logger = logging.getLogger("duplicate_detector")
 # Configuration
 DOUBLE_SUBMIT_SECONDS = 5
 DUPLICATE_WINDOW_DAYS = 30
+FINGERPRINT_BACKFILL_CHUNK = 1000
 
 
 class DuplicateResult:
@@ -95,6 +105,188 @@ async def check_double_submit(
     return DuplicateResult(is_duplicate=False)
 
 
+async def check_recent_submissions_many(
+    phones: List[str],
+    provider_id: str,
+    window_seconds: int
+) -> Dict[Tuple[str, str], str]:
+    """
+    Version lot de l'anti double-submit (ingestion bulk provider):
+    leads du même provider, mêmes phones, créés dans la fenêtre.
+    1 requête ($in). Retourne {(phone, produit): lead_id original}.
+    """
+    if not phones or not provider_id:
+        return {}
+
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=window_seconds)).isoformat()
+    found: Dict[Tuple[str, str], str] = {}
+    async for doc in db.leads.find(
+        {
+            "phone": {"$in": list(set(phones))},
+            "provider_id": provider_id,
+            "created_at": {"$gte": cutoff}
+        },
+        {"_id": 0, "id": 1, "phone": 1, "produit": 1}
+    ):
+        found.setdefault((doc.get("phone", ""), doc.get("produit", "")), doc.get("id"))
+
+    if found:
+        logger.info(f"[DOUBLE_SUBMIT] {len(found)} resoumission(s) provider {provider_id[:8]}...")
+    return found
+
+
+def _fingerprint_expiry(delivered_at: str) -> datetime:
+    """expires_at (date native, pour l'index TTL) = date de livraison + 30 jours"""
+    dt = datetime.fromisoformat(delivered_at.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt + timedelta(days=DUPLICATE_WINDOW_DAYS)
+
+
+async def record_delivery_fingerprints(entries: List[Dict[str, Any]]) -> int:
+    """
+    Enregistre des empreintes de livraison (upsert par phone+produit+client_id).
+
+    entries: [{phone, produit, client_id, client_name, lead_id, delivered_at}]
+    La livraison la plus récente gagne ($max sur delivered_at / expires_at).
+    """
+    ops = []
+    for e in entries:
+        if not e.get("phone") or not e.get("produit") or not e.get("client_id") or not e.get("delivered_at"):
+            continue
+        ops.append(UpdateOne(
+            {"phone": e["phone"], "produit": e["produit"], "client_id": e["client_id"]},
+            {
+                "$set": {"lead_id": e.get("lead_id"), "client_name": e.get("client_name", "")},
+                "$max": {
+                    "delivered_at": e["delivered_at"],
+                    "expires_at": _fingerprint_expiry(e["delivered_at"]),
+                },
+            },
+            upsert=True
+        ))
+    if not ops:
+        return 0
+
+    try:
+        await db.delivery_fingerprints.bulk_write(ops, ordered=False)
+    except Exception as e:
+        # Fail-open: la livraison est faite, seule l'empreinte manque
+        logger.error(f"[FINGERPRINT] Écriture échouée ({len(ops)} empreintes): {e}")
+        return 0
+    return len(ops)
+
+
+async def record_delivery_fingerprint(
+    phone: str,
+    produit: str,
+    client_id: str,
+    lead_id: str,
+    delivered_at: str,
+    client_name: str = ""
+) -> None:
+    """Enregistre une empreinte de livraison (cf. record_delivery_fingerprints)"""
+    await record_delivery_fingerprints([{
+        "phone": phone, "produit": produit, "client_id": client_id,
+        "client_name": client_name, "lead_id": lead_id, "delivered_at": delivered_at,
+    }])
+
+
+async def remove_delivery_fingerprint(lead_id: str, client_id: str) -> None:
+    """Supprime l'empreinte d'une livraison rejetée / retirée (le lead redevient new)"""
+    if not lead_id or not client_id:
+        return
+    await db.delivery_fingerprints.delete_many({"lead_id": lead_id, "client_id": client_id})
+
+
+def _fingerprint_entries_for_lead(lead: Dict[str, Any], cutoff: str) -> List[Dict[str, Any]]:
+    """0, 1 ou 2 empreintes (nouveau + ancien format) pour un lead"""
+    entries = []
+    base = {"phone": lead.get("phone"), "produit": lead.get("produit"), "lead_id": lead.get("id")}
+
+    if (
+        lead.get("delivery_client_id")
+        and lead.get("status") in ("routed", "livre")
+        and (lead.get("routed_at") or "") >= cutoff
+    ):
+        entries.append({
+            **base,
+            "client_id": lead["delivery_client_id"],
+            "client_name": lead.get("delivery_client_name", ""),
+            "delivered_at": lead["routed_at"],
+        })
+
+    if (
+        lead.get("delivered_to_client_id")
+        and lead.get("status") == "livre"
+        and (lead.get("delivered_at") or "") >= cutoff
+    ):
+        entries.append({
+            **base,
+            "client_id": lead["delivered_to_client_id"],
+            "client_name": lead.get("delivered_to_client_name", ""),
+            "delivered_at": lead["delivered_at"],
+        })
+
+    return entries
+
+
+async def backfill_delivery_fingerprints(chunk_size: int = FINGERPRINT_BACKFILL_CHUNK) -> Dict[str, int]:
+    """
+    Empreintes depuis les leads livrés / routés des 30 derniers jours
+    (ancien format livre/delivered_to_client_id et nouveau format
+    routed/delivery_client_id). Idempotent (upsert, la plus récente gagne).
+
+    Returns:
+        {leads, written}
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=DUPLICATE_WINDOW_DAYS)).isoformat()
+    cursor = db.leads.find(
+        {
+            "phone": {"$exists": True, "$ne": ""},
+            "produit": {"$exists": True, "$ne": ""},
+            "$or": [
+                {"status": {"$in": ["routed", "livre"]}, "routed_at": {"$gte": cutoff}},
+                {"status": "livre", "delivered_at": {"$gte": cutoff}},
+            ]
+        },
+        {
+            "_id": 0, "id": 1, "phone": 1, "produit": 1, "status": 1,
+            "delivery_client_id": 1, "delivery_client_name": 1, "routed_at": 1,
+            "delivered_to_client_id": 1, "delivered_to_client_name": 1, "delivered_at": 1,
+        }
+    )
+
+    report = {"leads": 0, "written": 0}
+    chunk: List[Dict[str, Any]] = []
+    async for lead in cursor:
+        report["leads"] += 1
+        chunk.extend(_fingerprint_entries_for_lead(lead, cutoff))
+        if len(chunk) >= chunk_size:
+            report["written"] += await record_delivery_fingerprints(chunk)
+            chunk = []
+    if chunk:
+        report["written"] += await record_delivery_fingerprints(chunk)
+    return report
+
+
+async def ensure_delivery_fingerprints() -> Optional[Dict[str, int]]:
+    """
+    Démarrage: backfill si delivery_fingerprints est vide (premier
+    déploiement). Sans cela la règle doublon 30 jours ne bloque rien tant
+    que scripts/backfill_delivery_fingerprints.py n'a pas été lancé.
+    """
+    if await db.delivery_fingerprints.count_documents({}, limit=1):
+        return None
+    report = await backfill_delivery_fingerprints()
+    if report["written"]:
+        logger.info(
+            f"[FINGERPRINT] Backfill démarrage: {report['written']} empreintes "
+            f"depuis {report['leads']} leads"
+        )
+    return report
+
+
 async def check_duplicate_30_days(
     phone: str,
     produit: str,
@@ -110,44 +302,23 @@ async def check_duplicate_30_days(
     IMPORTANT: Cette fonction vérifie si le lead peut être envoyé à un client spécifique.
     Un lead peut être doublon pour un client mais pas pour un autre.
     
-    Supporte les deux formats:
-    - Ancien: status=livre, delivered_to_client_id, delivered_at
-    - Nouveau: status=routed, delivery_client_id, routed_at
+    Point lookup sur delivery_fingerprints (index unique phone+produit+client_id).
+    Le filtre expires_at couvre le délai de purge du TTL monitor (~60s).
     """
     if not phone or not produit or not target_client_id:
         return DuplicateResult(is_duplicate=False)
     
-    now = datetime.now(timezone.utc)
-    cutoff = (now - timedelta(days=DUPLICATE_WINDOW_DAYS)).isoformat()
-    
-    # Chercher un lead déjà livré/routé à CE CLIENT avec ce phone+produit dans les 30 jours
-    # Supporte ancien format (livre/delivered_to_client_id) et nouveau (routed/delivery_client_id)
-    existing = await db.leads.find_one({
+    existing = await db.delivery_fingerprints.find_one({
         "phone": phone,
         "produit": produit,
-        "$or": [
-            # Nouveau format (Phase 2)
-            {
-                "delivery_client_id": target_client_id,
-                "status": {"$in": ["routed", "livre"]},
-                "routed_at": {"$gte": cutoff}
-            },
-            # Ancien format (daily_delivery)
-            {
-                "delivered_to_client_id": target_client_id,
-                "status": "livre",
-                "delivered_at": {"$gte": cutoff}
-            }
-        ]
-    }, {"_id": 0, "id": 1, "delivery_client_id": 1, "delivery_client_name": 1, 
-        "delivered_to_client_id": 1, "delivered_to_client_name": 1, 
-        "routed_at": 1, "delivered_at": 1})
+        "client_id": target_client_id,
+        "expires_at": {"$gt": datetime.now(timezone.utc)}
+    }, {"_id": 0, "lead_id": 1, "client_id": 1, "client_name": 1, "delivered_at": 1})
 
     if existing:
-        # Extraire les infos (nouveau ou ancien format)
-        client_id = existing.get("delivery_client_id") or existing.get("delivered_to_client_id")
-        client_name = existing.get("delivery_client_name") or existing.get("delivered_to_client_name")
-        delivery_date = existing.get("routed_at") or existing.get("delivered_at") or ""
+        client_id = existing.get("client_id")
+        client_name = existing.get("client_name")
+        delivery_date = existing.get("delivered_at") or ""
         
         logger.info(
             f"[DOUBLON_30J] phone={phone[-4:]} produit={produit} "
@@ -156,7 +327,7 @@ async def check_duplicate_30_days(
         return DuplicateResult(
             is_duplicate=True,
             duplicate_type="30_days",
-            original_lead_id=existing.get("id"),
+            original_lead_id=existing.get("lead_id"),
             original_client_id=client_id,
             original_client_name=client_name,
             original_delivery_date=delivery_date,
@@ -166,6 +337,92 @@ async def check_duplicate_30_days(
     return DuplicateResult(is_duplicate=False)
 
 
+async def check_duplicate_30_days_many(
+    phone: str,
+    produit: str,
+    client_ids: List[str]
+) -> Set[str]:
+    """
+    Règle doublon 30 jours pour plusieurs clients candidats en 1 requête ($in).
+
+    Returns:
+        set des client_ids pour lesquels (phone, produit) est doublon
+    """
+    if not phone or not produit or not client_ids:
+        return set()
+
+    unique_ids = list({cid for cid in client_ids if cid})
+    docs = await db.delivery_fingerprints.find({
+        "phone": phone,
+        "produit": produit,
+        "client_id": {"$in": unique_ids},
+        "expires_at": {"$gt": datetime.now(timezone.utc)}
+    }, {"_id": 0, "client_id": 1}).to_list(len(unique_ids))
+
+    blocked = {d["client_id"] for d in docs}
+    if blocked:
+        logger.info(
+            f"[DOUBLON_30J] phone={phone[-4:]} produit={produit} "
+            f"bloqué pour {len(blocked)}/{len(unique_ids)} clients"
+        )
+    return blocked
+
+
+async def check_duplicate_30_days_phones(
+    phones: List[str],
+    produit: str,
+    client_id: str
+) -> Set[str]:
+    """
+    Règle doublon 30 jours pour plusieurs téléphones vers UN client (1 requête $in).
+
+    Returns:
+        set des phones déjà livrés à ce client pour ce produit
+    """
+    if not phones or not produit or not client_id:
+        return set()
+
+    unique_phones = list({p for p in phones if p})
+    docs = await db.delivery_fingerprints.find({
+        "phone": {"$in": unique_phones},
+        "produit": produit,
+        "client_id": client_id,
+        "expires_at": {"$gt": datetime.now(timezone.utc)}
+    }, {"_id": 0, "phone": 1}).to_list(len(unique_phones))
+
+    return {d["phone"] for d in docs}
+
+
+async def load_active_fingerprints(
+    phones: List[str],
+    client_ids: List[str],
+    chunk_size: int = 1000
+) -> Set[Tuple[str, str, str]]:
+    """
+    Empreintes actives (< 30 jours) pour un ensemble de téléphones x clients,
+    en 1 curseur par tranche de chunk_size téléphones (run quotidien).
+
+    Returns:
+        set de (phone, produit, client_id) bloqués par la règle doublon 30 jours
+    """
+    unique_phones = sorted({p for p in phones if p})
+    unique_clients = list({cid for cid in client_ids if cid})
+    if not unique_phones or not unique_clients:
+        return set()
+
+    now = datetime.now(timezone.utc)
+    blocked: Set[Tuple[str, str, str]] = set()
+    for start in range(0, len(unique_phones), chunk_size):
+        cursor = db.delivery_fingerprints.find({
+            "phone": {"$in": unique_phones[start:start + chunk_size]},
+            "client_id": {"$in": unique_clients},
+            "expires_at": {"$gt": now}
+        }, {"_id": 0, "phone": 1, "produit": 1, "client_id": 1})
+        async for doc in cursor:
+            blocked.add((doc["phone"], doc["produit"], doc["client_id"]))
+    return blocked
+
+
 async def check_duplicate_for_any_client(
     phone: str,
     produit: str,
@@ -0,0 +1,140 @@
+"""
+RDZ CRM - Cache ingestion (process-local, LRU + TTL)
+
+Résolutions répétées à chaque POST /public/leads:
+- provider par api_key   (db.providers)
+- config formulaire       (settings.forms_config → collection forms legacy)
+
+Résultat absent (clé inconnue / form non configuré) = mis en cache aussi.
+
+INVALIDATION:
+- providers: create / update / delete / rotate-key → invalidate_provider_cache()
+- forms-config (PUT + POST /settings/forms-config) → invalidate_form_config_cache()
+Les autres workers convergent en INGESTION_CACHE_TTL_SECONDS (défaut 30s).
+INGESTION_CACHE_TTL_SECONDS=0 désactive le cache.
+"""
+
+import os
+import copy
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+from config import db
+
+logger = logging.getLogger("ingestion_cache")
+
+INGESTION_CACHE_TTL_SECONDS = float(os.environ.get("INGESTION_CACHE_TTL_SECONDS", "30"))
+INGESTION_CACHE_MAX_SIZE = int(os.environ.get("INGESTION_CACHE_MAX_SIZE", "1024"))
+
+
+class LruTtlCache:
+    """Petit cache LRU borné, entrées expirées après ttl secondes"""
+
+    def __init__(self, name: str, ttl: float, max_size: int):
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """Retourne (found, value)"""
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.stats["misses"] += 1
+            return False, None
+        self._data.move_to_end(key)
+        self.stats["hits"] += 1
+        return True, copy.deepcopy(entry[1])
+
+    def set(self, key: str, value: Any) -> None:
+        if self.ttl <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, copy.deepcopy(value))
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def discard(self, key: str) -> None:
+        if self._data.pop(key, None) is not None:
+            self.stats["invalidations"] += 1
+
+    def discard_where(self, predicate: Callable[[Any], bool]) -> int:
+        """Supprime les entrées dont la valeur satisfait predicate"""
+        keys = [k for k, (_, value) in self._data.items() if predicate(value)]
+        for k in keys:
+            del self._data[k]
+        self.stats["invalidations"] += len(keys)
+        return len(keys)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.stats["invalidations"] += 1
+
+    def snapshot_stats(self) -> Dict:
+        total = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "size": len(self._data),
+            "hit_rate": round(self.stats["hits"] / total * 100, 1) if total > 0 else 0,
+        }
+
+
+_providers = LruTtlCache("providers_by_key", INGESTION_CACHE_TTL_SECONDS, INGESTION_CACHE_MAX_SIZE)
+_forms = LruTtlCache("form_config", INGESTION_CACHE_TTL_SECONDS, INGESTION_CACHE_MAX_SIZE)
+
+
+async def resolve_provider(api_key: str) -> Optional[Dict]:
+    """Provider ACTIF pour cette api_key (None si invalide / inactif)"""
+    found, provider = _providers.get(api_key)
+    if found:
+        return provider
+
+    provider = await db.providers.find_one(
+        {"api_key": api_key, "active": True},
+        {"_id": 0}
+    )
+    _providers.set(api_key, provider)
+    return provider
+
+
+async def resolve_form_config(form_code: str) -> Optional[Dict]:
+    """Config d'un formulaire {entity, produit} (cf. settings.get_form_config)"""
+    from services.settings import get_form_config
+
+    found, config = _forms.get(form_code)
+    if found:
+        return config
+
+    config = await get_form_config(form_code)
+    _forms.set(form_code, config)
+    return config
+
+
+def invalidate_provider_cache(reason: str = "") -> None:
+    """Vide le cache providers du worker courant (clé rotée / désactivée = refusée immédiatement)"""
+    _providers.clear()
+    if reason:
+        logger.debug(f"[INGESTION_CACHE] providers invalidated: {reason}")
+
+
+def invalidate_form_config_cache(reason: str = "") -> None:
+    """Vide le cache forms-config du worker courant"""
+    _forms.clear()
+    if reason:
+        logger.debug(f"[INGESTION_CACHE] forms invalidated: {reason}")
+
+
+def get_ingestion_cache_stats() -> Dict:
+    """Métriques du cache ingestion (pour /system/health)"""
+    return {
+        "enabled": INGESTION_CACHE_TTL_SECONDS > 0,
+        "ttl_seconds": INGESTION_CACHE_TTL_SECONDS,
+        "max_size": INGESTION_CACHE_MAX_SIZE,
+        "providers": _providers.snapshot_stats(),
+        "forms": _forms.snapshot_stats(),
+    }
@@ -12,7 +12,7 @@ not expired, not already reserved/delivered, not duplicate for this client.
 import logging
 from datetime import datetime, timezone, timedelta
 from config import db, now_iso
-from services.duplicate_detector import check_duplicate_30_days
+from services.duplicate_detector import check_duplicate_30_days_phones
 
 logger = logging.getLogger("lb_replacement")
 
@@ -28,7 +28,7 @@ async def try_lb_replacement(
     Try to find and atomically reserve an LB lead compatible with the commande.
 
     Returns:
-        {"found": True, "lead_id": "..."} if replacement found
+        {"found": True, "lead_id": "...", "phone": "...", "produit": "..."} if replacement found
         {"found": False, "reason": "..."} otherwise
 
     ATOMIC: Uses findOneAndUpdate to prevent double-reservation under concurrency.
@@ -66,14 +66,18 @@ async def try_lb_replacement(
     if not candidates:
         return {"found": False, "reason": "no_lb_available"}
 
-    # Try each candidate — check duplicate + atomic reserve
+    # Duplicate check: an LB must not be a 30-day duplicate for this client
+    # (one $in query for all candidate phones)
+    blocked_phones = await check_duplicate_30_days_phones(
+        [c["phone"] for c in candidates], produit, client_id
+    )
+
+    # Try each candidate — atomic reserve
     for candidate in candidates:
         cand_id = candidate["id"]
         cand_phone = candidate["phone"]
 
-        # Duplicate check: this LB must not be a 30-day duplicate for this client
-        dup = await check_duplicate_30_days(cand_phone, produit, client_id)
-        if dup.is_duplicate:
+        if cand_phone in blocked_phones:
             continue
 
         # Atomic reservation: findOneAndUpdate with status filter
@@ -99,6 +103,6 @@ async def try_lb_replacement(
                 f"[LB_REPLACE] Reserved LB={cand_id[:8]}... for client={client_id[:8]}... "
                 f"entity={target_entity} produit={produit}"
             )
-            return {"found": True, "lead_id": cand_id}
+            return {"found": True, "lead_id": cand_id, "phone": cand_phone, "produit": candidate.get("produit", produit)}
 
     return {"found": False, "reason": "all_candidates_duplicate_or_reserved"}
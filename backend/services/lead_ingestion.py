@@ -0,0 +1,447 @@
+"""
+RDZ CRM - Routing + persistance d'un lead ingéré
+
+Partagé par /public/leads, /public/leads/bulk et les workers de la file
+de routing asynchrone (services/routing_queue.py).
+
+1. plan_lead_routing(): routing, overlap guard, remplacement LB.
+   Aucune écriture sur leads/deliveries (seuls le slot de quota et la
+   réservation LB sont posés). Le lead est complété en mémoire avec son
+   état FINAL (status, delivery_*, routing_reason...).
+2. persist_planned_leads(): 1 insert par lead (insert_many en bulk) +
+   deliveries, dans une transaction si Mongo est en replica set.
+   Sans transaction (standalone): deliveries écrites avant les leads, et
+   écritures annulées en cas d'échec (_undo_writes).
+   Lead déjà stocké (mode async "queued"): 1 update au lieu de l'insert.
+   Bulk: persist_planned_chunks() découpe le lot en tranches de
+   BULK_PERSIST_CHUNK leads (1 transaction par tranche, résultat par tranche).
+3. Après commit: empreintes doublon 30j + compteurs LB.
+4. Clients API (RoutingResult.api_endpoint): deliveries mises en file
+   outbox channel "api" (1 job par client/commande) → push en quelques
+   secondes. Sinon (ou échec d'enqueue): pending_csv → cron quotidien.
+
+Échec entre 1 et 3 → slots de quota rendus (release_routing_slot) et lead
+stocké en "new" (store_unrouted_leads) pour la livraison différée.
+"""
+
+import os
+import uuid
+import logging
+from typing import Dict, List, Optional, Tuple
+from pymongo import UpdateOne
+from config import db, now_iso
+from services.routing_engine import route_lead, RoutingResult, reserve_routing_slot, release_routing_slot
+from services.routing_snapshot import note_commande_routed
+from services.commande_counters import inc_commande_counters
+from services.duplicate_detector import record_delivery_fingerprints
+
+logger = logging.getLogger("lead_ingestion")
+
+# auto = transaction si replica set / mongos détecté, off = jamais
+TRANSACTIONS_MODE = os.environ.get("LEAD_INGESTION_TRANSACTIONS", "auto").lower()
+
+# Leads par transaction en bulk (transaction courte, échec limité à la tranche)
+BULK_PERSIST_CHUNK = int(os.environ.get("BULK_PERSIST_CHUNK", "200"))
+
+_transactions_supported: Optional[bool] = None
+
+
+async def _supports_transactions() -> bool:
+    """Détecté une fois par process (hello: setName = replica set, isdbgrid = mongos)"""
+    global _transactions_supported
+    if TRANSACTIONS_MODE == "off":
+        return False
+    if _transactions_supported is None:
+        try:
+            hello = await db.client.admin.command("hello")
+            _transactions_supported = bool(hello.get("setName") or hello.get("msg") == "isdbgrid")
+        except Exception as e:
+            logger.warning(f"[INGESTION] Détection replica set impossible ({e}) - sans transaction")
+            _transactions_supported = False
+        logger.info(f"[INGESTION] transactions={'on' if _transactions_supported else 'off'}")
+    return _transactions_supported
+
+
+async def plan_lead_routing(lead: Dict) -> Dict:
+    """
+    Route un lead "new" (ou "queued") SANS le persister.
+
+    Complète `lead` avec son état final et retourne le plan:
+    {routing_result, delivery (ou None), lb_update (lb_id, fields) ou None,
+     fingerprint (ou None), lb_delivered (bool)}
+    Si un slot est réservé, persist_planned_leads() DOIT suivre
+    (ou release_routing_slot() en cas d'abandon).
+    """
+    lead_id = lead["id"]
+    entity = lead["entity"]
+    produit = lead["produit"]
+    dept = lead["departement"]
+    phone = lead["phone"]
+
+    routing_result = await route_lead(
+        entity=entity,
+        produit=produit,
+        departement=dept,
+        phone=phone,
+        is_lb=False,
+        entity_locked=lead.get("entity_locked", False)
+    )
+
+    plan = {
+        "routing_result": routing_result,
+        "delivery": None,
+        "lb_update": None,
+        "fingerprint": None,
+        "lb_delivered": False,
+    }
+
+    if not routing_result.success:
+        # Pas de commande OPEN
+        reason = routing_result.reason
+        lead["status"] = "duplicate" if "duplicate" in reason else "no_open_orders"
+        lead["routing_reason"] = reason
+        return plan
+
+    try:
+        # Entity de la commande retenue (peut différer du lead en cross-entity)
+        target_entity = routing_result.entity or entity
+
+        # ════════════════════════════════════════════════════════
+        # CLIENT OVERLAP GUARD (fail-open, kill switch, bounded)
+        # Avoid delivering to shared clients if alternative exists
+        # ════════════════════════════════════════════════════════
+        overlap_result = {"is_shared": False, "overlap_active_30d": False,
+                          "client_group_key": "", "fallback": False}
+        try:
+            from services.overlap_guard import check_overlap_and_find_alternative, is_guard_enabled
+            if await is_guard_enabled():
+                overlap_result = await check_overlap_and_find_alternative(
+                    selected_client_id=routing_result.client_id,
+                    selected_commande_id=routing_result.commande_id,
+                    entity=target_entity,
+                    produit=produit,
+                    departement=dept,
+                    phone=phone,
+                )
+                if overlap_result.get("alternative_found"):
+                    # Switch to alternative (si son slot de quota est réservable)
+                    alternative = RoutingResult(
+                        success=True,
+                        client_id=overlap_result["alternative_client_id"],
+                        client_name=overlap_result["alternative_client_name"],
+                        commande_id=overlap_result["alternative_commande_id"],
+                        is_lb=routing_result.is_lb,
+                        reason="overlap_alternative",
+                        routing_mode=routing_result.routing_mode,
+                        entity=target_entity,
+                        api_endpoint=overlap_result.get("alternative_api_endpoint"),
+                    )
+                    if await reserve_routing_slot(
+                        alternative,
+                        overlap_result.get("alternative_quota_semaine", 0),
+                        target_entity, produit
+                    ):
+                        await release_routing_slot(routing_result)
+                        routing_result = alternative
+                        plan["routing_result"] = alternative
+                        logger.info(
+                            f"[OVERLAP] Switched to alternative: {overlap_result['alternative_client_name']}"
+                        )
+                    else:
+                        overlap_result["fallback"] = True
+        except Exception as e:
+            logger.error(f"[OVERLAP] Guard failed (fail-open): {e}")
+
+        # ════════════════════════════════════════════════════════
+        # SUSPICIOUS LB REPLACEMENT HOOK
+        # If suspicious + internal_lp → try to deliver an LB instead
+        # ════════════════════════════════════════════════════════
+        lead_updates: Dict = {}
+        actual_lead_id = lead_id
+        fp_phone, fp_produit = phone, produit
+        was_replaced = False
+
+        if lead.get("phone_quality") == "suspicious" and lead.get("lead_source_type") == "internal_lp":
+            from services.lb_replacement import try_lb_replacement
+            lb_result = await try_lb_replacement(
+                commande_id=routing_result.commande_id,
+                target_entity=target_entity,
+                produit=produit,
+                client_id=routing_result.client_id,
+                exclude_lead_id=lead_id,
+            )
+            if lb_result.get("found"):
+                actual_lead_id = lb_result["lead_id"]
+                fp_phone, fp_produit = lb_result.get("phone", ""), lb_result.get("produit", produit)
+                was_replaced = True
+                # Original suspicious lead: stocké directement en replaced_by_lb
+                lead_updates.update({
+                    "was_replaced": True,
+                    "replacement_source": "LB",
+                    "replacement_lead_id": actual_lead_id,
+                    "status": "replaced_by_lb",
+                    "updated_at": now_iso(),
+                })
+                logger.info(
+                    f"[LB_REPLACE] suspicious={lead_id[:8]}... replaced by LB={actual_lead_id[:8]}... "
+                    f"commande={routing_result.commande_id[:8]}..."
+                )
+            else:
+                # No LB available → deliver suspicious normally
+                lead_updates["was_replaced"] = False
+
+        # Delivery record (for actual_lead_id — LB or original)
+        delivery_id = str(uuid.uuid4())
+        delivery = {
+            "id": delivery_id,
+            "lead_id": actual_lead_id,
+            "client_id": routing_result.client_id,
+            "client_name": routing_result.client_name,
+            "commande_id": routing_result.commande_id,
+            "entity": target_entity,
+            "produit": produit,
+            "delivery_method": "realtime",
+            "status": "pending_csv",
+            "is_lb": was_replaced,
+            "routing_mode": routing_result.routing_mode,
+            "client_group_key": overlap_result.get("client_group_key", ""),
+            "is_shared_client_30d": overlap_result.get("overlap_active_30d", False),
+            "overlap_fallback_delivery": overlap_result.get("fallback", False),
+            "created_at": now_iso(),
+        }
+        if was_replaced:
+            delivery["replaced_suspicious_id"] = lead_id
+
+        # Champs du lead réellement livré (LB ou original)
+        routed_at = now_iso()
+        routed_fields = {
+            "status": "routed",
+            "delivery_id": delivery_id,
+            "delivery_client_id": routing_result.client_id,
+            "delivery_client_name": routing_result.client_name,
+            "delivery_commande_id": routing_result.commande_id,
+            "routing_mode": routing_result.routing_mode,
+            "routed_at": routed_at
+        }
+        if was_replaced:
+            plan["lb_update"] = (actual_lead_id, routed_fields)
+        else:
+            lead_updates.update(routed_fields)
+
+        plan["delivery"] = delivery
+        plan["lb_delivered"] = was_replaced
+        plan["fingerprint"] = {
+            "phone": fp_phone,
+            "produit": fp_produit,
+            "client_id": routing_result.client_id,
+            "client_name": routing_result.client_name,
+            "lead_id": actual_lead_id,
+            "delivered_at": routed_at,
+        }
+    except Exception:
+        # Slot de quota réservé par route_lead → le rendre
+        await release_routing_slot(routing_result)
+        raise
+
+    # Quota consommé localement (les leads suivants voient le snapshot à jour)
+    note_commande_routed(target_entity, produit, routing_result.commande_id, was_replaced)
+    lead.update(lead_updates)
+    return plan
+
+
+async def persist_planned_leads(
+    items: List[Tuple[Dict, Optional[Dict]]],
+    inserted: bool = False
+) -> None:
+    """
+    Persiste des leads dans leur état final + leurs deliveries.
+
+    items: [(lead, plan ou None)] — plan None = lead non routé (invalid, queued...)
+    inserted: True si les leads sont déjà en base (mode async) → update au lieu d'insert
+    """
+    leads = [lead for lead, _ in items]
+    plans = [plan for _, plan in items if plan]
+    deliveries = [plan["delivery"] for plan in plans if plan["delivery"]]
+    lb_updates = [plan["lb_update"] for plan in plans if plan["lb_update"]]
+
+    async def _write(session=None, undo: Optional[List[Tuple[str, object]]] = None):
+        # Ordre: deliveries → LB → leads. Un lead n'est visible "routed" qu'une
+        # fois sa delivery écrite. Hors transaction, chaque écriture est notée
+        # dans `undo` (avant l'appel: un insert_many peut échouer en partie).
+        if undo is not None:
+            undo.append(("deliveries", [d["id"] for d in deliveries]))
+        if len(deliveries) == 1:
+            await db.deliveries.insert_one(dict(deliveries[0]), session=session)
+        elif deliveries:
+            await db.deliveries.insert_many([dict(d) for d in deliveries], ordered=True, session=session)
+
+        for lb_id, fields in lb_updates:
+            before = await db.leads.find_one_and_update({"id": lb_id}, {"$set": fields}, session=session)
+            if undo is not None and before:
+                undo.append(("restore", before))
+
+        if inserted:
+            for lead in leads:
+                fields = {k: v for k, v in lead.items() if k not in ("_id", "id")}
+                before = await db.leads.find_one_and_update(
+                    {"id": lead["id"], "status": "queued"}, {"$set": fields}, session=session
+                )
+                if before is None:
+                    # Routé entre-temps par un autre worker (bail expiré)
+                    raise RuntimeError(f"lead {lead['id'][:8]}... n'est plus en file")
+                if undo is not None:
+                    undo.append(("restore", before))
+        else:
+            if undo is not None:
+                undo.append(("leads", [lead["id"] for lead in leads]))
+            if len(leads) == 1:
+                await db.leads.insert_one(dict(leads[0]), session=session)
+            elif leads:
+                await db.leads.insert_many([dict(lead) for lead in leads], ordered=True, session=session)
+
+    try:
+        if (deliveries or lb_updates) and await _supports_transactions():
+            async with await db.client.start_session() as session:
+                await session.with_transaction(_write)
+        else:
+            undo: List[Tuple[str, object]] = []
+            try:
+                await _write(undo=undo)
+            except Exception:
+                await _undo_writes(undo)
+                raise
+    except Exception:
+        for plan in plans:
+            await release_routing_slot(plan["routing_result"])
+        raise
+
+    # Après commit: empreintes doublon 30j (phone du lead réellement livré)
+    fingerprints = [plan["fingerprint"] for plan in plans if plan["fingerprint"]]
+    if fingerprints:
+        await record_delivery_fingerprints(fingerprints)
+
+    for plan in plans:
+        if plan["lb_delivered"]:
+            # Slot réservé en non-LB: le lead livré est finalement un LB
+            await inc_commande_counters(plan["routing_result"].commande_id, lb_delivered=1)
+
+    await dispatch_api_deliveries(plans)
+
+
+async def _undo_writes(undo: List[Tuple[str, object]]) -> None:
+    """
+    Annule les écritures de persist_planned_leads hors transaction (ordre inverse):
+    deliveries et leads insérés supprimés (l'appelant les restocke en "new" via
+    store_unrouted_leads), leads mis à jour (LB, "queued") restaurés à l'identique.
+    """
+    for kind, payload in reversed(undo):
+        try:
+            if kind == "deliveries" and payload:
+                await db.deliveries.delete_many({"id": {"$in": payload}})
+            elif kind == "leads" and payload:
+                await db.leads.delete_many({"id": {"$in": payload}})
+            elif kind == "restore":
+                await db.leads.replace_one({"id": payload["id"]}, payload)
+        except Exception as e:
+            logger.error(f"[INGESTION] Annulation {kind} impossible: {e}")
+
+
+async def persist_planned_chunks(
+    items: List[Tuple[Dict, Optional[Dict]]],
+    pristine: List[Dict],
+    chunk_size: Optional[int] = None
+) -> List[Dict]:
+    """
+    Persistance bulk par tranches (1 transaction par tranche).
+
+    pristine: leads tels qu'à l'ingestion, alignés sur items. Une tranche en
+    échec a ses slots rendus (persist_planned_leads) et ses leads stockés en
+    "new" (store_unrouted_leads); les tranches suivantes sont persistées.
+
+    Returns:
+        [{chunk, start, count, persisted, error?}] dans l'ordre du lot
+    """
+    size = max(1, chunk_size or BULK_PERSIST_CHUNK)
+    reports = []
+    for start in range(0, len(items), size):
+        chunk = items[start:start + size]
+        report = {"chunk": start // size, "start": start, "count": len(chunk), "persisted": True}
+        try:
+            await persist_planned_leads(chunk)
+        except Exception as e:
+            logger.error(f"[INGESTION] Tranche {report['chunk']} ({len(chunk)} leads) non persistée: {e}")
+            await store_unrouted_leads(pristine[start:start + size])
+            report.update(persisted=False, error=str(e))
+        reports.append(report)
+    return reports
+
+
+async def dispatch_api_deliveries(plans: List[Dict]) -> None:
+    """Met en file le push API des deliveries de clients API (micro-batch par commande)"""
+    groups: Dict[Tuple, List[Dict]] = {}
+    for plan in plans:
+        routing_result = plan["routing_result"]
+        if plan["delivery"] and routing_result.api_endpoint:
+            key = (routing_result.client_id, routing_result.commande_id)
+            groups.setdefault(key, []).append(plan)
+    if not groups:
+        return
+
+    from services.settings import get_simulation_email_override
+    if await get_simulation_email_override():
+        # Mode simulation: aucun push vers un client réel (CSV de simulation au cron)
+        return
+
+    from services.outbox import enqueue_api_push
+    for group in groups.values():
+        first = group[0]["routing_result"]
+        deliveries = [plan["delivery"] for plan in group]
+        try:
+            await enqueue_api_push(
+                entity=deliveries[0]["entity"],
+                client_id=first.client_id,
+                client_name=first.client_name,
+                commande_id=first.commande_id,
+                produit=deliveries[0]["produit"],
+                delivery_ids=[d["id"] for d in deliveries],
+                lead_ids=[d["lead_id"] for d in deliveries],
+                endpoint=first.api_endpoint,
+                lb_count=sum(1 for d in deliveries if d.get("is_lb")),
+                source="realtime",
+            )
+        except Exception as e:
+            # Fail-open: deliveries restent pending_csv (cron quotidien)
+            logger.error(f"[INGESTION] Push API non mis en file ({first.client_name}): {e}")
+
+
+async def store_unrouted_leads(leads: List[Dict]) -> None:
+    """
+    Filet de sécurité après un échec de routing / persistance: le lead est
+    stocké tel qu'à l'ingestion (statut "new") s'il n'est pas déjà en base.
+    """
+    if not leads:
+        return
+    await db.leads.bulk_write(
+        [UpdateOne({"id": lead["id"]}, {"$setOnInsert": lead}, upsert=True) for lead in leads],
+        ordered=False
+    )
+
+
+async def route_and_persist_lead(
+    lead: Dict,
+    inserted: bool = False
+) -> Tuple[Optional[RoutingResult], Optional[str]]:
+    """
+    Routing + persistance d'un lead routable (1 insert lead + 1 insert delivery).
+    Retourne (routing_result, delivery_id).
+    """
+    pristine = dict(lead)
+    try:
+        plan = await plan_lead_routing(lead)
+        await persist_planned_leads([(lead, plan)], inserted=inserted)
+    except Exception:
+        if not inserted:
+            await store_unrouted_leads([pristine])
+        raise
+    delivery = plan["delivery"]
+    return plan["routing_result"], delivery["id"] if delivery else None
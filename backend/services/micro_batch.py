@@ -0,0 +1,261 @@
+"""
+RDZ CRM - Micro-batchs intraday des deliveries pending_csv
+
+Sans ce module, les deliveries du routing immédiat (pending_csv) attendent
+le run de 09h30: jusqu'à 24h de délai, et tout le CSV / SMTP / state
+machine de la journée concentré sur un seul run.
+
+Mode opt-in (MICRO_BATCH_ENABLED=true, entités MICRO_BATCH_ENTITIES):
+toutes les MICRO_BATCH_POLL_SECONDS, les deliveries pending_csv sont
+groupées par (entité, client) (1 aggregate) et le lot d'un client est
+envoyé dès que:
+  - la plus ancienne attend depuis >= intervalle (minutes), ou
+  - le lot atteint le seuil de taille
+Défauts: MICRO_BATCH_INTERVAL_MINUTES / MICRO_BATCH_SIZE_THRESHOLD,
+surchargeables par client (micro_batch_interval_minutes / micro_batch_size).
+
+Envoi via process_pending_csv_deliveries(client_ids=...) → mêmes règles que
+le run quotidien (client livrable, outbox, state machine), source "micro_batch".
+
+JAMAIS de micro-batch:
+  - entité en jour OFF (calendrier) → deliveries restent pending_csv
+  - client auto_send_enabled=false → lot du jour en ready_to_send au run 09h30
+  - client introuvable → traité (erreur) par le run 09h30
+
+MULTI-PROCESS: un seul process à la fois fait les cycles (bail
+MICRO_BATCH_LEASE_SECONDS dans scheduler_leases, repris à expiration).
+Le bail ne couvre pas le cron 09h30 ni les envois manuels: un cycle peut
+lire les mêmes deliveries qu'eux, le claim atomique de l'outbox n'en
+met chacune que dans un seul job.
+"""
+
+import os
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional
+from pymongo.errors import DuplicateKeyError
+from config import db, now_iso
+
+logger = logging.getLogger("micro_batch")
+
+MICRO_BATCH_ENABLED = os.environ.get("MICRO_BATCH_ENABLED", "false").lower() in ("1", "true", "yes")
+MICRO_BATCH_ENTITIES = [
+    e.strip().upper() for e in os.environ.get("MICRO_BATCH_ENTITIES", "ZR7,MDL").split(",") if e.strip()
+]
+MICRO_BATCH_INTERVAL_MINUTES = int(os.environ.get("MICRO_BATCH_INTERVAL_MINUTES", "30"))
+MICRO_BATCH_SIZE_THRESHOLD = int(os.environ.get("MICRO_BATCH_SIZE_THRESHOLD", "50"))
+MICRO_BATCH_POLL_SECONDS = int(os.environ.get("MICRO_BATCH_POLL_SECONDS", "60"))
+MICRO_BATCH_LEASE_SECONDS = int(os.environ.get("MICRO_BATCH_LEASE_SECONDS", "300"))
+
+LEASE_ID = "micro_batch"
+
+_task: Optional[asyncio.Task] = None
+_wakeup: Optional[asyncio.Event] = None
+_stopping = False
+_owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+_stats = {
+    "cycles": 0,
+    "flushes": 0,
+    "flushed_by_size": 0,
+    "flushed_by_interval": 0,
+    "leads_queued": 0,
+    "skipped_calendar": 0,
+    "skipped_manual": 0,
+    "errors": 0,
+    "last_cycle_at": None,
+}
+
+
+def flush_reason(count: int, oldest_created_at: Optional[str], client: Dict, now: datetime) -> Optional[str]:
+    """
+    "size" | "interval" | None pour le lot pending_csv d'un client
+    (réglages du client, sinon défauts MICRO_BATCH_*)
+    """
+    size_threshold = client.get("micro_batch_size") or MICRO_BATCH_SIZE_THRESHOLD
+    interval_minutes = client.get("micro_batch_interval_minutes") or MICRO_BATCH_INTERVAL_MINUTES
+
+    if size_threshold > 0 and count >= size_threshold:
+        return "size"
+    if oldest_created_at and interval_minutes > 0:
+        oldest = datetime.fromisoformat(oldest_created_at)
+        if now - oldest >= timedelta(minutes=interval_minutes):
+            return "interval"
+    return None
+
+
+async def load_pending_groups(entities: List[str]) -> List[Dict]:
+    """Lots pending_csv par (entité, client): taille + plus ancienne delivery"""
+    groups = await db.deliveries.aggregate([
+        {"$match": {"status": "pending_csv", "entity": {"$in": entities}}},
+        {"$group": {
+            "_id": {"entity": "$entity", "client_id": "$client_id"},
+            "count": {"$sum": 1},
+            "oldest_created_at": {"$min": "$created_at"},
+        }},
+    ]).to_list(None)
+    return [
+        {
+            "entity": g["_id"]["entity"],
+            "client_id": g["_id"]["client_id"],
+            "count": g["count"],
+            "oldest_created_at": g.get("oldest_created_at"),
+        }
+        for g in groups
+    ]
+
+
+async def load_clients(client_ids: List[str]) -> Dict[str, Dict]:
+    clients = await db.clients.find(
+        {"id": {"$in": client_ids}},
+        {"_id": 0, "id": 1, "auto_send_enabled": 1, "micro_batch_interval_minutes": 1, "micro_batch_size": 1}
+    ).to_list(None)
+    return {c["id"]: c for c in clients}
+
+
+async def run_micro_batch_cycle(now: Optional[datetime] = None) -> Dict:
+    """
+    1 cycle: lots dus (taille / intervalle) → process_pending_csv_deliveries
+
+    Returns:
+        {"due": {client_id: reason}, "skipped_calendar", "skipped_manual", "flush": résultat | None}
+    """
+    from services.settings import is_delivery_day_enabled
+    from services.daily_delivery import process_pending_csv_deliveries
+
+    now = now or datetime.now(timezone.utc)
+    cycle = {"due": {}, "skipped_calendar": 0, "skipped_manual": 0, "flush": None}
+
+    groups = await load_pending_groups(MICRO_BATCH_ENTITIES)
+    if not groups:
+        return cycle
+
+    # Calendrier: entité OFF → ses lots restent pending_csv
+    open_entities = set()
+    for entity in {g["entity"] for g in groups}:
+        day_enabled, _ = await is_delivery_day_enabled(entity, now)
+        if day_enabled:
+            open_entities.add(entity)
+
+    clients = await load_clients(sorted({g["client_id"] for g in groups if g["entity"] in open_entities}))
+
+    for group in groups:
+        if group["entity"] not in open_entities:
+            cycle["skipped_calendar"] += group["count"]
+            continue
+        client = clients.get(group["client_id"])
+        if not client:
+            continue
+        if not client.get("auto_send_enabled", True):
+            cycle["skipped_manual"] += group["count"]
+            continue
+        reason = flush_reason(group["count"], group["oldest_created_at"], client, now)
+        if reason:
+            cycle["due"][group["client_id"]] = reason
+
+    if cycle["due"]:
+        cycle["flush"] = await process_pending_csv_deliveries(
+            client_ids=list(cycle["due"]), source="micro_batch"
+        )
+        logger.info(
+            f"[MICRO_BATCH] {len(cycle['due'])} clients → {cycle['flush']['queued']} leads en file "
+            f"(taille={sum(1 for r in cycle['due'].values() if r == 'size')}, "
+            f"intervalle={sum(1 for r in cycle['due'].values() if r == 'interval')})"
+        )
+    return cycle
+
+
+async def _acquire_lease() -> bool:
+    """Bail partagé entre process: un seul fait les cycles"""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.scheduler_leases.update_one(
+            {"_id": LEASE_ID, "$or": [{"owner": _owner}, {"lease_until": {"$lt": now.isoformat()}}]},
+            {"$set": {
+                "owner": _owner,
+                "lease_until": (now + timedelta(seconds=MICRO_BATCH_LEASE_SECONDS)).isoformat(),
+                "renewed_at": now_iso(),
+            }},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False  # bail actif d'un autre process
+    return True
+
+
+def _record(cycle: Dict) -> None:
+    _stats["cycles"] += 1
+    _stats["last_cycle_at"] = now_iso()
+    _stats["skipped_calendar"] += cycle["skipped_calendar"]
+    _stats["skipped_manual"] += cycle["skipped_manual"]
+    if cycle["flush"]:
+        _stats["flushes"] += 1
+        _stats["leads_queued"] += cycle["flush"]["queued"]
+        _stats["errors"] += len(cycle["flush"]["errors"])
+    for reason in cycle["due"].values():
+        _stats[f"flushed_by_{reason}"] += 1
+
+
+async def _loop() -> None:
+    while not _stopping:
+        try:
+            if await _acquire_lease():
+                _record(await run_micro_batch_cycle())
+        except Exception as e:
+            _stats["errors"] += 1
+            logger.error(f"[MICRO_BATCH] Cycle échoué: {e}")
+
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), MICRO_BATCH_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+def _is_running() -> bool:
+    return _task is not None and not _task.done() and not _stopping
+
+
+def start_micro_batch() -> None:
+    """Démarre la boucle (lifespan) si MICRO_BATCH_ENABLED"""
+    global _task, _wakeup, _stopping
+    if not MICRO_BATCH_ENABLED or _is_running() or not MICRO_BATCH_ENTITIES:
+        return
+    _stopping = False
+    _wakeup = asyncio.Event()
+    _task = asyncio.create_task(_loop())
+    logger.info(
+        f"[MICRO_BATCH] started entities={MICRO_BATCH_ENTITIES} interval={MICRO_BATCH_INTERVAL_MINUTES}min "
+        f"size={MICRO_BATCH_SIZE_THRESHOLD} poll={MICRO_BATCH_POLL_SECONDS}s"
+    )
+
+
+async def stop_micro_batch() -> None:
+    """Arrête la boucle après le cycle en cours (les lots restent pending_csv)"""
+    global _task, _stopping
+    if _task is None:
+        return
+    _stopping = True
+    if _wakeup is not None:
+        _wakeup.set()
+    await asyncio.gather(_task, return_exceptions=True)
+    _task = None
+    try:
+        # Bail libéré: un autre process reprend sans attendre l'expiration
+        await db.scheduler_leases.delete_one({"_id": LEASE_ID, "owner": _owner})
+    except Exception as e:
+        logger.warning(f"[MICRO_BATCH] Libération du bail: {e}")
+    logger.info("[MICRO_BATCH] stopped")
+
+
+def get_micro_batch_stats() -> Dict:
+    """Métriques de la boucle locale (pour /system/health)"""
+    return {
+        **_stats,
+        "enabled": MICRO_BATCH_ENABLED,
+        "running": _is_running(),
+        "entities": MICRO_BATCH_ENTITIES,
+        "interval_minutes": MICRO_BATCH_INTERVAL_MINUTES,
+        "size_threshold": MICRO_BATCH_SIZE_THRESHOLD,
+    }
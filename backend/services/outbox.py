@@ -0,0 +1,633 @@
+"""
+RDZ CRM - Outbox des livraisons clients (envoi durable, hors requêtes)
+
+Collection: outbox
+  1 job = 1 envoi d'un batch de deliveries vers un client:
+  {
+    id, channel ("email" | "api"), source ("daily" | "pending_csv" | "micro_batch" | "realtime"),
+    status,            # pending → sent | dead
+    entity, client_id, client_name, commande_id, produit,
+    delivery_ids, lead_ids, to_emails, recipient_domains,
+    csv_file_id, csv_filename,   # channel email (CSV dans delivery_files)
+    endpoint,                    # channel api (services/api_push.py)
+    lead_count, lb_count, batch_id,
+    attempts, max_attempts, next_attempt_at, lease_until, last_error
+  }
+
+ENQUEUE (cron quotidien, deliveries pending_csv en auto_send, routing
+temps réel des clients API):
+  deliveries → "sending" par claim atomique (state machine, outbox_job_id
+  posé sur les deliveries prises): un job ne porte que les deliveries
+  qu'il a prises, aucun job si toutes sont déjà en file ailleurs (autre
+  enqueuer / process). leads.outbox_job_id posé (les leads en cours
+  d'envoi ne sont plus proposés à l'allocation).
+  Leads pas encore attribués (run quotidien): delivered réservé dans
+  commande_week_counters dès la mise en file (reserve_delivery_counters),
+  rendu si le job part en dead-letter.
+
+WORKERS (OUTBOX_WORKERS par process): claim atomique (bail
+OUTBOX_LEASE_SECONDS) du job dû le plus ancien, puis:
+  - succès → batch_mark_deliveries_sent (deliveries sent, leads livre)
+  - échec  → nouvelle tentative après backoff exponentiel
+             (OUTBOX_BACKOFF_BASE_SECONDS * 2^(n-1), max OUTBOX_BACKOFF_MAX_SECONDS)
+             échec non réessayable (ex: HTTP 4xx) → "dead" directement
+  - report (circuit API ouvert) → job redaté sans consommer de tentative
+  - OUTBOX_MAX_ATTEMPTS échecs → "dead" + batch_mark_deliveries_failed.
+    Relance manuelle: requeue_dead_job() (POST /deliveries/outbox/{id}/requeue)
+
+RATE LIMIT: OUTBOX_DOMAIN_RATE_PER_MINUTE envois max par domaine
+destinataire / hôte d'endpoint API (fenêtre glissante, par process). Domaine saturé → job
+reporté sans consommer de tentative.
+"""
+
+import os
+import uuid
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timezone, timedelta
+from time import monotonic
+from typing import Deque, Dict, List, Optional
+from pymongo import ReturnDocument
+from config import db, now_iso
+
+logger = logging.getLogger("outbox")
+
+PENDING_STATUS = "pending"
+SENT_STATUS = "sent"
+DEAD_STATUS = "dead"
+
+OUTBOX_WORKERS = int(os.environ.get("OUTBOX_WORKERS", "2"))
+OUTBOX_POLL_MS = int(os.environ.get("OUTBOX_POLL_MS", "1000"))
+OUTBOX_LEASE_SECONDS = int(os.environ.get("OUTBOX_LEASE_SECONDS", "120"))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "6"))
+OUTBOX_BACKOFF_BASE_SECONDS = int(os.environ.get("OUTBOX_BACKOFF_BASE_SECONDS", "60"))
+OUTBOX_BACKOFF_MAX_SECONDS = int(os.environ.get("OUTBOX_BACKOFF_MAX_SECONDS", "3600"))
+OUTBOX_DOMAIN_RATE_PER_MINUTE = int(os.environ.get("OUTBOX_DOMAIN_RATE_PER_MINUTE", "20"))
+
+_workers: List[asyncio.Task] = []
+_wakeup: Optional[asyncio.Event] = None
+_stopping = False
+# domaine -> instants (monotonic) des envois de la dernière minute
+_domain_sends: Dict[str, Deque[float]] = {}
+_stats = {
+    "enqueued": 0,
+    "sent": 0,
+    "retried": 0,
+    "dead_lettered": 0,
+    "rate_limited": 0,
+    "deferred": 0,
+    "errors": 0,
+    "claim_conflicts": 0,
+}
+
+
+def recipient_domains(emails: List[str]) -> List[str]:
+    return sorted({e.rsplit("@", 1)[-1].strip().lower() for e in emails if e and "@" in e})
+
+
+def backoff_seconds(attempts: int) -> int:
+    """Délai avant la tentative suivante (attempts = échecs déjà subis, >= 1)"""
+    return min(OUTBOX_BACKOFF_BASE_SECONDS * 2 ** max(attempts - 1, 0), OUTBOX_BACKOFF_MAX_SECONDS)
+
+
+def _reserve_domain_slots(domains: List[str]) -> float:
+    """
+    Réserve 1 envoi par domaine si aucun n'est saturé.
+    Retourne 0 (réservé) ou le nombre de secondes avant libération d'un slot.
+    """
+    if OUTBOX_DOMAIN_RATE_PER_MINUTE <= 0:
+        return 0
+    now = monotonic()
+    wait = 0.0
+    for domain in domains:
+        sends = _domain_sends.setdefault(domain, deque())
+        while sends and now - sends[0] >= 60:
+            sends.popleft()
+        if len(sends) >= OUTBOX_DOMAIN_RATE_PER_MINUTE:
+            wait = max(wait, 60 - (now - sends[0]))
+    if wait > 0:
+        return wait
+    for domain in domains:
+        _domain_sends[domain].append(now)
+    return 0
+
+
+def _is_running() -> bool:
+    return bool(_workers) and not _stopping and any(not w.done() for w in _workers)
+
+
+def _notify() -> None:
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def _enqueue(
+    job_fields: Dict,
+    delivery_ids: List[str],
+    lead_ids: List[str],
+    claimed_by: Optional[str] = None
+) -> Optional[Dict]:
+    """
+    Met en file un job. Les deliveries passent en "sending" par claim
+    atomique (batch_mark_deliveries_sending): le job ne porte que les
+    deliveries effectivement prises. delivery_ids / lead_ids alignés.
+
+    claimed_by: deliveries créées déjà prises (status "sending",
+    outbox_job_id = claimed_by, run quotidien): id du job, pas de claim.
+
+    Returns:
+        job, ou None si aucune delivery n'a pu être prise (déjà en file
+        par un autre enqueuer / process)
+    """
+    from services.delivery_state_machine import (
+        batch_mark_deliveries_sending, batch_mark_deliveries_failed,
+        reserve_delivery_counters, release_reserved_counters
+    )
+
+    if claimed_by:
+        job_id, claimed = claimed_by, set(delivery_ids)
+    else:
+        job_id = str(uuid.uuid4())
+        claim = await batch_mark_deliveries_sending(delivery_ids, outbox_job_id=job_id)
+        claimed = set(claim["claimed_ids"])
+    if not claimed:
+        _stats["claim_conflicts"] += 1
+        logger.warning(
+            f"[OUTBOX] job non créé: 0/{len(delivery_ids)} deliveries disponibles "
+            f"(client={job_fields.get('client_name')}, source={job_fields.get('source')})"
+        )
+        return None
+    if len(claimed) < len(delivery_ids):
+        # Batch pris en partie par un autre enqueuer: job restreint aux deliveries prises
+        _stats["claim_conflicts"] += 1
+        pairs = [(d, l) for d, l in zip(delivery_ids, lead_ids) if d in claimed]
+        delivery_ids, lead_ids = [d for d, _ in pairs], [l for _, l in pairs]
+        if job_fields.get("channel") == "email":
+            job_fields = await _restrict_csv(job_fields, delivery_ids, lead_ids)
+
+    if job_fields.get("source") != "realtime":
+        # Temps réel: leads déjà comptés au routing (reserve_commande_slot)
+        await reserve_delivery_counters(delivery_ids)
+
+    now = now_iso()
+    job = {
+        "id": job_id,
+        "status": PENDING_STATUS,
+        **job_fields,
+        "delivery_ids": delivery_ids,
+        "lead_ids": lead_ids,
+        "lead_count": len(lead_ids),
+        "batch_id": job_fields.get("batch_id") or str(uuid.uuid4()),
+        "attempts": 0,
+        "max_attempts": OUTBOX_MAX_ATTEMPTS,
+        "next_attempt_at": now,
+        "last_error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+    try:
+        await db.outbox.insert_one(dict(job))
+    except Exception as e:
+        await batch_mark_deliveries_failed(delivery_ids=delivery_ids, error=f"outbox_enqueue_failed: {e}")
+        await release_reserved_counters(delivery_ids)
+        raise
+
+    await db.leads.update_many({"id": {"$in": lead_ids}}, {"$set": {"outbox_job_id": job["id"]}})
+    _stats["enqueued"] += 1
+    _notify()
+    logger.info(
+        f"[OUTBOX] enqueued job={job['id'][:8]}... channel={job['channel']} source={job['source']} "
+        f"client={job['client_name']} leads={len(lead_ids)} to={_recipients(job)}"
+    )
+    return job
+
+
+async def _restrict_csv(job_fields: Dict, delivery_ids: List[str], lead_ids: List[str]) -> Dict:
+    """CSV régénéré pour les seuls leads pris (claim partiel), référencé sur leurs deliveries et le job"""
+    from services.csv_delivery import generate_csv_content
+    from services.delivery_files import store_csv
+
+    by_id = {
+        lead["id"]: lead
+        async for lead in db.leads.find({"id": {"$in": lead_ids}}, {"_id": 0})
+    }
+    leads = [by_id[lead_id] for lead_id in lead_ids if lead_id in by_id]
+    csv_content = generate_csv_content(leads, job_fields.get("produit", ""), job_fields.get("entity", ""))
+    csv_file_id = await store_csv(csv_content)
+    await db.deliveries.update_many({"id": {"$in": delivery_ids}}, {"$set": {"csv_file_id": csv_file_id}})
+    return {
+        **job_fields,
+        "csv_file_id": csv_file_id,
+        "lb_count": sum(1 for lead in leads if lead.get("is_lb")),
+    }
+
+
+async def enqueue_csv_email(
+    entity: str,
+    client_id: str,
+    client_name: str,
+    commande_id: str,
+    produit: str,
+    delivery_ids: List[str],
+    lead_ids: List[str],
+    to_emails: List[str],
+    csv_file_id: str,
+    csv_filename: str,
+    lb_count: int,
+    source: str,
+    batch_id: Optional[str] = None,
+    claimed_by: Optional[str] = None
+) -> Optional[Dict]:
+    """
+    Met en file l'envoi d'un CSV par email (None: deliveries déjà prises ailleurs).
+    Le job référence le CSV (csv_file_id, delivery_files), chargé à l'envoi.
+    """
+    return await _enqueue({
+        "channel": "email",
+        "source": source,
+        "entity": entity,
+        "client_id": client_id,
+        "client_name": client_name,
+        "commande_id": commande_id,
+        "produit": produit,
+        "to_emails": to_emails,
+        "recipient_domains": recipient_domains(to_emails),
+        "csv_file_id": csv_file_id,
+        "csv_filename": csv_filename,
+        "lb_count": lb_count,
+        "batch_id": batch_id,
+    }, delivery_ids, lead_ids, claimed_by=claimed_by)
+
+
+async def enqueue_api_push(
+    entity: str,
+    client_id: str,
+    client_name: str,
+    commande_id: str,
+    produit: str,
+    delivery_ids: List[str],
+    lead_ids: List[str],
+    endpoint: str,
+    lb_count: int,
+    source: str,
+    batch_id: Optional[str] = None,
+    claimed_by: Optional[str] = None
+) -> Optional[Dict]:
+    """Met en file un push API (delivery_ids / lead_ids alignés; None: déjà prises ailleurs)"""
+    from services.api_push import endpoint_host
+
+    host = endpoint_host(endpoint)
+    return await _enqueue({
+        "channel": "api",
+        "source": source,
+        "entity": entity,
+        "client_id": client_id,
+        "client_name": client_name,
+        "commande_id": commande_id,
+        "produit": produit,
+        "endpoint": endpoint,
+        "to_emails": [],
+        "recipient_domains": [host] if host else [],
+        "lb_count": lb_count,
+        "batch_id": batch_id,
+    }, delivery_ids, lead_ids, claimed_by=claimed_by)
+
+
+def _recipients(job: Dict) -> List[str]:
+    """Destinataires enregistrés dans deliveries.sent_to"""
+    if job.get("channel") == "api":
+        return [job.get("endpoint", "")]
+    return job.get("to_emails", [])
+
+
+async def claim_next_job(worker_name: str) -> Optional[Dict]:
+    """Claim atomique du job dû le plus ancien sans bail actif"""
+    now = datetime.now(timezone.utc)
+    now_s = now.isoformat()
+    return await db.outbox.find_one_and_update(
+        {
+            "status": PENDING_STATUS,
+            "next_attempt_at": {"$lte": now_s},
+            "$or": [
+                {"lease_until": {"$exists": False}},
+                {"lease_until": {"$lt": now_s}},
+            ],
+        },
+        {
+            "$set": {
+                "lease_until": (now + timedelta(seconds=OUTBOX_LEASE_SECONDS)).isoformat(),
+                "worker": worker_name,
+            },
+        },
+        sort=[("next_attempt_at", 1)],
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def _send(job: Dict) -> Dict:
+    if job.get("channel") == "api":
+        from services.api_push import push_job
+        return await push_job(job)
+
+    from services.csv_delivery import send_csv_email
+    from services.delivery_files import load_delivery_csv
+
+    # csv_file_id (delivery_files), sinon csv_content inline (anciens jobs)
+    csv_content = await load_delivery_csv(job)
+    if csv_content is None:
+        return {"success": False, "error": "csv_file_missing", "retryable": False}
+    return await send_csv_email(
+        entity=job["entity"],
+        to_emails=job["to_emails"],
+        csv_content=csv_content,
+        csv_filename=job["csv_filename"],
+        lead_count=job.get("lead_count", 0),
+        lb_count=job.get("lb_count", 0),
+        produit=job.get("produit", "")
+    )
+
+
+async def _release_leads(job: Dict) -> None:
+    await db.leads.update_many(
+        {"id": {"$in": job["lead_ids"]}, "outbox_job_id": job["id"]},
+        {"$unset": {"outbox_job_id": ""}}
+    )
+
+
+async def _complete(job: Dict, attempts: int, result: Dict) -> None:
+    """Envoi accepté: transition sent/livre via la state machine"""
+    from services.delivery_state_machine import batch_mark_deliveries_sent, DeliveryInvariantError
+
+    now = now_iso()
+    note = None
+    sent_to = [result["endpoint"]] if result.get("endpoint") else _recipients(job)
+    try:
+        await batch_mark_deliveries_sent(
+            delivery_ids=job["delivery_ids"],
+            lead_ids=job["lead_ids"],
+            sent_to=sent_to,
+            client_id=job["client_id"],
+            client_name=job["client_name"],
+            commande_id=job.get("commande_id") or ""
+        )
+    except DeliveryInvariantError as e:
+        # Envoi accepté: ne surtout pas renvoyer
+        note = f"state_machine: {e}"
+        logger.error(f"[OUTBOX] job={job['id'][:8]}... envoyé mais transition refusée: {e}")
+
+    if job.get("source") == "daily":
+        # Historique des batchs (backward compatibility)
+        await db.delivery_batches.insert_one({
+            "id": job["batch_id"],
+            "entity": job["entity"],
+            "client_id": job["client_id"],
+            "client_name": job["client_name"],
+            "commande_id": job.get("commande_id"),
+            "produit": job.get("produit"),
+            "lead_ids": job["lead_ids"],
+            "delivery_ids": job["delivery_ids"],
+            "lead_count": job.get("lead_count", 0),
+            "lb_count": job.get("lb_count", 0),
+            "fresh_count": job.get("lead_count", 0) - job.get("lb_count", 0),
+            "status": "sent",
+            "csv_filename": job.get("csv_filename"),
+            "delivery_channel": job.get("channel", "email"),
+            "emails_sent_to": sent_to,
+            "sent_at": now,
+            "created_at": job.get("created_at", now)
+        })
+
+    await db.outbox.update_one(
+        {"id": job["id"]},
+        {
+            "$set": {
+                "status": SENT_STATUS,
+                "attempts": attempts,
+                "sent_at": now,
+                "latency_ms": result.get("latency_ms"),
+                "last_error": note,
+                "updated_at": now,
+            },
+            # CSV conservé dans delivery_files (csv_file_id des deliveries);
+            # csv_content: copie inline des anciens jobs uniquement
+            "$unset": {"lease_until": "", "worker": "", "csv_content": ""},
+        }
+    )
+    await _release_leads(job)
+    _stats["sent"] += 1
+    logger.info(
+        f"[OUTBOX] sent job={job['id'][:8]}... client={job['client_name']} "
+        f"leads={job.get('lead_count')} attempt={attempts}"
+    )
+
+
+async def _fail(job: Dict, attempts: int, error: str, retryable: bool = True) -> None:
+    """Échec d'envoi: backoff, ou dead-letter (max_attempts / non réessayable)"""
+    from services.delivery_state_machine import (
+        batch_mark_deliveries_failed, release_reserved_counters, DeliveryInvariantError
+    )
+
+    now = datetime.now(timezone.utc)
+    if not retryable or attempts >= job.get("max_attempts", OUTBOX_MAX_ATTEMPTS):
+        try:
+            await batch_mark_deliveries_failed(delivery_ids=job["delivery_ids"], error=error)
+        except DeliveryInvariantError as e:
+            logger.error(f"[OUTBOX] job={job['id'][:8]}... transition failed refusée: {e}")
+        # Quota réservé à la mise en file rendu (le routing temps réel peut le reprendre)
+        await release_reserved_counters(job["delivery_ids"])
+        await db.outbox.update_one(
+            {"id": job["id"]},
+            {
+                "$set": {
+                    "status": DEAD_STATUS,
+                    "attempts": attempts,
+                    "last_error": error[:500],
+                    "dead_at": now.isoformat(),
+                    "updated_at": now.isoformat(),
+                },
+                "$unset": {"lease_until": "", "worker": ""},
+            }
+        )
+        await _release_leads(job)
+        _stats["dead_lettered"] += 1
+        logger.error(
+            f"[OUTBOX] dead job={job['id'][:8]}... client={job['client_name']} "
+            f"après {attempts} tentatives: {error}"
+        )
+        return
+
+    delay = backoff_seconds(attempts)
+    await db.outbox.update_one(
+        {"id": job["id"]},
+        {
+            "$set": {
+                "attempts": attempts,
+                "last_error": error[:500],
+                "next_attempt_at": (now + timedelta(seconds=delay)).isoformat(),
+                "updated_at": now.isoformat(),
+            },
+            "$unset": {"lease_until": "", "worker": ""},
+        }
+    )
+    _stats["retried"] += 1
+    logger.warning(
+        f"[OUTBOX] job={job['id'][:8]}... tentative {attempts} échouée, retry dans {delay}s: {error}"
+    )
+
+
+async def process_job(job: Dict) -> None:
+    """Envoie un job claimé et applique le résultat"""
+    wait = _reserve_domain_slots(job.get("recipient_domains", []))
+    if wait > 0:
+        # Domaine saturé: reporté, sans consommer de tentative
+        _stats["rate_limited"] += 1
+        await _defer(job, wait)
+        return
+
+    attempts = job.get("attempts", 0) + 1
+    try:
+        result = await _send(job)
+    except Exception as e:
+        result = {"success": False, "error": str(e)}
+
+    if result.get("success"):
+        await _complete(job, attempts, result)
+    elif result.get("defer_seconds"):
+        # Circuit API ouvert: pas d'appel, pas de tentative consommée
+        _stats["deferred"] += 1
+        await _defer(job, result["defer_seconds"])
+    else:
+        await _fail(job, attempts, result.get("error") or "send_failed", result.get("retryable", True))
+
+
+async def _defer(job: Dict, seconds: float) -> None:
+    await db.outbox.update_one(
+        {"id": job["id"], "status": PENDING_STATUS},
+        {
+            "$set": {
+                "next_attempt_at": (datetime.now(timezone.utc) + timedelta(seconds=seconds)).isoformat()
+            },
+            "$unset": {"lease_until": "", "worker": ""},
+        }
+    )
+
+
+async def requeue_dead_job(job_id: str) -> Optional[Dict]:
+    """Relance manuelle d'un job dead (deliveries failed → sending)"""
+    from services.delivery_state_machine import (
+        batch_mark_deliveries_sending, batch_mark_deliveries_failed, reserve_delivery_counters,
+        DeliveryInvariantError
+    )
+
+    job = await db.outbox.find_one({"id": job_id, "status": DEAD_STATUS}, {"_id": 0})
+    if not job:
+        return None
+
+    claim = await batch_mark_deliveries_sending(job["delivery_ids"], outbox_job_id=job_id)
+    if len(claim["claimed_ids"]) < len(job["delivery_ids"]):
+        if claim["claimed_ids"]:
+            await batch_mark_deliveries_failed(delivery_ids=claim["claimed_ids"], error="requeue_conflict")
+        raise DeliveryInvariantError(
+            f"Requeue bloqué: {len(job['delivery_ids']) - len(claim['claimed_ids'])} deliveries "
+            f"ne sont plus failed (reprises par un autre envoi)"
+        )
+    if job.get("source") != "realtime":
+        await reserve_delivery_counters(job["delivery_ids"])
+    now = now_iso()
+    await db.outbox.update_one(
+        {"id": job_id, "status": DEAD_STATUS},
+        {
+            "$set": {
+                "status": PENDING_STATUS,
+                "attempts": 0,
+                "next_attempt_at": now,
+                "requeued_at": now,
+                "updated_at": now,
+            },
+            "$unset": {"dead_at": ""},
+        }
+    )
+    await db.leads.update_many({"id": {"$in": job["lead_ids"]}}, {"$set": {"outbox_job_id": job_id}})
+    _notify()
+    logger.info(f"[OUTBOX] requeued job={job_id[:8]}...")
+    return {**job, "status": PENDING_STATUS, "attempts": 0, "next_attempt_at": now}
+
+
+async def _worker_loop(worker_name: str) -> None:
+    while not _stopping:
+        try:
+            job = await claim_next_job(worker_name)
+        except Exception as e:
+            logger.error(f"[OUTBOX] Claim échoué ({worker_name}): {e}")
+            job = None
+
+        if job:
+            try:
+                await process_job(job)
+            except Exception as e:
+                # Bail expiré → job repris par un worker
+                _stats["errors"] += 1
+                logger.error(f"[OUTBOX] job={job['id'][:8]}... erreur: {e}")
+            continue
+
+        # Rien de dû: attendre un enqueue local ou le prochain poll
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), OUTBOX_POLL_MS / 1000)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_outbox() -> None:
+    """Démarre les workers (lifespan). OUTBOX_WORKERS=0 → désactivé dans ce process"""
+    global _wakeup, _stopping
+    if _is_running() or OUTBOX_WORKERS <= 0:
+        return
+    _stopping = False
+    _wakeup = asyncio.Event()
+    _workers.clear()
+    for i in range(OUTBOX_WORKERS):
+        _workers.append(asyncio.create_task(_worker_loop(f"outbox-{os.getpid()}-{i}")))
+    logger.info(
+        f"[OUTBOX] started workers={OUTBOX_WORKERS} max_attempts={OUTBOX_MAX_ATTEMPTS} "
+        f"domain_rate={OUTBOX_DOMAIN_RATE_PER_MINUTE}/min"
+    )
+
+
+async def stop_outbox() -> None:
+    """Arrête les workers après le job en cours (les jobs restent en base)"""
+    global _stopping
+    if not _workers:
+        return
+    _stopping = True
+    if _wakeup is not None:
+        _wakeup.set()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    logger.info("[OUTBOX] stopped")
+
+
+async def get_outbox_stats() -> Dict:
+    """Profondeur / retard de l'outbox + métriques locales (pour /system/health)"""
+    pending = await db.outbox.count_documents({"status": PENDING_STATUS})
+    dead = await db.outbox.count_documents({"status": DEAD_STATUS})
+    oldest_due_age_seconds = 0
+    if pending:
+        oldest = await db.outbox.find_one(
+            {"status": PENDING_STATUS}, {"_id": 0, "next_attempt_at": 1}, sort=[("next_attempt_at", 1)]
+        )
+        if oldest and oldest.get("next_attempt_at"):
+            due = datetime.fromisoformat(oldest["next_attempt_at"])
+            oldest_due_age_seconds = max(0, int((datetime.now(timezone.utc) - due).total_seconds()))
+
+    return {
+        **_stats,
+        "running": _is_running(),
+        "workers": OUTBOX_WORKERS,
+        "pending": pending,
+        "dead": dead,
+        "oldest_due_age_seconds": oldest_due_age_seconds,
+        "domain_rate_per_minute": OUTBOX_DOMAIN_RATE_PER_MINUTE,
+    }
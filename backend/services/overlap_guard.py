@@ -5,6 +5,7 @@ when an alternative non-shared commande exists.
 
 FAIL-OPEN: any error → deliver normally, never block.
 BOUNDED: max 10 candidates, timeout ~100ms.
+SHARED CHECKS: in-memory client_groups index (services/client_groups.py).
 KILL SWITCH: OVERLAP_GUARD_ENABLED setting.
 """
 
@@ -20,28 +21,16 @@ OVERLAP_WINDOW_DAYS = 30
 MAX_CANDIDATES = 10
 
 
-def _normalize_email(email: str) -> str:
-    return (email or "").strip().lower()
-
-
 def compute_client_group_key(client: dict) -> str:
     """Build a canonical group key from delivery emails."""
-    emails = set()
-    for e in client.get("delivery_emails", []):
-        n = _normalize_email(e)
-        if n:
-            emails.add(n)
-    main = _normalize_email(client.get("email", ""))
-    if main:
-        emails.add(main)
-    if not emails:
-        return ""
-    return "|".join(sorted(emails))
+    from services.client_groups import client_emails, group_key_for
+    return group_key_for(client_emails(client))
 
 
 async def is_guard_enabled() -> bool:
     """Check kill switch in settings."""
-    doc = await db.settings.find_one({"key": "overlap_guard"}, {"_id": 0})
+    from services.settings import get_setting
+    doc = await get_setting("overlap_guard")
     if not doc:
         return True  # Enabled by default
     return doc.get("enabled", True)
@@ -67,6 +56,7 @@ async def check_overlap_and_find_alternative(
             "alternative_client_id": str|None,
             "alternative_client_name": str|None,
             "alternative_commande_id": str|None,
+            "alternative_api_endpoint": str|None,  # client API → push temps réel
             "fallback": bool,  # True = delivered to original despite overlap
         }
     """
@@ -92,6 +82,7 @@ def _no_overlap_result(key: str) -> dict:
         "client_group_key": key,
         "alternative_found": False, "alternative_client_id": None,
         "alternative_client_name": None, "alternative_commande_id": None,
+        "alternative_api_endpoint": None,
         "fallback": False,
     }
 
@@ -100,51 +91,34 @@ async def _check_overlap_internal(
     selected_client_id, selected_commande_id,
     entity, produit, departement, phone,
 ) -> dict:
-    # 1. Get selected client's group key
-    client = await db.clients.find_one(
-        {"id": selected_client_id},
-        {"_id": 0, "email": 1, "delivery_emails": 1}
-    )
-    if not client:
-        return _no_overlap_result("")
+    from services.client_groups import get_client_group_index
 
-    group_key = compute_client_group_key(client)
+    # 1. Selected client's group key (in-memory client_groups index)
+    groups = await get_client_group_index()
+    group_key = groups.group_key(selected_client_id)
     if not group_key:
         return _no_overlap_result("")
 
-    # 2. Check if any client in the OTHER entity shares the same emails
+    # 2. Clients in the OTHER entity sharing the same emails
     other_entity = "MDL" if entity == "ZR7" else "ZR7"
-    emails_list = [e for e in group_key.split("|") if e]
-
-    shared_client = await db.clients.find_one({
-        "entity": other_entity,
-        "$or": [
-            {"email": {"$in": emails_list}},
-            {"delivery_emails": {"$elemMatch": {"$in": emails_list}}},
-        ],
-    }, {"_id": 0, "id": 1})
+    shared_client_ids = groups.shared_with(selected_client_id, other_entity)
 
-    if not shared_client:
+    if not shared_client_ids:
         return _no_overlap_result(group_key)
 
-    # 3. Check 30-day window: was there a cross-entity delivery to this group?
+    # 3. Check 30-day window: was there a cross-entity delivery to this group
+    #    (by group key or by one of the shared clients)?
     cutoff_30d = (datetime.now(timezone.utc) - timedelta(days=OVERLAP_WINDOW_DAYS)).isoformat()
     cross_delivery = await db.deliveries.find_one({
-        "client_group_key": group_key,
         "entity": other_entity,
         "status": "sent",
         "created_at": {"$gte": cutoff_30d},
+        "$or": [
+            {"client_group_key": group_key},
+            {"client_id": {"$in": list(shared_client_ids)}},
+        ],
     }, {"_id": 0, "id": 1})
 
-    if not cross_delivery:
-        # Also check by client_id of the shared client
-        cross_delivery = await db.deliveries.find_one({
-            "client_id": shared_client["id"],
-            "entity": other_entity,
-            "status": "sent",
-            "created_at": {"$gte": cutoff_30d},
-        }, {"_id": 0, "id": 1})
-
     if not cross_delivery:
         # Shared structure exists but no active overlap in 30d
         return {
@@ -160,42 +134,21 @@ async def _check_overlap_internal(
     )
 
     from services.routing_engine import find_open_commandes
-    from services.duplicate_detector import check_duplicate_30_days
-
-    alt_commandes = await find_open_commandes(entity, produit, departement, False)
+    from services.duplicate_detector import check_duplicate_30_days_many
+
+    # Non-shared candidates only (set checks, no query per candidate)
+    alt_commandes = [
+        cmd for cmd in await find_open_commandes(entity, produit, departement, False)
+        if cmd.get("client_id") != selected_client_id
+        and not groups.shared_with(cmd.get("client_id"), other_entity)
+    ][:MAX_CANDIDATES]
+    blocked_clients = await check_duplicate_30_days_many(
+        phone, produit, [cmd.get("client_id") for cmd in alt_commandes]
+    )
 
-    candidates_checked = 0
     for cmd in alt_commandes:
-        if candidates_checked >= MAX_CANDIDATES:
-            break
-        if cmd.get("client_id") == selected_client_id:
-            continue  # Skip the original
-
-        candidates_checked += 1
         alt_client_id = cmd.get("client_id")
-
-        # Check if this alternative is also shared
-        alt_client = await db.clients.find_one(
-            {"id": alt_client_id},
-            {"_id": 0, "email": 1, "delivery_emails": 1}
-        )
-        if alt_client:
-            alt_key = compute_client_group_key(alt_client)
-            # Check if alt also has cross-entity overlap
-            if alt_key:
-                alt_shared = await db.clients.find_one({
-                    "entity": other_entity,
-                    "$or": [
-                        {"email": {"$in": [e for e in alt_key.split("|") if e]}},
-                        {"delivery_emails": {"$elemMatch": {"$in": [e for e in alt_key.split("|") if e]}}},
-                    ],
-                }, {"_id": 0, "id": 1})
-                if alt_shared:
-                    continue  # This alternative is also shared, skip
-
-        # Check duplicate
-        dup = await check_duplicate_30_days(phone, produit, alt_client_id)
-        if dup.is_duplicate:
+        if alt_client_id in blocked_clients:
             continue
 
         # Found a non-shared alternative!
@@ -210,6 +163,8 @@ async def _check_overlap_internal(
             "alternative_client_id": alt_client_id,
             "alternative_client_name": cmd.get("client_name", ""),
             "alternative_commande_id": cmd.get("id"),
+            "alternative_quota_semaine": cmd.get("quota_semaine", 0),
+            "alternative_api_endpoint": cmd.get("client_api_endpoint") or None,
             "fallback": False,
         }
 
@@ -220,5 +175,6 @@ async def _check_overlap_internal(
         "client_group_key": group_key,
         "alternative_found": False, "alternative_client_id": None,
         "alternative_client_name": None, "alternative_commande_id": None,
+        "alternative_api_endpoint": None,
         "fallback": True,
     }
@@ -0,0 +1,61 @@
+"""
+RDZ CRM - Comptage des commandes MongoDB par portion de code
+
+Listener pymongo enregistré sur le client Motor (config.py): chaque
+commande envoyée (find, getMore, aggregate, insert, update...) est comptée
+dans le compteur du contexte courant, ouvert par count_queries().
+
+Motor exécute pymongo dans son executor en copiant le contexte (contextvars):
+les commandes d'une tâche asyncio sont comptées dans le compteur de cette
+tâche, même si d'autres tâches tournent en parallèle.
+Hors count_queries(): un ContextVar.get() par commande, rien d'autre.
+"""
+
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+from pymongo import monitoring
+
+WRITE_COMMANDS = {"insert", "update", "delete", "findAndModify"}
+
+_current: ContextVar[Optional[Counter]] = ContextVar("query_counter", default=None)
+_lock = threading.Lock()
+
+
+class QueryCountListener(monitoring.CommandListener):
+    def started(self, event):
+        counter = _current.get()
+        if counter is not None:
+            with _lock:
+                counter[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+query_count_listener = QueryCountListener()
+
+
+@contextmanager
+def count_queries() -> Iterator[Counter]:
+    """Compte les commandes MongoDB du bloc (par nom de commande)"""
+    counter: Counter = Counter()
+    token = _current.set(counter)
+    try:
+        yield counter
+    finally:
+        _current.reset(token)
+
+
+def summarize_queries(counter: Counter) -> Dict:
+    return {
+        "total": sum(counter.values()),
+        "writes": sum(counter[name] for name in WRITE_COMMANDS),
+        "by_command": dict(counter),
+    }
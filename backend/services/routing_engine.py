@@ -8,6 +8,8 @@ ORDRE DE PRIORITÉ DES RÈGLES:
 1. Calendar gating (day OFF) → bloque routing
 2. Client non livrable → aucune commande OPEN possible
 3. Quota / Doublon → règles standard
+4. Réservation atomique du slot de quota (commande_week_counters) → la
+   commande retenue est celle dont le slot a pu être réservé
 
 Cross-entity fallback uniquement si settings l'autorisent ET commande OPEN compatible existe.
 """
@@ -17,8 +19,15 @@ from datetime import datetime, timezone, timedelta
 from math import ceil
 from typing import Optional, List, Dict, Any, Tuple
 from config import db
-from services.duplicate_detector import check_duplicate_30_days
+from services.duplicate_detector import check_duplicate_30_days_many
 from services.settings import is_delivery_day_enabled
+from services.commande_counters import (
+    week_key_for,
+    get_commande_week_counters,
+    get_commandes_week_counters,
+    reserve_commande_slot,
+    release_commande_slot,
+)
 
 logger = logging.getLogger("routing_engine")
 
@@ -34,7 +43,10 @@ class RoutingResult:
         commande_id: Optional[str] = None,
         is_lb: bool = False,
         reason: str = "",
-        routing_mode: str = "normal"
+        routing_mode: str = "normal",
+        slot_week_key: Optional[str] = None,
+        entity: Optional[str] = None,
+        api_endpoint: Optional[str] = None
     ):
         self.success = success
         self.client_id = client_id
@@ -43,6 +55,12 @@ class RoutingResult:
         self.is_lb = is_lb
         self.reason = reason
         self.routing_mode = routing_mode  # "normal" | "fallback_no_orders"
+        # Semaine du slot de quota réservé (None = aucune réservation)
+        self.slot_week_key = slot_week_key
+        # Entity de la commande retenue (≠ entity du lead en cross-entity)
+        self.entity = entity
+        # Endpoint du client si livraison par push API temps réel
+        self.api_endpoint = api_endpoint
 
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -53,6 +71,8 @@ class RoutingResult:
             "is_lb": self.is_lb,
             "reason": self.reason,
             "routing_mode": self.routing_mode,
+            "entity": self.entity,
+            "slot_reserved": self.slot_week_key is not None,
         }
 
 
@@ -195,6 +215,8 @@ async def is_commande_open(cmd: Dict, week_start: str) -> Tuple[bool, Dict]:
     """
     COMMANDE OPEN = active=true AND semaine courante AND delivered_this_week < quota_semaine
 
+    delivered_this_week = point read sur commande_week_counters (pas d'aggregation).
+
     Returns:
         (is_open, stats_dict)
         stats_dict contient: leads_delivered, lb_delivered, quota_remaining
@@ -205,9 +227,9 @@ async def is_commande_open(cmd: Dict, week_start: str) -> Tuple[bool, Dict]:
     cmd_id = cmd.get("id")
     quota = cmd.get("quota_semaine", 0)
 
-    stats = await get_commande_stats(cmd_id, week_start)
-    delivered = stats.get("leads_delivered", 0)
-    lb_delivered = stats.get("lb_delivered", 0)
+    counters = await get_commande_week_counters(cmd_id, week_key_for(week_start))
+    delivered = counters["delivered"]
+    lb_delivered = counters["lb_delivered"]
 
     info = {
         "leads_delivered": delivered,
@@ -241,114 +263,89 @@ async def find_open_commandes(
     OPEN = active + semaine courante + delivered < quota
     + departement compatible + client actif ET livrable
     + si LB: lb_percent_max > 0 et % LB non depasse
+
+    Lit le routing snapshot (services/routing_snapshot.py): aucune requête
+    Mongo tant que le snapshot (entity, produit) est valide.
     """
-    from models.client import check_client_deliverable
-    from services.settings import get_email_denylist_settings
-    
-    week_start = get_week_start()
-
-    query = {
-        "entity": entity,
-        "produit": produit,
-        "active": True,
-        "$or": [
-            {"departements": departement},
-            {"departements": "*"}
-        ]
-    }
+    from services.routing_snapshot import get_open_commandes
 
-    commandes = await db.commandes.find(query, {"_id": 0}).sort("priorite", 1).to_list(100)
+    commandes = await get_open_commandes(entity, produit, departement)
 
-    # Récupérer la denylist pour vérification client livrable
-    denylist_settings = await get_email_denylist_settings()
-    denylist = denylist_settings.get("domains", [])
+    if not is_lb:
+        return commandes
 
+    lb_candidates = [cmd for cmd in commandes if cmd.get("lb_target_pct", 0) > 0]
+    counters = await get_commandes_week_counters([cmd.get("id") for cmd in lb_candidates])
     open_commandes = []
 
     for cmd in commandes:
-        # Client actif ET livrable ?
-        client = await db.clients.find_one(
-            {"id": cmd.get("client_id")},
-            {"_id": 0, "name": 1, "active": 1, "email": 1, "delivery_emails": 1, "api_endpoint": 1}
-        )
-        if not client:
-            continue
-        
-        if not client.get("active", True):
-            logger.debug(f"[ROUTING] Skip client {client.get('name')}: inactive")
-            continue
-        
-        # Vérifier si client est livrable (a un canal valide)
-        deliverable_check = check_client_deliverable(
-            email=client.get("email", ""),
-            delivery_emails=client.get("delivery_emails", []),
-            api_endpoint=client.get("api_endpoint", ""),
-            denylist=denylist
-        )
-        
-        if not deliverable_check["deliverable"]:
-            logger.debug(
-                f"[ROUTING] Skip client {client.get('name')}: non livrable - {deliverable_check['reason']}"
-            )
+        # LB: vérifier lb_target_pct (remplace lb_percent_max)
+        target = cmd.get("lb_target_pct", 0)
+        if target <= 0:
+            logger.debug(f"[ROUTING] Skip {cmd.get('client_name')}: lb_target_pct=0, no LB wanted")
             continue
 
-        cmd["client_name"] = client.get("name", "")
-        cmd["client_delivery_emails"] = client.get("delivery_emails", [])
-        cmd["client_email"] = client.get("email", "")
+        # Calculer lb_needed avec les stats acceptées (compteurs matérialisés)
+        accepted = counters[cmd.get("id")]
+        delivered_units = accepted["accepted"]
+        lb_delivered = accepted["lb_accepted"]
+        lb_needed = compute_lb_needed(target, delivered_units, lb_delivered)
 
-        # OPEN ?
-        is_open, stats = await is_commande_open(cmd, week_start)
-        if not is_open:
+        if lb_needed <= 0:
             logger.debug(
-                f"[ROUTING] Commande {cmd.get('id')[:8]}... CLOSED: {stats.get('reason', 'quota_full')}"
+                f"[ROUTING] Skip {cmd.get('client_name')}: LB target atteint "
+                f"({lb_delivered}/{delivered_units}, target={target})"
             )
             continue
 
-        # PREPAID BLOCK: Skip if billing_mode=PREPAID and balance empty
-        prepay_pricing = await db.client_product_pricing.find_one(
-            {"client_id": cmd.get("client_id"), "product_code": produit, "billing_mode": "PREPAID", "active": True},
-            {"_id": 0, "billing_mode": 1}
-        )
-        if prepay_pricing:
-            balance = await db.prepayment_balances.find_one(
-                {"client_id": cmd.get("client_id"), "product_code": produit},
-                {"_id": 0, "units_remaining": 1}
-            )
-            if not balance or balance.get("units_remaining", 0) <= 0:
-                logger.info(
-                    f"[ROUTING] Skip {client.get('name')}: PREPAID balance empty for {produit}"
-                )
-                continue
+        open_commandes.append(cmd)
 
-        cmd["quota_remaining"] = stats["quota_remaining"]
-        cmd["leads_delivered_this_week"] = stats["leads_delivered"]
-        cmd["lb_delivered_this_week"] = stats["lb_delivered"]
+    return open_commandes
 
-        # LB: vérifier lb_target_pct (remplace lb_percent_max)
-        if is_lb:
-            target = cmd.get("lb_target_pct", 0)
-            if target <= 0:
-                logger.debug(f"[ROUTING] Skip {client.get('name')}: lb_target_pct=0, no LB wanted")
-                continue
-
-            # Calculer lb_needed avec les stats acceptées
-            accepted = await get_accepted_stats_for_lb_target(
-                cmd.get("id"), week_start, get_week_end()
-            )
-            delivered_units = accepted["units_accepted"]
-            lb_delivered = accepted["lb_accepted"]
-            lb_needed = compute_lb_needed(target, delivered_units, lb_delivered)
 
-            if lb_needed <= 0:
-                logger.debug(
-                    f"[ROUTING] Skip {client.get('name')}: LB target atteint "
-                    f"({lb_delivered}/{delivered_units}, target={target})"
-                )
-                continue
+async def _claim_slot(entity: str, produit: str, cmd: Dict, is_lb: bool) -> Optional[str]:
+    """
+    Réserve 1 unité de quota pour la commande.
+    Retourne la week_key du slot, ou None si le quota a été atteint
+    entre-temps (autre requête / autre worker) → commande retirée du snapshot.
+    """
+    from services.routing_snapshot import note_commande_full
 
-        open_commandes.append(cmd)
+    slot_week_key = week_key_for(get_week_start())
+    reserved = await reserve_commande_slot(
+        cmd.get("id"), cmd.get("quota_semaine", 0), slot_week_key, is_lb
+    )
+    if not reserved:
+        note_commande_full(entity, produit, cmd.get("id"))
+        return None
+    return slot_week_key
 
-    return open_commandes
+
+async def reserve_routing_slot(result: RoutingResult, quota: int, entity: str = "", produit: str = "") -> bool:
+    """
+    Réserve un slot pour un RoutingResult construit hors route_lead
+    (ex: alternative overlap guard). Met à jour result.slot_week_key.
+    """
+    slot_week_key = await _claim_slot(
+        entity, produit, {"id": result.commande_id, "quota_semaine": quota}, result.is_lb
+    )
+    result.slot_week_key = slot_week_key
+    return slot_week_key is not None
+
+
+async def release_routing_slot(result: Optional[RoutingResult]) -> None:
+    """
+    Libère le slot réservé par route_lead quand une étape suivante échoue
+    (ou quand le lead part finalement vers une autre commande).
+    """
+    if not result or not result.slot_week_key:
+        return
+    try:
+        await release_commande_slot(result.commande_id, result.slot_week_key, result.is_lb)
+        logger.info(f"[ROUTING] Slot libéré commande={result.commande_id[:8]}...")
+    except Exception as e:
+        logger.error(f"[ROUTING] Release slot failed for {result.commande_id}: {e}")
+    result.slot_week_key = None
 
 
 async def route_lead(
@@ -366,7 +363,11 @@ async def route_lead(
     1. Calendar gating - si jour OFF → no_open_orders (delivery_day_disabled)
     2. Chercher commandes OPEN dans l'entite (client livrable)
     3. Filtrer doublons 30 jours
-    4. Si aucune -> tenter cross-entity fallback (si autorise ET entity_locked=False)
+    4. Réserver atomiquement 1 slot de quota (sinon commande suivante)
+    5. Si aucune -> tenter cross-entity fallback (si autorise ET entity_locked=False)
+
+    Si success, le slot est réservé: l'appelant DOIT appeler
+    release_routing_slot() si la suite (delivery, lead) échoue.
     """
     logger.info(
         f"[ROUTING] entity={entity} produit={produit} dept={departement} "
@@ -399,16 +400,22 @@ async def route_lead(
 
         return RoutingResult(success=False, reason="no_open_orders")
 
-    # 2. Verifier doublon 30 jours pour chaque commande
+    # 2. Verifier doublon 30 jours (1 requête pour tous les clients candidats)
+    blocked_clients = await check_duplicate_30_days_many(
+        phone, produit, [cmd.get("client_id") for cmd in commandes]
+    )
     for cmd in commandes:
         client_id = cmd.get("client_id")
         client_name = cmd.get("client_name", "")
 
-        dup = await check_duplicate_30_days(phone, produit, client_id)
-        if dup.is_duplicate:
+        if client_id in blocked_clients:
             logger.debug(f"[ROUTING] Skip {client_name}: doublon 30j")
             continue
 
+        slot_week_key = await _claim_slot(entity, produit, cmd, is_lb)
+        if not slot_week_key:
+            continue
+
         logger.info(
             f"[ROUTING_OK] -> {client_name} commande={cmd.get('id')[:8]}... "
             f"priorite={cmd.get('priorite')} is_lb={is_lb}"
@@ -419,7 +426,10 @@ async def route_lead(
             client_name=client_name,
             commande_id=cmd.get("id"),
             is_lb=is_lb,
-            reason="open_commande_found"
+            reason="open_commande_found",
+            slot_week_key=slot_week_key,
+            entity=entity,
+            api_endpoint=cmd.get("client_api_endpoint") or None
         )
 
     # Toutes doublons -> tenter cross-entity (sauf entity_locked)
@@ -481,13 +491,19 @@ async def _try_cross_entity(
         )
         return None
 
-    # 3. Verifier doublons
+    # 3. Verifier doublons (1 requête pour tous les clients candidats)
+    blocked_clients = await check_duplicate_30_days_many(
+        phone, produit, [cmd.get("client_id") for cmd in commandes]
+    )
     for cmd in commandes:
         client_id = cmd.get("client_id")
         client_name = cmd.get("client_name", "")
 
-        dup = await check_duplicate_30_days(phone, produit, client_id)
-        if dup.is_duplicate:
+        if client_id in blocked_clients:
+            continue
+
+        slot_week_key = await _claim_slot(to_entity, produit, cmd, is_lb)
+        if not slot_week_key:
             continue
 
         logger.info(
@@ -501,7 +517,10 @@ async def _try_cross_entity(
             commande_id=cmd.get("id"),
             is_lb=is_lb,
             reason=f"cross_entity_{from_entity}_to_{to_entity}",
-            routing_mode="fallback_no_orders"
+            routing_mode="fallback_no_orders",
+            slot_week_key=slot_week_key,
+            entity=to_entity,
+            api_endpoint=cmd.get("client_api_endpoint") or None
         )
 
     logger.info(
@@ -511,7 +530,7 @@ async def _try_cross_entity(
 
 
 async def route_lead_batch(leads: List[Dict]) -> List[Tuple[Dict, RoutingResult]]:
-    """Route un batch de leads"""
+    """Route un batch de leads (slots réservés: cf. route_lead)"""
     results = []
     for lead in leads:
         result = await route_lead(
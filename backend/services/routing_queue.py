@@ -0,0 +1,247 @@
+"""
+RDZ CRM - File de routing asynchrone (/public/leads en mode async)
+
+Mode opt-in (ASYNC_ROUTING_ENABLED=true): le lead est persisté avec le
+statut "queued" et la réponse part immédiatement. Un pool de
+ROUTING_QUEUE_WORKERS workers asyncio (par process) route ensuite les
+leads via route_and_persist_lead() — même routing, même création de delivery.
+
+CLAIM ATOMIQUE: find_one_and_update sur {status: "queued", bail expiré}
+→ pose un bail (routing_lease_until) de ROUTING_QUEUE_LEASE_SECONDS.
+Plusieurs process peuvent consommer la même file sans double routing.
+Un worker mort laisse un bail expiré → le lead est repris.
+
+ÉCHECS: après ROUTING_QUEUE_MAX_ATTEMPTS tentatives, le lead repasse en
+"new" (routing_reason=routing_queue_failed) → pris par la livraison
+quotidienne comme tout lead non routé.
+
+RÉVEIL: enqueue dans le process courant → réveil immédiat; sinon
+polling toutes les ROUTING_QUEUE_POLL_MS.
+
+MODE SYNCHRONE (ASYNC_ROUTING_ENABLED=false): aucun worker permanent.
+Au démarrage, un passage unique (drain_queued_leads) route les leads
+restés "queued" (mode async désactivé entre deux déploiements); un échec
+les rend directement en "new" (livraison quotidienne).
+"""
+
+import os
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional
+from pymongo import ReturnDocument
+from config import db
+
+logger = logging.getLogger("routing_queue")
+
+QUEUED_STATUS = "queued"
+
+ASYNC_ROUTING_ENABLED = os.environ.get("ASYNC_ROUTING_ENABLED", "false").lower() in ("1", "true", "yes")
+QUEUE_WORKERS = int(os.environ.get("ROUTING_QUEUE_WORKERS", "4"))
+QUEUE_POLL_MS = int(os.environ.get("ROUTING_QUEUE_POLL_MS", "500"))
+QUEUE_LEASE_SECONDS = int(os.environ.get("ROUTING_QUEUE_LEASE_SECONDS", "60"))
+QUEUE_MAX_ATTEMPTS = int(os.environ.get("ROUTING_QUEUE_MAX_ATTEMPTS", "3"))
+
+_workers: List[asyncio.Task] = []
+_wakeup: Optional[asyncio.Event] = None
+_stopping = False
+_stats = {
+    "enqueued": 0,
+    "processed": 0,
+    "routed": 0,
+    "errors": 0,
+    "abandoned": 0,
+    "drained": 0,
+    "last_wait_ms": 0,
+    "max_wait_ms": 0,
+}
+
+
+def is_async_routing_available() -> bool:
+    """Mode async activé ET workers actifs dans ce process"""
+    return ASYNC_ROUTING_ENABLED and _is_running()
+
+
+def _is_running() -> bool:
+    return bool(_workers) and not _stopping and any(not w.done() for w in _workers)
+
+
+def notify_lead_queued() -> None:
+    """Appelé après l'insert d'un lead "queued": réveille un worker local"""
+    _stats["enqueued"] += 1
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def claim_next_lead(worker_name: str) -> Optional[Dict]:
+    """
+    Claim atomique du plus ancien lead "queued" sans bail actif.
+    Pose un bail et incrémente routing_attempts.
+    """
+    now = datetime.now(timezone.utc)
+    return await db.leads.find_one_and_update(
+        {
+            "status": QUEUED_STATUS,
+            "$or": [
+                {"routing_lease_until": {"$exists": False}},
+                {"routing_lease_until": {"$lt": now.isoformat()}},
+            ],
+        },
+        {
+            "$set": {
+                "routing_lease_until": (now + timedelta(seconds=QUEUE_LEASE_SECONDS)).isoformat(),
+                "routing_worker": worker_name,
+            },
+            "$inc": {"routing_attempts": 1},
+        },
+        sort=[("queued_at", 1)],
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def _abandon(lead: Dict, error: str) -> None:
+    """Trop d'échecs: le lead sort de la file (statut "new" → livraison quotidienne)"""
+    _stats["abandoned"] += 1
+    await db.leads.update_one(
+        {"id": lead["id"], "status": QUEUED_STATUS},
+        {
+            "$set": {"status": "new", "routing_reason": "routing_queue_failed", "routing_error": error[:200]},
+            "$unset": {"routing_lease_until": "", "routing_worker": ""},
+        }
+    )
+    logger.error(f"[ROUTING_QUEUE] Lead {lead['id'][:8]}... abandonné après {lead.get('routing_attempts')} tentatives")
+
+
+async def process_lead(lead: Dict, retry: bool = True) -> None:
+    """
+    Route un lead claimé (mêmes étapes que le mode synchrone).
+    retry=False: un échec rend le lead en "new" sans nouvelle tentative.
+    """
+    from services.lead_ingestion import route_and_persist_lead
+
+    queued_at = lead.get("queued_at")
+    if queued_at:
+        wait_ms = int((datetime.now(timezone.utc) - datetime.fromisoformat(queued_at)).total_seconds() * 1000)
+        _stats["last_wait_ms"] = wait_ms
+        _stats["max_wait_ms"] = max(_stats["max_wait_ms"], wait_ms)
+
+    try:
+        routing_result, delivery_id = await route_and_persist_lead(lead, inserted=True)
+    except Exception as e:
+        _stats["errors"] += 1
+        logger.error(f"[ROUTING_QUEUE] Routing lead {lead['id'][:8]}... échoué: {e}")
+        if not retry or lead.get("routing_attempts", 0) >= QUEUE_MAX_ATTEMPTS:
+            await _abandon(lead, str(e))
+        # Sinon: bail expiré → nouvelle tentative
+        return
+
+    # Statut final posé (1 update); le lead sort de la file
+    await db.leads.update_one(
+        {"id": lead["id"]},
+        {"$unset": {"routing_lease_until": "", "routing_worker": ""}}
+    )
+    _stats["processed"] += 1
+    if delivery_id:
+        _stats["routed"] += 1
+    logger.info(
+        f"[ROUTING_QUEUE] lead={lead['id'][:8]}... status={lead['status']}"
+        + (f" -> ROUTED to {routing_result.client_name}" if delivery_id else "")
+    )
+
+
+async def _worker_loop(worker_name: str) -> None:
+    while not _stopping:
+        try:
+            lead = await claim_next_lead(worker_name)
+        except Exception as e:
+            logger.error(f"[ROUTING_QUEUE] Claim échoué ({worker_name}): {e}")
+            lead = None
+
+        if lead:
+            await process_lead(lead)
+            continue
+
+        # File vide: attendre un enqueue local ou le prochain poll
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), QUEUE_POLL_MS / 1000)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def drain_queued_leads(worker_name: str) -> int:
+    """Passage unique sur la file (mode synchrone): route les leads "queued" restants"""
+    drained = 0
+    while not _stopping:
+        try:
+            lead = await claim_next_lead(worker_name)
+        except Exception as e:
+            logger.error(f"[ROUTING_QUEUE] Claim échoué ({worker_name}): {e}")
+            break
+        if not lead:
+            break
+        await process_lead(lead, retry=False)
+        drained += 1
+
+    _stats["drained"] += drained
+    if drained:
+        logger.info(f"[ROUTING_QUEUE] {drained} leads \"queued\" repris au démarrage (mode synchrone)")
+    return drained
+
+
+def start_routing_queue() -> None:
+    """
+    Démarre le pool de workers (lifespan) en mode async.
+    Mode synchrone: 1 passage unique sur les leads restés "queued".
+    ROUTING_QUEUE_WORKERS=0 → désactivé
+    """
+    global _wakeup, _stopping
+    if _is_running() or QUEUE_WORKERS <= 0:
+        return
+    _stopping = False
+    _wakeup = asyncio.Event()
+    _workers.clear()
+    if not ASYNC_ROUTING_ENABLED:
+        _workers.append(asyncio.create_task(drain_queued_leads(f"{os.getpid()}-drain")))
+        return
+    for i in range(QUEUE_WORKERS):
+        _workers.append(asyncio.create_task(_worker_loop(f"{os.getpid()}-{i}")))
+    logger.info(
+        f"[ROUTING_QUEUE] started workers={QUEUE_WORKERS} lease={QUEUE_LEASE_SECONDS}s"
+    )
+
+
+async def stop_routing_queue() -> None:
+    """Arrête les workers après le lead en cours (les leads en file restent "queued")"""
+    global _stopping
+    if not _workers:
+        return
+    _stopping = True
+    if _wakeup is not None:
+        _wakeup.set()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    logger.info("[ROUTING_QUEUE] stopped")
+
+
+async def get_routing_queue_stats() -> Dict:
+    """Profondeur / âge de la file + métriques du pool local (pour /system/health)"""
+    depth = await db.leads.count_documents({"status": QUEUED_STATUS})
+    oldest_age_seconds = 0
+    if depth:
+        oldest = await db.leads.find_one(
+            {"status": QUEUED_STATUS}, {"_id": 0, "queued_at": 1}, sort=[("queued_at", 1)]
+        )
+        if oldest and oldest.get("queued_at"):
+            oldest_dt = datetime.fromisoformat(oldest["queued_at"])
+            oldest_age_seconds = int((datetime.now(timezone.utc) - oldest_dt).total_seconds())
+
+    return {
+        **_stats,
+        "async_mode": ASYNC_ROUTING_ENABLED,
+        "running": _is_running(),
+        "workers": QUEUE_WORKERS if ASYNC_ROUTING_ENABLED else 0,
+        "queue_depth": depth,
+        "oldest_age_seconds": oldest_age_seconds,
+    }
@@ -0,0 +1,280 @@
+"""
+RDZ CRM - Routing Snapshot (cache process-local)
+
+Snapshot des commandes OPEN par (entity, produit), indexé par departement.
+Chaque entrée contient la commande + infos client (livrable) + quota restant,
+exactement comme retourné par find_open_commandes(is_lb=False).
+
+CONSTRUCTION: 1 requête commandes + 1 clients ($in) + 1 compteurs ($in)
+              + 2 requêtes prepaid ($in) par (entity, produit) — au lieu de N+1.
+NEGATIVE CACHE: (entity, produit, departement) sans commande OPEN → mémorisé.
+INVALIDATION: commandes / clients / settings / pricing → invalidate_routing_snapshot()
+TTL: ROUTING_SNAPSHOT_TTL_SECONDS (défaut 15s) borne la dérive entre workers.
+     ROUTING_SNAPSHOT_TTL_SECONDS=0 désactive le cache.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, List, Tuple, Optional
+from config import db
+
+logger = logging.getLogger("routing_snapshot")
+
+SNAPSHOT_TTL_SECONDS = float(os.environ.get("ROUTING_SNAPSHOT_TTL_SECONDS", "15"))
+NEGATIVE_TTL_SECONDS = float(os.environ.get("ROUTING_NEGATIVE_TTL_SECONDS", "5"))
+
+
+class ProduitSnapshot:
+    """Commandes OPEN d'un couple (entity, produit), triées par priorite"""
+
+    def __init__(self, entity: str, produit: str, week_start: str, commandes: List[Dict], generation: int):
+        self.entity = entity
+        self.produit = produit
+        self.week_start = week_start
+        self.commandes = commandes
+        self.generation = generation
+        self.built_at = time.monotonic()
+        ttl = SNAPSHOT_TTL_SECONDS if commandes else min(SNAPSHOT_TTL_SECONDS, NEGATIVE_TTL_SECONDS)
+        self.expires_at = self.built_at + ttl
+        # departement -> commandes OPEN (liste vide = negative cache)
+        self.by_dept: Dict[str, List[Dict]] = {}
+
+    def is_valid(self, week_start: str, generation: int) -> bool:
+        return (
+            self.generation == generation
+            and self.week_start == week_start
+            and time.monotonic() < self.expires_at
+        )
+
+    def for_departement(self, departement: str) -> Tuple[List[Dict], bool]:
+        """Retourne (commandes, memo_hit)"""
+        cached = self.by_dept.get(departement)
+        if cached is not None:
+            return cached, True
+        matching = [
+            cmd for cmd in self.commandes
+            if departement in cmd.get("departements", []) or "*" in cmd.get("departements", [])
+        ]
+        self.by_dept[departement] = matching
+        return matching, False
+
+
+_snapshots: Dict[Tuple[str, str], ProduitSnapshot] = {}
+_build_locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+_generation = 0
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "negative_hits": 0,
+    "builds": 0,
+    "invalidations": 0,
+    "quota_consumed": 0,
+}
+
+
+def invalidate_routing_snapshot(reason: str = "") -> None:
+    """
+    Invalide TOUT le snapshot du worker courant.
+    Appelé après toute écriture commandes / clients / settings / pricing.
+    """
+    global _generation
+    _generation += 1
+    _snapshots.clear()
+    _stats["invalidations"] += 1
+    if reason:
+        logger.debug(f"[ROUTING_SNAPSHOT] invalidated: {reason}")
+
+
+def get_routing_snapshot_stats() -> Dict:
+    """Métriques du snapshot (pour /system/health)"""
+    total = _stats["hits"] + _stats["misses"]
+    return {
+        **_stats,
+        "enabled": SNAPSHOT_TTL_SECONDS > 0,
+        "ttl_seconds": SNAPSHOT_TTL_SECONDS,
+        "negative_ttl_seconds": NEGATIVE_TTL_SECONDS,
+        "generation": _generation,
+        "keys": len(_snapshots),
+        "hit_rate": round(_stats["hits"] / total * 100, 1) if total > 0 else 0,
+    }
+
+
+async def _build_produit_snapshot(entity: str, produit: str, week_start: str) -> List[Dict]:
+    """
+    Charge toutes les commandes OPEN (hors filtre departement / LB) d'un
+    couple (entity, produit) avec des requêtes groupées.
+    Mêmes règles que find_open_commandes: client actif + livrable,
+    commande OPEN (quota), PREPAID avec solde > 0.
+    """
+    from models.client import check_client_deliverable
+    from services.settings import get_email_denylist_settings
+    from services.commande_counters import get_commandes_week_counters, week_key_for
+
+    commandes = await db.commandes.find(
+        {"entity": entity, "produit": produit, "active": True},
+        {"_id": 0}
+    ).sort("priorite", 1).to_list(500)
+
+    if not commandes:
+        return []
+
+    client_ids = list({cmd.get("client_id") for cmd in commandes if cmd.get("client_id")})
+    clients = {
+        c["id"]: c for c in await db.clients.find(
+            {"id": {"$in": client_ids}},
+            {"_id": 0, "id": 1, "name": 1, "active": 1, "email": 1, "delivery_emails": 1,
+             "api_endpoint": 1, "auto_send_enabled": 1}
+        ).to_list(len(client_ids))
+    }
+
+    denylist_settings = await get_email_denylist_settings()
+    denylist = denylist_settings.get("domains", [])
+
+    counters = await get_commandes_week_counters(
+        [cmd.get("id") for cmd in commandes], week_key_for(week_start)
+    )
+
+    # PREPAID: clients dont le solde est vide pour ce produit
+    prepaid_client_ids = {
+        p.get("client_id") for p in await db.client_product_pricing.find(
+            {"client_id": {"$in": client_ids}, "product_code": produit, "billing_mode": "PREPAID", "active": True},
+            {"_id": 0, "client_id": 1}
+        ).to_list(len(client_ids))
+    }
+    prepaid_empty = set(prepaid_client_ids)
+    if prepaid_client_ids:
+        balances = await db.prepayment_balances.find(
+            {"client_id": {"$in": list(prepaid_client_ids)}, "product_code": produit},
+            {"_id": 0, "client_id": 1, "units_remaining": 1}
+        ).to_list(len(prepaid_client_ids))
+        for bal in balances:
+            if bal.get("units_remaining", 0) > 0:
+                prepaid_empty.discard(bal.get("client_id"))
+
+    open_commandes = []
+    for cmd in commandes:
+        client = clients.get(cmd.get("client_id"))
+        if not client or not client.get("active", True):
+            continue
+
+        deliverable_check = check_client_deliverable(
+            email=client.get("email", ""),
+            delivery_emails=client.get("delivery_emails", []),
+            api_endpoint=client.get("api_endpoint", ""),
+            denylist=denylist
+        )
+        if not deliverable_check["deliverable"]:
+            logger.debug(
+                f"[ROUTING_SNAPSHOT] Skip client {client.get('name')}: non livrable - {deliverable_check['reason']}"
+            )
+            continue
+
+        stats = counters[cmd.get("id")]
+        quota = cmd.get("quota_semaine", 0)
+        if quota > 0:
+            remaining = quota - stats["delivered"]
+            if remaining <= 0:
+                continue
+        else:
+            remaining = 999999
+
+        if cmd.get("client_id") in prepaid_empty:
+            logger.info(
+                f"[ROUTING_SNAPSHOT] Skip {client.get('name')}: PREPAID balance empty for {produit}"
+            )
+            continue
+
+        cmd["client_name"] = client.get("name", "")
+        cmd["client_delivery_emails"] = client.get("delivery_emails", [])
+        cmd["client_email"] = client.get("email", "")
+        # Push API temps réel: client API en envoi automatique
+        cmd["client_api_endpoint"] = (
+            (client.get("api_endpoint") or "").strip() if client.get("auto_send_enabled", True) else ""
+        )
+        cmd["quota_remaining"] = remaining
+        cmd["leads_delivered_this_week"] = stats["delivered"]
+        cmd["lb_delivered_this_week"] = stats["lb_delivered"]
+        open_commandes.append(cmd)
+
+    return open_commandes
+
+
+async def _get_produit_snapshot(entity: str, produit: str, week_start: str) -> Tuple[ProduitSnapshot, bool]:
+    """Retourne (snapshot, was_cached). Single-flight par (entity, produit)."""
+    key = (entity, produit)
+    snap = _snapshots.get(key)
+    if snap and snap.is_valid(week_start, _generation):
+        return snap, True
+
+    lock = _build_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        snap = _snapshots.get(key)
+        if snap and snap.is_valid(week_start, _generation):
+            return snap, True
+
+        generation = _generation
+        commandes = await _build_produit_snapshot(entity, produit, week_start)
+        snap = ProduitSnapshot(entity, produit, week_start, commandes, generation)
+        _stats["builds"] += 1
+        # Ne pas publier un snapshot invalidé pendant sa construction
+        if generation == _generation and SNAPSHOT_TTL_SECONDS > 0:
+            _snapshots[key] = snap
+        return snap, False
+
+
+async def get_open_commandes(entity: str, produit: str, departement: str) -> List[Dict]:
+    """
+    Commandes OPEN (non-LB) pour (entity, produit, departement), triées par priorite.
+    Retourne des copies: l'appelant peut les modifier sans polluer le snapshot.
+    """
+    from services.routing_engine import get_week_start
+
+    snap, was_cached = await _get_produit_snapshot(entity, produit, get_week_start())
+    commandes, memo_hit = snap.for_departement(departement)
+
+    if was_cached:
+        _stats["hits"] += 1
+        if not commandes:
+            _stats["negative_hits"] += 1
+    else:
+        _stats["misses"] += 1
+
+    return [dict(cmd) for cmd in commandes]
+
+
+def note_commande_full(entity: str, produit: str, commande_id: str) -> None:
+    """Retire une commande du snapshot (réservation refusée: quota atteint ailleurs)"""
+    snap = _snapshots.get((entity, produit))
+    if not snap:
+        return
+    before = len(snap.commandes)
+    snap.commandes = [c for c in snap.commandes if c.get("id") != commande_id]
+    if len(snap.commandes) != before:
+        snap.by_dept.clear()
+
+
+def note_commande_routed(entity: str, produit: str, commande_id: str, is_lb: bool = False) -> None:
+    """
+    Consomme localement une unité de quota après un routing réussi.
+    Si le quota tombe à 0, la commande sort du snapshot (plus OPEN).
+    """
+    snap = _snapshots.get((entity, produit))
+    if not snap:
+        return
+
+    for cmd in snap.commandes:
+        if cmd.get("id") != commande_id:
+            continue
+        _stats["quota_consumed"] += 1
+        cmd["leads_delivered_this_week"] = cmd.get("leads_delivered_this_week", 0) + 1
+        if is_lb:
+            cmd["lb_delivered_this_week"] = cmd.get("lb_delivered_this_week", 0) + 1
+        if cmd.get("quota_semaine", 0) > 0:
+            cmd["quota_remaining"] = cmd.get("quota_remaining", 0) - 1
+            if cmd["quota_remaining"] <= 0:
+                snap.commandes = [c for c in snap.commandes if c.get("id") != commande_id]
+                snap.by_dept.clear()
+                logger.info(f"[ROUTING_SNAPSHOT] Commande {commande_id[:8]}... quota_full -> retirée")
+        return
@@ -10,20 +10,97 @@ Settings disponibles:
 - forms_config: mapping form_code -> entity + produit
 - email_denylist: domaines email interdits
 - delivery_calendar: jours de livraison par entity
+
+CACHE (process-local):
+- get_setting() sert depuis un cache en memoire (setting absent = cache negatif)
+- upsert_setting() incremente settings_version (collection partagee)
+- Toutes les SETTINGS_CACHE_TTL_SECONDS (defaut 10s), 1 lecture de la version:
+  si elle a change (ecriture sur un autre worker) → cache vide
+- SETTINGS_CACHE_TTL_SECONDS=0 desactive le cache
 """
 
+import os
+import copy
+import time
 import logging
 from typing import Optional, Dict, Any, List
 from datetime import datetime, timezone
+from pymongo import ReturnDocument
 from config import db, now_iso
 
 logger = logging.getLogger("settings")
 
+SETTINGS_CACHE_TTL_SECONDS = float(os.environ.get("SETTINGS_CACHE_TTL_SECONDS", "10"))
+SETTINGS_VERSION_ID = "settings"
+
+_cache: Dict[str, Optional[Dict]] = {}
+_cache_version: Optional[int] = None
+_cache_checked_at = 0.0
+_cache_generation = 0
+_cache_stats = {
+    "hits": 0,
+    "misses": 0,
+    "version_checks": 0,
+    "invalidations": 0,
+}
+
+
+def invalidate_settings_cache(reason: str = "") -> None:
+    """Vide le cache settings du worker courant"""
+    global _cache_generation
+    _cache_generation += 1
+    _cache.clear()
+    _cache_stats["invalidations"] += 1
+    if reason:
+        logger.debug(f"[SETTINGS_CACHE] invalidated: {reason}")
+
+
+def get_settings_cache_stats() -> Dict:
+    """Metriques du cache settings (pour /system/health)"""
+    total = _cache_stats["hits"] + _cache_stats["misses"]
+    return {
+        **_cache_stats,
+        "enabled": SETTINGS_CACHE_TTL_SECONDS > 0,
+        "ttl_seconds": SETTINGS_CACHE_TTL_SECONDS,
+        "version": _cache_version,
+        "keys": len(_cache),
+        "hit_rate": round(_cache_stats["hits"] / total * 100, 1) if total > 0 else 0,
+    }
+
+
+async def _ensure_cache_fresh() -> None:
+    """Relit settings_version au plus 1 fois par TTL; vide le cache si elle a change"""
+    global _cache_version, _cache_checked_at
+    if time.monotonic() - _cache_checked_at < SETTINGS_CACHE_TTL_SECONDS:
+        return
+
+    doc = await db.settings_version.find_one({"_id": SETTINGS_VERSION_ID}, {"version": 1})
+    version = (doc or {}).get("version", 0)
+    _cache_stats["version_checks"] += 1
+    if version != _cache_version:
+        if _cache_version is not None:
+            invalidate_settings_cache(f"version {_cache_version} -> {version}")
+        _cache_version = version
+    _cache_checked_at = time.monotonic()
+
 
 async def get_setting(key: str) -> Optional[Dict]:
-    """Recupere un setting par sa cle"""
+    """Recupere un setting par sa cle (copie: l'appelant peut la modifier)"""
+    if SETTINGS_CACHE_TTL_SECONDS <= 0:
+        return await db.settings.find_one({"key": key}, {"_id": 0})
+
+    await _ensure_cache_fresh()
+    if key in _cache:
+        _cache_stats["hits"] += 1
+        return copy.deepcopy(_cache[key])
+
+    _cache_stats["misses"] += 1
+    generation = _cache_generation
     doc = await db.settings.find_one({"key": key}, {"_id": 0})
-    return doc
+    # Ne pas publier une valeur lue pendant une invalidation
+    if generation == _cache_generation:
+        _cache[key] = doc
+    return copy.deepcopy(doc)
 
 
 async def upsert_setting(key: str, data: Dict[str, Any], updated_by: str = "system") -> Dict:
@@ -39,6 +116,22 @@ async def upsert_setting(key: str, data: Dict[str, Any], updated_by: str = "syst
         data["created_at"] = now_iso()
         await db.settings.insert_one(data)
 
+    # Version partagee: les autres workers videront leur cache (≤ TTL)
+    global _cache_version, _cache_checked_at
+    version_doc = await db.settings_version.find_one_and_update(
+        {"_id": SETTINGS_VERSION_ID},
+        {"$inc": {"version": 1}, "$set": {"updated_at": now_iso(), "key": key}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    invalidate_settings_cache(f"upsert:{key}")
+    _cache_version = (version_doc or {}).get("version")
+    _cache_checked_at = time.monotonic()
+
+    # Denylist / calendar / cross-entity influencent le routing
+    from services.routing_snapshot import invalidate_routing_snapshot
+    invalidate_routing_snapshot(f"setting:{key}")
+
     result = await db.settings.find_one({"key": key}, {"_id": 0})
     return result
 
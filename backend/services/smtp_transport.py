@@ -0,0 +1,226 @@
+"""
+RDZ CRM - Transport SMTP non bloquant (pool de connexions par entité)
+
+smtplib est synchrone: chaque opération réseau (connexion SSL, login,
+envoi) tourne dans un pool de threads dédié (SMTP_THREAD_POOL_SIZE) →
+la boucle asyncio n'est jamais bloquée pendant un envoi.
+
+CONNEXIONS: jusqu'à SMTP_MAX_CONCURRENCY_PER_ENTITY connexions
+authentifiées par entité, réutilisées d'un envoi à l'autre (un batch de
+livraisons = 1 login). Une connexion inactive depuis plus de
+SMTP_IDLE_TIMEOUT_SECONDS est fermée avant réutilisation (le serveur
+l'aura probablement coupée). Connexion réutilisée coupée par le serveur
+(SMTPServerDisconnected) → 1 nouvelle tentative sur une connexion neuve.
+
+CONCURRENCE: sémaphore par entité (= nombre max de connexions) → pas de
+rafale de logins sur le compte SMTP d'une entité.
+
+MÉTRIQUES: latence par envoi (dernière / moyenne / max) par entité,
+connexions ouvertes / réutilisées → get_smtp_stats() (/system/health).
+"""
+
+import os
+import time
+import asyncio
+import logging
+import smtplib
+from concurrent.futures import ThreadPoolExecutor
+from email.message import Message
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger("smtp_transport")
+
+SMTP_TIMEOUT_SECONDS = float(os.environ.get("SMTP_TIMEOUT_SECONDS", "30"))
+SMTP_MAX_CONCURRENCY_PER_ENTITY = int(os.environ.get("SMTP_MAX_CONCURRENCY_PER_ENTITY", "2"))
+SMTP_IDLE_TIMEOUT_SECONDS = float(os.environ.get("SMTP_IDLE_TIMEOUT_SECONDS", "60"))
+SMTP_THREAD_POOL_SIZE = int(os.environ.get("SMTP_THREAD_POOL_SIZE", "4"))
+
+# Configuration SMTP par entité (mot de passe en variable d'environnement)
+SMTP_CONFIG = {
+    "ZR7": {
+        "host": "ssl0.ovh.net",
+        "port": 465,
+        "email": "vos-leads@zr7-digital.fr",
+        "password_env": "ZR7_SMTP_PASSWORD"
+    },
+    "MDL": {
+        "host": "ssl0.ovh.net",
+        "port": 465,
+        "email": "livraisonleads@maisonduleads.fr",
+        "password_env": "MDL_SMTP_PASSWORD"
+    }
+}
+
+# Remplaçable dans les tests (serveur factice)
+SMTP_CLASS = smtplib.SMTP_SSL
+
+_executor: Optional[ThreadPoolExecutor] = None
+# entity -> [(connexion, dernier usage monotonic)]
+_idle: Dict[str, List[Tuple[smtplib.SMTP, float]]] = {}
+# entity -> (loop, sémaphore): un sémaphore asyncio est lié à sa boucle
+_semaphores: Dict[str, Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = {}
+_stats: Dict[str, Dict] = {}
+
+
+def get_smtp_config(entity: str) -> Optional[Dict]:
+    return SMTP_CONFIG.get(entity)
+
+
+def _entity_stats(entity: str) -> Dict:
+    if entity not in _stats:
+        _stats[entity] = {
+            "sent": 0,
+            "errors": 0,
+            "connections_opened": 0,
+            "connections_reused": 0,
+            "reconnects": 0,
+            "in_flight": 0,
+            "last_latency_ms": 0,
+            "avg_latency_ms": 0,
+            "max_latency_ms": 0,
+            "total_latency_ms": 0,
+        }
+    return _stats[entity]
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=max(1, SMTP_THREAD_POOL_SIZE), thread_name_prefix="smtp"
+        )
+    return _executor
+
+
+def _get_semaphore(entity: str) -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    current = _semaphores.get(entity)
+    if current is None or current[0] is not loop:
+        # Nouvelle boucle (tests, reload): les connexions restent valides
+        current = (loop, asyncio.Semaphore(max(1, SMTP_MAX_CONCURRENCY_PER_ENTITY)))
+        _semaphores[entity] = current
+    return current[1]
+
+
+async def _run(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_get_executor(), func, *args)
+
+
+def _open_connection(config: Dict, password: str) -> smtplib.SMTP:
+    """Thread SMTP: connexion SSL + login"""
+    server = SMTP_CLASS(config["host"], config["port"], timeout=SMTP_TIMEOUT_SECONDS)
+    try:
+        server.login(config["email"], password)
+    except Exception:
+        _close_connection(server)
+        raise
+    return server
+
+
+def _close_connection(server: smtplib.SMTP) -> None:
+    """Thread SMTP: QUIT, ou fermeture brute si la connexion est déjà morte"""
+    try:
+        server.quit()
+    except Exception:
+        try:
+            server.close()
+        except Exception:
+            pass
+
+
+def _take_idle(entity: str) -> Tuple[Optional[smtplib.SMTP], List[smtplib.SMTP]]:
+    """Connexion réutilisable la plus récente + connexions expirées à fermer"""
+    idle = _idle.get(entity, [])
+    now = time.monotonic()
+    expired = [server for server, last in idle if now - last > SMTP_IDLE_TIMEOUT_SECONDS]
+    fresh = [(server, last) for server, last in idle if now - last <= SMTP_IDLE_TIMEOUT_SECONDS]
+    server = fresh.pop()[0] if fresh else None
+    _idle[entity] = fresh
+    return server, expired
+
+
+async def send_message(entity: str, msg: Message) -> int:
+    """
+    Envoie un message via le pool de l'entité.
+    Retourne la latence en ms (attente du sémaphore incluse).
+    Lève ValueError (entité / mot de passe) ou smtplib.SMTPException.
+    """
+    config = get_smtp_config(entity)
+    if not config:
+        raise ValueError(f"Entity {entity} non configurée")
+    password = os.environ.get(config["password_env"], "")
+    if not password:
+        raise ValueError(f"Mot de passe SMTP non configuré pour {entity}")
+
+    stats = _entity_stats(entity)
+    started = time.perf_counter()
+    async with _get_semaphore(entity):
+        stats["in_flight"] += 1
+        try:
+            server, expired = _take_idle(entity)
+            for old in expired:
+                await _run(_close_connection, old)
+
+            reused = server is not None
+            if reused:
+                stats["connections_reused"] += 1
+            else:
+                server = await _run(_open_connection, config, password)
+                stats["connections_opened"] += 1
+
+            try:
+                await _run(server.send_message, msg)
+            except smtplib.SMTPServerDisconnected:
+                await _run(_close_connection, server)
+                if not reused:
+                    raise
+                # Connexion du pool coupée côté serveur: 1 retry sur une neuve
+                stats["reconnects"] += 1
+                server = await _run(_open_connection, config, password)
+                stats["connections_opened"] += 1
+                try:
+                    await _run(server.send_message, msg)
+                except Exception:
+                    await _run(_close_connection, server)
+                    raise
+            except Exception:
+                await _run(_close_connection, server)
+                raise
+
+            _idle.setdefault(entity, []).append((server, time.monotonic()))
+        except Exception:
+            stats["errors"] += 1
+            raise
+        finally:
+            stats["in_flight"] -= 1
+
+    latency_ms = int((time.perf_counter() - started) * 1000)
+    stats["sent"] += 1
+    stats["last_latency_ms"] = latency_ms
+    stats["max_latency_ms"] = max(stats["max_latency_ms"], latency_ms)
+    stats["total_latency_ms"] += latency_ms
+    stats["avg_latency_ms"] = stats["total_latency_ms"] // stats["sent"]
+    return latency_ms
+
+
+async def close_smtp_connections() -> None:
+    """Ferme les connexions inactives (arrêt du serveur)"""
+    idle = [server for conns in _idle.values() for server, _ in conns]
+    _idle.clear()
+    for server in idle:
+        await _run(_close_connection, server)
+    if idle:
+        logger.info(f"[SMTP] {len(idle)} connexion(s) fermée(s)")
+
+
+def get_smtp_stats() -> Dict:
+    """Métriques du transport (pour /system/health)"""
+    return {
+        "max_concurrency_per_entity": SMTP_MAX_CONCURRENCY_PER_ENTITY,
+        "idle_timeout_seconds": SMTP_IDLE_TIMEOUT_SECONDS,
+        "idle_connections": {entity: len(conns) for entity, conns in _idle.items()},
+        "entities": {
+            entity: {k: v for k, v in s.items() if k != "total_latency_ms"}
+            for entity, s in _stats.items()
+        },
+    }
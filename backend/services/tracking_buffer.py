@@ -0,0 +1,280 @@
+"""
+RDZ CRM - Buffer write-behind du tracking (/track/lp-visit, /track/event)
+
+Les beacons sont acquittés immédiatement; les événements sont écrits par
+lots (insert_many ordered=False) toutes les TRACKING_FLUSH_INTERVAL_MS
+ou dès TRACKING_FLUSH_BATCH_SIZE événements.
+
+ANTI-DOUBLON (lp_visit, cta_click, form_start):
+- index unique partiel (session_id, event) sur once_per_session=True
+  → le doublon est rejeté par Mongo au flush (E11000 ignoré)
+- mémoire locale (session_id, event) → réponse "duplicate" immédiate
+  dans le worker courant, sans lecture
+
+FILE BORNÉE: TRACKING_BUFFER_MAX_EVENTS. File pleine (ou buffer non
+démarré) → écriture directe (aucune perte, backpressure sur l'appelant).
+ÉCHEC DE FLUSH (réseau, élection primaire...): les éléments en erreur sont
+remis en file (TRACKING_FLUSH_MAX_ATTEMPTS tentatives, pause croissante),
+puis écrits un par un en direct; seul l'échec de cette écriture compte en erreur.
+ARRÊT: stop_tracking_buffer() vide la file avant la fermeture (lifespan).
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from config import db
+
+logger = logging.getLogger("tracking_buffer")
+
+ONCE_PER_SESSION_EVENTS = ["lp_visit", "cta_click", "form_start"]
+
+FLUSH_INTERVAL_MS = int(os.environ.get("TRACKING_FLUSH_INTERVAL_MS", "500"))
+FLUSH_BATCH_SIZE = int(os.environ.get("TRACKING_FLUSH_BATCH_SIZE", "500"))
+BUFFER_MAX_EVENTS = int(os.environ.get("TRACKING_BUFFER_MAX_EVENTS", "20000"))
+FLUSH_MAX_ATTEMPTS = int(os.environ.get("TRACKING_FLUSH_MAX_ATTEMPTS", "3"))
+SEEN_MAX_KEYS = 50000
+
+# (enqueued_at, kind, payload, attempts) — kind: "event" | "session"
+_queue: Optional[asyncio.Queue] = None
+_flusher: Optional[asyncio.Task] = None
+_stopping = False
+_seen_once: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+_stats = {
+    "enqueued": 0,
+    "flushed": 0,
+    "duplicates": 0,
+    "flushes": 0,
+    "direct_writes": 0,
+    "retried": 0,
+    "errors": 0,
+    "last_flush_lag_ms": 0,
+    "max_flush_lag_ms": 0,
+}
+
+
+def _remember_once(session_id: str, event_type: str, event_id: str) -> Optional[str]:
+    """Retourne l'event_id déjà vu pour (session, event), sinon l'enregistre"""
+    key = (session_id, event_type)
+    existing = _seen_once.get(key)
+    if existing:
+        return existing
+    _seen_once[key] = event_id
+    while len(_seen_once) > SEEN_MAX_KEYS:
+        _seen_once.popitem(last=False)
+    return None
+
+
+def prepare_event(event: Dict) -> Optional[str]:
+    """
+    Marque les événements uniques par session (once_per_session=True).
+    Retourne l'event_id existant si doublon connu localement, sinon None.
+    """
+    if event.get("event") not in ONCE_PER_SESSION_EVENTS:
+        return None
+    event["once_per_session"] = True
+    return _remember_once(event["session_id"], event["event"], event["id"])
+
+
+async def _write_events(events: List[Dict]) -> List[int]:
+    """
+    insert_many non ordonné; les doublons (E11000) sont ignorés.
+    Retourne les index des événements en erreur (hors doublons).
+    """
+    try:
+        result = await db.tracking.insert_many(events, ordered=False)
+        _stats["flushed"] += len(result.inserted_ids)
+        return []
+    except BulkWriteError as e:
+        details = e.details or {}
+        write_errors = details.get("writeErrors", [])
+        dups = [w for w in write_errors if w.get("code") == 11000]
+        _stats["flushed"] += details.get("nInserted", 0)
+        _stats["duplicates"] += len(dups)
+        failed = [w["index"] for w in write_errors if w.get("code") != 11000]
+        if failed:
+            logger.warning(f"[TRACKING_BUFFER] {len(failed)} événements en erreur")
+        return failed
+
+
+async def _write_session_updates(updates: Dict[str, Dict]) -> None:
+    ops = [UpdateOne({"id": sid}, {"$set": fields}) for sid, fields in updates.items()]
+    if ops:
+        await db.visitor_sessions.bulk_write(ops, ordered=False)
+
+
+async def _write_direct(kind: str, payload: Dict) -> None:
+    """Écriture unitaire (dernier recours après les tentatives en lot)"""
+    _stats["direct_writes"] += 1
+    try:
+        if kind == "event":
+            await db.tracking.insert_one(payload)
+            _stats["flushed"] += 1
+        else:
+            await db.visitor_sessions.update_one({"id": payload["session_id"]}, {"$set": payload["fields"]})
+    except DuplicateKeyError:
+        _stats["duplicates"] += 1
+    except Exception as e:
+        _stats["errors"] += 1
+        logger.error(f"[TRACKING_BUFFER] Écriture directe {kind} échouée: {e}")
+
+
+async def _retry(items: List[Tuple[float, str, Dict, int]]) -> None:
+    """Remet en file (tentatives restantes, hors arrêt) ou écrit en direct"""
+    requeued = 0
+    for enqueued_at, kind, payload, attempts in items:
+        if attempts + 1 < FLUSH_MAX_ATTEMPTS and not _stopping:
+            try:
+                _queue.put_nowait((enqueued_at, kind, payload, attempts + 1))
+                requeued += 1
+                continue
+            except asyncio.QueueFull:
+                pass
+        await _write_direct(kind, payload)
+
+    if requeued:
+        _stats["retried"] += requeued
+        # Laisse passer l'incident (élection, réseau) avant le lot suivant
+        attempts = max(item[3] for item in items) + 1
+        await asyncio.sleep(FLUSH_INTERVAL_MS / 1000 * 2 ** attempts)
+
+
+async def _flush(batch: List[Tuple[float, str, Dict, int]]) -> None:
+    event_items = [item for item in batch if item[1] == "event"]
+    session_items = [item for item in batch if item[1] == "session"]
+    session_updates: Dict[str, Dict] = {}
+    for _, _, payload, _ in session_items:
+        session_updates.setdefault(payload["session_id"], {}).update(payload["fields"])
+
+    failed: List[Tuple[float, str, Dict, int]] = []
+    if event_items:
+        try:
+            failed.extend(event_items[i] for i in await _write_events([item[2] for item in event_items]))
+        except Exception as e:
+            failed.extend(event_items)
+            logger.warning(f"[TRACKING_BUFFER] Flush events échoué ({len(event_items)}): {e}")
+    if session_updates:
+        try:
+            await _write_session_updates(session_updates)
+        except Exception as e:
+            failed.extend(session_items)
+            logger.warning(f"[TRACKING_BUFFER] Flush sessions échoué ({len(session_updates)}): {e}")
+
+    lag_ms = int((time.monotonic() - batch[0][0]) * 1000)
+    _stats["flushes"] += 1
+    _stats["last_flush_lag_ms"] = lag_ms
+    _stats["max_flush_lag_ms"] = max(_stats["max_flush_lag_ms"], lag_ms)
+
+    if failed:
+        await _retry(failed)
+
+
+async def _flush_loop() -> None:
+    """Flush par lots; None en file = arrêt après écriture de ce qui précède"""
+    interval = FLUSH_INTERVAL_MS / 1000
+    while True:
+        first = await _queue.get()
+        if first is None:
+            return
+        batch = [first]
+        stop = False
+        deadline = first[0] + interval
+        while len(batch) < FLUSH_BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                stop = True
+                break
+            batch.append(item)
+        await _flush(batch)
+        if stop:
+            return
+
+
+def _is_running() -> bool:
+    return (
+        _queue is not None and _flusher is not None
+        and not _flusher.done() and not _stopping
+    )
+
+
+async def enqueue_event(event: Dict) -> None:
+    """Ajoute un événement tracking (écriture directe si file pleine / buffer arrêté)"""
+    if _is_running():
+        try:
+            _queue.put_nowait((time.monotonic(), "event", event, 0))
+            _stats["enqueued"] += 1
+            return
+        except asyncio.QueueFull:
+            pass
+
+    _stats["direct_writes"] += 1
+    try:
+        await db.tracking.insert_one(event)
+    except DuplicateKeyError:
+        _stats["duplicates"] += 1
+
+
+async def enqueue_session_update(session_id: str, fields: Dict) -> None:
+    """MAJ visitor_session (UTM manquants), coalescée au flush"""
+    if not fields:
+        return
+    if _is_running():
+        try:
+            _queue.put_nowait((time.monotonic(), "session", {"session_id": session_id, "fields": fields}, 0))
+            return
+        except asyncio.QueueFull:
+            pass
+
+    _stats["direct_writes"] += 1
+    await db.visitor_sessions.update_one({"id": session_id}, {"$set": fields})
+
+
+def start_tracking_buffer() -> None:
+    """Démarre le flusher (lifespan)"""
+    global _queue, _flusher, _stopping
+    if _is_running():
+        return
+    _stopping = False
+    _queue = asyncio.Queue(maxsize=BUFFER_MAX_EVENTS)
+    _flusher = asyncio.create_task(_flush_loop())
+    logger.info(
+        f"[TRACKING_BUFFER] started interval={FLUSH_INTERVAL_MS}ms "
+        f"batch={FLUSH_BATCH_SIZE} max={BUFFER_MAX_EVENTS} attempts={FLUSH_MAX_ATTEMPTS}"
+    )
+
+
+async def stop_tracking_buffer() -> None:
+    """Arrête le flusher après avoir écrit tout ce qui reste en file (lifespan)"""
+    global _flusher, _stopping
+    if _flusher is None:
+        return
+    # Les nouveaux événements passent en écriture directe pendant le drain
+    _stopping = True
+    drained = _queue.qsize()
+    if not _flusher.done():
+        await _queue.put(None)
+        await _flusher
+    _flusher = None
+    logger.info(f"[TRACKING_BUFFER] stopped, drained={drained}")
+
+
+def get_tracking_buffer_stats() -> Dict:
+    """Métriques du buffer (pour /system/health)"""
+    return {
+        **_stats,
+        "running": _is_running(),
+        "queue_depth": _queue.qsize() if _queue is not None else 0,
+        "queue_max": BUFFER_MAX_EVENTS,
+        "flush_interval_ms": FLUSH_INTERVAL_MS,
+        "flush_batch_size": FLUSH_BATCH_SIZE,
+    }
@@ -0,0 +1,158 @@
+"""
+RDZ CRM — Daily Allocation Optimizer Tests
+Tests: flot max (commande "*" prioritaire vs commande étroite), priorités,
+doublons 30j, objectif LB, dry run, rapport de remplissage, volumétrie.
+Run: cd /app/backend && pytest tests/test_allocation_optimizer.py -v
+"""
+
+import sys
+import time
+import random
+import asyncio
+
+sys.path.insert(0, "/app/backend")
+
+import pytest
+
+from services import daily_delivery, event_logger
+from services.allocation_optimizer import FlowGraph, optimize_allocation
+from services.daily_delivery import DeliveryHistory, LeadPool
+
+
+def _lead(lead_id, dept, created_at, phone=None, produit="PV"):
+    return {
+        "id": lead_id, "produit": produit, "departement": dept,
+        "created_at": created_at, "phone": phone or f"06{lead_id}",
+    }
+
+
+def _cmd(cmd_id, departements, quota, lb_target_pct=0, produit="PV"):
+    return {
+        "id": cmd_id, "client_id": f"client-{cmd_id}", "client_name": cmd_id, "entity": "ZR7",
+        "produit": produit, "departements": departements, "quota": quota, "lb_target_pct": lb_target_pct,
+    }
+
+
+@pytest.fixture(autouse=True)
+def no_db(monkeypatch):
+    async def state(cmd, week_start):
+        return {"already_delivered": 0, "already_lb": 0, "quota_remaining": cmd["quota"]}
+
+    events = []
+
+    async def log_event(**kwargs):
+        events.append(kwargs)
+
+    monkeypatch.setattr(daily_delivery, "get_commande_allocation_state", state)
+    monkeypatch.setattr(event_logger, "log_event", log_event)
+    return events
+
+
+def _run(commandes, fresh, lb=(), history=None, dry_run=False):
+    used = set()
+    return asyncio.run(optimize_allocation(
+        "ZR7", commandes, LeadPool.from_leads(fresh, used), LeadPool.from_leads(list(lb), used),
+        history or DeliveryHistory(), "2026-01-05", dry_run=dry_run
+    ))
+
+
+def _allocated(allocations):
+    return {a["cmd"]["id"]: sorted(lead["id"] for lead in a["leads"]) for a in allocations if a["leads"]}
+
+
+class TestFlowGraph:
+    def test_reroutes_existing_flow(self):
+        graph = FlowGraph()
+        s, a, b, x, y = (graph.add_node() for _ in range(5))
+        graph.add_edge(s, a, 1)
+        graph.add_edge(s, b, 1)
+        graph.add_edge(a, x, 1)
+        graph.add_edge(b, x, 1)
+        graph.add_edge(a, y, 1)
+        assert graph.augment(s, x, 1) == 1
+        assert graph.augment(s, y, 1) == 1
+        assert graph.augment(s, x, 1) == 0
+
+
+class TestOptimizer:
+    def test_wildcard_does_not_starve_narrow_commande(self):
+        fresh = [
+            _lead("a13", "13", "2026-01-01"), _lead("b13", "13", "2026-01-02"),
+            _lead("a75", "75", "2026-01-03"), _lead("b75", "75", "2026-01-04"),
+        ]
+        commandes = [_cmd("wide", ["*"], 2), _cmd("narrow", ["13"], 2)]
+        planned, report = _run(commandes, fresh)
+
+        assert _allocated(planned) == {"wide": ["a75", "b75"], "narrow": ["a13", "b13"]}
+        assert report["optimizer"]["fill_rate"] == 1.0
+        assert report["greedy_estimate"]["allocated"] <= report["optimizer"]["allocated"]
+
+    def test_priority_wins_under_scarcity(self):
+        fresh = [_lead("a", "13", "2026-01-01")]
+        planned, report = _run([_cmd("first", ["13"], 1), _cmd("second", ["13"], 1)], fresh)
+        assert _allocated(planned) == {"first": ["a"]}
+        assert report["optimizer"]["commandes_short"] == 1
+
+    def test_oldest_first_within_bucket(self):
+        fresh = [_lead("new", "13", "2026-01-05"), _lead("old", "13", "2026-01-01")]
+        planned, _ = _run([_cmd("c", ["13"], 1)], fresh)
+        assert _allocated(planned) == {"c": ["old"]}
+
+    def test_blocked_lead_goes_to_other_client(self):
+        fresh = [_lead("a", "13", "2026-01-01", phone="0611"), _lead("b", "13", "2026-01-02", phone="0622")]
+        history = DeliveryHistory(blocked={("0611", "PV", "client-first")})
+        planned, _ = _run([_cmd("first", ["13"], 1), _cmd("second", ["13"], 1)], fresh, history=history)
+        assert _allocated(planned) == {"first": ["b"], "second": ["a"]}
+        assert planned[0]["skipped_duplicates"] == 1
+
+    def test_lb_target(self):
+        fresh = [_lead(f"f{i}", "13", f"2026-01-0{i + 1}") for i in range(4)]
+        lb = [_lead(f"l{i}", "13", f"2025-12-0{i + 1}") for i in range(4)]
+        planned, _ = _run([_cmd("c", ["13"], 4, lb_target_pct=0.5)], fresh, lb)
+        allocation, = planned
+        assert len(allocation["leads"]) == 4
+        assert allocation["lb_count"] == 2
+
+    def test_no_lb_when_target_zero(self):
+        lb = [_lead("l", "13", "2025-12-01")]
+        planned, _ = _run([_cmd("c", ["13"], 1)], [], lb)
+        assert _allocated(planned) == {}
+
+    def test_lb_shortfall_logged(self, no_db):
+        fresh = [_lead(f"f{i}", "13", f"2026-01-0{i + 1}") for i in range(2)]
+        planned, _ = _run([_cmd("c", ["13"], 2, lb_target_pct=0.5)], fresh)
+        assert len(planned[0]["leads"]) == 2
+        assert planned[0]["lb_shortfall"]["lb_needed"] == 1
+        assert [e["action"] for e in no_db] == ["lb_shortfall"]
+
+    def test_lb_shortfall_not_logged_in_dry_run(self, no_db):
+        fresh = [_lead(f"f{i}", "13", f"2026-01-0{i + 1}") for i in range(2)]
+        planned, _ = _run([_cmd("c", ["13"], 2, lb_target_pct=0.5)], fresh, dry_run=True)
+        assert planned[0]["lb_shortfall"]["lb_needed"] == 1
+        assert no_db == []
+
+    def test_produits_isolated(self):
+        fresh = [_lead("pac", "13", "2026-01-01", produit="PAC")]
+        planned, _ = _run([_cmd("pv", ["*"], 1)], fresh)
+        assert _allocated(planned) == {}
+
+    def test_scale(self):
+        rng = random.Random(7)
+        depts = [f"{d:02d}" for d in range(1, 96)]
+        fresh = [
+            _lead(f"l{i}", rng.choice(depts), f"2026-01-{rng.randint(1, 28):02d}", produit=rng.choice(["PV", "PAC"]))
+            for i in range(50000)
+        ]
+        commandes = [
+            _cmd(f"c{i}", ["*"] if i % 10 == 0 else rng.sample(depts, 3), rng.randint(20, 200),
+                 produit=rng.choice(["PV", "PAC"]))
+            for i in range(500)
+        ]
+        started = time.perf_counter()
+        planned, report = _run(commandes, fresh)
+        elapsed = time.perf_counter() - started
+
+        assert elapsed < 30
+        assert report["optimizer"]["allocated"] >= report["greedy_estimate"]["allocated"]
+        delivered = [lead["id"] for a in planned for lead in a["leads"]]
+        assert len(delivered) == len(set(delivered))
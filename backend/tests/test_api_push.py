@@ -0,0 +1,195 @@
+"""
+RDZ CRM — API Push Delivery Tests
+Tests: POST vers un serveur HTTP local, classification des échecs, circuit breaker,
+concurrence par client, payload (colonnes CSV).
+Run: cd /app/backend && pytest tests/test_api_push.py -v
+"""
+
+import sys
+import json
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, "/app/backend")
+
+import pytest
+
+from services import api_push
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Endpoint client factice: statut / délai pilotés par le test"""
+
+    def do_POST(self):
+        stub = self.server.stub
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with stub["lock"]:
+            stub["active"] += 1
+            stub["max_active"] = max(stub["max_active"], stub["active"])
+            stub["requests"].append({"headers": dict(self.headers), "json": json.loads(body)})
+        time.sleep(stub["delay"])
+        with stub["lock"]:
+            stub["active"] -= 1
+        self.send_response(stub["status"])
+        self.end_headers()
+        self.wfile.write(b'{"ok": true}')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.stub = {
+        "status": 200, "delay": 0.0, "requests": [],
+        "active": 0, "max_active": 0, "lock": threading.Lock(),
+    }
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.stub, f"http://127.0.0.1:{server.server_address[1]}/leads"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(api_push, "_http", None)
+    monkeypatch.setattr(api_push, "_semaphores", {})
+    monkeypatch.setattr(api_push, "_breakers", {})
+    monkeypatch.setattr(api_push, "_stats", {})
+
+
+def _post(endpoint, client_id="client-1", payload=None):
+    async def run():
+        try:
+            return await api_push.post_leads(client_id, endpoint, "key-123", payload or {"leads": []}, "job-1")
+        finally:
+            await api_push.close_api_push_client()
+    return asyncio.run(run())
+
+
+class TestPost:
+    def test_success(self, stub_server):
+        stub, endpoint = stub_server
+        result = _post(endpoint, payload={"leads": [{"telephone": "0611223344"}]})
+        assert result["success"] is True
+        assert result["status_code"] == 200
+        request = stub["requests"][0]
+        assert request["headers"]["Authorization"] == "key-123"
+        assert request["headers"]["Idempotency-Key"] == "job-1"
+        assert request["json"]["leads"][0]["telephone"] == "0611223344"
+
+    def test_server_error_retryable(self, stub_server):
+        stub, endpoint = stub_server
+        stub["status"] = 503
+        result = _post(endpoint)
+        assert result["success"] is False
+        assert result["retryable"] is True
+
+    def test_client_error_not_retryable(self, stub_server):
+        stub, endpoint = stub_server
+        stub["status"] = 422
+        result = _post(endpoint)
+        assert result["success"] is False
+        assert result["retryable"] is False
+        # Un 4xx définitif ne compte pas pour le circuit
+        assert api_push._breakers == {}
+
+    def test_rate_limited_retryable(self, stub_server):
+        stub, endpoint = stub_server
+        stub["status"] = 429
+        assert _post(endpoint)["retryable"] is True
+
+    def test_timeout_retryable(self, stub_server, monkeypatch):
+        stub, endpoint = stub_server
+        stub["delay"] = 0.5
+        monkeypatch.setattr(api_push, "API_PUSH_TIMEOUT_SECONDS", 0.1)
+        result = _post(endpoint)
+        assert result["success"] is False
+        assert result["retryable"] is True
+        assert "Timeout" in result["error"]
+
+    def test_connection_refused_retryable(self):
+        result = _post("http://127.0.0.1:9/leads")
+        assert result["success"] is False
+        assert result["retryable"] is True
+
+
+class TestCircuitBreaker:
+    def test_opens_after_threshold(self, stub_server, monkeypatch):
+        stub, endpoint = stub_server
+        stub["status"] = 500
+        monkeypatch.setattr(api_push, "API_PUSH_BREAKER_THRESHOLD", 3)
+        for _ in range(3):
+            _post(endpoint)
+        result = _post(endpoint)
+        assert result["error"] == "circuit_open"
+        assert result["defer_seconds"] > 0
+        assert len(stub["requests"]) == 3
+        assert api_push.get_api_push_stats()["open_circuits"] == ["client-1"]
+
+    def test_other_client_unaffected(self, stub_server, monkeypatch):
+        stub, endpoint = stub_server
+        stub["status"] = 500
+        monkeypatch.setattr(api_push, "API_PUSH_BREAKER_THRESHOLD", 1)
+        _post(endpoint, client_id="client-1")
+        stub["status"] = 200
+        assert _post(endpoint, client_id="client-2")["success"] is True
+
+    def test_half_open_success_closes(self, stub_server, monkeypatch):
+        stub, endpoint = stub_server
+        stub["status"] = 500
+        monkeypatch.setattr(api_push, "API_PUSH_BREAKER_THRESHOLD", 1)
+        monkeypatch.setattr(api_push, "API_PUSH_BREAKER_COOLDOWN_SECONDS", 0.05)
+        _post(endpoint)
+        time.sleep(0.06)
+        stub["status"] = 200
+        assert _post(endpoint)["success"] is True
+        assert api_push.breaker_wait_seconds("client-1") == 0
+        assert api_push._breakers["client-1"]["failures"] == 0
+
+
+class TestConcurrency:
+    def test_per_client_cap(self, stub_server, monkeypatch):
+        stub, endpoint = stub_server
+        stub["delay"] = 0.05
+        monkeypatch.setattr(api_push, "API_PUSH_MAX_CONCURRENCY_PER_CLIENT", 2)
+
+        async def run():
+            try:
+                return await asyncio.gather(*[
+                    api_push.post_leads("client-1", endpoint, "", {"leads": []}, f"job-{i}")
+                    for i in range(6)
+                ])
+            finally:
+                await api_push.close_api_push_client()
+        results = asyncio.run(run())
+
+        assert all(r["success"] for r in results)
+        assert stub["max_active"] <= 2
+
+
+class TestPayload:
+    def test_rows_match_csv_columns(self):
+        from services.csv_delivery import CSV_COLUMNS_ZR7
+        job = {
+            "batch_id": "b1", "entity": "ZR7", "produit": "PV",
+            "delivery_ids": ["d1", "d2"], "lead_ids": ["l1", "l2"],
+        }
+        leads = [{"id": "l2", "nom": "Martin", "phone": "0611223344", "produit": "PAC"}]
+        payload = api_push.build_payload(job, leads)
+        assert payload["batch_id"] == "b1"
+        assert len(payload["leads"]) == 1
+        row = payload["leads"][0]
+        assert row["delivery_id"] == "d2"
+        assert row["telephone"] == "0611223344"
+        # LB invisible: produit de la commande
+        assert row["produit"] == "PV"
+        assert set(CSV_COLUMNS_ZR7) <= set(row)
+
+    def test_endpoint_host(self):
+        assert api_push.endpoint_host("https://API.client.fr:8443/leads") == "api.client.fr"
+        assert api_push.endpoint_host("") == ""
@@ -0,0 +1,113 @@
+"""
+RDZ CRM — Bulk Lead Ingestion Tests
+Tests: JSON / {leads: [...]} / NDJSON body parsing, positional errors,
+persistance par tranches (1 transaction par tranche, échec limité à la tranche).
+Run: cd /app/backend && pytest tests/test_bulk_ingestion.py -v
+"""
+
+import sys
+import json
+import asyncio
+
+import pytest
+
+sys.path.insert(0, "/app/backend")
+
+from routes.public import _parse_bulk_body
+from services import lead_ingestion
+
+LEADS = [
+    {"phone": "0611223301", "nom": "a", "departement": "75", "produit": "PV"},
+    {"phone": "0611223302", "nom": "b", "departement": "13", "produit": "PAC"},
+]
+
+
+class TestJsonBody:
+    def test_list(self):
+        items, api_key = _parse_bulk_body(json.dumps(LEADS).encode(), "application/json")
+        assert items == LEADS
+        assert api_key == ""
+
+    def test_envelope_with_api_key(self):
+        body = {"api_key": "prov_x", "leads": LEADS}
+        items, api_key = _parse_bulk_body(json.dumps(body).encode(), "application/json")
+        assert items == LEADS
+        assert api_key == "prov_x"
+
+    def test_single_object(self):
+        items, _ = _parse_bulk_body(json.dumps(LEADS[0]).encode(), "application/json")
+        assert items == [LEADS[0]]
+
+    def test_scalar_rejected(self):
+        with pytest.raises(ValueError):
+            _parse_bulk_body(b"42", "application/json")
+
+    def test_empty(self):
+        assert _parse_bulk_body(b"  ", "application/json") == ([], "")
+
+
+class TestNdjsonBody:
+    def test_lines_in_order(self):
+        raw = "\n".join(json.dumps(lead) for lead in LEADS).encode()
+        items, _ = _parse_bulk_body(raw, "application/x-ndjson")
+        assert items == LEADS
+
+    def test_blank_lines_skipped(self):
+        raw = ("\n" + json.dumps(LEADS[0]) + "\n\n" + json.dumps(LEADS[1]) + "\n").encode()
+        items, _ = _parse_bulk_body(raw, "application/x-ndjson")
+        assert items == LEADS
+
+    def test_bad_line_keeps_position(self):
+        raw = (json.dumps(LEADS[0]) + "\n{bad\n" + json.dumps(LEADS[1])).encode()
+        items, _ = _parse_bulk_body(raw, "application/x-ndjson")
+        assert items == [LEADS[0], None, LEADS[1]]
+
+    def test_detected_without_content_type(self):
+        raw = "\n".join(json.dumps(lead) for lead in LEADS).encode()
+        items, _ = _parse_bulk_body(raw, "")
+        assert items == LEADS
+
+
+class TestPersistChunks:
+    @pytest.fixture
+    def persisted(self, monkeypatch):
+        calls = {"chunks": [], "unrouted": []}
+
+        async def persist(items, inserted=False):
+            ids = [lead["id"] for lead, _ in items]
+            calls["chunks"].append(ids)
+            if "l4" in ids:
+                raise RuntimeError("write conflict")
+
+        async def store_unrouted(leads):
+            calls["unrouted"].append([lead["id"] for lead in leads])
+
+        monkeypatch.setattr(lead_ingestion, "persist_planned_leads", persist)
+        monkeypatch.setattr(lead_ingestion, "store_unrouted_leads", store_unrouted)
+        return calls
+
+    def _items(self, count):
+        leads = [{"id": f"l{i}", "status": "new"} for i in range(count)]
+        return [(lead, None) for lead in leads], [dict(lead) for lead in leads]
+
+    def test_bounded_chunks(self, persisted):
+        items, pristine = self._items(7)
+        reports = asyncio.run(lead_ingestion.persist_planned_chunks(items, pristine, chunk_size=3))
+
+        assert persisted["chunks"] == [["l0", "l1", "l2"], ["l3", "l4", "l5"], ["l6"]]
+        assert [(r["chunk"], r["start"], r["count"]) for r in reports] == [(0, 0, 3), (1, 3, 3), (2, 6, 1)]
+
+    def test_failed_chunk_isolated(self, persisted):
+        items, pristine = self._items(7)
+        reports = asyncio.run(lead_ingestion.persist_planned_chunks(items, pristine, chunk_size=3))
+
+        assert [r["persisted"] for r in reports] == [True, False, True]
+        assert reports[1]["error"] == "write conflict"
+        # Seule la tranche en échec est stockée en "new"
+        assert persisted["unrouted"] == [["l3", "l4", "l5"]]
+
+    def test_default_chunk_size(self, persisted, monkeypatch):
+        monkeypatch.setattr(lead_ingestion, "BULK_PERSIST_CHUNK", 200)
+        items, pristine = self._items(450)
+        reports = asyncio.run(lead_ingestion.persist_planned_chunks(items, pristine))
+        assert [r["count"] for r in reports] == [200, 200, 50]
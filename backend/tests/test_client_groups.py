@@ -0,0 +1,55 @@
+"""
+RDZ CRM — Client Groups Index Tests
+Tests: email normalization, group keys, in-memory shared checks.
+Run: cd /app/backend && pytest tests/test_client_groups.py -v
+"""
+
+import sys
+
+sys.path.insert(0, "/app/backend")
+
+from services.client_groups import ClientGroupIndex, client_emails, group_key_for
+from services.overlap_guard import compute_client_group_key
+
+
+GROUPS = [
+    {"email": "shared@x.fr", "entities": {"ZR7": ["a"], "MDL": ["m"]}, "shared": True},
+    {"email": "a@x.fr", "entities": {"ZR7": ["a"]}, "shared": False},
+    {"email": "b@x.fr", "entities": {"ZR7": ["b"], "MDL": []}, "shared": False},
+    {"email": "empty@x.fr", "entities": {"ZR7": []}, "shared": False},
+]
+
+
+class TestClientEmails:
+    def test_normalized_and_deduplicated(self):
+        emails = client_emails({"email": " A@X.fr ", "delivery_emails": ["a@x.fr", "B@x.fr", ""]})
+        assert emails == {"a@x.fr", "b@x.fr"}
+
+    def test_group_key_matches_guard(self):
+        client = {"email": "Z@x.fr", "delivery_emails": ["a@x.fr"]}
+        assert group_key_for(client_emails(client)) == compute_client_group_key(client)
+        assert compute_client_group_key(client) == "a@x.fr|z@x.fr"
+
+    def test_none_client(self):
+        assert client_emails(None) == set()
+
+
+class TestIndex:
+    def test_group_key(self):
+        idx = ClientGroupIndex(GROUPS)
+        assert idx.group_key("a") == "a@x.fr|shared@x.fr"
+        assert idx.group_key("unknown") == ""
+
+    def test_shared_with_other_entity(self):
+        idx = ClientGroupIndex(GROUPS)
+        assert idx.shared_with("a", "MDL") == {"m"}
+        assert idx.shared_with("m", "ZR7") == {"a"}
+
+    def test_not_shared(self):
+        idx = ClientGroupIndex(GROUPS)
+        assert idx.shared_with("b", "MDL") == set()
+
+    def test_empty_groups_ignored(self):
+        idx = ClientGroupIndex(GROUPS)
+        assert "empty@x.fr" not in idx.by_email
+        assert set(idx.shared_emails()) == {"shared@x.fr"}
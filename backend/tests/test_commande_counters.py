@@ -0,0 +1,173 @@
+"""
+RDZ CRM — Commande Week Counters Tests
+Tests: week key derivation (alignée sur routing_engine.get_week_key), slot reservation flag,
+réservation / libération / quota plein (DuplicateKeyError), rebuild, remplissage au démarrage.
+Run: cd /app/backend && pytest tests/test_commande_counters.py -v
+"""
+
+import sys
+import asyncio
+
+sys.path.insert(0, "/app/backend")
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from services import commande_counters
+from services.commande_counters import week_key_for, COUNTER_FIELDS
+from services.routing_engine import get_week_key, week_key_to_range, RoutingResult
+
+
+class TestWeekKey:
+    def test_monday_start(self):
+        assert week_key_for("2026-02-09T00:00:00+00:00") == "2026-W07"
+
+    def test_sunday_end(self):
+        assert week_key_for("2026-02-15T23:59:59+00:00") == "2026-W07"
+
+    def test_z_suffix(self):
+        assert week_key_for("2026-02-16T08:00:00Z") == "2026-W08"
+
+    def test_current_matches_routing_engine(self):
+        assert week_key_for() == get_week_key()
+
+    def test_roundtrip_with_range(self):
+        start, _ = week_key_to_range("2026-W07")
+        assert week_key_for(start) == "2026-W07"
+
+
+class TestFields:
+    def test_counter_fields(self):
+        assert COUNTER_FIELDS == ["delivered", "lb_delivered", "accepted", "lb_accepted"]
+
+
+class TestSlotReservation:
+    def test_routing_result_exposes_reservation(self):
+        r = RoutingResult(success=True, commande_id="k1", slot_week_key="2026-W07")
+        assert r.to_dict()["slot_reserved"] is True
+
+    def test_routing_result_without_slot(self):
+        assert RoutingResult(success=False, reason="no_open_orders").to_dict()["slot_reserved"] is False
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for doc in self.docs:
+            yield dict(doc)
+
+
+class FakeCounters:
+    """update_one upsert avec index unique (commande_id, week_key), comme MongoDB"""
+
+    def __init__(self):
+        self.docs = {}
+
+    def _matches(self, doc, query):
+        for key, cond in query.items():
+            if isinstance(cond, dict):
+                if "$lt" in cond and not doc.get(key, 0) < cond["$lt"]:
+                    return False
+            elif doc.get(key) != cond:
+                return False
+        return True
+
+    async def update_one(self, query, update, upsert=False):
+        key = (query["commande_id"], query["week_key"])
+        doc = self.docs.get(key)
+        if doc is None:
+            doc = self.docs[key] = dict(update.get("$setOnInsert", {}))
+        elif not self._matches(doc, query):
+            raise DuplicateKeyError("E11000 duplicate key")
+        for field, value in update.get("$inc", {}).items():
+            doc[field] = doc.get(field, 0) + value
+        for field, value in update.get("$max", {}).items():
+            doc[field] = max(doc.get(field, value), value)
+        doc.update(update.get("$set", {}))
+
+    def find(self, query, projection=None):
+        return FakeCursor([d for d in self.docs.values() if d["week_key"] == query["week_key"]])
+
+    async def count_documents(self, query, limit=0):
+        return sum(1 for d in self.docs.values() if d["week_key"] == query["week_key"])
+
+
+@pytest.fixture
+def counters(monkeypatch):
+    fake = FakeCounters()
+
+    class FakeDb:
+        commande_week_counters = fake
+
+    monkeypatch.setattr(commande_counters, "db", FakeDb())
+    return fake
+
+
+class TestReserveRelease:
+    def test_reserve_until_quota_full(self, counters):
+        async def run():
+            return [await commande_counters.reserve_commande_slot("k1", 2, "2026-W07") for _ in range(3)]
+
+        assert asyncio.run(run()) == [True, True, False]
+        assert counters.docs[("k1", "2026-W07")]["delivered"] == 2
+
+    def test_release_reopens_slot(self, counters):
+        async def run():
+            await commande_counters.reserve_commande_slot("k1", 1, "2026-W07", is_lb=True)
+            full = await commande_counters.reserve_commande_slot("k1", 1, "2026-W07")
+            await commande_counters.release_commande_slot("k1", "2026-W07", is_lb=True)
+            return full, await commande_counters.reserve_commande_slot("k1", 1, "2026-W07")
+
+        assert asyncio.run(run()) == (False, True)
+        doc = counters.docs[("k1", "2026-W07")]
+        assert (doc["delivered"], doc["lb_delivered"]) == (1, 0)
+
+    def test_unlimited_quota(self, counters):
+        async def run():
+            return [await commande_counters.reserve_commande_slot("k1", 0, "2026-W07") for _ in range(5)]
+
+        assert all(asyncio.run(run()))
+        assert counters.docs[("k1", "2026-W07")]["delivered"] == 5
+
+
+class TestRebuild:
+    EXPECTED = {
+        "k1": {"delivered": 4, "lb_delivered": 1, "accepted": 3, "lb_accepted": 1},
+        "k2": {"delivered": 2, "lb_delivered": 0, "accepted": 0, "lb_accepted": 0},
+    }
+
+    @pytest.fixture(autouse=True)
+    def expected(self, monkeypatch):
+        async def compute(week_key):
+            return {k: dict(v) for k, v in self.EXPECTED.items()}
+        monkeypatch.setattr(commande_counters, "compute_commande_week_stats", compute)
+
+    def test_report_then_apply(self, counters):
+        counters.docs[("k1", "2026-W07")] = {
+            "commande_id": "k1", "week_key": "2026-W07",
+            "delivered": 9, "lb_delivered": 1, "accepted": 3, "lb_accepted": 1,
+        }
+        report = asyncio.run(commande_counters.rebuild_commande_counters("2026-W07"))
+        assert (report["checked"], report["drifted"], report["fixed"]) == (2, 2, 0)
+        assert counters.docs[("k1", "2026-W07")]["delivered"] == 9
+
+        report = asyncio.run(commande_counters.rebuild_commande_counters("2026-W07", apply=True))
+        assert report["fixed"] == 2
+        assert {k: counters.docs[(k, "2026-W07")]["delivered"] for k in ("k1", "k2")} == {"k1": 4, "k2": 2}
+
+    def test_startup_fills_empty_week(self, counters):
+        result = asyncio.run(commande_counters.ensure_commande_counters())
+        assert result["filled"] == 2
+        wk = week_key_for()
+        assert {f: counters.docs[("k1", wk)][f] for f in COUNTER_FIELDS} == self.EXPECTED["k1"]
+
+    def test_startup_keeps_existing_week(self, counters):
+        wk = week_key_for()
+        counters.docs[("k1", wk)] = {"commande_id": "k1", "week_key": wk, "delivered": 1}
+        assert asyncio.run(commande_counters.ensure_commande_counters())["filled"] == 0
+        assert counters.docs[("k1", wk)]["delivered"] == 1
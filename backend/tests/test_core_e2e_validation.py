@@ -260,20 +260,19 @@ class TestCDeduplication:
 
                 test_phone = "0699990001"
                 test_client_id = "test_client_dedup_001"
-                await db.leads.insert_one({
-                    "id": str(uuid.uuid4()),
+                # Empreinte écrite au routing (delivery_fingerprints)
+                await db.delivery_fingerprints.insert_one({
                     "phone": test_phone,
                     "produit": "PV",
-                    "delivery_client_id": test_client_id,
-                    "status": "routed",
-                    "routed_at": datetime.now(timezone.utc).isoformat(),
-                    "entity": "ZR7",
-                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "client_id": test_client_id,
+                    "lead_id": str(uuid.uuid4()),
+                    "delivered_at": datetime.now(timezone.utc).isoformat(),
+                    "expires_at": datetime.now(timezone.utc) + timedelta(days=30),
                 })
                 result = await check_duplicate_30_days(test_phone, "PV", test_client_id)
                 assert result.is_duplicate is True, "Should be duplicate"
                 assert result.duplicate_type == "30_days"
-                await db.leads.delete_many({"phone": test_phone})
+                await db.delivery_fingerprints.delete_many({"phone": test_phone})
                 client.close()
 
             loop.run_until_complete(run())
@@ -0,0 +1,270 @@
+"""
+RDZ CRM — Daily Run Scheduling Tests
+Tests: allocation séquentielle, mise en file des batchs en parallèle (borne),
+entités en parallèle, timings / requêtes par phase, dry run, deliveries créées
+déjà prises par leur job outbox.
+Run: cd /app/backend && pytest tests/test_daily_run.py -v
+"""
+
+import sys
+import asyncio
+
+sys.path.insert(0, "/app/backend")
+
+import pytest
+
+from services import daily_delivery
+from services.daily_delivery import DeliveryHistory, LeadPool
+
+
+COMMANDES = [{"id": f"cmd-{i}", "client_id": f"cl{i}", "client_name": f"C{i}"} for i in range(6)]
+
+
+class Tracker:
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+        self.allocation_order = []
+        self.delivered = []
+        self.lb_pending_marking = []
+
+
+@pytest.fixture
+def tracker(monkeypatch):
+    tracker = Tracker()
+
+    async def pool(entity, used=None):
+        return LeadPool.from_leads([{"id": f"{entity}-l"}], used if used is not None else set())
+
+    async def lb_pool(entity, used=None, include_pending_marking=False):
+        tracker.lb_pending_marking.append(include_pending_marking)
+        return await pool(entity, used)
+
+    async def commandes(entity):
+        return [dict(cmd, entity=entity) for cmd in COMMANDES]
+
+    async def history(leads, cmds):
+        return DeliveryHistory()
+
+    async def allocate(cmd, fresh, lb, used, week_start, history=None, dry_run=False):
+        tracker.allocation_order.append(cmd["id"])
+        shortfall = {"target_pct": 0.2, "current_pct": 0, "lb_needed": 1, "available_lb": 0}
+        return {"leads": [{"id": f"{cmd['id']}-lead"}], "lb_count": 0, "skipped_duplicates": 1,
+                "lb_shortfall": shortfall if cmd["id"] == "cmd-0" else None}
+
+    async def deliver(entity, cmd, leads, lb_count):
+        tracker.active += 1
+        tracker.max_active = max(tracker.max_active, tracker.active)
+        await asyncio.sleep(0.01)
+        tracker.active -= 1
+        tracker.delivered.append((entity, cmd["id"]))
+        if cmd["id"] == "cmd-3":
+            return {"success": False, "error": "Aucun email configuré"}
+        return {"success": True}
+
+    monkeypatch.setattr(daily_delivery, "get_fresh_leads", pool)
+    monkeypatch.setattr(daily_delivery, "get_lb_leads", lb_pool)
+    monkeypatch.setattr(daily_delivery, "get_active_commandes", commandes)
+    monkeypatch.setattr(daily_delivery, "load_delivery_history", history)
+    monkeypatch.setattr(daily_delivery, "process_commande_delivery", allocate)
+    monkeypatch.setattr(daily_delivery, "deliver_leads_to_client", deliver)
+    return tracker
+
+
+class TestEntityDeliveries:
+    def test_batches_bounded_and_results_in_order(self, tracker, monkeypatch):
+        monkeypatch.setattr(daily_delivery, "DAILY_DELIVERY_BATCH_CONCURRENCY", 2)
+        result = asyncio.run(daily_delivery.process_entity_deliveries("ZR7"))
+
+        assert tracker.allocation_order == [cmd["id"] for cmd in COMMANDES]
+        assert tracker.max_active == 2
+        assert result["batches_queued"] == 5
+        assert result["total_delivered"] == 5
+        assert result["errors"] == [{"client": "C3", "error": "Aucun email configuré"}]
+        assert set(result["timings"]) == {"load_seconds", "allocation_seconds", "delivery_seconds"}
+        assert set(result["queries"]) == {"load", "allocation", "delivery"}
+        assert result["skipped_duplicates"] == len(COMMANDES)
+        assert [s["commande_id"] for s in result["lb_shortfalls"]] == ["cmd-0"]
+        assert tracker.lb_pending_marking == [False]
+
+    def test_sequential_when_bound_is_one(self, tracker, monkeypatch):
+        monkeypatch.setattr(daily_delivery, "DAILY_DELIVERY_BATCH_CONCURRENCY", 1)
+        asyncio.run(daily_delivery.process_entity_deliveries("ZR7"))
+        assert tracker.max_active == 1
+        assert [cmd_id for _, cmd_id in tracker.delivered] == [cmd["id"] for cmd in COMMANDES]
+
+    def test_deliver_exception_is_error(self, tracker, monkeypatch):
+        async def boom(entity, cmd, leads, lb_count):
+            raise RuntimeError("boom")
+        monkeypatch.setattr(daily_delivery, "deliver_leads_to_client", boom)
+        result = asyncio.run(daily_delivery.process_entity_deliveries("ZR7"))
+        assert result["batches_queued"] == 0
+        assert len(result["errors"]) == len(COMMANDES)
+
+    def test_dry_run_plans_without_delivering(self, tracker, monkeypatch):
+        async def cross_entity(entity, fresh_pool):
+            return {"to": "MDL", "allowed": True, "leftover_fresh": len(fresh_pool), "eligible": 0}
+        monkeypatch.setattr(daily_delivery, "simulate_cross_entity_fallback", cross_entity)
+        result = asyncio.run(daily_delivery.process_entity_deliveries("ZR7", dry_run=True))
+
+        assert tracker.delivered == []
+        assert tracker.lb_pending_marking == [True]
+        assert result["batches_queued"] == len(COMMANDES)
+        assert [b["commande_id"] for b in result["planned_batches"]] == [cmd["id"] for cmd in COMMANDES]
+        assert result["planned_batches"][0] == {
+            "commande_id": "cmd-0", "client_id": "cl0", "client_name": "C0", "produit": None,
+            "channel": "email", "lead_count": 1, "fresh_count": 1, "lb_count": 0, "skipped_duplicates": 1,
+        }
+        assert result["cross_entity"]["to"] == "MDL"
+        assert "cross_entity" in result["queries"]
+
+
+class TestCrossEntitySimulation:
+    def test_counts_leftover_matching_other_entity(self, monkeypatch):
+        from services import settings
+
+        async def allowed(from_entity, to_entity):
+            return True
+
+        async def commandes(entity):
+            assert entity == "MDL"
+            return [{"produit": "PV", "departements": ["13"]}, {"produit": "PAC", "departements": ["*"]}]
+
+        monkeypatch.setattr(settings, "is_cross_entity_allowed", allowed)
+        monkeypatch.setattr(daily_delivery, "get_active_commandes", commandes)
+        used = {"used"}
+        pool = LeadPool.from_leads([
+            {"id": "a", "produit": "PV", "departement": "13"},
+            {"id": "b", "produit": "PV", "departement": "75"},
+            {"id": "c", "produit": "PAC", "departement": "75"},
+            {"id": "used", "produit": "PV", "departement": "13"},
+        ], used)
+        report = asyncio.run(daily_delivery.simulate_cross_entity_fallback("ZR7", pool))
+        assert report == {"to": "MDL", "allowed": True, "leftover_fresh": 3, "eligible": 2}
+
+    def test_not_allowed(self, monkeypatch):
+        from services import settings
+
+        async def allowed(from_entity, to_entity):
+            return False
+
+        monkeypatch.setattr(settings, "is_cross_entity_allowed", allowed)
+        pool = LeadPool.from_leads([{"id": "a", "produit": "PV", "departement": "13"}], set())
+        report = asyncio.run(daily_delivery.simulate_cross_entity_fallback("MDL", pool))
+        assert report == {"to": "ZR7", "allowed": False, "leftover_fresh": 1, "eligible": 0}
+
+
+class TestRunDaily:
+    @pytest.fixture(autouse=True)
+    def no_db_phases(self, monkeypatch):
+        self.reports = []
+
+        self.writes = []
+
+        async def pending():
+            self.writes.append("pending_csv")
+            return {"queued": 0, "processed": 0}
+
+        async def mark_lb():
+            self.writes.append("lb_marking")
+            return 0, 0
+
+        async def count_lb():
+            return 3, 4
+
+        async def cross_entity(entity, fresh_pool):
+            return {}
+
+        class Reports:
+            async def insert_one(inner, doc):
+                self.reports.append(doc)
+
+        class Deliveries:
+            async def count_documents(inner, query):
+                assert query == {"status": "pending_csv"}
+                return 2
+
+        class FakeDb:
+            delivery_reports = Reports()
+            deliveries = Deliveries()
+
+        monkeypatch.setattr(daily_delivery, "process_pending_csv_deliveries", pending)
+        monkeypatch.setattr(daily_delivery, "mark_leads_as_lb", mark_lb)
+        monkeypatch.setattr(daily_delivery, "count_leads_to_mark_lb", count_lb)
+        monkeypatch.setattr(daily_delivery, "simulate_cross_entity_fallback", cross_entity)
+        monkeypatch.setattr(daily_delivery, "db", FakeDb())
+
+    def test_entities_concurrent(self, tracker, monkeypatch):
+        monkeypatch.setattr(daily_delivery, "DAILY_DELIVERY_BATCH_CONCURRENCY", 1)
+        monkeypatch.setattr(daily_delivery, "DAILY_DELIVERY_ENTITY_CONCURRENCY", 2)
+        result = asyncio.run(daily_delivery.run_daily_delivery())
+
+        assert tracker.max_active == 2
+        assert list(result["entities"]) == ["ZR7", "MDL"]
+        assert result["entities"]["MDL"]["batches_queued"] == 5
+        assert set(result["timings"]) == {"pending_csv_seconds", "lb_marking_seconds", "entities_seconds"}
+        assert set(result["queries"]) == {"pending_csv", "lb_marking"}
+        assert result["dry_run"] is False
+        assert self.reports == [result]
+
+    def test_entity_failure_isolated(self, tracker, monkeypatch):
+        real = daily_delivery.process_entity_deliveries
+
+        async def process(entity, allocator=None, dry_run=False):
+            if entity == "MDL":
+                raise RuntimeError("mdl down")
+            return await real(entity, allocator, dry_run=dry_run)
+        monkeypatch.setattr(daily_delivery, "process_entity_deliveries", process)
+        result = asyncio.run(daily_delivery.run_daily_delivery())
+
+        assert result["entities"]["MDL"] == {"error": "mdl down"}
+        assert result["entities"]["ZR7"]["batches_queued"] == 5
+
+    def test_dry_run_writes_only_report(self, tracker):
+        result = asyncio.run(daily_delivery.run_daily_delivery(dry_run=True))
+
+        assert self.writes == []
+        assert tracker.delivered == []
+        assert result["dry_run"] is True
+        assert result["pending_csv"] == {"dry_run": True, "pending": 2}
+        assert result["lb_marked"] == {"from_old_leads": 3, "from_delivered": 4, "total": 7}
+        assert result["entities"]["ZR7"]["planned_batches"]
+        assert self.reports == [result]
+
+
+class TestDeliverLeadsToClient:
+    def test_deliveries_created_already_claimed(self, monkeypatch):
+        from types import SimpleNamespace
+        from services import outbox, delivery_files, settings
+
+        inserted, jobs = [], []
+
+        async def insert_many(docs):
+            inserted.extend(docs)
+
+        async def store_csv(csv_content):
+            return "file"
+
+        async def no_override():
+            return None
+
+        async def enqueue(**kwargs):
+            jobs.append(kwargs)
+            return {"id": kwargs["claimed_by"]}
+
+        monkeypatch.setattr(daily_delivery, "db", SimpleNamespace(deliveries=SimpleNamespace(insert_many=insert_many)))
+        monkeypatch.setattr(delivery_files, "store_csv", store_csv)
+        monkeypatch.setattr(settings, "get_simulation_email_override", no_override)
+        monkeypatch.setattr(outbox, "enqueue_csv_email", enqueue)
+
+        cmd = {"id": "cmd-0", "client_id": "cl0", "client_name": "C0", "produit": "PV", "client_email": "a@c0.fr"}
+        leads = [{"id": f"l{i}", "nom": "N", "phone": "0600000000", "departement": "75"} for i in range(3)]
+        result = asyncio.run(daily_delivery.deliver_leads_to_client("ZR7", cmd, leads, 0))
+
+        # Jamais pending_csv: un micro-batch d'un autre process ne peut pas les prendre
+        assert {d["status"] for d in inserted} == {"sending"}
+        assert {d["outbox_job_id"] for d in inserted} == {jobs[0]["claimed_by"]}
+        assert result["outbox_job_id"] == jobs[0]["claimed_by"]
+        # Le job référence le CSV stocké (pas de copie inline)
+        assert jobs[0]["csv_file_id"] == "file"
+        assert "csv_content" not in jobs[0]
@@ -0,0 +1,154 @@
+"""
+RDZ CRM — Streaming Delivery Exports Tests
+Tests: CSV identique à generate_csv_content, envoi par morceaux, leads
+chargés par lots $in, ZIP en flux (fichier stocké ou régénéré), ZIP filtré = CSV, noms uniques.
+Run: cd /app/backend && pytest tests/test_delivery_exports.py -v
+"""
+
+import io
+import sys
+import gzip
+import asyncio
+import zipfile
+from types import SimpleNamespace
+
+sys.path.insert(0, "/app/backend")
+
+import pytest
+
+from services import delivery_exports, delivery_files
+from services.csv_delivery import generate_csv_content
+
+
+LEADS = [
+    {"id": f"l{i}", "nom": f"Nom{i}", "prenom": "P", "phone": f"06{i:08d}", "email": "", "departement": "75"}
+    for i in range(25)
+]
+DELIVERIES = [
+    {"id": f"d{i}", "lead_id": f"l{i}", "produit": "PV", "entity": "ZR7",
+     "batch_id": "batch-a" if i < 10 else "batch-b", "created_at": f"2026-03-02T10:00:{i:02d}"}
+    for i in range(25)
+]
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, *args):
+        return self
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for doc in self.docs:
+            yield dict(doc)
+
+
+class FakeDeliveries:
+    def _match(self, query):
+        return [d for d in DELIVERIES if all(d.get(k) == v for k, v in query.items())]
+
+    def find(self, query, projection=None):
+        return FakeCursor(self._match(query))
+
+    async def find_one(self, query, projection=None):
+        found = self._match(query)
+        return found[0] if found else None
+
+
+class FakeLeads:
+    def __init__(self):
+        self.in_sizes = []
+
+    def find(self, query, projection=None):
+        ids = query["id"]["$in"]
+        self.in_sizes.append(len(ids))
+        # ordre $in non garanti
+        return FakeCursor([lead for lead in reversed(LEADS) if lead["id"] in ids])
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    fake = SimpleNamespace(deliveries=FakeDeliveries(), leads=FakeLeads())
+    monkeypatch.setattr(delivery_exports, "db", fake)
+    monkeypatch.setattr(delivery_exports, "EXPORT_LEAD_CHUNK", 10)
+    return fake
+
+
+async def _collect(chunks):
+    return [chunk async for chunk in chunks]
+
+
+class TestCsvStream:
+    def test_same_as_generate_csv_content(self, fake_db):
+        chunks = asyncio.run(_collect(delivery_exports.stream_csv({}, "ZR7")))
+        assert b"".join(chunks).decode("utf-8") == generate_csv_content(LEADS, "PV", "ZR7")
+        assert fake_db.leads.in_sizes == [10, 10, 5]
+
+    def test_flushes_in_chunks(self, fake_db, monkeypatch):
+        monkeypatch.setattr(delivery_exports, "EXPORT_FLUSH_BYTES", 100)
+        chunks = asyncio.run(_collect(delivery_exports.stream_csv({}, "MDL")))
+        assert len(chunks) > 5
+        assert max(len(c) for c in chunks) < 200
+        assert b"".join(chunks).decode("utf-8") == generate_csv_content(LEADS, "PV", "MDL")
+
+    def test_missing_lead_skipped(self, fake_db, monkeypatch):
+        monkeypatch.setattr(delivery_exports, "EXPORT_LEAD_CHUNK", 3)
+        DELIVERIES.append({"id": "ghost", "lead_id": "gone", "produit": "PV", "batch_id": "batch-b"})
+        try:
+            text = b"".join(asyncio.run(_collect(delivery_exports.stream_csv({"batch_id": "batch-b"}, "ZR7"))))
+        finally:
+            DELIVERIES.pop()
+        assert text.decode("utf-8") == generate_csv_content(LEADS[10:], "PV", "ZR7")
+
+
+class TestZipStream:
+    def test_batches_zip(self, fake_db, monkeypatch):
+        stored = "stored;csv\n"
+
+        async def get_csv_file(file_id):
+            return {"data": gzip.compress(stored.encode())} if file_id == "f-a" else None
+
+        monkeypatch.setattr(delivery_files, "get_csv_file", get_csv_file)
+        DELIVERIES[0]["csv_file_id"] = "f-a"
+        batches = [
+            {"batch_id": "batch-a", "entity": "ZR7", "csv_filename": "ZR7_PV_2026-03-02.csv"},
+            {"batch_id": "batch-b", "entity": "ZR7", "csv_filename": "ZR7_PV_2026-03-02.csv"},
+        ]
+        try:
+            data = b"".join(asyncio.run(_collect(delivery_exports.stream_zip(batches))))
+        finally:
+            DELIVERIES[0].pop("csv_file_id")
+
+        archive = zipfile.ZipFile(io.BytesIO(data))
+        assert archive.namelist() == ["ZR7_PV_2026-03-02_batch-a.csv", "ZR7_PV_2026-03-02_batch-b.csv"]
+        assert archive.read("ZR7_PV_2026-03-02_batch-a.csv").decode() == stored
+        assert archive.read("ZR7_PV_2026-03-02_batch-b.csv").decode() == generate_csv_content(LEADS[10:], "PV", "ZR7")
+
+    def test_filtered_zip_matches_csv(self, fake_db, monkeypatch):
+        async def get_csv_file(file_id):
+            return {"data": gzip.compress(b"stored;csv\n")}
+
+        monkeypatch.setattr(delivery_files, "get_csv_file", get_csv_file)
+        for d in DELIVERIES:
+            d.update(status="sent", csv_file_id="f")
+        DELIVERIES[12]["status"] = "rejected"
+        batches = [{"batch_id": "batch-b", "entity": "ZR7", "csv_filename": "b.csv"}]
+        try:
+            data = b"".join(asyncio.run(_collect(delivery_exports.stream_zip(batches, query={"status": "sent"}))))
+            csv = b"".join(asyncio.run(_collect(delivery_exports.stream_csv({"status": "sent", "batch_id": "batch-b"}, "ZR7"))))
+        finally:
+            for d in DELIVERIES:
+                d.pop("status")
+                d.pop("csv_file_id")
+
+        # Fichier stocké ignoré: la ligne rejetée depuis l'envoi n'est pas exportée
+        entry = zipfile.ZipFile(io.BytesIO(data)).read("b_batch-b.csv")
+        assert entry == csv
+        assert entry.decode() == generate_csv_content(LEADS[10:12] + LEADS[13:], "PV", "ZR7")
+
+    def test_entry_name_without_filename(self):
+        name = delivery_exports.batch_entry_name({"batch_id": "0123456789", "created_at": "2026-03-02T10:00:00"})
+        assert name == "batch_2026-03-02_01234567.csv"
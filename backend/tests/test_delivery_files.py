@@ -0,0 +1,133 @@
+"""
+RDZ CRM — Delivery Files Store Tests
+Tests: stockage gzip adressé par hash (dédup), relecture, streaming par
+morceaux, repli csv_content inline, migration des deliveries.
+Run: cd /app/backend && pytest tests/test_delivery_files.py -v
+"""
+
+import sys
+import asyncio
+from types import SimpleNamespace
+
+sys.path.insert(0, "/app/backend")
+
+import pytest
+
+from services import delivery_files
+
+
+CSV = "nom;telephone;departement\n" + "".join(f"Dupont;06{i:08d};75\n" for i in range(500))
+
+
+class FakeFiles:
+    def __init__(self):
+        self.docs = {}
+
+    async def update_one(self, query, update, upsert=False):
+        if query["id"] in self.docs:
+            return SimpleNamespace(upserted_id=None)
+        self.docs[query["id"]] = dict(update["$setOnInsert"])
+        return SimpleNamespace(upserted_id=query["id"])
+
+    async def find_one(self, query, projection=None):
+        return self.docs.get(query["id"])
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for doc in self.docs:
+            yield doc
+
+
+class FakeDeliveries:
+    def __init__(self, docs):
+        self.docs = docs
+        self.ops = []
+
+    def find(self, query, projection):
+        return FakeCursor([d for d in self.docs if d.get("csv_content")])
+
+    async def bulk_write(self, ops, ordered=True):
+        self.ops.extend(ops)
+        return SimpleNamespace(modified_count=len(ops))
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    fake = SimpleNamespace(delivery_files=FakeFiles(), deliveries=FakeDeliveries([]))
+    monkeypatch.setattr(delivery_files, "db", fake)
+    return fake
+
+
+class TestStore:
+    def test_roundtrip_and_dedup(self, fake_db):
+        async def run():
+            first = await delivery_files.store_csv(CSV)
+            second = await delivery_files.store_csv(CSV)
+            return first, second, await delivery_files.load_csv(first)
+
+        first, second, loaded = asyncio.run(run())
+        assert first == second == delivery_files.csv_file_id(CSV)
+        assert loaded == CSV
+        assert len(fake_db.delivery_files.docs) == 1
+        doc = fake_db.delivery_files.docs[first]
+        assert doc["size"] == len(CSV.encode("utf-8"))
+        assert doc["stored_size"] < doc["size"] / 4
+
+    def test_stream_chunks(self, fake_db):
+        async def run():
+            file_id = await delivery_files.store_csv(CSV)
+            doc = await delivery_files.get_csv_file(file_id)
+            return [chunk async for chunk in delivery_files.iter_csv_chunks(doc, chunk_size=64)]
+
+        chunks = asyncio.run(run())
+        assert len(chunks) > 1
+        assert b"".join(chunks).decode("utf-8") == CSV
+
+    def test_delivery_inline_fallback(self, fake_db):
+        async def run():
+            file_id = await delivery_files.store_csv("a\n")
+            return (
+                await delivery_files.load_delivery_csv({"csv_file_id": file_id}),
+                await delivery_files.load_delivery_csv({"csv_content": "legacy\n"}),
+                await delivery_files.load_delivery_csv({"csv_file_id": "missing", "csv_content": "legacy\n"}),
+                await delivery_files.load_delivery_csv({}),
+            )
+
+        assert asyncio.run(run()) == ("a\n", "legacy\n", "legacy\n", None)
+
+
+class TestMigration:
+    @pytest.fixture
+    def deliveries(self, fake_db):
+        fake_db.deliveries = FakeDeliveries([
+            {"id": "d1", "csv_content": CSV},
+            {"id": "d2", "csv_content": CSV},
+            {"id": "d3", "csv_content": "autre\n"},
+            {"id": "d4", "csv_file_id": "deja"},
+        ])
+        return fake_db
+
+    def test_report_only(self, deliveries):
+        report = asyncio.run(delivery_files.migrate_inline_csv())
+        assert report["deliveries"] == 3
+        assert report["unique_files"] == 2
+        assert report["bytes_stored"] < report["bytes_inline"]
+        assert deliveries.delivery_files.docs == {}
+        assert deliveries.deliveries.ops == []
+
+    def test_apply(self, deliveries):
+        report = asyncio.run(delivery_files.migrate_inline_csv(apply=True, chunk_size=2))
+        assert report["migrated"] == 3
+        assert set(deliveries.delivery_files.docs) == {
+            delivery_files.csv_file_id(CSV), delivery_files.csv_file_id("autre\n")
+        }
+        first = deliveries.deliveries.ops[0]
+        assert first._filter == {"id": "d1"}
+        assert first._doc == {"$set": {"csv_file_id": delivery_files.csv_file_id(CSV)}, "$unset": {"csv_content": ""}}
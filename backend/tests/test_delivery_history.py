@@ -0,0 +1,106 @@
+"""
+RDZ CRM — Daily Delivery History Tests
+Tests: historique livré / doublons 30j en mémoire, split LB nouveau / recyclé,
+aucune requête par lead pendant l'allocation, quota restant lu dans les compteurs.
+Run: cd /app/backend && pytest tests/test_delivery_history.py -v
+"""
+
+import sys
+import asyncio
+
+sys.path.insert(0, "/app/backend")
+
+import pytest
+
+from services import daily_delivery, commande_counters, event_logger
+from services.daily_delivery import DeliveryHistory
+
+
+def _lead(lead_id, phone, produit="PV", dept="75"):
+    return {"id": lead_id, "phone": phone, "produit": produit, "departement": dept, "nom": "n"}
+
+
+CMD = {
+    "id": "cmd-1", "client_id": "cl1", "client_name": "Client", "entity": "ZR7",
+    "produit": "PV", "departements": ["75"], "quota_semaine": 0, "lb_target_pct": 0,
+}
+
+
+class TestDeliveryHistory:
+    def test_lookups(self):
+        history = DeliveryHistory(
+            delivered={("0611", "PV", "cl1"): "2026-01-01T00:00:00+00:00"},
+            blocked={("0622", "PV", "cl1")},
+        )
+        assert history.was_delivered("0611", "PV", "cl1")
+        assert not history.was_delivered("0611", "PV", "cl2")
+        assert not history.was_delivered("0611", "PAC", "cl1")
+        assert history.is_blocked("0622", "PV", "cl1")
+        assert not history.is_blocked("0611", "PV", "cl1")
+
+    def test_record_blocks_within_run(self):
+        history = DeliveryHistory()
+        history.record("0611", "PV", "cl1", "2026-01-01T00:00:00+00:00")
+        assert history.was_delivered("0611", "PV", "cl1")
+        assert history.is_blocked("0611", "PV", "cl1")
+
+
+class TestCommandeAllocation:
+    @pytest.fixture(autouse=True)
+    def no_db(self, monkeypatch):
+        async def counters(commande_id, week_key):
+            return {"delivered": self.delivered, "lb_delivered": 0, "accepted": 0, "lb_accepted": 0}
+
+        async def forbidden(*args, **kwargs):
+            raise AssertionError("requête par lead pendant l'allocation")
+
+        async def log_event(**kwargs):
+            self.events.append(kwargs["action"])
+
+        self.events = []
+        self.delivered = 0
+        monkeypatch.setattr(commande_counters, "get_commande_week_counters", counters)
+        monkeypatch.setattr(event_logger, "log_event", log_event)
+        monkeypatch.setattr(daily_delivery, "was_delivered_to_client", forbidden)
+        monkeypatch.setattr(daily_delivery, "is_duplicate_blocked", forbidden)
+
+    def _run(self, cmd, fresh, lb, history, used=None):
+        return asyncio.run(daily_delivery.process_commande_delivery(
+            cmd, fresh, lb, used if used is not None else set(), "2026-01-05", history
+        ))
+
+    def test_quota_remaining_from_counters(self):
+        self.delivered = 7
+        state = asyncio.run(daily_delivery.get_commande_allocation_state({**CMD, "quota_semaine": 10}, "2026-01-05"))
+        assert state["quota_remaining"] == 3
+        unlimited = asyncio.run(daily_delivery.get_commande_allocation_state({**CMD, "quota_semaine": 0}, "2026-01-05"))
+        assert unlimited["quota_remaining"] == daily_delivery.UNLIMITED_QUOTA
+
+    def test_blocked_fresh_skipped(self):
+        history = DeliveryHistory(blocked={("0611", "PV", "cl1")})
+        result = self._run(CMD, [_lead("a", "0611"), _lead("b", "0622")], [], history)
+        assert [lead["id"] for lead in result["leads"]] == ["b"]
+        assert result["skipped_duplicates"] == 1
+
+    def test_lb_never_delivered_first(self):
+        cmd = {**CMD, "lb_target_pct": 1.0}
+        history = DeliveryHistory(delivered={("0611", "PV", "cl1"): "2025-01-01T00:00:00+00:00"})
+        lb = [_lead("old", "0611"), _lead("new", "0622")]
+        result = self._run(cmd, [], lb, history)
+        assert [lead["id"] for lead in result["leads"]] == ["new", "old"]
+        assert result["lb_count"] == 2
+        assert self.events == ["lb_shortfall"]
+
+    def test_same_phone_once_per_client_in_run(self):
+        history = DeliveryHistory()
+        used = set()
+        first = self._run(CMD, [_lead("a", "0611")], [], history, used)
+        second = self._run({**CMD, "id": "cmd-2"}, [_lead("b", "0611")], [], history, used)
+        assert [lead["id"] for lead in first["leads"]] == ["a"]
+        assert second["leads"] == []
+        assert second["skipped_duplicates"] == 1
+
+    def test_other_client_not_blocked(self):
+        history = DeliveryHistory(blocked={("0611", "PV", "cl1")})
+        result = self._run({**CMD, "client_id": "cl2"}, [_lead("a", "0611")], [], history)
+        assert [lead["id"] for lead in result["leads"]] == ["a"]
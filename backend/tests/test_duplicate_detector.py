@@ -0,0 +1,217 @@
+"""
+RDZ CRM — Duplicate Detector Tests
+Tests: doublon 30 jours par lot de téléphones (empreintes actives, bord de
+fenêtre, client / produit), anti double-submit bulk (fenêtre provider),
+backfill des empreintes de livraison (ancien + nouveau format, fenêtre
+30 jours), backfill au démarrage seulement si la collection est vide.
+Run: cd /app/backend && pytest tests/test_duplicate_detector.py -v
+"""
+
+import sys
+import asyncio
+from datetime import datetime, timezone, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, "/app/backend")
+
+import pytest
+
+from services import duplicate_detector
+
+
+def _days_ago(days):
+    return (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for doc in self.docs:
+            yield dict(doc)
+
+    async def to_list(self, length):
+        return [dict(doc) for doc in self.docs[:length]]
+
+
+def _matches(doc, query):
+    for key, cond in query.items():
+        value = doc.get(key)
+        if not isinstance(cond, dict):
+            if value != cond:
+                return False
+            continue
+        if "$in" in cond and value not in cond["$in"]:
+            return False
+        if "$gt" in cond and not (value is not None and value > cond["$gt"]):
+            return False
+        if "$gte" in cond and not (value is not None and value >= cond["$gte"]):
+            return False
+    return True
+
+
+class FakeCollection:
+    """find() avec les opérateurs utilisés par le détecteur ($in, $gt, $gte)"""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.queries = []
+
+    def find(self, query, projection=None):
+        self.queries.append(query)
+        return FakeCursor([d for d in self.docs if _matches(d, query)])
+
+
+class FakeFingerprints:
+    def __init__(self, count=0):
+        self.count = count
+
+    async def count_documents(self, query, limit=0):
+        return self.count
+
+
+@pytest.fixture
+def recorded(monkeypatch):
+    entries = []
+
+    async def record(chunk):
+        entries.extend(chunk)
+        return len(chunk)
+
+    monkeypatch.setattr(duplicate_detector, "record_delivery_fingerprints", record)
+    return entries
+
+
+def _fake_db(monkeypatch, leads, fingerprints=0):
+    fake = SimpleNamespace(
+        leads=SimpleNamespace(find=lambda query, projection: FakeCursor(leads)),
+        delivery_fingerprints=FakeFingerprints(fingerprints),
+    )
+    monkeypatch.setattr(duplicate_detector, "db", fake)
+    return fake
+
+
+def _seconds_ago(seconds):
+    return (datetime.now(timezone.utc) - timedelta(seconds=seconds)).isoformat()
+
+
+def _expires_in(seconds):
+    return datetime.now(timezone.utc) + timedelta(seconds=seconds)
+
+
+LEADS = [
+    # nouveau format
+    {"id": "l1", "phone": "0601", "produit": "PV", "status": "routed",
+     "delivery_client_id": "c1", "delivery_client_name": "C1", "routed_at": _days_ago(2)},
+    # ancien format
+    {"id": "l2", "phone": "0602", "produit": "PAC", "status": "livre",
+     "delivered_to_client_id": "c2", "delivered_to_client_name": "C2", "delivered_at": _days_ago(5)},
+    # hors fenêtre
+    {"id": "l3", "phone": "0603", "produit": "PV", "status": "routed",
+     "delivery_client_id": "c1", "routed_at": _days_ago(31)},
+]
+
+
+class TestBackfill:
+    def test_entries_both_formats_in_window(self, monkeypatch, recorded):
+        _fake_db(monkeypatch, LEADS)
+        report = asyncio.run(duplicate_detector.backfill_delivery_fingerprints(chunk_size=1))
+
+        assert report == {"leads": 3, "written": 2}
+        assert [(e["phone"], e["client_id"]) for e in recorded] == [("0601", "c1"), ("0602", "c2")]
+
+    def test_startup_backfill_when_empty(self, monkeypatch, recorded):
+        _fake_db(monkeypatch, LEADS)
+        assert asyncio.run(duplicate_detector.ensure_delivery_fingerprints())["written"] == 2
+
+    def test_startup_skipped_when_filled(self, monkeypatch, recorded):
+        _fake_db(monkeypatch, LEADS, fingerprints=1)
+        assert asyncio.run(duplicate_detector.ensure_delivery_fingerprints()) is None
+        assert recorded == []
+
+
+class TestDuplicatePhones:
+    FINGERPRINTS = [
+        {"phone": "0601", "produit": "PV", "client_id": "c1", "expires_at": _expires_in(86400)},
+        # même phone, autre client / autre produit
+        {"phone": "0602", "produit": "PV", "client_id": "c2", "expires_at": _expires_in(86400)},
+        {"phone": "0603", "produit": "PAC", "client_id": "c1", "expires_at": _expires_in(86400)},
+        # bord de fenêtre: expirée il y a 1 s / expire dans 1 min
+        {"phone": "0604", "produit": "PV", "client_id": "c1", "expires_at": _expires_in(-1)},
+        {"phone": "0605", "produit": "PV", "client_id": "c1", "expires_at": _expires_in(60)},
+    ]
+
+    @pytest.fixture
+    def fingerprints(self, monkeypatch):
+        fake = FakeCollection(self.FINGERPRINTS)
+        monkeypatch.setattr(duplicate_detector, "db", SimpleNamespace(delivery_fingerprints=fake))
+        return fake
+
+    def _check(self, phones, produit="PV", client_id="c1"):
+        return asyncio.run(duplicate_detector.check_duplicate_30_days_phones(phones, produit, client_id))
+
+    def test_hits_and_misses(self, fingerprints):
+        assert self._check(["0601", "0609"]) == {"0601"}
+
+    def test_window_edge(self, fingerprints):
+        assert self._check(["0604", "0605"]) == {"0605"}
+
+    def test_other_client_or_produit(self, fingerprints):
+        assert self._check(["0602", "0603"]) == set()
+        assert self._check(["0602"], client_id="c2") == {"0602"}
+        assert self._check(["0603"], produit="PAC") == {"0603"}
+
+    def test_single_query_dedup_phones(self, fingerprints):
+        self._check(["0601", "0601", "", "0605"])
+        assert len(fingerprints.queries) == 1
+        assert sorted(fingerprints.queries[0]["phone"]["$in"]) == ["0601", "0605"]
+
+    def test_empty_inputs(self, fingerprints):
+        assert self._check([]) == set()
+        assert self._check(["0601"], client_id="") == set()
+        assert fingerprints.queries == []
+
+
+class TestRecentSubmissions:
+    WINDOW = 600
+    LEADS = [
+        {"id": "r1", "phone": "0601", "produit": "PV", "provider_id": "p1", "created_at": _seconds_ago(30)},
+        {"id": "r2", "phone": "0601", "produit": "PAC", "provider_id": "p1", "created_at": _seconds_ago(60)},
+        {"id": "r3", "phone": "0602", "produit": "PV", "provider_id": "p2", "created_at": _seconds_ago(30)},
+        # bord de fenêtre: 10 s avant / après la limite
+        {"id": "r4", "phone": "0603", "produit": "PV", "provider_id": "p1", "created_at": _seconds_ago(590)},
+        {"id": "r5", "phone": "0604", "produit": "PV", "provider_id": "p1", "created_at": _seconds_ago(610)},
+    ]
+
+    @pytest.fixture
+    def leads(self, monkeypatch):
+        fake = FakeCollection(self.LEADS)
+        monkeypatch.setattr(duplicate_detector, "db", SimpleNamespace(leads=fake))
+        return fake
+
+    def _check(self, phones, provider_id="p1"):
+        return asyncio.run(duplicate_detector.check_recent_submissions_many(phones, provider_id, self.WINDOW))
+
+    def test_hits_per_phone_and_produit(self, leads):
+        assert self._check(["0601", "0609"]) == {("0601", "PV"): "r1", ("0601", "PAC"): "r2"}
+
+    def test_window_edge(self, leads):
+        assert self._check(["0603", "0604"]) == {("0603", "PV"): "r4"}
+
+    def test_other_provider(self, leads):
+        assert self._check(["0602"]) == {}
+        assert self._check(["0602"], provider_id="p2") == {("0602", "PV"): "r3"}
+
+    def test_single_query(self, leads):
+        self._check(["0601", "0601", "0603"])
+        assert len(leads.queries) == 1
+        assert sorted(leads.queries[0]["phone"]["$in"]) == ["0601", "0603"]
+
+    def test_empty_inputs(self, leads):
+        assert self._check([]) == {}
+        assert self._check(["0601"], provider_id="") == {}
+        assert leads.queries == []
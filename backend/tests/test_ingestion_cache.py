@@ -0,0 +1,70 @@
+"""
+RDZ CRM — Ingestion Cache Tests
+Tests: LRU eviction, TTL expiry, negative entries, copies isolées, invalidation (aussi utilisé par le cache sessions auth).
+Run: cd /app/backend && pytest tests/test_ingestion_cache.py -v
+"""
+
+import sys
+import time
+
+sys.path.insert(0, "/app/backend")
+
+from services.ingestion_cache import LruTtlCache
+
+
+class TestLruTtlCache:
+    def test_hit_and_miss(self):
+        cache = LruTtlCache("t", ttl=30, max_size=10)
+        assert cache.get("k") == (False, None)
+        cache.set("k", {"id": "p1"})
+        assert cache.get("k") == (True, {"id": "p1"})
+        assert cache.stats["hits"] == 1 and cache.stats["misses"] == 1
+
+    def test_negative_entry(self):
+        cache = LruTtlCache("t", ttl=30, max_size=10)
+        cache.set("prov_unknown", None)
+        assert cache.get("prov_unknown") == (True, None)
+
+    def test_lru_eviction(self):
+        cache = LruTtlCache("t", ttl=30, max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("b") == (False, None)
+        assert cache.get("a") == (True, 1)
+        assert cache.stats["evictions"] == 1
+
+    def test_ttl_expiry(self):
+        cache = LruTtlCache("t", ttl=0.01, max_size=10)
+        cache.set("k", 1)
+        time.sleep(0.02)
+        assert cache.get("k") == (False, None)
+
+    def test_disabled(self):
+        cache = LruTtlCache("t", ttl=0, max_size=10)
+        cache.set("k", 1)
+        assert cache.get("k") == (False, None)
+
+    def test_returns_copy(self):
+        cache = LruTtlCache("t", ttl=30, max_size=10)
+        cache.set("k", {"entity": "ZR7"})
+        _, value = cache.get("k")
+        value["entity"] = "MDL"
+        assert cache.get("k") == (True, {"entity": "ZR7"})
+
+    def test_clear(self):
+        cache = LruTtlCache("t", ttl=30, max_size=10)
+        cache.set("k", 1)
+        cache.clear()
+        assert cache.get("k") == (False, None)
+        assert cache.stats["invalidations"] == 1
+
+    def test_discard_where(self):
+        cache = LruTtlCache("t", ttl=30, max_size=10)
+        cache.set("tok1", ({"id": "u1"}, None))
+        cache.set("tok2", ({"id": "u1"}, None))
+        cache.set("tok3", ({"id": "u2"}, None))
+        assert cache.discard_where(lambda entry: entry[0]["id"] == "u1") == 2
+        assert cache.get("tok1") == (False, None)
+        assert cache.get("tok3")[0] is True
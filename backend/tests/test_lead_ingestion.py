@@ -0,0 +1,242 @@
+"""
+RDZ CRM — Lead Ingestion Planning Tests
+Tests: routing computed before persistence (final lead state in memory,
+delivery built from the routing result, no lead write during planning,
+overlap alternative keeps its client API endpoint),
+persistance sans transaction annulée en cas d'échec (aucun lead "routed"
+sans sa delivery).
+Run: cd /app/backend && pytest tests/test_lead_ingestion.py -v
+"""
+
+import sys
+import asyncio
+from types import SimpleNamespace
+
+sys.path.insert(0, "/app/backend")
+
+import pytest
+
+from services import lead_ingestion, overlap_guard
+from services.routing_engine import RoutingResult
+
+
+def _lead(**kw):
+    lead = {
+        "id": "lead-1", "entity": "ZR7", "produit": "PV", "departement": "75",
+        "phone": "0611223344", "phone_quality": "valid", "lead_source_type": "direct",
+        "entity_locked": False, "status": "new",
+    }
+    lead.update(kw)
+    return lead
+
+
+class _Patched:
+    """Remplace route_lead / overlap guard le temps d'un test"""
+
+    def __init__(self, result):
+        self.result = result
+
+    def __enter__(self):
+        self._route = lead_ingestion.route_lead
+        self._guard = overlap_guard.is_guard_enabled
+
+        async def fake_route(**kwargs):
+            return self.result
+
+        async def guard_off():
+            return False
+
+        lead_ingestion.route_lead = fake_route
+        overlap_guard.is_guard_enabled = guard_off
+        return self
+
+    def __exit__(self, *exc):
+        lead_ingestion.route_lead = self._route
+        overlap_guard.is_guard_enabled = self._guard
+
+
+class TestPlanNoRoute:
+    def test_duplicate_reason(self):
+        lead = _lead()
+        with _Patched(RoutingResult(success=False, reason="all_commandes_duplicate")):
+            plan = asyncio.run(lead_ingestion.plan_lead_routing(lead))
+        assert lead["status"] == "duplicate"
+        assert lead["routing_reason"] == "all_commandes_duplicate"
+        assert plan["delivery"] is None
+
+    def test_no_open_orders(self):
+        lead = _lead()
+        with _Patched(RoutingResult(success=False, reason="no_open_orders")):
+            asyncio.run(lead_ingestion.plan_lead_routing(lead))
+        assert lead["status"] == "no_open_orders"
+
+
+class TestPlanRouted:
+    def _routed(self, entity="MDL"):
+        return RoutingResult(
+            success=True, client_id="c1", client_name="Client 1", commande_id="k1",
+            reason="cross_entity_ZR7_to_MDL", routing_mode="fallback_no_orders", entity=entity,
+        )
+
+    def test_final_lead_state(self):
+        lead = _lead()
+        with _Patched(self._routed()):
+            plan = asyncio.run(lead_ingestion.plan_lead_routing(lead))
+        assert lead["status"] == "routed"
+        assert lead["delivery_id"] == plan["delivery"]["id"]
+        assert lead["delivery_commande_id"] == "k1"
+        assert lead["routed_at"]
+
+    def test_target_entity_from_routing_result(self):
+        lead = _lead()
+        with _Patched(self._routed(entity="MDL")):
+            plan = asyncio.run(lead_ingestion.plan_lead_routing(lead))
+        assert plan["delivery"]["entity"] == "MDL"
+        assert plan["delivery"]["lead_id"] == "lead-1"
+
+    def test_fingerprint_planned(self):
+        lead = _lead()
+        with _Patched(self._routed()):
+            plan = asyncio.run(lead_ingestion.plan_lead_routing(lead))
+        assert plan["fingerprint"]["phone"] == "0611223344"
+        assert plan["fingerprint"]["client_id"] == "c1"
+        assert plan["lb_update"] is None
+
+
+class TestPlanOverlapAlternative:
+    def test_alternative_keeps_api_endpoint(self, monkeypatch):
+        async def guard_on():
+            return True
+
+        async def overlap(**kwargs):
+            return {
+                "is_shared": True, "overlap_active_30d": True, "client_group_key": "g",
+                "alternative_found": True, "alternative_client_id": "c2",
+                "alternative_client_name": "Client API", "alternative_commande_id": "k2",
+                "alternative_quota_semaine": 10,
+                "alternative_api_endpoint": "https://api.client2.fr/leads",
+                "fallback": False,
+            }
+
+        async def reserved(*args):
+            return True
+
+        async def released(*args):
+            return None
+
+        async def route(**kwargs):
+            return RoutingResult(success=True, client_id="c1", client_name="Client 1", commande_id="k1")
+
+        monkeypatch.setattr(lead_ingestion, "route_lead", route)
+        monkeypatch.setattr(overlap_guard, "is_guard_enabled", guard_on)
+        monkeypatch.setattr(overlap_guard, "check_overlap_and_find_alternative", overlap)
+        monkeypatch.setattr(lead_ingestion, "reserve_routing_slot", reserved)
+        monkeypatch.setattr(lead_ingestion, "release_routing_slot", released)
+        plan = asyncio.run(lead_ingestion.plan_lead_routing(_lead()))
+
+        # Client API de l'alternative: push temps réel (dispatch_api_deliveries)
+        assert plan["routing_result"].commande_id == "k2"
+        assert plan["routing_result"].api_endpoint == "https://api.client2.fr/leads"
+        assert plan["delivery"]["client_id"] == "c2"
+
+
+class FakeCollection:
+    """Documents par id; fail_insert_after=n → échec après n documents insérés"""
+
+    def __init__(self, docs=None, fail_insert_after=None):
+        self.docs = {d["id"]: dict(d) for d in docs or []}
+        self.fail_insert_after = fail_insert_after
+
+    async def insert_one(self, doc, session=None):
+        await self.insert_many([doc], session=session)
+
+    async def insert_many(self, docs, ordered=True, session=None):
+        for n, doc in enumerate(docs):
+            if self.fail_insert_after is not None and n >= self.fail_insert_after:
+                raise RuntimeError("insert failed")
+            self.docs[doc["id"]] = dict(doc)
+
+    async def find_one_and_update(self, query, update, session=None):
+        doc = self.docs.get(query["id"])
+        if doc is None or any(doc.get(k) != v for k, v in query.items()):
+            return None
+        before = dict(doc)
+        doc.update(update["$set"])
+        return before
+
+    async def replace_one(self, query, doc):
+        self.docs[query["id"]] = dict(doc)
+
+    async def delete_many(self, query):
+        for doc_id in query["id"]["$in"]:
+            self.docs.pop(doc_id, None)
+
+
+class TestPersistWithoutTransaction:
+    @pytest.fixture
+    def released(self, monkeypatch):
+        calls = []
+
+        async def no_transactions():
+            return False
+
+        async def release(routing_result):
+            calls.append(routing_result.commande_id)
+
+        monkeypatch.setattr(lead_ingestion, "_supports_transactions", no_transactions)
+        monkeypatch.setattr(lead_ingestion, "release_routing_slot", release)
+        return calls
+
+    def _items(self, count=2, lb_update=None):
+        items = []
+        for i in range(count):
+            lead = _lead(id=f"lead-{i}", status="routed", delivery_id=f"d{i}")
+            plan = {
+                "routing_result": RoutingResult(success=True, client_id="c1", commande_id="k1"),
+                "delivery": {"id": f"d{i}", "lead_id": lead["id"]},
+                "lb_update": lb_update if i == 0 else None,
+                "fingerprint": None, "lb_delivered": False,
+            }
+            items.append((lead, plan))
+        return items
+
+    def _db(self, monkeypatch, leads=None, deliveries=None):
+        fake = SimpleNamespace(leads=leads or FakeCollection(), deliveries=deliveries or FakeCollection())
+        monkeypatch.setattr(lead_ingestion, "db", fake)
+        return fake
+
+    def test_delivery_insert_fails(self, monkeypatch, released):
+        fake = self._db(monkeypatch, deliveries=FakeCollection(fail_insert_after=1))
+        with pytest.raises(RuntimeError):
+            asyncio.run(lead_ingestion.persist_planned_leads(self._items()))
+
+        # Aucun lead "routed" vers une delivery absente, delivery partielle supprimée
+        assert fake.leads.docs == {}
+        assert fake.deliveries.docs == {}
+        assert released == ["k1", "k1"]
+
+    def test_lead_insert_fails_after_deliveries(self, monkeypatch, released):
+        lb = {"id": "lb-1", "status": "lb"}
+        fake = self._db(monkeypatch, leads=FakeCollection([lb], fail_insert_after=1))
+        items = self._items(lb_update=("lb-1", {"status": "routed", "delivery_id": "d0"}))
+        with pytest.raises(RuntimeError):
+            asyncio.run(lead_ingestion.persist_planned_leads(items))
+
+        assert fake.deliveries.docs == {}
+        assert fake.leads.docs == {"lb-1": lb}
+
+    def test_queued_lead_restored(self, monkeypatch, released):
+        queued = {"id": "lead-0", "status": "queued"}
+        fake = self._db(
+            monkeypatch,
+            leads=FakeCollection([queued]),
+            deliveries=FakeCollection(),
+        )
+        items = self._items(count=1)
+        items[0][1]["lb_update"] = ("lb-missing", {"status": "routed"})
+        items.append((_lead(id="lead-gone", status="routed"), None))
+        with pytest.raises(RuntimeError):
+            asyncio.run(lead_ingestion.persist_planned_leads(items, inserted=True))
+
+        assert fake.leads.docs == {"lead-0": queued}
+        assert fake.deliveries.docs == {}
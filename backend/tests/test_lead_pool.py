@@ -0,0 +1,93 @@
+"""
+RDZ CRM — Daily Lead Pool Tests
+Tests: buckets produit x département, ordre created_at, vue fusionnée "*",
+retrait des leads utilisés entre commandes, taille = leads non utilisés.
+Run: cd /app/backend && pytest tests/test_lead_pool.py -v
+"""
+
+import sys
+
+sys.path.insert(0, "/app/backend")
+
+from services.daily_delivery import LeadPool
+
+
+def _lead(lead_id, dept, created_at, produit="PV"):
+    return {"id": lead_id, "produit": produit, "departement": dept, "created_at": created_at}
+
+
+LEADS = [
+    _lead("c", "75", "2026-01-03"),
+    _lead("a", "75", "2026-01-01"),
+    _lead("b", "13", "2026-01-02"),
+    _lead("d", "13", "2026-01-04"),
+    _lead("p", "75", "2026-01-01", produit="PAC"),
+]
+
+
+def _ids(leads):
+    return [lead["id"] for lead in leads]
+
+
+class TestCursor:
+    def test_single_departement_sorted(self):
+        pool = LeadPool.from_leads(LEADS, set())
+        assert _ids(pool.cursor("PV", ["75"])) == ["a", "c"]
+
+    def test_wildcard_merges_by_created_at(self):
+        pool = LeadPool.from_leads(LEADS, set())
+        assert _ids(pool.cursor("PV", ["*"])) == ["a", "b", "c", "d"]
+
+    def test_several_departements_merged(self):
+        pool = LeadPool.from_leads(LEADS, set())
+        assert _ids(pool.cursor("PV", ["13", "75", "13"])) == ["a", "b", "c", "d"]
+
+    def test_produit_isolated(self):
+        pool = LeadPool.from_leads(LEADS, set())
+        assert _ids(pool.cursor("PAC", ["*"])) == ["p"]
+        assert _ids(pool.cursor("CET", ["*"])) == []
+
+    def test_unknown_departement(self):
+        pool = LeadPool.from_leads(LEADS, set())
+        assert _ids(pool.cursor("PV", ["69"])) == []
+
+
+class TestUsedLeads:
+    def test_used_skipped_and_purged(self):
+        used = set()
+        pool = LeadPool.from_leads(LEADS, used)
+        assert len(pool) == 5
+        used.update({"a", "b"})
+        assert _ids(pool.cursor("PV", ["*"])) == ["c", "d"]
+        assert len(pool) == 3
+
+    def test_len_counts_used_without_purge(self):
+        used = set()
+        fresh = LeadPool.from_leads(LEADS, used)
+        lb = LeadPool.from_leads([_lead("x", "75", "2026-01-05")], used)
+        # Attribués via un autre bucket / pool: jamais purgés d'ici
+        used.update({"c", "p", "x"})
+        assert len(fresh) == 3
+        assert len(lb) == 0
+        assert _ids(fresh.cursor("PV", ["13"])) == ["b", "d"]
+        assert len(fresh) == 3
+
+    def test_used_while_iterating(self):
+        used = set()
+        pool = LeadPool.from_leads(LEADS, used)
+        cursor = pool.cursor("PV", ["*"])
+        assert next(cursor)["id"] == "a"
+        used.add("b")
+        assert _ids(cursor) == ["c", "d"]
+
+    def test_shared_between_pools(self):
+        used = set()
+        fresh = LeadPool.from_leads(LEADS[:2], used)
+        lb = LeadPool.from_leads(LEADS[2:], used)
+        used.add("c")
+        assert _ids(fresh.cursor("PV", ["*"])) == ["a"]
+        assert _ids(lb.cursor("PV", ["*"])) == ["b", "d"]
+
+    def test_iter_all(self):
+        pool = LeadPool.from_leads(LEADS, set())
+        assert sorted(_ids(pool)) == ["a", "b", "c", "d", "p"]
@@ -0,0 +1,149 @@
+"""
+RDZ CRM — Intraday Micro-Batch Tests
+Tests: déclenchement taille / intervalle (défauts + réglages client),
+calendrier, auto_send_enabled, filtre client de process_pending_csv_deliveries,
+bail multi-process.
+Run: cd /app/backend && pytest tests/test_micro_batch.py -v
+"""
+
+import sys
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+sys.path.insert(0, "/app/backend")
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from services import micro_batch, daily_delivery, settings
+
+
+NOW = datetime(2026, 3, 4, 11, 0, tzinfo=timezone.utc)  # mercredi
+
+
+def _ago(minutes):
+    return (NOW - timedelta(minutes=minutes)).isoformat()
+
+
+class TestFlushReason:
+    @pytest.fixture(autouse=True)
+    def defaults(self, monkeypatch):
+        monkeypatch.setattr(micro_batch, "MICRO_BATCH_INTERVAL_MINUTES", 30)
+        monkeypatch.setattr(micro_batch, "MICRO_BATCH_SIZE_THRESHOLD", 50)
+
+    def test_size(self):
+        assert micro_batch.flush_reason(50, _ago(1), {}, NOW) == "size"
+
+    def test_interval(self):
+        assert micro_batch.flush_reason(3, _ago(30), {}, NOW) == "interval"
+
+    def test_not_due(self):
+        assert micro_batch.flush_reason(3, _ago(29), {}, NOW) is None
+
+    def test_client_overrides(self):
+        client = {"micro_batch_size": 5, "micro_batch_interval_minutes": 120}
+        assert micro_batch.flush_reason(5, _ago(1), client, NOW) == "size"
+        assert micro_batch.flush_reason(4, _ago(60), client, NOW) is None
+
+
+class TestCycle:
+    @pytest.fixture
+    def flushed(self, monkeypatch):
+        flushed = []
+
+        async def groups(entities):
+            return [
+                {"entity": "ZR7", "client_id": "big", "count": 80, "oldest_created_at": _ago(1)},
+                {"entity": "ZR7", "client_id": "old", "count": 2, "oldest_created_at": _ago(45)},
+                {"entity": "ZR7", "client_id": "young", "count": 2, "oldest_created_at": _ago(5)},
+                {"entity": "ZR7", "client_id": "manual", "count": 90, "oldest_created_at": _ago(90)},
+                {"entity": "ZR7", "client_id": "ghost", "count": 90, "oldest_created_at": _ago(90)},
+                {"entity": "MDL", "client_id": "mdl", "count": 90, "oldest_created_at": _ago(90)},
+            ]
+
+        async def clients(client_ids):
+            assert "mdl" not in client_ids
+            found = {cid: {"id": cid} for cid in client_ids if cid != "ghost"}
+            found["manual"]["auto_send_enabled"] = False
+            return found
+
+        async def day_enabled(entity, check_date=None):
+            return (True, None) if entity == "ZR7" else (False, "delivery_day_disabled:mercredi")
+
+        async def process(client_ids=None, source="pending_csv"):
+            flushed.append((sorted(client_ids), source))
+            return {"queued": 82, "errors": []}
+
+        monkeypatch.setattr(micro_batch, "MICRO_BATCH_INTERVAL_MINUTES", 30)
+        monkeypatch.setattr(micro_batch, "MICRO_BATCH_SIZE_THRESHOLD", 50)
+        monkeypatch.setattr(micro_batch, "load_pending_groups", groups)
+        monkeypatch.setattr(micro_batch, "load_clients", clients)
+        monkeypatch.setattr(settings, "is_delivery_day_enabled", day_enabled)
+        monkeypatch.setattr(daily_delivery, "process_pending_csv_deliveries", process)
+        return flushed
+
+    def test_flushes_due_clients_only(self, flushed):
+        cycle = asyncio.run(micro_batch.run_micro_batch_cycle(NOW))
+
+        assert flushed == [(["big", "old"], "micro_batch")]
+        assert cycle["due"] == {"big": "size", "old": "interval"}
+        assert cycle["skipped_calendar"] == 90
+        assert cycle["skipped_manual"] == 90
+
+    def test_nothing_pending(self, flushed, monkeypatch):
+        async def groups(entities):
+            return []
+        monkeypatch.setattr(micro_batch, "load_pending_groups", groups)
+        cycle = asyncio.run(micro_batch.run_micro_batch_cycle(NOW))
+        assert flushed == []
+        assert cycle["flush"] is None
+
+
+class TestPendingCsvFilter:
+    def test_client_ids_filter(self, monkeypatch):
+        queries = []
+
+        class Cursor:
+            def __aiter__(self):
+                return self
+
+            async def __anext__(self):
+                raise StopAsyncIteration
+
+        class Deliveries:
+            def aggregate(self, pipeline, **kwargs):
+                queries.append(pipeline[0]["$match"])
+                return Cursor()
+
+        class FakeDb:
+            deliveries = Deliveries()
+
+        async def none():
+            return None
+
+        async def denylist():
+            return {"domains": []}
+
+        monkeypatch.setattr(daily_delivery, "db", FakeDb())
+        monkeypatch.setattr(settings, "get_email_denylist_settings", denylist)
+        monkeypatch.setattr(settings, "get_simulation_email_override", none)
+        asyncio.run(daily_delivery.process_pending_csv_deliveries(client_ids=["a", "b"]))
+        asyncio.run(daily_delivery.process_pending_csv_deliveries())
+
+        assert queries == [
+            {"status": "pending_csv", "client_id": {"$in": ["a", "b"]}},
+            {"status": "pending_csv"},
+        ]
+
+
+class TestLease:
+    def test_lease_held_elsewhere(self, monkeypatch):
+        class Leases:
+            async def update_one(self, query, update, upsert=False):
+                raise DuplicateKeyError("E11000")
+
+        class FakeDb:
+            scheduler_leases = Leases()
+
+        monkeypatch.setattr(micro_batch, "db", FakeDb())
+        assert asyncio.run(micro_batch._acquire_lease()) is False
@@ -0,0 +1,362 @@
+"""
+RDZ CRM — Delivery Outbox Tests
+Tests: backoff exponentiel, domaines destinataires, rate limit par domaine, issue d'un envoi
+(succès, retry, non réessayable, report circuit ouvert), claim atomique des deliveries
+à l'enqueue (enqueuers concurrents, claim partiel), CSV email chargé à l'envoi (csv_file_id),
+quota réservé à la mise en file (run quotidien) et rendu en dead-letter.
+Run: cd /app/backend && pytest tests/test_outbox.py -v
+"""
+
+import sys
+import asyncio
+from types import SimpleNamespace
+
+sys.path.insert(0, "/app/backend")
+
+import pytest
+
+from services import outbox, delivery_state_machine, delivery_files
+
+
+class TestBackoff:
+    def test_exponential(self, monkeypatch):
+        monkeypatch.setattr(outbox, "OUTBOX_BACKOFF_BASE_SECONDS", 60)
+        monkeypatch.setattr(outbox, "OUTBOX_BACKOFF_MAX_SECONDS", 3600)
+        assert [outbox.backoff_seconds(n) for n in (1, 2, 3, 4)] == [60, 120, 240, 480]
+
+    def test_capped(self, monkeypatch):
+        monkeypatch.setattr(outbox, "OUTBOX_BACKOFF_BASE_SECONDS", 60)
+        monkeypatch.setattr(outbox, "OUTBOX_BACKOFF_MAX_SECONDS", 3600)
+        assert outbox.backoff_seconds(10) == 3600
+
+
+class TestRecipientDomains:
+    def test_normalized_and_deduplicated(self):
+        emails = ["a@Client.fr", "b@client.fr ", "c@autre.com", "", "invalide"]
+        assert outbox.recipient_domains(emails) == ["autre.com", "client.fr"]
+
+
+class TestDomainRateLimit:
+    @pytest.fixture(autouse=True)
+    def fresh_limiter(self, monkeypatch):
+        monkeypatch.setattr(outbox, "_domain_sends", {})
+        monkeypatch.setattr(outbox, "OUTBOX_DOMAIN_RATE_PER_MINUTE", 2)
+
+    def test_allows_up_to_limit(self):
+        assert outbox._reserve_domain_slots(["client.fr"]) == 0
+        assert outbox._reserve_domain_slots(["client.fr"]) == 0
+        assert outbox._reserve_domain_slots(["client.fr"]) > 0
+
+    def test_domains_independent(self):
+        outbox._reserve_domain_slots(["client.fr"])
+        outbox._reserve_domain_slots(["client.fr"])
+        assert outbox._reserve_domain_slots(["autre.com"]) == 0
+
+    def test_saturated_domain_reserves_nothing(self):
+        outbox._reserve_domain_slots(["client.fr"])
+        outbox._reserve_domain_slots(["client.fr"])
+        assert outbox._reserve_domain_slots(["autre.com", "client.fr"]) > 0
+        assert len(outbox._domain_sends["autre.com"]) == 0
+
+    def test_disabled(self, monkeypatch):
+        monkeypatch.setattr(outbox, "OUTBOX_DOMAIN_RATE_PER_MINUTE", 0)
+        assert all(outbox._reserve_domain_slots(["client.fr"]) == 0 for _ in range(10))
+
+
+class TestProcessJob:
+    @pytest.fixture(autouse=True)
+    def recorder(self, monkeypatch):
+        self.calls = []
+        monkeypatch.setattr(outbox, "_domain_sends", {})
+
+        async def complete(job, attempts, result):
+            self.calls.append(("complete", attempts))
+
+        async def fail(job, attempts, error, retryable=True):
+            self.calls.append(("fail", attempts, error, retryable))
+
+        async def defer(job, seconds):
+            self.calls.append(("defer", seconds))
+
+        monkeypatch.setattr(outbox, "_complete", complete)
+        monkeypatch.setattr(outbox, "_fail", fail)
+        monkeypatch.setattr(outbox, "_defer", defer)
+        self.monkeypatch = monkeypatch
+
+    def _job(self, attempts=0):
+        return {"id": "job-1", "attempts": attempts, "recipient_domains": ["client.fr"]}
+
+    def test_success_completes(self):
+        async def send(job):
+            return {"success": True, "latency_ms": 12}
+        self.monkeypatch.setattr(outbox, "_send", send)
+        asyncio.run(outbox.process_job(self._job(attempts=2)))
+        assert self.calls == [("complete", 3)]
+
+    def test_failure_result(self):
+        async def send(job):
+            return {"success": False, "error": "Erreur SMTP: 421"}
+        self.monkeypatch.setattr(outbox, "_send", send)
+        asyncio.run(outbox.process_job(self._job()))
+        assert self.calls == [("fail", 1, "Erreur SMTP: 421", True)]
+
+    def test_non_retryable_failure(self):
+        async def send(job):
+            return {"success": False, "error": "HTTP 422", "retryable": False}
+        self.monkeypatch.setattr(outbox, "_send", send)
+        asyncio.run(outbox.process_job(self._job()))
+        assert self.calls == [("fail", 1, "HTTP 422", False)]
+
+    def test_open_circuit_defers(self):
+        async def send(job):
+            return {"success": False, "error": "circuit_open", "retryable": True, "defer_seconds": 30}
+        self.monkeypatch.setattr(outbox, "_send", send)
+        asyncio.run(outbox.process_job(self._job()))
+        assert self.calls == [("defer", 30)]
+
+    def test_exception_is_failure(self):
+        async def send(job):
+            raise RuntimeError("boom")
+        self.monkeypatch.setattr(outbox, "_send", send)
+        asyncio.run(outbox.process_job(self._job()))
+        assert self.calls == [("fail", 1, "boom", True)]
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for doc in self.docs:
+            yield dict(doc)
+
+    async def to_list(self, length):
+        return [dict(d) for d in self.docs]
+
+
+class FakeDeliveries:
+    """update_many atomique par document (filtre status), comme MongoDB"""
+
+    def __init__(self, docs):
+        self.docs = {d["id"]: d for d in docs}
+
+    def _match(self, doc, query):
+        for key, cond in query.items():
+            value = doc.get(key)
+            if isinstance(cond, dict) and "$in" in cond:
+                if value not in cond["$in"]:
+                    return False
+            elif isinstance(cond, dict) and "$exists" in cond:
+                if (key in doc) != cond["$exists"]:
+                    return False
+            elif isinstance(cond, dict) and "$ne" in cond:
+                if value == cond["$ne"]:
+                    return False
+            elif value != cond:
+                return False
+        return True
+
+    async def update_many(self, query, update):
+        await asyncio.sleep(0)  # laisse l'autre enqueuer s'intercaler
+        modified = 0
+        for doc in self.docs.values():
+            if self._match(doc, query):
+                doc.update(update.get("$set", {}))
+                for field in update.get("$unset", {}):
+                    doc.pop(field, None)
+                modified += 1
+        return SimpleNamespace(modified_count=modified)
+
+    def find(self, query, projection=None):
+        return FakeCursor([d for d in self.docs.values() if self._match(d, query)])
+
+
+class TestEnqueueClaim:
+    @pytest.fixture
+    def fake_db(self, monkeypatch):
+        fake = SimpleNamespace(
+            deliveries=FakeDeliveries([
+                {"id": f"d{i}", "lead_id": f"l{i}", "status": "pending_csv"} for i in range(4)
+            ]),
+            outbox=SimpleNamespace(inserted=[]),
+            leads=SimpleNamespace(
+                find=lambda query, projection: FakeCursor(
+                    [{"id": lead_id, "nom": "N", "phone": "0600000000", "departement": "75"}
+                     for lead_id in query["id"]["$in"]]
+                ),
+            ),
+        )
+
+        async def insert_one(doc):
+            fake.outbox.inserted.append(doc)
+
+        async def leads_update_many(query, update):
+            return None
+
+        async def store_csv(csv_content):
+            return f"file-{csv_content.count(chr(10))}"
+
+        fake.outbox.insert_one = insert_one
+        fake.leads.update_many = leads_update_many
+        monkeypatch.setattr(outbox, "db", fake)
+        monkeypatch.setattr(delivery_state_machine, "db", fake)
+        monkeypatch.setattr(delivery_files, "store_csv", store_csv)
+        return fake
+
+    def _push(self, delivery_ids):
+        return outbox.enqueue_api_push(
+            entity="ZR7", client_id="c1", client_name="Client", commande_id="k1", produit="PV",
+            delivery_ids=delivery_ids, lead_ids=[d.replace("d", "l") for d in delivery_ids],
+            endpoint="https://client.fr/leads", lb_count=0, source="micro_batch",
+        )
+
+    def test_concurrent_enqueue_single_job(self, fake_db):
+        ids = ["d0", "d1", "d2", "d3"]
+
+        async def run():
+            return await asyncio.gather(self._push(ids), self._push(ids))
+
+        jobs = asyncio.run(run())
+        created = [job for job in jobs if job]
+        assert len(created) == 1
+        assert created[0]["delivery_ids"] == ids
+        assert len(fake_db.outbox.inserted) == 1
+        assert {d["outbox_job_id"] for d in fake_db.deliveries.docs.values()} == {created[0]["id"]}
+
+    def test_partial_claim_restricts_job(self, fake_db):
+        fake_db.deliveries.docs["d1"].update(status="sending", outbox_job_id="other")
+
+        job = asyncio.run(outbox.enqueue_csv_email(
+            entity="ZR7", client_id="c1", client_name="Client", commande_id="k1", produit="PV",
+            delivery_ids=["d0", "d1", "d2"], lead_ids=["l0", "l1", "l2"], to_emails=["a@client.fr"],
+            csv_file_id="file-full", csv_filename="leads.csv", lb_count=0, source="pending_csv",
+        ))
+        assert job["delivery_ids"] == ["d0", "d2"]
+        assert job["lead_ids"] == ["l0", "l2"]
+        assert job["csv_file_id"] == "file-3"  # en-tête + 2 leads
+        assert "csv_content" not in job
+        assert fake_db.deliveries.docs["d1"]["outbox_job_id"] == "other"
+
+
+class TestSendEmail:
+    @pytest.fixture
+    def sent(self, monkeypatch):
+        from services import csv_delivery
+
+        calls = []
+
+        async def load_csv(file_id):
+            return "nom\nx\n" if file_id == "file-1" else None
+
+        async def send_csv_email(**kwargs):
+            calls.append(kwargs)
+            return {"success": True}
+
+        monkeypatch.setattr(delivery_files, "load_csv", load_csv)
+        monkeypatch.setattr(csv_delivery, "send_csv_email", send_csv_email)
+        return calls
+
+    def _job(self, **kw):
+        job = {"id": "job1", "channel": "email", "entity": "ZR7", "to_emails": ["a@client.fr"],
+               "csv_filename": "leads.csv", "lead_count": 1, "produit": "PV"}
+        job.update(kw)
+        return job
+
+    def test_loads_csv_file(self, sent):
+        assert asyncio.run(outbox._send(self._job(csv_file_id="file-1")))["success"]
+        assert sent[0]["csv_content"] == "nom\nx\n"
+
+    def test_legacy_inline_csv(self, sent):
+        assert asyncio.run(outbox._send(self._job(csv_content="nom\ny\n")))["success"]
+        assert sent[0]["csv_content"] == "nom\ny\n"
+
+    def test_missing_file_not_retryable(self, sent):
+        result = asyncio.run(outbox._send(self._job(csv_file_id="gone")))
+        assert result == {"success": False, "error": "csv_file_missing", "retryable": False}
+        assert sent == []
+
+
+class TestCounterReservation:
+    @pytest.fixture
+    def fake_db(self, monkeypatch):
+        from services import commande_counters
+
+        leads = {
+            "l0": {"id": "l0", "status": "new"},
+            "l1": {"id": "l1", "status": "lb", "is_lb": True},
+            # Routé en temps réel: déjà compté au routing
+            "l2": {"id": "l2", "status": "routed", "delivery_commande_id": "k1"},
+        }
+        fake = SimpleNamespace(
+            deliveries=FakeDeliveries([
+                {"id": f"d{i}", "lead_id": f"l{i}", "commande_id": "k1", "status": "sending"} for i in range(3)
+            ]),
+            leads=SimpleNamespace(find=lambda query, projection: FakeCursor([
+                leads[i] for i in query["id"]["$in"]
+                if i in leads and (not query.get("is_lb") or leads[i].get("is_lb"))
+            ])),
+            incs=[],
+        )
+
+        async def inc(commande_id, week_key=None, **counters):
+            fake.incs.append((commande_id, week_key, {k: v for k, v in counters.items() if v}))
+
+        monkeypatch.setattr(delivery_state_machine, "db", fake)
+        monkeypatch.setattr(commande_counters, "inc_commande_counters", inc)
+        monkeypatch.setattr(commande_counters, "week_key_for", lambda ts=None: "2026-W07")
+        return fake
+
+    def test_reserve_unattributed_only(self, fake_db):
+        reserved = asyncio.run(delivery_state_machine.reserve_delivery_counters(["d0", "d1", "d2"]))
+
+        assert reserved == 2
+        assert fake_db.incs == [("k1", "2026-W07", {"delivered": 2, "lb_delivered": 1})]
+        assert [d.get("counter_reserved_week") for d in fake_db.deliveries.docs.values()] == [
+            "2026-W07", "2026-W07", None
+        ]
+        # Idempotent: déjà réservées
+        assert asyncio.run(delivery_state_machine.reserve_delivery_counters(["d0", "d1"])) == 0
+
+    def test_sent_skips_reserved_delivered(self, fake_db):
+        asyncio.run(delivery_state_machine._inc_sent_counters(
+            [{"lead_id": "l0", "commande_id": "k1", "counter_reserved_week": "2026-W07"},
+             {"lead_id": "l3", "commande_id": "k1"}],
+            {"l0": {"status": "new"}, "l3": {"status": "new"}}
+        ))
+        assert fake_db.incs == [("k1", None, {"delivered": 1, "accepted": 2})]
+
+    def test_release_on_dead_letter(self, fake_db):
+        asyncio.run(delivery_state_machine.reserve_delivery_counters(["d0", "d1", "d2"]))
+        fake_db.deliveries.docs["d0"]["status"] = "sent"
+        fake_db.incs.clear()
+
+        released = asyncio.run(delivery_state_machine.release_reserved_counters(["d0", "d1", "d2"]))
+
+        assert released == 1
+        assert fake_db.incs == [("k1", "2026-W07", {"delivered": -1, "lb_delivered": -1})]
+        assert "counter_reserved_week" not in fake_db.deliveries.docs["d1"]
+        assert fake_db.deliveries.docs["d0"]["counter_reserved_week"] == "2026-W07"
+
+    def test_dead_job_releases(self, monkeypatch):
+        released = []
+
+        async def mark_failed(delivery_ids, error):
+            return None
+
+        async def release(delivery_ids):
+            released.append(delivery_ids)
+
+        async def noop(*args, **kwargs):
+            return None
+
+        monkeypatch.setattr(delivery_state_machine, "batch_mark_deliveries_failed", mark_failed)
+        monkeypatch.setattr(delivery_state_machine, "release_reserved_counters", release)
+        monkeypatch.setattr(outbox, "_release_leads", noop)
+        monkeypatch.setattr(outbox, "db", SimpleNamespace(outbox=SimpleNamespace(update_one=noop)))
+
+        job = {"id": "job1", "client_name": "C", "delivery_ids": ["d0"], "lead_ids": ["l0"]}
+        asyncio.run(outbox._fail(job, 1, "smtp 550", retryable=False))
+        assert released == [["d0"]]
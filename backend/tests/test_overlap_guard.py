@@ -121,6 +121,10 @@ class TestKillSwitch:
                 {"$set": {"key": "overlap_guard", "enabled": False}},
                 upsert=True,
             )
+            # Écriture hors upsert_setting → bump de version pour le cache settings
+            await db.settings_version.update_one(
+                {"_id": "settings"}, {"$inc": {"version": 1}}, upsert=True
+            )
             client.close()
 
         _db_op(run())
@@ -145,6 +149,9 @@ class TestKillSwitch:
                 {"key": "overlap_guard"},
                 {"$set": {"enabled": True}},
             )
+            await db.settings_version.update_one(
+                {"_id": "settings"}, {"$inc": {"version": 1}}, upsert=True
+            )
             client.close()
 
         _db_op(reenable())
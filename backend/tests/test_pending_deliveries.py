@@ -0,0 +1,159 @@
+"""
+RDZ CRM — Pending Deliveries Pagination Tests
+Tests: groupes lus par pages (aggregate), clients / commandes préchargés
+par page ($in), calendrier lu une fois par entité, découpage des gros
+groupes, débit rapporté, pas de plafond à 1000 deliveries.
+Run: cd /app/backend && pytest tests/test_pending_deliveries.py -v
+"""
+
+import sys
+import asyncio
+from types import SimpleNamespace
+
+sys.path.insert(0, "/app/backend")
+
+import pytest
+
+from services import daily_delivery, settings, outbox, delivery_files
+
+
+def _deliveries(client_id, count):
+    return [
+        {"id": f"{client_id}-d{i}", "lead_id": f"{client_id}-l{i}", "produit": "PV"}
+        for i in range(count)
+    ]
+
+
+GROUPS = [
+    {"_id": {"client_id": "c1", "commande_id": "k1", "entity": "ZR7"}, "deliveries": _deliveries("c1", 1500)},
+    {"_id": {"client_id": "c2", "commande_id": "k2", "entity": "ZR7"}, "deliveries": _deliveries("c2", 3)},
+    {"_id": {"client_id": "c3", "commande_id": "k3", "entity": "MDL"}, "deliveries": _deliveries("c3", 4)},
+    {"_id": {"client_id": "ghost", "commande_id": "k4", "entity": "ZR7"}, "deliveries": _deliveries("ghost", 2)},
+]
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for doc in self.docs:
+            yield doc
+
+    async def to_list(self, length):
+        return list(self.docs)
+
+
+class FakeDb:
+    def __init__(self):
+        self.pipelines = []
+        self.ref_queries = []
+        self.updates = []
+        self.deliveries = SimpleNamespace(aggregate=self._aggregate, update_many=self._update_many)
+        self.clients = SimpleNamespace(find=self._find_refs("clients"))
+        self.commandes = SimpleNamespace(find=self._find_refs("commandes"))
+        self.leads = SimpleNamespace(find=lambda query, projection: FakeCursor(
+            [{"id": lead_id, "nom": "N", "phone": "0600000000", "departement": "75"}
+             for lead_id in query["id"]["$in"]]
+        ))
+
+    def _aggregate(self, pipeline, **kwargs):
+        self.pipelines.append(pipeline)
+        return FakeCursor(GROUPS)
+
+    def _find_refs(self, collection):
+        def find(query, projection):
+            ids = query["id"]["$in"]
+            self.ref_queries.append((collection, sorted(ids)))
+            return FakeCursor([
+                {"id": i, "name": i, "produit": "PV", "email": f"{i}@client.fr"} for i in ids if i != "ghost"
+            ])
+        return find
+
+    async def _update_many(self, query, update):
+        self.updates.append(query)
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    fake = FakeDb()
+    calendar_calls = []
+    enqueued = []
+
+    async def day_enabled(entity, check_date=None):
+        calendar_calls.append(entity)
+        return (True, None) if entity == "ZR7" else (False, "delivery_day_disabled:samedi")
+
+    async def denylist():
+        return {"domains": []}
+
+    async def no_override():
+        return None
+
+    async def store_csv(csv_content):
+        return "file"
+
+    async def enqueue(**kwargs):
+        enqueued.append(kwargs)
+        return {"id": "job", "delivery_ids": kwargs["delivery_ids"], "lead_count": len(kwargs["lead_ids"])}
+
+    monkeypatch.setattr(daily_delivery, "db", fake)
+    monkeypatch.setattr(settings, "is_delivery_day_enabled", day_enabled)
+    monkeypatch.setattr(settings, "get_email_denylist_settings", denylist)
+    monkeypatch.setattr(settings, "get_simulation_email_override", no_override)
+    monkeypatch.setattr(delivery_files, "store_csv", store_csv)
+    monkeypatch.setattr(outbox, "enqueue_csv_email", enqueue)
+    monkeypatch.setattr(daily_delivery, "PENDING_GROUP_PAGE", 2)
+    monkeypatch.setattr(daily_delivery, "PENDING_BATCH_MAX", 1000)
+    monkeypatch.setattr("models.client.check_client_deliverable", lambda **kwargs: {"deliverable": True})
+    fake.calendar_calls = calendar_calls
+    fake.enqueued = enqueued
+    return fake
+
+
+class TestGroupPages:
+    def test_pages(self, fake_db):
+        async def run():
+            return [page async for page in daily_delivery.iter_delivery_group_pages({"status": "pending_csv"})]
+
+        pages = asyncio.run(run())
+        assert [len(p) for p in pages] == [2, 2]
+        assert pages[0][0]["client_id"] == "c1"
+        assert len(pages[0][0]["deliveries"]) == 1500
+        assert fake_db.pipelines[0][0] == {"$match": {"status": "pending_csv"}}
+
+    def test_prefetch_without_commandes(self, fake_db):
+        clients, commandes = asyncio.run(daily_delivery.prefetch_group_refs(
+            [{"client_id": "c1", "commande_id": "k1"}, {"client_id": "c1", "commande_id": "k2"}],
+            with_commandes=False
+        ))
+        assert list(clients) == ["c1"]
+        assert commandes == {}
+        assert fake_db.ref_queries == [("clients", ["c1"])]
+
+
+class TestPendingCsv:
+    def test_single_pass_with_prefetch(self, fake_db):
+        results = asyncio.run(daily_delivery.process_pending_csv_deliveries())
+
+        # Pas de plafond: les 1509 deliveries sont prises en une passe
+        assert results["processed"] == 1509
+        assert results["groups"] == 4
+        assert results["pages"] == 2
+        # 1 requête $in par page et par collection
+        assert fake_db.ref_queries == [
+            ("clients", ["c1", "c2"]), ("commandes", ["k1", "k2"]),
+            ("clients", ["c3", "ghost"]), ("commandes", ["k3", "k4"]),
+        ]
+        # Calendrier lu une fois par entité
+        assert sorted(fake_db.calendar_calls) == ["MDL", "ZR7"]
+        # Groupe de 1500 → 2 CSV / jobs (PENDING_BATCH_MAX=1000)
+        assert [len(job["delivery_ids"]) for job in fake_db.enqueued] == [1000, 500, 3]
+        assert results["queued"] == 1503
+        assert results["skipped_calendar"] == 4
+        assert results["errors"] == [{"client_id": "ghost", "error": "client_or_commande_not_found"}]
+        assert results["duration_seconds"] >= 0
+        assert "deliveries_per_second" in results
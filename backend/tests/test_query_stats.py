@@ -0,0 +1,61 @@
+"""
+RDZ CRM — MongoDB Query Count Tests
+Tests: comptage par nom de commande dans count_queries(), rien hors bloc,
+écritures, isolation entre tâches asyncio.
+Run: cd /app/backend && pytest tests/test_query_stats.py -v
+"""
+
+import sys
+import asyncio
+from types import SimpleNamespace
+
+sys.path.insert(0, "/app/backend")
+
+from services.query_stats import count_queries, query_count_listener, summarize_queries
+
+
+def _send(command_name):
+    query_count_listener.started(SimpleNamespace(command_name=command_name))
+
+
+class TestCountQueries:
+    def test_counts_inside_block_only(self):
+        _send("find")
+        with count_queries() as queries:
+            _send("find")
+            _send("getMore")
+            _send("insert")
+        _send("find")
+        assert dict(queries) == {"find": 1, "getMore": 1, "insert": 1}
+
+    def test_nested_blocks(self):
+        with count_queries() as outer:
+            _send("find")
+            with count_queries() as inner:
+                _send("aggregate")
+            _send("update")
+        assert dict(outer) == {"find": 1, "update": 1}
+        assert dict(inner) == {"aggregate": 1}
+
+    def test_summary(self):
+        with count_queries() as queries:
+            for name in ("find", "find", "insert", "update", "findAndModify", "count"):
+                _send(name)
+        assert summarize_queries(queries) == {
+            "total": 6,
+            "writes": 3,
+            "by_command": {"find": 2, "insert": 1, "update": 1, "findAndModify": 1, "count": 1},
+        }
+
+    def test_tasks_isolated(self):
+        async def task(name, n):
+            with count_queries() as queries:
+                for _ in range(n):
+                    _send(name)
+                    await asyncio.sleep(0)
+            return dict(queries)
+
+        async def main():
+            return await asyncio.gather(task("find", 3), task("insert", 2))
+
+        assert asyncio.run(main()) == [{"find": 3}, {"insert": 2}]
@@ -0,0 +1,138 @@
+"""
+RDZ CRM — Async Routing Queue Tests
+Tests: async mode selection (LP vs provider vs sync_routing), pool state,
+démarrage (workers en mode async seulement, passage unique sur les leads
+"queued" en mode synchrone).
+Run: cd /app/backend && pytest tests/test_routing_queue.py -v
+"""
+
+import sys
+import asyncio
+
+sys.path.insert(0, "/app/backend")
+
+import pytest
+
+from routes import public
+from routes.public import LeadData, _use_async_routing
+from services import routing_queue, lead_ingestion
+
+
+def _data(**kw):
+    return LeadData(session_id="s", form_code="F", phone="0611223344", **kw)
+
+
+class TestAsyncModeSelection:
+    def setup_method(self):
+        self._orig = public.is_async_routing_available
+        public.is_async_routing_available = lambda: True
+
+    def teardown_method(self):
+        public.is_async_routing_available = self._orig
+
+    def test_landing_page_goes_async(self):
+        assert _use_async_routing(_data(), None) is True
+
+    def test_sync_routing_forces_sync(self):
+        assert _use_async_routing(_data(sync_routing=True), None) is False
+
+    def test_provider_sync_by_default(self):
+        assert _use_async_routing(_data(), {"id": "p1"}) is False
+
+    def test_provider_opt_in(self):
+        assert _use_async_routing(_data(), {"id": "p1", "async_routing": True}) is True
+
+    def test_provider_models_expose_opt_in(self):
+        from models.provider import ProviderCreate, ProviderUpdate
+
+        created = ProviderCreate(name="P", slug="p", entity="ZR7", async_routing=True)
+        assert created.async_routing is True
+        assert ProviderCreate(name="P", slug="p", entity="ZR7").async_routing is False
+        # update partiel: seuls les champs fournis sont écrits
+        update = {k: v for k, v in ProviderUpdate(async_routing=False).dict().items() if v is not None}
+        assert update == {"async_routing": False}
+
+    def test_unavailable_pool_stays_sync(self):
+        public.is_async_routing_available = lambda: False
+        assert _use_async_routing(_data(), None) is False
+
+
+class TestPoolState:
+    def test_not_available_without_workers(self):
+        assert routing_queue._workers == []
+        assert routing_queue.is_async_routing_available() is False
+
+    def test_notify_counts_enqueued(self):
+        before = routing_queue._stats["enqueued"]
+        routing_queue.notify_lead_queued()
+        assert routing_queue._stats["enqueued"] == before + 1
+
+
+class TestStartup:
+    @pytest.fixture
+    def queue(self, monkeypatch):
+        state = {"queued": [{"id": f"q{i}", "routing_attempts": 1} for i in range(3)], "processed": []}
+
+        async def claim(worker_name):
+            return state["queued"].pop(0) if state["queued"] else None
+
+        async def process(lead, retry=True):
+            state["processed"].append((lead["id"], retry))
+
+        monkeypatch.setattr(routing_queue, "claim_next_lead", claim)
+        monkeypatch.setattr(routing_queue, "process_lead", process)
+        monkeypatch.setattr(routing_queue, "QUEUE_WORKERS", 2)
+        monkeypatch.setattr(routing_queue, "QUEUE_POLL_MS", 10)
+        return state
+
+    def _start(self):
+        async def run():
+            routing_queue.start_routing_queue()
+            workers = len(routing_queue._workers)
+            await asyncio.sleep(0.05)
+            available = routing_queue.is_async_routing_available()
+            await routing_queue.stop_routing_queue()
+            return workers, available
+
+        return asyncio.run(run())
+
+    def test_sync_mode_drains_once(self, queue, monkeypatch):
+        monkeypatch.setattr(routing_queue, "ASYNC_ROUTING_ENABLED", False)
+        workers, available = self._start()
+
+        assert workers == 1
+        assert available is False
+        assert queue["processed"] == [("q0", False), ("q1", False), ("q2", False)]
+
+    def test_async_mode_starts_pool(self, queue, monkeypatch):
+        monkeypatch.setattr(routing_queue, "ASYNC_ROUTING_ENABLED", True)
+        workers, available = self._start()
+
+        assert workers == 2
+        assert available is True
+        assert [lead_id for lead_id, _ in queue["processed"]] == ["q0", "q1", "q2"]
+        assert all(retry for _, retry in queue["processed"])
+
+
+class TestProcessFailure:
+    @pytest.fixture
+    def abandoned(self, monkeypatch):
+        calls = []
+
+        async def failing_route(lead, inserted=False):
+            raise RuntimeError("boom")
+
+        async def abandon(lead, error):
+            calls.append(lead["id"])
+
+        monkeypatch.setattr(lead_ingestion, "route_and_persist_lead", failing_route)
+        monkeypatch.setattr(routing_queue, "_abandon", abandon)
+        return calls
+
+    def test_retry_left_in_queue(self, abandoned):
+        asyncio.run(routing_queue.process_lead({"id": "q1", "routing_attempts": 1}))
+        assert abandoned == []
+
+    def test_no_retry_returns_to_new(self, abandoned):
+        asyncio.run(routing_queue.process_lead({"id": "q1", "routing_attempts": 1}, retry=False))
+        assert abandoned == ["q1"]
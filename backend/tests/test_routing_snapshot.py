@@ -0,0 +1,99 @@
+"""
+RDZ CRM — Routing Snapshot Tests
+Tests: departement index, negative cache, local quota consumption, invalidation.
+Run: cd /app/backend && pytest tests/test_routing_snapshot.py -v
+"""
+
+import sys
+
+sys.path.insert(0, "/app/backend")
+
+from services import routing_snapshot
+from services.routing_snapshot import (
+    ProduitSnapshot,
+    invalidate_routing_snapshot,
+    note_commande_routed,
+    note_commande_full,
+    get_routing_snapshot_stats,
+)
+
+WEEK = "2026-02-09T00:00:00+00:00"
+
+
+def _cmd(cmd_id, depts, quota=10, delivered=0, priorite=1):
+    return {
+        "id": cmd_id, "client_id": f"client-{cmd_id}", "departements": depts,
+        "quota_semaine": quota, "priorite": priorite,
+        "quota_remaining": quota - delivered if quota > 0 else 999999,
+        "leads_delivered_this_week": delivered, "lb_delivered_this_week": 0,
+    }
+
+
+def _install(commandes):
+    invalidate_routing_snapshot("test")
+    snap = ProduitSnapshot("ZR7", "PV", WEEK, commandes, routing_snapshot._generation)
+    routing_snapshot._snapshots[("ZR7", "PV")] = snap
+    return snap
+
+
+class TestDepartementIndex:
+    def test_exact_and_wildcard(self):
+        snap = _install([_cmd("a", ["75"]), _cmd("b", ["*"], priorite=2)])
+        cmds, memo = snap.for_departement("75")
+        assert [c["id"] for c in cmds] == ["a", "b"]
+        assert memo is False
+
+    def test_memoized(self):
+        snap = _install([_cmd("a", ["75"])])
+        snap.for_departement("75")
+        _, memo = snap.for_departement("75")
+        assert memo is True
+
+    def test_negative_entry(self):
+        snap = _install([_cmd("a", ["75"])])
+        cmds, _ = snap.for_departement("13")
+        assert cmds == []
+        assert snap.by_dept["13"] == []
+
+
+class TestQuotaConsumption:
+    def test_decrement(self):
+        snap = _install([_cmd("a", ["75"], quota=5, delivered=1)])
+        note_commande_routed("ZR7", "PV", "a")
+        assert snap.commandes[0]["quota_remaining"] == 3
+        assert snap.commandes[0]["leads_delivered_this_week"] == 2
+
+    def test_quota_full_removes_commande(self):
+        snap = _install([_cmd("a", ["75"], quota=1), _cmd("b", ["75"], priorite=2)])
+        snap.for_departement("75")
+        note_commande_routed("ZR7", "PV", "a")
+        cmds, _ = snap.for_departement("75")
+        assert [c["id"] for c in cmds] == ["b"]
+
+    def test_reservation_refused_removes_commande(self):
+        snap = _install([_cmd("a", ["75"]), _cmd("b", ["75"], priorite=2)])
+        snap.for_departement("75")
+        note_commande_full("ZR7", "PV", "a")
+        cmds, _ = snap.for_departement("75")
+        assert [c["id"] for c in cmds] == ["b"]
+
+    def test_unlimited_quota_never_removed(self):
+        snap = _install([_cmd("a", ["75"], quota=0)])
+        for _ in range(5):
+            note_commande_routed("ZR7", "PV", "a")
+        assert len(snap.commandes) == 1
+
+
+class TestInvalidation:
+    def test_invalidate_clears_and_bumps_generation(self):
+        snap = _install([_cmd("a", ["75"])])
+        assert snap.is_valid(WEEK, routing_snapshot._generation)
+        before = get_routing_snapshot_stats()["generation"]
+        invalidate_routing_snapshot("test")
+        assert get_routing_snapshot_stats()["generation"] == before + 1
+        assert not snap.is_valid(WEEK, routing_snapshot._generation)
+        assert get_routing_snapshot_stats()["keys"] == 0
+
+    def test_week_change_invalidates(self):
+        snap = _install([_cmd("a", ["75"])])
+        assert not snap.is_valid("2026-02-16T00:00:00+00:00", routing_snapshot._generation)
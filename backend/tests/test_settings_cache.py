@@ -0,0 +1,49 @@
+"""
+RDZ CRM — Settings Cache Tests
+Tests: cache hit sans DB, copies isolées, cache négatif, invalidation, métriques.
+Run: cd /app/backend && pytest tests/test_settings_cache.py -v
+"""
+
+import sys
+import time
+import asyncio
+
+sys.path.insert(0, "/app/backend")
+
+from services import settings as settings_service
+from services.settings import get_setting, invalidate_settings_cache, get_settings_cache_stats
+
+
+def _seed(key, doc):
+    invalidate_settings_cache("test")
+    settings_service._cache[key] = doc
+    settings_service._cache_checked_at = time.monotonic()
+
+
+class TestCacheHit:
+    def test_hit_served_from_memory(self):
+        _seed("cross_entity", {"key": "cross_entity", "cross_entity_enabled": False})
+        before = get_settings_cache_stats()["hits"]
+        doc = asyncio.run(get_setting("cross_entity"))
+        assert doc["cross_entity_enabled"] is False
+        assert get_settings_cache_stats()["hits"] == before + 1
+
+    def test_returns_isolated_copy(self):
+        _seed("forms_config", {"key": "forms_config", "forms": {}})
+        doc = asyncio.run(get_setting("forms_config"))
+        doc["forms"]["X"] = {"entity": "ZR7"}
+        assert settings_service._cache["forms_config"]["forms"] == {}
+
+    def test_negative_entry(self):
+        _seed("overlap_guard", None)
+        assert asyncio.run(get_setting("overlap_guard")) is None
+
+
+class TestInvalidation:
+    def test_invalidate_clears(self):
+        _seed("source_gating", {"key": "source_gating"})
+        before = get_settings_cache_stats()["invalidations"]
+        invalidate_settings_cache("test")
+        stats = get_settings_cache_stats()
+        assert stats["keys"] == 0
+        assert stats["invalidations"] == before + 1
@@ -0,0 +1,209 @@
+"""
+RDZ CRM — SMTP Transport Tests
+Tests: réutilisation des connexions, reconnexion, concurrence par entité, latence.
+Run: cd /app/backend && pytest tests/test_smtp_transport.py -v
+"""
+
+import sys
+import time
+import asyncio
+import smtplib
+import threading
+from email.mime.text import MIMEText
+
+sys.path.insert(0, "/app/backend")
+
+import pytest
+
+from services import smtp_transport
+
+
+class FakeSMTP:
+    """Serveur SMTP factice (thread-safe), enregistre logins et envois"""
+    instances = []
+    lock = threading.Lock()
+    active_sends = 0
+    max_active_sends = 0
+    send_delay = 0.0
+
+    def __init__(self, host, port, timeout=None):
+        self.logins = 0
+        self.sent = []
+        self.closed = False
+        self.disconnect_next = False
+        with FakeSMTP.lock:
+            FakeSMTP.instances.append(self)
+
+    def login(self, user, password):
+        self.logins += 1
+
+    def send_message(self, msg):
+        if self.disconnect_next:
+            self.disconnect_next = False
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        with FakeSMTP.lock:
+            FakeSMTP.active_sends += 1
+            FakeSMTP.max_active_sends = max(FakeSMTP.max_active_sends, FakeSMTP.active_sends)
+        time.sleep(FakeSMTP.send_delay)
+        with FakeSMTP.lock:
+            FakeSMTP.active_sends -= 1
+        self.sent.append(msg["Subject"])
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def fake_smtp(monkeypatch):
+    FakeSMTP.instances = []
+    FakeSMTP.active_sends = 0
+    FakeSMTP.max_active_sends = 0
+    FakeSMTP.send_delay = 0.0
+    monkeypatch.setattr(smtp_transport, "SMTP_CLASS", FakeSMTP)
+    monkeypatch.setattr(smtp_transport, "_idle", {})
+    monkeypatch.setattr(smtp_transport, "_stats", {})
+    monkeypatch.setattr(smtp_transport, "_semaphores", {})
+    monkeypatch.setenv("ZR7_SMTP_PASSWORD", "secret")
+    monkeypatch.setenv("MDL_SMTP_PASSWORD", "secret")
+    yield
+
+
+def _msg(subject="test"):
+    msg = MIMEText("body")
+    msg["Subject"] = subject
+    return msg
+
+
+class TestConnectionReuse:
+    def test_batch_uses_one_connection(self):
+        async def run():
+            for i in range(5):
+                await smtp_transport.send_message("ZR7", _msg(f"m{i}"))
+        asyncio.run(run())
+
+        assert len(FakeSMTP.instances) == 1
+        assert FakeSMTP.instances[0].logins == 1
+        assert len(FakeSMTP.instances[0].sent) == 5
+        stats = smtp_transport.get_smtp_stats()["entities"]["ZR7"]
+        assert stats["connections_opened"] == 1
+        assert stats["connections_reused"] == 4
+
+    def test_one_pool_per_entity(self):
+        async def run():
+            await smtp_transport.send_message("ZR7", _msg())
+            await smtp_transport.send_message("MDL", _msg())
+        asyncio.run(run())
+        assert len(FakeSMTP.instances) == 2
+
+    def test_idle_connection_replaced(self, monkeypatch):
+        monkeypatch.setattr(smtp_transport, "SMTP_IDLE_TIMEOUT_SECONDS", 0.0)
+
+        async def run():
+            await smtp_transport.send_message("ZR7", _msg())
+            await asyncio.sleep(0.01)
+            await smtp_transport.send_message("ZR7", _msg())
+        asyncio.run(run())
+
+        assert len(FakeSMTP.instances) == 2
+        assert FakeSMTP.instances[0].closed
+
+    def test_close_connections(self):
+        asyncio.run(smtp_transport.send_message("ZR7", _msg()))
+        asyncio.run(smtp_transport.close_smtp_connections())
+        assert FakeSMTP.instances[0].closed
+        assert smtp_transport.get_smtp_stats()["idle_connections"] == {}
+
+
+class TestReconnect:
+    def test_dropped_pooled_connection_retried(self):
+        async def run():
+            await smtp_transport.send_message("ZR7", _msg("first"))
+            FakeSMTP.instances[0].disconnect_next = True
+            await smtp_transport.send_message("ZR7", _msg("second"))
+        asyncio.run(run())
+
+        assert len(FakeSMTP.instances) == 2
+        assert FakeSMTP.instances[1].sent == ["second"]
+        assert smtp_transport.get_smtp_stats()["entities"]["ZR7"]["reconnects"] == 1
+
+    def test_fresh_connection_failure_raises(self, monkeypatch):
+        original_init = FakeSMTP.__init__
+
+        def failing_init(self, *args, **kwargs):
+            original_init(self, *args, **kwargs)
+            self.disconnect_next = True
+        monkeypatch.setattr(FakeSMTP, "__init__", failing_init)
+
+        with pytest.raises(smtplib.SMTPServerDisconnected):
+            asyncio.run(smtp_transport.send_message("ZR7", _msg()))
+        assert smtp_transport.get_smtp_stats()["entities"]["ZR7"]["errors"] == 1
+        assert smtp_transport.get_smtp_stats()["idle_connections"].get("ZR7", 0) == 0
+
+    def test_missing_password(self, monkeypatch):
+        monkeypatch.delenv("MDL_SMTP_PASSWORD")
+        with pytest.raises(ValueError):
+            asyncio.run(smtp_transport.send_message("MDL", _msg()))
+        assert FakeSMTP.instances == []
+
+
+class TestConcurrency:
+    def test_per_entity_limit(self, monkeypatch):
+        monkeypatch.setattr(smtp_transport, "SMTP_MAX_CONCURRENCY_PER_ENTITY", 2)
+        FakeSMTP.send_delay = 0.05
+
+        async def run():
+            await asyncio.gather(*[smtp_transport.send_message("ZR7", _msg()) for _ in range(6)])
+        asyncio.run(run())
+
+        assert FakeSMTP.max_active_sends <= 2
+        assert len(FakeSMTP.instances) <= 2
+
+    def test_event_loop_not_blocked(self):
+        FakeSMTP.send_delay = 0.2
+        ticks = []
+
+        async def ticker():
+            for _ in range(5):
+                ticks.append(time.perf_counter())
+                await asyncio.sleep(0.02)
+
+        async def run():
+            await asyncio.gather(smtp_transport.send_message("ZR7", _msg()), ticker())
+        asyncio.run(run())
+
+        assert len(ticks) == 5
+        assert ticks[-1] - ticks[0] < 0.2
+
+    def test_latency_reported(self):
+        FakeSMTP.send_delay = 0.02
+        latency = asyncio.run(smtp_transport.send_message("ZR7", _msg()))
+        stats = smtp_transport.get_smtp_stats()["entities"]["ZR7"]
+        assert latency >= 20
+        assert stats["last_latency_ms"] == latency
+        assert stats["sent"] == 1
+
+
+class TestSendCsvEmail:
+    def test_result_includes_latency(self):
+        from services.csv_delivery import send_csv_email
+        result = asyncio.run(send_csv_email(
+            entity="ZR7", to_emails=["client@example.com"], csv_content="nom\nx\n",
+            csv_filename="ZR7_PV_2026-01-01.csv", lead_count=1, lb_count=0, produit="PV"
+        ))
+        assert result["success"] is True
+        assert "latency_ms" in result
+        assert FakeSMTP.instances[0].sent == [f"Livraison leads ZR7 – PV – {time.strftime('%d/%m/%Y', time.gmtime())}"]
+
+    def test_smtp_error_returned(self, monkeypatch):
+        from services.csv_delivery import send_csv_email
+        monkeypatch.setattr(FakeSMTP, "login", lambda self, u, p: (_ for _ in ()).throw(
+            smtplib.SMTPAuthenticationError(535, b"bad credentials")))
+        result = asyncio.run(send_csv_email(
+            entity="MDL", to_emails=["client@example.com"], csv_content="nom\n",
+            csv_filename="MDL_PV_2026-01-01.csv", lead_count=0, lb_count=0, produit="PV"
+        ))
+        assert result["success"] is False
+        assert "Authentification" in result["error"]
@@ -0,0 +1,194 @@
+"""
+RDZ CRM — Tracking Buffer Tests
+Tests: marquage once_per_session, doublon local, events libres, flush par
+taille, doublons E11000 ignorés, drain à l'arrêt, file pleine, lag, reprise
+après échec de flush (remise en file puis écriture directe).
+Run: cd /app/backend && pytest tests/test_tracking_buffer.py -v
+"""
+
+import sys
+import uuid
+import asyncio
+from types import SimpleNamespace
+
+sys.path.insert(0, "/app/backend")
+
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from services import tracking_buffer
+from services.tracking_buffer import prepare_event, ONCE_PER_SESSION_EVENTS
+
+
+def _event(session_id, event_type):
+    return {"id": str(uuid.uuid4()), "session_id": session_id, "event": event_type}
+
+
+class TestOncePerSession:
+    def test_once_events_flagged(self):
+        for event_type in ONCE_PER_SESSION_EVENTS:
+            ev = _event(str(uuid.uuid4()), event_type)
+            assert prepare_event(ev) is None
+            assert ev["once_per_session"] is True
+
+    def test_second_event_is_duplicate(self):
+        session_id = str(uuid.uuid4())
+        first = _event(session_id, "lp_visit")
+        prepare_event(first)
+        assert prepare_event(_event(session_id, "lp_visit")) == first["id"]
+
+    def test_other_session_not_duplicate(self):
+        prepare_event(_event(str(uuid.uuid4()), "cta_click"))
+        assert prepare_event(_event(str(uuid.uuid4()), "cta_click")) is None
+
+    def test_free_events_never_deduplicated(self):
+        session_id = str(uuid.uuid4())
+        ev = _event(session_id, "beacon_test")
+        assert prepare_event(ev) is None
+        assert prepare_event(_event(session_id, "beacon_test")) is None
+        assert "once_per_session" not in ev
+
+
+class FakeTracking:
+    """insert_many: fail_times échecs réseau, puis doublons simulés (dup_ids)"""
+
+    def __init__(self, fail_times=0, dup_ids=()):
+        self.fail_times = fail_times
+        self.dup_ids = set(dup_ids)
+        self.batches = []
+        self.direct = []
+
+    async def insert_many(self, events, ordered=False):
+        if self.fail_times:
+            self.fail_times -= 1
+            raise AutoReconnect("primary stepped down")
+        self.batches.append([e["id"] for e in events])
+        dups = [i for i, e in enumerate(events) if e["id"] in self.dup_ids]
+        if dups:
+            raise BulkWriteError({
+                "writeErrors": [{"index": i, "code": 11000} for i in dups],
+                "nInserted": len(events) - len(dups),
+            })
+        return SimpleNamespace(inserted_ids=[e["id"] for e in events])
+
+    async def insert_one(self, event):
+        self.direct.append(event["id"])
+
+
+class FakeSessions:
+    def __init__(self):
+        self.bulk = []
+
+    async def bulk_write(self, ops, ordered=False):
+        self.bulk.append(len(ops))
+
+
+@pytest.fixture
+def buffer(monkeypatch):
+    fake = SimpleNamespace(tracking=FakeTracking(), visitor_sessions=FakeSessions())
+    monkeypatch.setattr(tracking_buffer, "db", fake)
+    monkeypatch.setattr(tracking_buffer, "_stats", {k: 0 for k in tracking_buffer._stats})
+    monkeypatch.setattr(tracking_buffer, "_flusher", None)
+    monkeypatch.setattr(tracking_buffer, "FLUSH_INTERVAL_MS", 10000)
+    monkeypatch.setattr(tracking_buffer, "FLUSH_BATCH_SIZE", 3)
+    monkeypatch.setattr(tracking_buffer, "BUFFER_MAX_EVENTS", 100)
+    return fake
+
+
+def _ev(event_id):
+    return {"id": event_id, "session_id": "s", "event": "beacon"}
+
+
+def _run(fake, events, before_stop=None):
+    async def run():
+        tracking_buffer.start_tracking_buffer()
+        for ev in events:
+            await tracking_buffer.enqueue_event(ev)
+        if before_stop:
+            await before_stop()
+        await tracking_buffer.stop_tracking_buffer()
+    asyncio.run(run())
+    return tracking_buffer._stats
+
+
+class TestFlush:
+    def test_size_triggered_flush(self, buffer):
+        async def wait():
+            await asyncio.sleep(0.05)
+            # Lot plein écrit sans attendre l'intervalle (10 s)
+            assert buffer.tracking.batches == [["e0", "e1", "e2"]]
+
+        _run(buffer, [_ev(f"e{i}") for i in range(4)], wait)
+        assert buffer.tracking.batches == [["e0", "e1", "e2"], ["e3"]]
+
+    def test_duplicates_ignored(self, buffer):
+        buffer.tracking.dup_ids = {"e1"}
+        stats = _run(buffer, [_ev("e0"), _ev("e1")])
+        assert (stats["flushed"], stats["duplicates"], stats["errors"], stats["retried"]) == (1, 1, 0, 0)
+
+    def test_drain_on_stop(self, buffer):
+        stats = _run(buffer, [_ev("e0"), _ev("e1")])
+        assert buffer.tracking.batches == [["e0", "e1"]]
+        assert stats["flushed"] == 2
+
+    def test_full_queue_writes_direct(self, buffer, monkeypatch):
+        monkeypatch.setattr(tracking_buffer, "BUFFER_MAX_EVENTS", 1)
+        stats = _run(buffer, [_ev("e0"), _ev("e1")])
+        assert buffer.tracking.direct == ["e1"]
+        assert stats["direct_writes"] == 1
+        assert buffer.tracking.batches == [["e0"]]
+
+    def test_lag_metric(self, buffer):
+        async def wait():
+            await asyncio.sleep(0.05)
+
+        stats = _run(buffer, [_ev("e0")], wait)
+        assert stats["last_flush_lag_ms"] >= 50
+        assert stats["max_flush_lag_ms"] == stats["last_flush_lag_ms"]
+
+
+class TestFlushFailure:
+    @pytest.fixture(autouse=True)
+    def fast_retry(self, buffer, monkeypatch):
+        monkeypatch.setattr(tracking_buffer, "FLUSH_INTERVAL_MS", 1)
+        monkeypatch.setattr(tracking_buffer, "FLUSH_MAX_ATTEMPTS", 3)
+
+    def _wait(self):
+        async def wait():
+            await asyncio.sleep(0.1)
+        return wait
+
+    def test_requeued_after_transient_error(self, buffer):
+        buffer.tracking.fail_times = 1
+        stats = _run(buffer, [_ev("e0"), _ev("e1")], self._wait())
+        assert sorted(sum(buffer.tracking.batches, [])) == ["e0", "e1"]
+        assert buffer.tracking.direct == []
+        assert stats["retried"] >= 1
+        assert (stats["flushed"], stats["errors"]) == (2, 0)
+
+    def test_direct_write_after_max_attempts(self, buffer):
+        buffer.tracking.fail_times = 10
+        stats = _run(buffer, [_ev("e0")], self._wait())
+        assert buffer.tracking.direct == ["e0"]
+        assert (stats["retried"], stats["errors"]) == (2, 0)
+
+    def test_sessions_requeued(self, buffer):
+        calls = {"n": 0}
+
+        async def flaky_bulk(ops, ordered=False):
+            calls["n"] += 1
+            if calls["n"] == 1:
+                raise AutoReconnect("network")
+            buffer.visitor_sessions.bulk.append(len(ops))
+
+        buffer.visitor_sessions.bulk_write = flaky_bulk
+
+        async def run():
+            tracking_buffer.start_tracking_buffer()
+            await tracking_buffer.enqueue_session_update("s1", {"utm_source": "g"})
+            await asyncio.sleep(0.1)
+            await tracking_buffer.stop_tracking_buffer()
+
+        asyncio.run(run())
+        assert buffer.visitor_sessions.bulk == [1]
+        assert tracking_buffer._stats["errors"] == 0